@@ -45,18 +45,23 @@ same line, but it is far from perfect (in either direction).
 import codecs
 import copy
 import getopt
+import hashlib
+import io
+import json
 import math  # for log
+import multiprocessing
 import os
 import re
 import string
 import sys
+import threading
 import unicodedata
 
 
 _USAGE = r"""
 Syntax: cpplint.py [--verbose=#] [--output=vs7] [--filter=-x,+y,...]
                    [--counting=total|toplevel|detailed] [--root=subdir]
-                   [--linelength=digits]
+                   [--linelength=digits] [--jobs=#] [--diff=file]
         <file> [file] ...
 
   The style guidelines this tries to follow are those in
@@ -134,6 +139,26 @@ Syntax: cpplint.py [--verbose=#] [--output=vs7] [--filter=-x,+y,...]
       Examples:
         --extensions=hpp,cpp
 
+    jobs=#
+      The number of processes to lint files in. The output is the same as
+      when linting one file at a time. Defaults to 1.
+
+    diff=file
+      A unified diff, such as the output of git diff. Only errors on the
+      lines it adds to the files are reported. Files the diff doesn't change
+      are linted in full, with a warning.
+
+      Examples:
+        --diff=changes.diff
+
+    diff_root=dir
+      The directory the paths in the diff are relative to. Defaults to the
+      top of the git checkout of the current directory, like the paths
+      printed by git diff, or to the current directory outside of a checkout.
+
+      Examples:
+        --diff_root=src
+
     cpplint.py supports per-directory configurations specified in CPPLINT.cfg
     files. CPPLINT.cfg file can contain a number of key=value pairs.
     Currently the following options are supported:
@@ -780,6 +805,19 @@ _line_length = 80
 # This is set by --extensions flag.
 _valid_extensions = set(['cc', 'h', 'cpp', 'cu', 'cuh'])
 
+# The number of processes main() lints files in.
+# This is set by --jobs flag.
+_jobs = 1
+
+# {str, set}: a map from the absolute paths of the files changed by the diff
+# given to main() to the numbers of the lines the diff adds.
+# This is set by --diff flag.
+_changed_lines = None
+
+# The directory the paths in the --diff file are relative to.
+# This is set by --diff_root flag.
+_diff_root = None
+
 # {str, bool}: a map from error categories to booleans which indicate if the
 # category should be suppressed for every line.
 _global_error_suppressions = {}
@@ -864,10 +902,12 @@ def Match(pattern, s):
     """Matches the string with the pattern, caching the compiled regexp."""
     # The regexp compilation caching is inlined in both Match and Search for
     # performance reasons; factoring it out into a separate function turns out
-    # to be noticeably expensive.
-    if pattern not in _regexp_compile_cache:
-        _regexp_compile_cache[pattern] = re.compile(pattern)
-    return _regexp_compile_cache[pattern].match(s)
+    # to be noticeably expensive. Likewise, a single lookup in the cache is
+    # cheaper than checking for the pattern before fetching it.
+    regexp = _regexp_compile_cache.get(pattern)
+    if regexp is None:
+        regexp = _regexp_compile_cache[pattern] = re.compile(pattern)
+    return regexp.match(s)
 
 
 def ReplaceAll(pattern, rep, s):
@@ -883,16 +923,18 @@ def ReplaceAll(pattern, rep, s):
     Returns:
         string with replacements made (or original string if no replacements)
     """
-    if pattern not in _regexp_compile_cache:
-        _regexp_compile_cache[pattern] = re.compile(pattern)
-    return _regexp_compile_cache[pattern].sub(rep, s)
+    regexp = _regexp_compile_cache.get(pattern)
+    if regexp is None:
+        regexp = _regexp_compile_cache[pattern] = re.compile(pattern)
+    return regexp.sub(rep, s)
 
 
 def Search(pattern, s):
     """Searches the string for the pattern, caching the compiled regexp."""
-    if pattern not in _regexp_compile_cache:
-        _regexp_compile_cache[pattern] = re.compile(pattern)
-    return _regexp_compile_cache[pattern].search(s)
+    regexp = _regexp_compile_cache.get(pattern)
+    if regexp is None:
+        regexp = _regexp_compile_cache[pattern] = re.compile(pattern)
+    return regexp.search(s)
 
 
 def _IsSourceExtension(s):
@@ -1415,6 +1457,16 @@ def _ShouldPrintError(category, confidence, linenum):
     return True
 
 
+# Holds the stream that _LintFile() collects the errors of the file it lints
+# in, per thread, so that linting does not swap sys.stderr under other threads.
+_thread_output = threading.local()
+
+
+def _Stderr():
+    """Returns the stream to write errors and diagnostics to."""
+    return getattr(_thread_output, 'stream', None) or sys.stderr
+
+
 def Error(filename, linenum, category, confidence, message):
     """Logs the fact we've found a lint error.
 
@@ -1440,14 +1492,14 @@ def Error(filename, linenum, category, confidence, message):
     if _ShouldPrintError(category, confidence, linenum):
         _cpplint_state.IncrementErrorCount(category)
         if _cpplint_state.output_format == 'vs7':
-            sys.stderr.write('%s(%s): (cpplint)  %s  [%s] [%d]\n' %
-                             (filename, linenum, message, category, confidence))
+            _Stderr().write('%s(%s): (cpplint)  %s  [%s] [%d]\n' %
+                            (filename, linenum, message, category, confidence))
         elif _cpplint_state.output_format == 'eclipse':
-            sys.stderr.write('%s:%s: (cpplint) warning: %s  [%s] [%d]\n' %
-                             (filename, linenum, message, category, confidence))
+            _Stderr().write('%s:%s: (cpplint) warning: %s  [%s] [%d]\n' %
+                            (filename, linenum, message, category, confidence))
         else:
-            sys.stderr.write('%s:%s:  (cpplint) %s  [%s] [%d]\n' %
-                             (filename, linenum, message, category, confidence))
+            _Stderr().write('%s:%s:  (cpplint) %s  [%s] [%d]\n' %
+                            (filename, linenum, message, category, confidence))
 
 
 # Matches standard C++ escape sequences per 2.13.2.3 of the C++ standard.
@@ -2042,14 +2094,14 @@ def GetHeaderGuardCPPVariable(filename):
 
     def FixupPathFromRoot():
         if _root_debug:
-            sys.stderr.write(
+            _Stderr().write(
                 "\n_root fixup, _root = '%s', repository name = '%s'\n" %
                 (_root, fileinfo.RepositoryName()))
 
         # Process the file path with the --root flag if it was set.
         if not _root:
             if _root_debug:
-                sys.stderr.write("_root unspecified\n")
+                _Stderr().write("_root unspecified\n")
             return file_path_from_root
 
         def StripListPrefix(lst, prefix):
@@ -2065,7 +2117,7 @@ def GetHeaderGuardCPPVariable(filename):
                                      PathSplitToList(_root))
 
         if _root_debug:
-            sys.stderr.write(
+            _Stderr().write(
                 ("_root lstrip (maybe_path=%s, file_path_from_root=%s," +
                  " _root=%s)\n") % (maybe_path, file_path_from_root, _root))
 
@@ -2081,7 +2133,7 @@ def GetHeaderGuardCPPVariable(filename):
                                      PathSplitToList(root_abspath))
 
         if _root_debug:
-            sys.stderr.write(
+            _Stderr().write(
                 ("_root prepend (maybe_path=%s, full_path=%s, " +
                  "root_abspath=%s)\n") % (maybe_path, full_path, root_abspath))
 
@@ -2089,8 +2141,8 @@ def GetHeaderGuardCPPVariable(filename):
             return os.path.join(*maybe_path)
 
         if _root_debug:
-            sys.stderr.write("_root ignore, returning %s\n" %
-                             (file_path_from_root))
+            _Stderr().write("_root ignore, returning %s\n" %
+                            (file_path_from_root))
 
         #   --root=FAKE_DIR is ignored
         return file_path_from_root
@@ -2340,6 +2392,10 @@ _THREADING_LIST = (
     ('strtok(', 'strtok_r(', _UNSAFE_FUNC_PREFIX + r'strtok\([^)]+\)'),
     ('ttyname(', 'ttyname_r(', _UNSAFE_FUNC_PREFIX + r'ttyname\([^)]+\)'),
 )
+# Matches any of the functions in _THREADING_LIST, so that most lines are
+# checked with a single search instead of one per function.
+_THREADING_FUNCS_RE = re.compile('|'.join(
+    re.escape(func) for func, _, _ in _THREADING_LIST))
 
 
 def CheckPosixThreading(filename, clean_lines, linenum, error):
@@ -2358,6 +2414,8 @@ def CheckPosixThreading(filename, clean_lines, linenum, error):
         error: The function to call with any errors found.
     """
     line = clean_lines.elided[linenum]
+    if not _THREADING_FUNCS_RE.search(line):
+        return
     for single_thread_func, multithread_safe_func, pattern in _THREADING_LIST:
         # Additional pattern matching check to confirm that this is the
         # function we are looking for
@@ -3044,18 +3102,22 @@ def CheckForNonStandardConstructs(filename, clean_lines, linenum, nesting_state,
     # Remove comments from the line, but leave in strings for now.
     line = clean_lines.lines[linenum]
 
-    if Search(r'printf\s*\(.*".*%[-+ ]?\d*q', line):
-        error(filename, linenum, 'runtime/printf_format', 3,
-              '%q in format strings is deprecated.  Use %ll instead.')
+    # The searches are guarded by cheap substring tests, as most lines have no
+    # printf calls or escapes.
+    if 'printf' in line:
+        if Search(r'printf\s*\(.*".*%[-+ ]?\d*q', line):
+            error(filename, linenum, 'runtime/printf_format', 3,
+                  '%q in format strings is deprecated.  Use %ll instead.')
 
-    if Search(r'printf\s*\(.*".*%\d+\$', line):
-        error(filename, linenum, 'runtime/printf_format', 2,
-              '%N$ formats are unconventional.  Try rewriting to avoid them.')
+        if Search(r'printf\s*\(.*".*%\d+\$', line):
+            error(
+                filename, linenum, 'runtime/printf_format', 2,
+                '%N$ formats are unconventional.  Try rewriting to avoid them.')
 
     # Remove escaped backslashes before looking for undefined escapes.
     line = line.replace('\\\\', '')
 
-    if Search(r'("|\').*\\(%|\[|\(|{)', line):
+    if '\\' in line and Search(r'("|\').*\\(%|\[|\(|{)', line):
         error(
             filename, linenum, 'build/printf_format', 3,
             '%, [, (, and { are undefined character escapes.  Unescape them.')
@@ -3082,8 +3144,9 @@ def CheckForNonStandardConstructs(filename, clean_lines, linenum, nesting_state,
             filename, linenum, 'build/forward_decl', 5,
             'Inner-style forward declarations are invalid.  Remove this line.')
 
-    if Search(r'(\w+|[+-]?\d+(\.\d*)?)\s*(<|>)\?=?\s*(\w+|[+-]?\d+)(\.\d*)?',
-              line):
+    if '?' in line and Search(
+            r'(\w+|[+-]?\d+(\.\d*)?)\s*(<|>)\?=?\s*(\w+|[+-]?\d+)(\.\d*)?',
+            line):
         error(
             filename, linenum, 'build/deprecated', 3,
             '>? and <? (max and min) operators are non-standard and deprecated.'
@@ -3188,6 +3251,9 @@ def CheckSpacingForFunctionCall(filename, clean_lines, linenum, error):
         error: The function to call with any errors found.
     """
     line = clean_lines.elided[linenum]
+    # All the checks below are about parentheses.
+    if '(' not in line and ')' not in line:
+        return
 
     # Since function calls often occur inside if/for/while/switch
     # expressions - which have their own, more liberal conventions - we
@@ -3565,7 +3631,7 @@ def CheckOperatorSpacing(filename, clean_lines, linenum, error):
     #
     # The replacement is done repeatedly to avoid false positives from
     # operators that call operators.
-    while True:
+    while 'operator' in line:
         match = Match(r'^(.*\boperator\b)(\S+)(\s*\(.*)$', line)
         if match:
             line = match.group(1) + ('_' * len(match.group(2))) + match.group(3)
@@ -3611,7 +3677,7 @@ def CheckOperatorSpacing(filename, clean_lines, linenum, error):
         # triggered if both sides are missing spaces, even though
         # technically should should flag if at least one side is missing a
         # space.  This is done to avoid some false positives with shifts.
-        match = Match(r'^(.*[^\s<])<[^\s=<,]', line)
+        match = '<' in line and Match(r'^(.*[^\s<])<[^\s=<,]', line)
         if match:
             (_, _, end_pos) = CloseExpression(clean_lines, linenum,
                                               len(match.group(1)))
@@ -3622,7 +3688,7 @@ def CheckOperatorSpacing(filename, clean_lines, linenum, error):
         # Look for > that is not surrounded by spaces.  Similar to the
         # above, we only trigger if both sides are missing spaces to avoid
         # false positives with shifts.
-        match = Match(r'^(.*[^-\s>])>[^\s=>,]', line)
+        match = '>' in line and Match(r'^(.*[^-\s>])>[^\s=>,]', line)
         if match:
             (_, _, start_pos) = ReverseCloseExpression(clean_lines, linenum,
                                                        len(match.group(1)))
@@ -3635,7 +3701,7 @@ def CheckOperatorSpacing(filename, clean_lines, linenum, error):
     #
     # We also allow operators following an opening parenthesis, since
     # those tend to be macros that deal with operators.
-    match = Search(
+    match = '<<' in line and Search(
         r'(operator|[^\s(<])(?:L|UL|LL|ULL|l|ul|ll|ull)?<<([^\s,=<])', line)
     if (match and not (match.group(1).isdigit() and match.group(2).isdigit())
             and not (match.group(1) == 'operator' and match.group(2) == ';')):
@@ -3654,7 +3720,7 @@ def CheckOperatorSpacing(filename, clean_lines, linenum, error):
     # follows would be part of an identifier, and there should still be
     # a space separating the template type and the identifier.
     #   type<type<type>> alpha
-    match = Search(r'>>[a-zA-Z_]', line)
+    match = '>>' in line and Search(r'>>[a-zA-Z_]', line)
     if match:
         error(filename, linenum, 'whitespace/operators', 3,
               'Missing spaces around >>')
@@ -4631,7 +4697,10 @@ def CheckStyle(filename, clean_lines, linenum, file_extension, nesting_state,
 
     # Check if the line is a header guard.
     is_header_guard = False
-    if file_extension == 'h':
+    # Only compute the header guard, which looks for the root of the checkout,
+    # for lines that can be one.
+    if file_extension == 'h' and line.startswith(
+        ('#ifndef ', '#define ', '#endif  // ')):
         cppvar = GetHeaderGuardCPPVariable(filename)
         if (line.startswith('#ifndef %s' % cppvar)
                 or line.startswith('#define %s' % cppvar)
@@ -6234,11 +6303,43 @@ def FlagCxx14Features(filename, clean_lines, linenum, error):
               ('<%s> is an unapproved C++14 header.') % include.group(1))
 
 
+def _UpdateLineState(filename, clean_lines, line, include_state, function_state,
+                     nesting_state, error):
+    """Keeps track of a line without checking it, see ProcessFileData().
+
+    Only does the part of ProcessLine() the following lines depend on: the
+    suppressions, the nesting of blocks, the length of functions and the
+    includes.
+    """
+    ParseNolintSuppressions(filename, clean_lines.raw_lines[line], line, error)
+    nesting_state.Update(filename, clean_lines, line, error)
+    if nesting_state.InAsmBlock(): return
+    CheckForFunctionLengths(filename, clean_lines, line, function_state, error)
+    elided = clean_lines.elided[line]
+    if _RE_PATTERN_INCLUDE.search(elided):
+        CheckIncludeLine(filename, clean_lines, line, include_state, error)
+        return
+    match = Match(r'^\s*#\s*(if|ifdef|ifndef|elif|else|endif)\b', elided)
+    if match:
+        include_state.ResetSection(match.group(1))
+
+
+def _FilterErrors(error, linenums):
+    """Returns an error function that only reports errors on linenums."""
+
+    def FilteredError(filename, linenum, category, confidence, message):
+        if linenum in linenums:
+            error(filename, linenum, category, confidence, message)
+
+    return FilteredError
+
+
 def ProcessFileData(filename,
                     file_extension,
                     lines,
                     error,
-                    extra_check_functions=[]):
+                    extra_check_functions=[],
+                    changed_lines=None):
     """Performs lint checks and reports any errors to the given error function.
 
     Args:
@@ -6251,9 +6352,16 @@ def ProcessFileData(filename,
         extra_check_functions: An array of additional check functions that will be
             run on each source line. Each function takes 4 arguments: filename,
             clean_lines, line, error
+        changed_lines: An optional collection of line numbers. If given, only
+            those lines are checked and only errors on them are reported. The
+            whole file is still parsed, so the checks see the blocks and
+            includes the lines are in.
     """
     lines = (['// marker so line numbers and indices both start at 1'] + lines +
              ['// marker so line numbers end in a known way'])
+    if changed_lines is not None:
+        changed_lines = set(changed_lines)
+        error = _FilterErrors(error, changed_lines)
 
     include_state = _IncludeState()
     function_state = _FunctionState()
@@ -6270,6 +6378,10 @@ def ProcessFileData(filename,
         CheckForHeaderGuard(filename, clean_lines, error)
 
     for line in range(clean_lines.NumLines()):
+        if changed_lines is not None and line not in changed_lines:
+            _UpdateLineState(filename, clean_lines, line, include_state,
+                             function_state, nesting_state, error)
+            continue
         ProcessLine(filename, file_extension, clean_lines, line, include_state,
                     function_state, nesting_state, error, extra_check_functions)
         FlagCxx11Features(filename, clean_lines, line, error)
@@ -6336,7 +6448,7 @@ def ProcessConfigOverrides(filename):
                         if base_name:
                             pattern = re.compile(val)
                             if pattern.match(base_name):
-                                sys.stderr.write(
+                                _Stderr().write(
                                     'Ignoring "%s": file excluded by "%s". '
                                     'File path component "%s" matches '
                                     'pattern "%s"\n' %
@@ -6347,14 +6459,14 @@ def ProcessConfigOverrides(filename):
                         try:
                             _line_length = int(val)
                         except ValueError:
-                            sys.stderr.write('Line length must be numeric.')
+                            _Stderr().write('Line length must be numeric.')
                     else:
-                        sys.stderr.write(
+                        _Stderr().write(
                             'Invalid configuration option (%s) in file %s\n' %
                             (name, cfg_file))
 
         except IOError:
-            sys.stderr.write(
+            _Stderr().write(
                 "Skipping config file '%s': Can't open for reading\n" %
                 cfg_file)
             keep_looking = False
@@ -6367,7 +6479,7 @@ def ProcessConfigOverrides(filename):
     return True
 
 
-def ProcessFile(filename, vlevel, extra_check_functions=[]):
+def ProcessFile(filename, vlevel, extra_check_functions=[], changed_lines=None):
     """Does google-lint on a single file.
 
     Args:
@@ -6379,6 +6491,9 @@ def ProcessFile(filename, vlevel, extra_check_functions=[]):
         extra_check_functions: An array of additional check functions that will be
             run on each source line. Each function takes 4 arguments: filename,
             clean_lines, line, error
+
+        changed_lines: An optional collection of the numbers of the lines to
+            check, see ProcessFileData().
     """
 
     _SetVerboseLevel(vlevel)
@@ -6417,8 +6532,8 @@ def ProcessFile(filename, vlevel, extra_check_functions=[]):
                 lf_lines.append(linenum + 1)
 
     except IOError:
-        sys.stderr.write("Skipping input '%s': Can't open for reading\n" %
-                         filename)
+        _Stderr().write("Skipping input '%s': Can't open for reading\n" %
+                        filename)
         _RestoreFilters()
         return
 
@@ -6428,11 +6543,11 @@ def ProcessFile(filename, vlevel, extra_check_functions=[]):
     # When reading from stdin, the extension is unknown, so no cpplint tests
     # should rely on the extension.
     if filename != '-' and file_extension not in _valid_extensions:
-        sys.stderr.write('Ignoring %s; not a valid file name '
-                         '(%s)\n' % (filename, ', '.join(_valid_extensions)))
+        _Stderr().write('Ignoring %s; not a valid file name '
+                        '(%s)\n' % (filename, ', '.join(_valid_extensions)))
     else:
         ProcessFileData(filename, file_extension, lines, Error,
-                        extra_check_functions)
+                        extra_check_functions, changed_lines)
 
         # If end-of-line sequences are a mix of LF and CR-LF, issue
         # warnings on the lines with CR.
@@ -6449,12 +6564,324 @@ def ProcessFile(filename, vlevel, extra_check_functions=[]):
             # check whether the file is mostly CRLF or just LF, and warn on the
             # minority, we bias toward LF here since most tools prefer LF.
             for linenum in crlf_lines:
+                if changed_lines is not None and linenum not in changed_lines:
+                    continue
                 Error(filename, linenum, 'whitespace/newline', 1,
                       'Unexpected \\r (^M) found; better to use only \\n')
 
     _RestoreFilters()
 
 
+def _GetState():
+    """Returns the module's settings that affect how files are linted."""
+    return {
+        'verbose_level': _cpplint_state.verbose_level,
+        'filters': _cpplint_state.filters[:],
+        'counting': _cpplint_state.counting,
+        'output_format': _cpplint_state.output_format,
+        'line_length': _line_length,
+        'root': _root,
+        'project_root': _project_root,
+        'valid_extensions': sorted(_valid_extensions),
+    }
+
+
+def _SetState(state):
+    """Restores settings returned by _GetState()."""
+    global _line_length, _root, _project_root, _valid_extensions
+    _cpplint_state.verbose_level = state['verbose_level']
+    _cpplint_state.filters = state['filters'][:]
+    _cpplint_state.counting = state['counting']
+    _cpplint_state.output_format = state['output_format']
+    _line_length = state['line_length']
+    _root = state['root']
+    _project_root = state['project_root']
+    _valid_extensions = set(state['valid_extensions'])
+
+
+def _LintFile(args):
+    """Lints a file for ProcessFiles(), possibly in another process.
+
+    Args:
+        args: A (state, filename, vlevel, extra_check_functions, changed_lines)
+            tuple, where state was returned by _GetState().
+
+    Returns:
+        A (output, error count, errors by category) tuple.
+    """
+    state, filename, vlevel, extra_check_functions, changed_lines = args
+    _SetState(state)
+    _cpplint_state.ResetErrorCounts()
+    _thread_output.stream = io.StringIO()
+    try:
+        ProcessFile(filename, vlevel, extra_check_functions, changed_lines)
+        output = _thread_output.stream.getvalue()
+    finally:
+        _thread_output.stream = None
+    return (output, _cpplint_state.error_count,
+            dict(_cpplint_state.errors_by_category))
+
+
+_cpplint_digest = None
+
+
+def _CpplintDigest():
+    """Returns a hash of this file, so that cached results expire with it."""
+    global _cpplint_digest
+    if _cpplint_digest is None:
+        with open(os.path.abspath(__file__), 'rb') as f:
+            _cpplint_digest = hashlib.sha256(f.read()).hexdigest()
+    return _cpplint_digest
+
+
+class _LintCache(object):
+    """Remembers the results of linting files, see ProcessFiles().
+
+    Results are keyed on everything they depend on: the path and contents of
+    the file, the module's settings, cpplint itself, the CPPLINT.cfg files of
+    the file's directory and its parents, and the headers next to the file,
+    which cpplint reads to check includes.
+    """
+    # Number of results kept, most recently used last.
+    MAX_ENTRIES = 10000
+    _HEADER_EXTENSIONS = ('.h', '.hh', '.hpp', '.hxx', '.cuh')
+
+    def __init__(self, path):
+        self._path = path
+        self._entries = {}
+        self._dirty = False
+        self._config_digests = {}
+        self._header_digests = {}
+        try:
+            with open(path) as f:
+                self._entries = dict(json.loads(f.read()))
+        except (IOError, ValueError, TypeError):
+            pass
+
+    def _ConfigDigest(self, directory):
+        """Returns a hash of the CPPLINT.cfg files of directory and its
+        parents."""
+        if directory not in self._config_digests:
+            digest = hashlib.sha256()
+            parent = os.path.dirname(directory)
+            if parent != directory:
+                digest.update(self._ConfigDigest(parent).encode('utf-8'))
+            try:
+                with open(os.path.join(directory, 'CPPLINT.cfg'), 'rb') as f:
+                    digest.update(f.read())
+            except (IOError, OSError):
+                pass
+            self._config_digests[directory] = digest.hexdigest()
+        return self._config_digests[directory]
+
+    def _HeaderDigest(self, directory):
+        """Returns a hash of the names, sizes and modification times of the
+        headers in directory."""
+        if directory not in self._header_digests:
+            headers = []
+            try:
+                for entry in os.scandir(directory):
+                    if entry.name.endswith(self._HEADER_EXTENSIONS):
+                        stat = entry.stat()
+                        headers.append(
+                            (entry.name, stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                pass
+            self._header_digests[directory] = hashlib.sha256(
+                json.dumps(sorted(headers)).encode('utf-8')).hexdigest()
+        return self._header_digests[directory]
+
+    def Key(self, filename, state, vlevel, extra_check_functions,
+            changed_lines):
+        """Returns the key of the results of linting filename, or None if
+        they can't be cached."""
+        if filename == '-':
+            return None
+        try:
+            with open(filename, 'rb') as f:
+                content_digest = hashlib.sha256(f.read()).hexdigest()
+        except (IOError, OSError):
+            return None
+        directory = os.path.dirname(os.path.abspath(filename))
+        key = [
+            filename,
+            os.path.abspath(filename),
+            content_digest,
+            state,
+            vlevel,
+            [f.__module__ + '.' + f.__name__ for f in extra_check_functions],
+            sorted(changed_lines) if changed_lines is not None else None,
+            _CpplintDigest(),
+            self._ConfigDigest(directory),
+            self._HeaderDigest(directory),
+        ]
+        return hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+
+    def Get(self, key):
+        """Returns the results stored for key, or None."""
+        result = self._entries.pop(key, None)
+        if result is None:
+            return None
+        self._entries[key] = result
+        self._dirty = True
+        output, error_count, errors_by_category = result
+        return output, error_count, errors_by_category
+
+    def Put(self, key, result):
+        self._entries.pop(key, None)
+        self._entries[key] = list(result)
+        self._dirty = True
+
+    def Save(self):
+        """Writes the most recently used results back, if any changed."""
+        if not self._dirty:
+            return
+        entries = list(self._entries.items())[-self.MAX_ENTRIES:]
+        try:
+            tmp_path = self._path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(entries))
+            os.replace(tmp_path, self._path)
+        except (IOError, OSError) as e:
+            sys.stderr.write('Failed to write cpplint cache %s: %s\n' %
+                             (self._path, e))
+
+
+def ProcessFiles(filenames,
+                 vlevel,
+                 extra_check_functions=[],
+                 jobs=1,
+                 cache_path=None,
+                 changed_lines=None):
+    """Does google-lint on several files, possibly in parallel.
+
+    The errors are printed in the order of filenames, and counted in the
+    module's error statistic, as if ProcessFile() had been called on each
+    file in turn. Unlike with ProcessFile(), a CPPLINT.cfg file only affects
+    the files it applies to.
+
+    Args:
+        filenames: The names of the files to lint.
+
+        vlevel: The level of errors to report.  Every error of confidence
+        >= verbose_level will be reported.  0 is a good default.
+
+        extra_check_functions: An array of additional check functions, see
+            ProcessFile(). They must be defined at the top level of a module
+            so that they can be passed to other processes.
+
+        jobs: The number of processes to lint files in. Files are linted in
+            this process when it is a daemonic one.
+
+        cache_path: An optional file to store the results of linting each
+            file in, so that linting an unchanged file again is a lookup.
+
+        changed_lines: An optional map from file names to the numbers of the
+            lines to check in them, see ProcessFileData(). Files that are not
+            in it are checked in full.
+    """
+    state = _GetState()
+    changed_lines = changed_lines or {}
+    cache = _LintCache(cache_path) if cache_path else None
+    keys = [
+        cache.Key(f, state, vlevel, extra_check_functions, changed_lines.get(f))
+        if cache else None for f in filenames
+    ]
+    results = [cache.Get(key) if key else None for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    work = [(state, filenames[i], vlevel, extra_check_functions,
+             changed_lines.get(filenames[i])) for i in missing]
+
+    # Only the main process can read stdin, and daemonic processes, such as the
+    # workers of git cl presubmit --jobs, are not allowed to have children.
+    if '-' in filenames or multiprocessing.current_process().daemon:
+        jobs = 1
+    error_count = _cpplint_state.error_count
+    errors_by_category = _cpplint_state.errors_by_category
+    try:
+        if jobs > 1 and len(work) > 1:
+            # Forking a process that runs other threads, such as other
+            # presubmit checks, can copy locks they hold; start the workers
+            # afresh then.
+            context = multiprocessing.get_context(
+                'spawn' if threading.active_count() > 1 else None)
+            with context.Pool(min(jobs, len(work))) as pool:
+                linted = pool.map(_LintFile, work)
+        else:
+            linted = [_LintFile(args) for args in work]
+    finally:
+        _SetState(state)
+        _cpplint_state.error_count = error_count
+        _cpplint_state.errors_by_category = errors_by_category
+
+    for i, result in zip(missing, linted):
+        results[i] = result
+        if keys[i]:
+            cache.Put(keys[i], result)
+    for output, count, categories in results:
+        sys.stderr.write(output)
+        _cpplint_state.error_count += count
+        for category, category_count in categories.items():
+            errors_by_category[category] = (
+                errors_by_category.get(category, 0) + category_count)
+    if cache:
+        cache.Save()
+
+
+def ParseUnifiedDiff(diff):
+    """Returns the lines a unified diff adds to each file.
+
+    Args:
+        diff: The text of a unified diff, such as the output of git diff.
+
+    Returns:
+        A map from the paths of the files the diff changes, without git's
+        b/ prefix, to the sets of the numbers of the lines it adds to them.
+    """
+    changed_lines = {}
+    lines = None
+    # The number of lines left in the current hunk on each side.
+    old_left = new_left = 0
+    for line in diff.splitlines():
+        if old_left > 0 or new_left > 0:
+            if line.startswith('+'):
+                lines.add(new_linenum)
+                new_linenum += 1
+                new_left -= 1
+            elif line.startswith('-'):
+                old_left -= 1
+            elif not line.startswith('\\'):
+                new_linenum += 1
+                old_left -= 1
+                new_left -= 1
+            continue
+        if line.startswith('+++ '):
+            path = line[4:].split('\t')[0]
+            if path == '/dev/null':
+                lines = set()
+                continue
+            if path.startswith('b/'):
+                path = path[2:]
+            lines = changed_lines.setdefault(path, set())
+            continue
+        match = Match(r'@@ -\d+(?:,(\d+))? \+(\d+)(?:,(\d+))? @@', line)
+        if match and lines is not None:
+            old_left = int(match.group(1) or 1)
+            new_linenum = int(match.group(2))
+            new_left = int(match.group(3) or 1)
+    return changed_lines
+
+
+def _FindGitRoot(directory):
+    """Returns the top of the git checkout containing directory, or None."""
+    directory = os.path.abspath(directory)
+    while not os.path.exists(os.path.join(directory, '.git')):
+        if directory == os.path.dirname(directory):
+            return None
+        directory = os.path.dirname(directory)
+    return directory
+
+
 def PrintUsage(message):
     """Prints a brief usage string and exits, optionally with an error message.
 
@@ -6503,7 +6930,10 @@ def ParseArguments(args):
                 'linelength=',
                 'extensions=',
                 'project_root=',
-                'repository='
+                'repository=',
+                'jobs=',
+                'diff=',
+                'diff_root=',
             ])
     except getopt.GetoptError as e:
         PrintUsage('Invalid arguments: {}'.format(e))
@@ -6512,6 +6942,7 @@ def ParseArguments(args):
     output_format = _OutputFormat()
     filters = ''
     counting_style = ''
+    diff = None
 
     for (opt, val) in opts:
         if opt == '--help':
@@ -6553,6 +6984,29 @@ def ParseArguments(args):
                 _valid_extensions = set(val.split(','))
             except ValueError:
                 PrintUsage('Extensions must be comma separated list.')
+        elif opt == '--jobs':
+            global _jobs
+            try:
+                _jobs = int(val)
+            except ValueError:
+                PrintUsage('Jobs must be digits.')
+        elif opt == '--diff':
+            try:
+                with open(val) as f:
+                    diff = f.read()
+            except IOError:
+                PrintUsage("Can't read the diff %s." % val)
+        elif opt == '--diff_root':
+            global _diff_root
+            _diff_root = val
+
+    if diff is not None:
+        global _changed_lines
+        diff_root = _diff_root or _FindGitRoot(os.getcwd()) or os.getcwd()
+        _changed_lines = {
+            os.path.abspath(os.path.join(diff_root, path)): lines
+            for path, lines in ParseUnifiedDiff(diff).items()
+        }
 
     if not filenames:
         PrintUsage('No files were specified.')
@@ -6576,9 +7030,21 @@ def main():
         getattr(sys.stderr, 'buffer', sys.stderr), codecs.getreader('utf8'),
         codecs.getwriter('utf8'), 'replace')
 
+    changed_lines = None
+    if _changed_lines is not None:
+        changed_lines = {}
+        for f in filenames:
+            if os.path.abspath(f) in _changed_lines:
+                changed_lines[f] = _changed_lines[os.path.abspath(f)]
+            else:
+                sys.stderr.write(
+                    'Warning: %s is not in the diff, linting all of it.\n' % f)
+
     _cpplint_state.ResetErrorCounts()
-    for filename in filenames:
-        ProcessFile(filename, _cpplint_state.verbose_level)
+    ProcessFiles(filenames,
+                 _cpplint_state.verbose_level,
+                 jobs=_jobs,
+                 changed_lines=changed_lines)
     _cpplint_state.PrintErrorCounts()
 
     sys.exit(_cpplint_state.error_count > 0)
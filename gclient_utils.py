@@ -10,6 +10,7 @@ import datetime
 import errno
 import functools
 import io
+import json
 import logging
 import operator
 import os
@@ -210,6 +211,32 @@ def FileWrite(filename, content, mode='w', encoding='utf-8'):
         f.write(content)
 
 
+def FileReadJson(filename):
+    """Returns the value stored in a JSON file, or None if the file doesn't
+    exist or isn't valid JSON."""
+    try:
+        with open(filename) as f:
+            return json.loads(f.read())
+    except (IOError, ValueError):
+        return None
+
+
+def FileWriteJson(filename, value):
+    """Writes value to a JSON file, replacing the file atomically so that
+    readers never see it half written.
+
+    Failing to write the file is only logged, as the files written this way
+    are caches and state that can be computed again.
+    """
+    tmp_path = filename + '.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(value))
+        os.replace(tmp_path, filename)
+    except (IOError, OSError) as e:
+        logging.warning('Failed to write %s: %s', filename, e)
+
+
 @contextlib.contextmanager
 def temporary_directory(**kwargs):
     tdir = tempfile.mkdtemp(**kwargs)
@@ -47,15 +47,16 @@ def CMDmovechanges(parser, args):
 
     limit = 100
     while True:
-        result = gerrit_util.QueryChanges(
-            host,
-            list(tuple(p.split('=', 1)) for p in opt.params),
-            limit=limit,
-        )
-        for change in result:
+        moved = 0
+        for change in gerrit_util.StreamQueryChanges(
+                host,
+                list(tuple(p.split('=', 1)) for p in opt.params),
+                limit=limit,
+        ):
             gerrit_util.MoveChange(host, change['id'], opt.destination_branch)
+            moved += 1
 
-        if len(result) < limit:
+        if moved < limit:
             break
     logging.info("Done")
 
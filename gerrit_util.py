@@ -10,7 +10,9 @@ https://gerrit-review.googlesource.com/Documentation/rest-api.html
 from __future__ import annotations
 
 import base64
+import concurrent.futures
 import contextlib
+import datetime
 import functools
 import http.cookiejar
 import json
@@ -30,7 +32,7 @@ import urllib.parse
 from dataclasses import dataclass
 from io import StringIO
 from multiprocessing.pool import ThreadPool
-from typing import Any, Container, Dict, List, Optional
+from typing import Any, Container, Dict, Iterator, List, Optional
 from typing import Tuple, TypedDict, cast
 
 import httplib2
@@ -110,6 +112,10 @@ GERRIT_PROTOCOL = 'https'
 # Controls how many concurrent Gerrit connections there can be.
 MAX_CONCURRENT_CONNECTION = 20
 
+# How many characters of a response body are decoded at a time when streaming
+# json arrays (see ReadHttpJsonStreamResponse).
+JSON_STREAM_CHUNK_SIZE = 64 * 1024
+
 
 def time_sleep(seconds):
     # Use this so that it can be mocked in tests without interfering with python
@@ -123,6 +129,12 @@ def time_time():
     return time.time()
 
 
+def time_monotonic():
+    # Use this so that it can be mocked in tests without interfering with python
+    # system machinery.
+    return time.monotonic()
+
+
 def log_retry_and_sleep(seconds, attempt, try_limit):
     LOGGER.info('Will retry in %d seconds (%d more times)...', seconds,
                 try_limit - attempt - 1)
@@ -130,6 +142,111 @@ def log_retry_and_sleep(seconds, attempt, try_limit):
     return seconds * random.uniform(MIN_BACKOFF, MAX_BACKOFF)
 
 
+class _HostThrottle(object):
+    """Adaptive limit on the number of concurrent requests to a single host.
+
+    The limit follows an AIMD (additive increase, multiplicative decrease)
+    scheme: it is halved whenever the host signals overload (429 or 503) and
+    grows by roughly one per round of successful requests, up to
+    MAX_CONCURRENT_CONNECTION. A Retry-After header additionally holds back
+    every request to the host until it has elapsed.
+    """
+
+    # Statuses with which a host tells us to back off.
+    OVERLOAD_STATUSES = (429, 503)
+    # Longest Retry-After that is honored, in seconds.
+    MAX_RETRY_AFTER = 60.0
+
+    def __init__(self, host, max_limit=None):
+        self.host = host
+        self._cond = threading.Condition()
+        self._max_limit = max_limit or MAX_CONCURRENT_CONNECTION
+        self._limit = float(self._max_limit)
+        self._in_flight = 0
+        self._not_before = 0.0
+        self._throttled = 0
+
+    @property
+    def limit(self) -> int:
+        return max(1, int(self._limit))
+
+    def acquire(self):
+        """Blocks until a request to the host may be sent."""
+        with self._cond:
+            while True:
+                wait = self._not_before - time_monotonic()
+                if wait <= 0 and self._in_flight < self.limit:
+                    break
+                self._cond.wait(wait if wait > 0 else None)
+            self._in_flight += 1
+
+    def release(self,
+                status: Optional[int],
+                retry_after: Optional[float] = None):
+        """Records the outcome of a request started with acquire().
+
+        Args:
+            status: The HTTP status of the response, or None if the request
+                failed without one (e.g. a timeout).
+            retry_after: The value of the Retry-After header, in seconds.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if status in self.OVERLOAD_STATUSES:
+                self._limit = max(1.0, self._limit / 2)
+                self._throttled += 1
+                if retry_after:
+                    retry_after = min(retry_after, self.MAX_RETRY_AFTER)
+                    self._not_before = max(self._not_before,
+                                           time_monotonic() + retry_after)
+                LOGGER.info(
+                    'Gerrit host %s is overloaded (%s), limiting to %d '
+                    'concurrent requests.', self.host, status, self.limit)
+                metrics.collector.add_repeated(
+                    'http_throttling',
+                    metrics_utils.extract_http_throttling_metrics(
+                        self.host, status, self.limit, retry_after))
+            elif status is not None and status < 500:
+                self._limit = min(float(self._max_limit),
+                                  self._limit + 1 / self._limit)
+            self._cond.notify_all()
+
+    def state(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'in_flight': self._in_flight,
+                'throttled': self._throttled,
+                'retry_after': max(0.0, self._not_before - time_monotonic()),
+            }
+
+
+_host_throttles: Dict[str, _HostThrottle] = {}
+_host_throttles_lock = threading.Lock()
+
+
+def _GetHostThrottle(host: str) -> _HostThrottle:
+    with _host_throttles_lock:
+        if host not in _host_throttles:
+            _host_throttles[host] = _HostThrottle(host)
+        return _host_throttles[host]
+
+
+def GetThrottleState() -> Dict[str, Dict[str, Any]]:
+    """Returns the current request throttling state of every Gerrit host."""
+    with _host_throttles_lock:
+        throttles = list(_host_throttles.values())
+    return {t.host: t.state() for t in throttles}
+
+
+def _ParseRetryAfter(value) -> Optional[float]:
+    """Parses the delay-seconds form of a Retry-After header."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
 class GerritError(Exception):
     """Exception class for errors commuicating with the gerrit-on-borg service."""
     def __init__(self, http_status, message, *args, **kwargs):
@@ -990,15 +1107,25 @@ def ReadHttpResponse(conn: HttpConn,
     """
     response = contents = None
     sleep_time = SLEEP_TIME
+    throttle = _GetHostThrottle(conn.req_host)
     for idx in range(max_tries):
+        throttle.acquire()
         before_response = time.time()
         try:
             response, contents = conn.request(**conn.req_params)
         except socket.timeout:
+            throttle.release(None)
             if idx < max_tries - 1:
                 sleep_time = log_retry_and_sleep(sleep_time, idx, max_tries)
                 continue
             raise
+        except:
+            throttle.release(None)
+            raise
+        retry_after = None
+        if response.status in _HostThrottle.OVERLOAD_STATUSES:
+            retry_after = _ParseRetryAfter(response.get('retry-after'))
+        throttle.release(response.status, retry_after)
         contents = contents.decode('utf-8', 'replace')
 
         response_time = time.time() - before_response
@@ -1035,6 +1162,8 @@ def ReadHttpResponse(conn: HttpConn,
             response.reason, contents)
 
         if idx < max_tries - 1:
+            if retry_after:
+                sleep_time = max(sleep_time, retry_after)
             sleep_time = log_retry_and_sleep(sleep_time, idx, max_tries)
     # end of retries loop
 
@@ -1078,6 +1207,86 @@ def ReadHttpJsonResponse(conn,
     return json.loads(s)
 
 
+def _IterJsonArray(fh, chunk_size=JSON_STREAM_CHUNK_SIZE):
+    """Incrementally decodes the elements of a JSON array read from |fh|.
+
+    Only as much of |fh| as is needed to decode the next element is buffered,
+    and consumed input is discarded, so the decoded array is never held in
+    memory as a whole.
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    # One of: '[' (before the array), 'first' (right after '['), 'value'
+    # (after a ',') or 'sep' (after an element).
+    state = '['
+
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n':
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                if state == '[':
+                    return
+                raise GerritError(200, 'Truncated json array')
+            chunk = fh.read(chunk_size)
+            buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+            continue
+
+        c = buf[pos]
+        if state == '[':
+            if c != '[':
+                raise GerritError(
+                    200, 'Expected json array: %s' % buf[pos:pos + 100])
+            pos += 1
+            state = 'first'
+        elif state == 'sep' or (state == 'first' and c == ']'):
+            if c == ']':
+                return
+            if c != ',':
+                raise GerritError(
+                    200, 'Unexpected json output: %s' % buf[pos:pos + 100])
+            pos += 1
+            state = 'value'
+        else:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                end = None
+            # A value ending exactly at the end of the buffer may be a
+            # truncated number, so only trust it once more input is read.
+            if end is None or (end == len(buf) and not eof):
+                if eof:
+                    raise GerritError(
+                        200, 'Unexpected json output: %s' % buf[pos:pos + 100])
+                # Grow reads geometrically so that large elements are not
+                # re-parsed once per chunk.
+                chunk = fh.read(max(chunk_size, len(buf) - pos))
+                buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+                continue
+            pos = end
+            state = 'sep'
+            yield value
+
+
+def ReadHttpJsonStreamResponse(conn,
+                               accept_statuses: Container[int] = frozenset(
+                                   [200]),
+                               max_tries=TRY_LIMIT) -> Iterator[Any]:
+    """Parses an https response containing a json array one element at a time.
+
+    Unlike ReadHttpJsonResponse, the array is never decoded as a whole; each
+    element is yielded as soon as it has been parsed.
+    """
+    fh = ReadHttpResponse(conn, accept_statuses, max_tries)
+    # The first line of the response should always be: )]}'
+    s = fh.readline()
+    if s and s.rstrip() != ")]}'":
+        raise GerritError(200, 'Unexpected json output: %s' % s[:100])
+    yield from _IterJsonArray(fh)
+
+
 def CallGerritApi(host, path, **kwargs):
     """Helper for calling a Gerrit API that returns a JSON response."""
     conn_kwargs = {}
@@ -1112,6 +1321,32 @@ def QueryChanges(host,
     Returns:
         A list of json-decoded query results.
     """
+    path = _QueryChangesPath(params, first_param, limit, o_params, start)
+    return ReadHttpJsonResponse(CreateHttpConn(host, path, timeout=30))
+
+
+def StreamQueryChanges(host,
+                       params,
+                       first_param=None,
+                       limit=None,
+                       o_params=None,
+                       start=None):
+    """Like QueryChanges, but yields the changes one at a time as they are
+    parsed instead of returning the whole decoded list.
+
+    Args:
+        Refer to QueryChanges().
+
+    Returns:
+        A generator of json-decoded query results.
+    """
+    path = _QueryChangesPath(params, first_param, limit, o_params, start)
+    yield from ReadHttpJsonStreamResponse(CreateHttpConn(host, path,
+                                                         timeout=30))
+
+
+def _QueryChangesPath(params, first_param, limit, o_params, start):
+    """Returns the REST path for QueryChanges and StreamQueryChanges."""
     # Note that no attempt is made to escape special characters; YMMV.
     if not params and not first_param:
         raise RuntimeError('QueryChanges requires search parameters')
@@ -1122,7 +1357,19 @@ def QueryChanges(host,
         path = '%s&n=%d' % (path, limit)
     if o_params:
         path = '%s&%s' % (path, '&'.join(['o=%s' % p for p in o_params]))
-    return ReadHttpJsonResponse(CreateHttpConn(host, path, timeout=30))
+    return path
+
+
+def _KeysetCursor(updated):
+    """Returns a `before:` operand covering changes updated at |updated|.
+
+    Gerrit's `updated` timestamps are UTC with nanosecond precision, while
+    `before:` only accepts second precision. Round up, since the operator is
+    inclusive and duplicates are filtered out by the caller anyway.
+    """
+    ts = datetime.datetime.strptime(updated[:19], '%Y-%m-%d %H:%M:%S')
+    ts += datetime.timedelta(seconds=1)
+    return urllib.parse.quote('"%s +0000"' % ts.strftime('%Y-%m-%d %H:%M:%S'))
 
 
 def GenerateAllChanges(host,
@@ -1130,7 +1377,10 @@ def GenerateAllChanges(host,
                        first_param=None,
                        limit=500,
                        o_params=None,
-                       start=None):
+                       start=None,
+                       stream=False,
+                       prefetch=False,
+                       keyset=False):
     """Queries a gerrit-on-borg server for all the changes matching the query
     terms.
 
@@ -1146,11 +1396,24 @@ def GenerateAllChanges(host,
         limit: Maximum number of requested changes per query.
         o_params: Refer to QueryChanges().
         start: Refer to QueryChanges().
+        stream: If True, use StreamQueryChanges() so that changes are yielded
+            while each page is being parsed, instead of holding whole pages in
+            memory.
+        prefetch: If True, request the next page in the background while the
+            current one is being consumed. Each page is then read in full
+            before its changes are yielded.
+        keyset: If True, page with a `before:` bound on the `updated` time of
+            the last change seen instead of a `start` offset, so that changes
+            updated while paging do not shift the following pages.
 
     Returns:
         A generator object to the list of returned changes.
     """
     already_returned = set()
+    query = StreamQueryChanges if stream else QueryChanges
+    page_size = 0
+    more_changes = 0
+    last_cl = None
 
     def at_most_once(cls):
         for cl in cls:
@@ -1158,36 +1421,94 @@ def GenerateAllChanges(host,
                 already_returned.add(cl['_number'])
                 yield cl
 
+    def tally(page):
+        nonlocal page_size, more_changes, last_cl
+        for cl in page:
+            page_size += 1
+            if '_more_changes' in cl:
+                more_changes += 1
+            last_cl = cl
+            yield cl
+
+    def fetch(cursor, page_start):
+        page_params = params
+        if cursor:
+            page_params = list(params) + [('before', cursor)]
+        return query(host, page_params, first_param, limit, o_params,
+                     page_start)
+
+    def fetch_all(cursor, page_start):
+        return list(fetch(cursor, page_start))
+
     start = start or 0
     cur_start = start
-    more_changes = True
-
-    while more_changes:
-        # This will fetch changes[start..start+limit] sorted by most recently
-        # updated. Since the rank of any change in this list can be changed any
-        # time (say user posting comment), subsequent calls may overalp like
-        # this: > initial order ABCDEFGH query[0..3]  => ABC > E gets updated.
-        # New order: EABCDFGH query[3..6] => CDF   # C is a dup query[6..9] =>
-        # GH    # E is missed.
-        page = QueryChanges(host, params, first_param, limit, o_params,
-                            cur_start)
-        for cl in at_most_once(page):
-            yield cl
+    cursor = None
+    paged = False
 
-        more_changes = [cl for cl in page if '_more_changes' in cl]
-        if len(more_changes) > 1:
+    def advance():
+        """Moves cursor/cur_start past the current page.
+
+        Returns whether there are more pages to fetch.
+        """
+        nonlocal cursor, cur_start, paged
+        if more_changes > 1:
             raise GerritError(
                 200,
                 'Received %d changes with a _more_changes attribute set but should '
-                'receive at most one.' % len(more_changes))
-        if more_changes:
-            cur_start += len(page)
+                'receive at most one.' % more_changes)
+        if not more_changes:
+            return False
+        paged = True
+        new_cursor = _KeysetCursor(last_cl['updated']) if keyset else None
+        if new_cursor != cursor:
+            cursor, cur_start = new_cursor, 0
+        else:
+            # Either offset paging, or a whole page of changes updated within
+            # the same second.
+            cur_start += page_size
+        return True
+
+    pool = ThreadPool(1) if prefetch else None
+    pending = None
+    try:
+        while True:
+            # This will fetch changes[start..start+limit] sorted by most
+            # recently updated. Since the rank of any change in this list can be
+            # changed any time (say user posting comment), subsequent calls may
+            # overalp like this: > initial order ABCDEFGH query[0..3]  => ABC >
+            # E gets updated. New order: EABCDFGH query[3..6] => CDF   # C is a
+            # dup query[6..9] => GH    # E is missed.
+            page_size = more_changes = 0
+            last_cl = None
+            if pending:
+                page = tally(pending.get())
+            else:
+                page = tally(fetch(cursor, cur_start))
+
+            more = None
+            if pool:
+                page = list(page)
+                more = advance()
+                pending = None
+                if more:
+                    pending = pool.apply_async(fetch_all, (cursor, cur_start))
+
+            for cl in at_most_once(page):
+                yield cl
+
+            if more is None:
+                more = advance()
+            if not more:
+                break
+    finally:
+        if pool:
+            pool.terminate()
 
     # If we paged through, query again the first page which in most
     # circumstances will fetch all changes that were modified while this
     # function was run.
-    if start != cur_start:
-        page = QueryChanges(host, params, first_param, limit, o_params, start)
+    if paged:
+        page = query(host, params, first_param, limit, o_params, start)
         for cl in at_most_once(page):
             yield cl
 
@@ -1517,6 +1838,21 @@ def GetOwnersForFile(host,
     return ReadHttpJsonResponse(CreateHttpConn(host, path))
 
 
+def GetCodeOwnerConfig(host, project, branch, path):
+    """Gets the code owner config of a folder, as a CodeOwnerConfigInfo.
+
+    https://gerrit.googlesource.com/plugins/code-owners/+/HEAD/resources/Documentation/rest-api.md
+
+    Returns:
+        An empty dict if the folder has no code owner config.
+    """
+    path = 'projects/%s/branches/%s/code_owners.config/%s' % (
+        urllib.parse.quote(project, ''), urllib.parse.quote(
+            branch, ''), urllib.parse.quote(path or '/', ''))
+    return ReadHttpJsonResponse(CreateHttpConn(host, path),
+                                accept_statuses=[200, 204])
+
+
 def GetReviewers(host, change):
     """Gets information about all reviewers attached to a change."""
     path = 'changes/%s/reviewers' % change
@@ -1818,6 +2154,59 @@ def GetAccountEmails(host,
     return cast(List[EmailRecord], resp)
 
 
+# Maps (host, account) to a Future of the account's details, or of None for
+# invalid accounts. Shared by ValidAccounts and PrefetchAccounts so that an
+# account is only ever looked up once.
+_account_details_cache: Dict[Tuple[str, str], concurrent.futures.Future] = {}
+_account_details_lock = threading.Lock()
+
+
+def _GetCachedAccountDetails(host, account):
+    key = (host, account)
+    with _account_details_lock:
+        future = _account_details_cache.get(key)
+        lookup = future is None
+        if lookup:
+            future = concurrent.futures.Future()
+            _account_details_cache[key] = future
+    if lookup:
+        try:
+            future.set_result(GetAccountDetails(host, account))
+        except GerritError:
+            future.set_result(None)
+        except BaseException as e:
+            # Don't remember unexpected failures, so that a later call looks
+            # the account up again.
+            with _account_details_lock:
+                if _account_details_cache.get(key) is future:
+                    del _account_details_cache[key]
+            future.set_exception(e)
+            raise
+    return future.result()
+
+
+def PrefetchAccounts(host, accounts, max_threads=10):
+    """Starts looking up the details of |accounts| in the background.
+
+    Lookups are cached, so a later ValidAccounts call for the same accounts
+    waits at most for the requests that are still in flight.
+    """
+    assert not isinstance(accounts, str), type(accounts)
+    with _account_details_lock:
+        accounts = [
+            a for a in set(accounts) if (host, a) not in _account_details_cache
+        ]
+    if not accounts:
+        return
+    # The executor's threads are joined once the lookups are done, or when
+    # the interpreter exits.
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(max_threads, len(accounts)))
+    for account in accounts:
+        executor.submit(_GetCachedAccountDetails, host, account)
+    executor.shutdown(wait=False)
+
+
 def ValidAccounts(host, accounts, max_threads=10):
     """Returns a mapping from valid account to its details.
 
@@ -1830,16 +2219,13 @@ def ValidAccounts(host, accounts, max_threads=10):
         return {}
 
     def get_one(account):
-        try:
-            return account, GetAccountDetails(host, account)
-        except GerritError:
-            return None, None
+        return account, _GetCachedAccountDetails(host, account)
 
     valid = {}
     with contextlib.closing(ThreadPool(min(max_threads,
                                            len(accounts)))) as pool:
         for account, details in pool.map(get_one, accounts):
-            if account and details:
+            if details:
                 valid[account] = details
     return valid
 
@@ -10,6 +10,7 @@ from __future__ import annotations
 
 import base64
 import collections
+import contextlib
 import datetime
 import enum
 import fnmatch
@@ -62,6 +63,7 @@ import newauth
 import owners_client
 import owners_finder
 import presubmit_canned_checks
+import presubmit_server
 import presubmit_support
 import rustfmt
 import scm
@@ -254,6 +256,17 @@ def time_time():
     return time.time()
 
 
+@contextlib.contextmanager
+def _UploadStage(name):
+    """Logs how long an upload stage took, shown with `git cl upload -v`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        logging.info('upload stage "%s" took %.2fs', name,
+                     time.perf_counter() - start)
+
+
 def datetime_now():
     # Use this so that it can be mocked in tests without interfering with python
     # system machinery.
@@ -1360,7 +1373,9 @@ class Changelist(object):
             self._owners_client = owners_client.GetCodeOwnersClient(
                 host=self.GetGerritHost(),
                 project=self.GetGerritProject(),
-                branch=branch)
+                branch=branch,
+                root=settings.GetRoot(),
+                ref=remote_branch)
         return self._owners_client
 
     def GetCCList(self):
@@ -1743,7 +1758,12 @@ class Changelist(object):
                 files: Optional[Sequence[str]] = None,
                 resultdb: Optional[bool] = None,
                 realm: Optional[str] = None,
-                end_commit: Optional[str] = None) -> Mapping[str, Any]:
+                end_commit: Optional[str] = None,
+                jobs: Optional[int] = None,
+                no_cache: bool = False,
+                profile: bool = False,
+                profile_output: Optional[str] = None,
+                incremental: bool = False) -> Mapping[str, Any]:
         """Calls sys.exit() if the hook fails; returns a HookResults otherwise."""
         args = self._GetCommonPresubmitArgs(verbose, upstream)
         args.append('--commit' if committing else '--upload')
@@ -1753,6 +1773,16 @@ class Changelist(object):
             args.append('--may_prompt')
         if parallel:
             args.append('--parallel')
+        if jobs:
+            args.extend(['--jobs', str(jobs)])
+        if no_cache:
+            args.append('--no_cache')
+        if incremental:
+            args.append('--incremental')
+        if profile:
+            args.append('--profile')
+        if profile_output:
+            args.extend(['--profile_output', profile_output])
         if all_files:
             args.append('--all_files')
         if files:
@@ -1791,8 +1821,14 @@ class Changelist(object):
                 if resultdb and realm:
                     cmd = ['rdb', 'stream', '-new', '-realm', realm, '--'] + cmd
 
-                p = subprocess2.Popen(cmd)
-                exit_code = p.wait()
+                exit_code = None
+                if not (resultdb and realm):
+                    # Use the checkout's presubmit_server.py, if running.
+                    exit_code = presubmit_server.RunPresubmit(
+                        settings.GetRoot(), args)
+                if exit_code is None:
+                    p = subprocess2.Popen(cmd)
+                    exit_code = p.wait()
 
                 metrics.collector.add_repeated(
                     'sub_commands', {
@@ -1816,6 +1852,23 @@ class Changelist(object):
             args.extend(['--description_file', description_file])
             subprocess2.Popen(['vpython3', PRESUBMIT_SUPPORT] + args).wait()
 
+    def _PrefetchAccounts(self, options: optparse.Values,
+                          change_desc: ChangeDescription) -> None:
+        """Starts validating the reviewer and cc accounts known so far.
+
+        The lookups run in the background and are cached, so that by the time
+        _CMDUploadChange validates the accounts, only the ones added since
+        (e.g. by presubmit checks) are left to look up.
+        """
+        if self.GetGerritHost() == 'chromium-review.googlesource.com':
+            # Accounts are not validated on this host, see _CMDUploadChange.
+            return
+        accounts = (change_desc.get_reviewers() + change_desc.get_cced() +
+                    (options.cc or []) + self.more_cc)
+        accounts = [a.strip() for a in accounts if a.strip()]
+        if accounts:
+            gerrit_util.PrefetchAccounts(self.GetGerritHost(), accounts)
+
     def _GetDescriptionForUpload(self, options: optparse.Values,
                                  git_diff_args: Sequence[str],
                                  files: Sequence[str]) -> ChangeDescription:
@@ -1866,7 +1919,7 @@ class Changelist(object):
                 if status[f] == self._owners_client.INSUFFICIENT_REVIEWERS
             ]
             owners = self.owners_client.SuggestOwners(
-                missing_files, exclude=[self.GetAuthor()])
+                missing_files, exclude=[self.GetAuthor()], minimal=True)
             assert isinstance(options.reviewers, list), options.reviewers
             options.reviewers.extend(owners)
 
@@ -2072,7 +2125,8 @@ class Changelist(object):
                                         upstream=parent,
                                         description=change_desc.description,
                                         all_files=False,
-                                        end_commit=end_commit)
+                                        end_commit=end_commit,
+                                        no_cache=options.no_cache)
             self.ExtendCC(hook_results['more_cc'])
 
         # Update the change description and ensure we have a Change Id.
@@ -2120,9 +2174,18 @@ class Changelist(object):
 
         return change_desc.get_reviewers(), ccs, change_desc
 
-    def PostUploadUpdates(self, options: optparse.Values,
-                          new_upload: _NewUpload, change_number: str) -> None:
-        """Makes necessary post upload changes to the local and remote cl."""
+    def PostUploadUpdates(
+        self,
+        options: optparse.Values,
+        new_upload: _NewUpload,
+        change_number: str,
+        pool: Optional[multiprocessing.pool.ThreadPool] = None
+    ) -> Optional[multiprocessing.pool.AsyncResult]:
+        """Makes necessary post upload changes to the local and remote cl.
+
+        If |pool| is given, the reviewers are added on it in the background
+        and the AsyncResult to wait on is returned.
+        """
         if not self.GetIssue():
             self.SetIssue(change_number)
 
@@ -2138,11 +2201,16 @@ class Changelist(object):
                                    new_upload.change_desc.description)
 
         if new_upload.reviewers or new_upload.ccs:
-            gerrit_util.AddReviewers(self.GetGerritHost(),
-                                     self._GerritChangeIdentifier(),
-                                     reviewers=new_upload.reviewers,
-                                     ccs=new_upload.ccs,
-                                     notify=bool(options.send_mail))
+            args = (self.GetGerritHost(), self._GerritChangeIdentifier())
+            kwargs = {
+                'reviewers': new_upload.reviewers,
+                'ccs': new_upload.ccs,
+                'notify': bool(options.send_mail),
+            }
+            if pool:
+                return pool.apply_async(gerrit_util.AddReviewers, args, kwargs)
+            gerrit_util.AddReviewers(*args, **kwargs)
+        return None
 
     def CMDUpload(self, options, git_diff_args, orig_args):
         """Uploads a change to codereview."""
@@ -2167,21 +2235,27 @@ class Changelist(object):
         print(f'Processing {_GetCommitCountSummary(*git_diff_args)}...')
 
         # Apply watchlists on upload.
-        watchlist = watchlists.Watchlists(settings.GetRoot())
-        files = self.GetAffectedFiles(base_branch)
-        if not options.bypass_watchlists:
-            self.ExtendCC(watchlist.GetWatchersForPaths(files))
-
-        change_desc = self._GetDescriptionForUpload(options, git_diff_args,
-                                                    files)
+        with _UploadStage('watchlists'):
+            watchlist = watchlists.Watchlists(settings.GetRoot())
+            files = self.GetAffectedFiles(base_branch)
+            if not options.bypass_watchlists:
+                self.ExtendCC(watchlist.GetWatchersForPaths(files))
+
+        with _UploadStage('description and owners'):
+            change_desc = self._GetDescriptionForUpload(options, git_diff_args,
+                                                        files)
+        # Look up the accounts known so far while the presubmit checks run.
+        self._PrefetchAccounts(options, change_desc)
         if not options.bypass_hooks:
-            hook_results = self.RunHook(committing=False,
-                                        may_prompt=not options.force,
-                                        verbose=options.verbose,
-                                        parallel=options.parallel,
-                                        upstream=base_branch,
-                                        description=change_desc.description,
-                                        all_files=False)
+            with _UploadStage('presubmit'):
+                hook_results = self.RunHook(committing=False,
+                                            may_prompt=not options.force,
+                                            verbose=options.verbose,
+                                            parallel=options.parallel,
+                                            upstream=base_branch,
+                                            description=change_desc.description,
+                                            all_files=False,
+                                            no_cache=options.no_cache)
             self.ExtendCC(hook_results['more_cc'])
 
         print_stats(git_diff_args)
@@ -3169,8 +3243,9 @@ class Changelist(object):
             valid_accounts = set(reviewers + cc)
             # TODO(crbug/877717): relax this for all hosts.
         else:
-            valid_accounts = gerrit_util.ValidAccounts(self.GetGerritHost(),
-                                                       reviewers + cc)
+            with _UploadStage('accounts'):
+                valid_accounts = gerrit_util.ValidAccounts(
+                    self.GetGerritHost(), reviewers + cc)
         logging.info('accounts %s are recognized, %s invalid',
                      sorted(valid_accounts),
                      set(reviewers + cc).difference(set(valid_accounts)))
@@ -3215,9 +3290,10 @@ class Changelist(object):
         # increment later.
         latest_ps = self.GetMostRecentPatchset(update=False) or 0
 
-        push_stdout = self._RunGitPushWithTraces(refspec, refspec_opts,
-                                                 git_push_metadata,
-                                                 options.push_options)
+        with _UploadStage('push'):
+            push_stdout = self._RunGitPushWithTraces(refspec, refspec_opts,
+                                                     git_push_metadata,
+                                                     options.push_options)
 
         if options.squash:
             regex = re.compile(r'remote:\s+https?://[\w\-\.\+\/#]*/(\d+)\s.*')
@@ -3239,11 +3315,12 @@ class Changelist(object):
             # GetIssue() is not set in case of non-squash uploads according to
             # tests. TODO(crbug.com/751901): non-squash uploads in git cl should
             # be removed.
-            gerrit_util.AddReviewers(self.GetGerritHost(),
-                                     self._GerritChangeIdentifier(),
-                                     reviewers,
-                                     cc,
-                                     notify=bool(options.send_mail))
+            with _UploadStage('reviewers'):
+                gerrit_util.AddReviewers(self.GetGerritHost(),
+                                         self._GerritChangeIdentifier(),
+                                         reviewers,
+                                         cc,
+                                         notify=bool(options.send_mail))
 
         return 0
 
@@ -4014,7 +4091,7 @@ def get_cl_statuses(changes: List[Changelist],
         yield (cl, 'error')
 
 
-def upload_branch_deps(cl, args, force=False):
+def upload_branch_deps(cl, args, force=False, stacked=False):
     """Uploads CLs of local branches that are dependents of the current branch.
 
     If the local branch dependency tree looks like:
@@ -4027,6 +4104,11 @@ def upload_branch_deps(cl, args, force=False):
     run on the dependent branches in this order:
     test2.1, test3.1, test3.2, test2.2, test3.3
 
+    If |stacked| is true, squashed uploads are used, which upload a branch
+    together with all of its changed upstream branches in a single push. So
+    "git cl upload" is only run on the leaves of the tree:
+    test3.1, test3.2, test3.3
+
     Note: This function does not rebase your local dependent branches. Use it
         when you make a change to the parent branch that will not conflict
         with its dependent branches, and you would like their dependencies
@@ -4057,11 +4139,13 @@ def upload_branch_deps(cl, args, force=False):
     # Create a dictionary of all local branches to the branches that are
     # dependent on it.
     tracked_to_dependents = collections.defaultdict(list)
+    upstreams = {}
     for b in branches.splitlines():
         tokens = b.split()
         if len(tokens) == 2:
             branch_name, tracked = tokens
             tracked_to_dependents[tracked].append(branch_name)
+            upstreams[branch_name] = tracked
 
     print()
     print('The dependent local branches of %s are:' % root_branch)
@@ -4082,11 +4166,33 @@ def upload_branch_deps(cl, args, force=False):
         print('There are no dependent local branches for %s' % root_branch)
         return 0
 
+    # Maps each dependent to the branch whose upload uploads it.
+    uploaded_by = {b: b for b in dependents}
+    if stacked:
+        uploaded_by = {}
+        for leaf in dependents:
+            if tracked_to_dependents.get(leaf):
+                continue
+            branch = leaf
+            while branch != root_branch:
+                uploaded_by.setdefault(branch, leaf)
+                branch = upstreams[branch]
+    to_upload = [b for b in dependents if uploaded_by[b] == b]
+
+    def is_uploaded(branch):
+        """Returns whether the last upload of branch is its current commit."""
+        key = 'branch.%s.%s' % (branch, LAST_UPLOAD_HASH_CONFIG_KEY)
+        last_upload = RunGit(['config', '--get', key], error_ok=True).strip()
+        return last_upload == RunGit(['rev-parse', branch]).strip()
+
     # Record all dependents that failed to upload.
     failures = {}
+    # Branches between a leaf and the root branch that a successful upload of
+    # the leaf left out, e.g. because only the leaf was cherry-picked.
+    skipped = set()
     # Go through all dependents, checkout the branch and upload.
     try:
-        for dependent_branch in dependents:
+        for dependent_branch in to_upload:
             print()
             print('--------------------------------------')
             print('Running "git cl upload" from %s:' % dependent_branch)
@@ -4096,6 +4202,11 @@ def upload_branch_deps(cl, args, force=False):
                 if CMDupload(OptionParser(), args) != 0:
                     print('Upload failed for %s!' % dependent_branch)
                     failures[dependent_branch] = 1
+                elif stacked:
+                    skipped.update(
+                        b for b in dependents
+                        if uploaded_by[b] == dependent_branch
+                        and b != dependent_branch and not is_uploaded(b))
             except Exception as e:
                 print(f"Unexpected exception: {e}")
                 failures[dependent_branch] = 1
@@ -4107,8 +4218,12 @@ def upload_branch_deps(cl, args, force=False):
     print()
     print('Upload complete for dependent branches!')
     for dependent_branch in dependents:
-        upload_status = 'failed' if failures.get(
-            dependent_branch) else 'succeeded'
+        if failures.get(uploaded_by[dependent_branch]):
+            upload_status = 'failed'
+        elif dependent_branch in skipped:
+            upload_status = 'skipped'
+        else:
+            upload_status = 'succeeded'
         print('  %s : %s' % (dependent_branch, upload_status))
     print()
 
@@ -4312,24 +4427,22 @@ def CMDstatus(parser, args):
                 print(url)
         return 0
 
-    branches = RunGit([
-        'for-each-ref', '--format=%(refname) %(committerdate:unix)',
-        'refs/heads'
-    ])
-    if not branches:
+    snapshot = git_common.get_branches_snapshot()
+    if not snapshot.branches:
         print('No local branch found.')
         return 0
 
     changes = [
-        Changelist(branchref=b, commit_date=ct)
-        for b, ct in map(lambda line: line.split(' '), branches.splitlines())
+        Changelist(branchref='refs/heads/' + b,
+                   commit_date=snapshot.branches[b].commit_date)
+        for b in sorted(snapshot.branches)
     ]
     print('Branches associated with reviews:')
     output = get_cl_statuses(changes,
                              fine_grained=not options.fast,
                              max_processes=options.maxjobs)
 
-    current_branch = scm.GIT.GetBranch(settings.GetRoot())
+    current_branch = snapshot.current_branch
 
     def FormatBranchName(branch, colorize=False):
         """Simulates 'git branch' behavior. Colorizes and prefixes branch name with
@@ -4861,9 +4974,18 @@ def CMDlint(parser, args):
         extra_check_functions = [
             cpplint_chromium.CheckPointerDeclarationWhitespace
         ]
-        for file in files_to_lint:
-            cpplint.ProcessFile(file, cpplint._cpplint_state.verbose_level,
-                                extra_check_functions)
+        cache_path = None
+        try:
+            cache_path = os.path.join(
+                scm.GIT.Capture(['rev-parse', '--absolute-git-dir'],
+                                cwd=root_path), 'cpplint_cache.json')
+        except (subprocess2.CalledProcessError, OSError):
+            pass
+        cpplint.ProcessFiles(files_to_lint,
+                             cpplint._cpplint_state.verbose_level,
+                             extra_check_functions,
+                             jobs=multiprocessing.cpu_count(),
+                             cache_path=cache_path)
     finally:
         os.chdir(previous_cwd)
 
@@ -4905,6 +5027,28 @@ def CMDpresubmit(parser, args):
         action='store_true',
         help='Run all tests specified by input_api.RunTests in all '
         'PRESUBMIT files in parallel.')
+    parser.add_option('--jobs',
+                      type='int',
+                      help='Run up to this many PRESUBMIT.py files '
+                      'concurrently in separate processes.')
+    parser.add_option('--no-cache',
+                      action='store_true',
+                      help='Run all presubmit checks, even the ones that '
+                      'passed before with the same files and description.')
+    parser.add_option('--incremental',
+                      action='store_true',
+                      help='Only run the per-file checks listed in '
+                      'PRESUBMIT_INCREMENTAL_CHECKS on the files changed '
+                      'since the last presubmit run that passed. Other checks '
+                      'still see the whole change.')
+    parser.add_option('--profile',
+                      action='store_true',
+                      help='Print the wall, CPU and subprocess time and the '
+                      'bytes read by each presubmit check.')
+    parser.add_option('--profile-output',
+                      help='Write the profile of each presubmit check to this '
+                      'file in the Trace Event Format, e.g. to load it in '
+                      'https://ui.perfetto.dev.')
     parser.add_option('--resultdb',
                       action='store_true',
                       help='Run presubmit checks in the ResultSink environment '
@@ -4954,7 +5098,12 @@ def CMDpresubmit(parser, args):
                         all_files=options.all,
                         files=options.files,
                         resultdb=options.resultdb,
-                        realm=options.realm)
+                        realm=options.realm,
+                        jobs=options.jobs,
+                        no_cache=options.no_cache,
+                        profile=options.profile,
+                        profile_output=options.profile_output,
+                        incremental=options.incremental)
     if options.json:
         write_json(options.json, result)
     return 0
@@ -5203,6 +5352,10 @@ def CMDupload(parser, args):
         action='store_true',
         help='Run all tests specified by input_api.RunTests in all '
         'PRESUBMIT files in parallel.')
+    parser.add_option('--no-cache',
+                      action='store_true',
+                      help='Run all presubmit checks, even the ones that '
+                      'passed before with the same files and description.')
     parser.add_option('--no-autocc',
                       action='store_true',
                       help='Disables automatic addition of CC emails')
@@ -5350,7 +5503,10 @@ def CMDupload(parser, args):
                 # doesn't have access to cl object. By unsetting lookedup_issue,
                 # we force code path that will read issue from the config.
                 cl.lookedup_issue = False
-            return upload_branch_deps(cl, orig_args, options.force)
+            return upload_branch_deps(cl,
+                                      orig_args,
+                                      options.force,
+                                      stacked=True)
         return 0
     if options.cherry_pick_stacked:
         parser.error(
@@ -5489,8 +5645,24 @@ def UploadAllSquashed(options: optparse.Values,
         m.group(1) for m in map(regex.match, push_stdout.splitlines()) if m
     ]
 
-    for i, (cl, new_upload) in enumerate(uploads_by_cl):
-        cl.PostUploadUpdates(options, new_upload, change_numbers[i])
+    # Local updates are made one change at a time since git config writes
+    # cannot run concurrently, while the reviewer updates on Gerrit are
+    # independent of each other and run in parallel.
+    pool = multiprocessing.pool.ThreadPool(
+        min(gerrit_util.MAX_CONCURRENT_CONNECTION, len(uploads_by_cl)))
+    try:
+        pending = [
+            cl.PostUploadUpdates(options,
+                                 new_upload,
+                                 change_numbers[i],
+                                 pool=pool)
+            for i, (cl, new_upload) in enumerate(uploads_by_cl)
+        ]
+        for result in pending:
+            if result:
+                result.get()
+    finally:
+        pool.close()
 
     return 0
 
@@ -6329,10 +6501,18 @@ def CMDowners(parser, args):
     parser.add_option('--show-all',
                       action='store_true',
                       help='Show all owners for a particular file')
+    parser.add_option('--local',
+                      action='store_true',
+                      help='Read the OWNERS files of the upstream branch '
+                      'instead of asking Gerrit.')
     options, args = parser.parse_args(args)
 
     cl = Changelist()
     author = cl.GetAuthor()
+    if options.local:
+        _, remote_branch = cl.GetRemoteBranch()
+        cl._owners_client = owners_client.LocalOwnersClient(settings.GetRoot(),
+                                                            ref=remote_branch)
 
     if options.show_all:
         if len(args) == 0:
@@ -150,6 +150,11 @@ GIT_TRANSIENT_ERRORS_RE = re.compile('|'.join(GIT_TRANSIENT_ERRORS),
 # See git commit b6160d95 for more information.
 MIN_UPSTREAM_TRACK_GIT_VERSION = (2, 3)
 
+# git merge-tree first supported --write-tree in version 2.38.0, and its
+# --merge-base option in 2.40.0.
+MIN_MERGE_TREE_GIT_VERSION = (2, 38)
+MIN_MERGE_TREE_BASE_GIT_VERSION = (2, 40)
+
 
 class BadCommitRefException(Exception):
     def __init__(self, refs):
@@ -383,19 +388,12 @@ def branch_config_map(option):
         return {}
 
 
-def branches(use_limit=True, *args):
-    NO_BRANCH = ('* (no branch', '* (detached', '* (HEAD detached')
-
+def check_branch_limit(num):
+    """Dies if num branches are more than depot-tools.branch-limit."""
     key = 'depot-tools.branch-limit'
     limit = get_config_int(key, 20)
 
-    output = run('branch', *args)
-    assert isinstance(output, str)
-    raw_branches = output.splitlines()
-
-    num = len(raw_branches)
-
-    if use_limit and num > limit:
+    if num > limit:
         die(
             """\
       Your git repo has too many branches (%d/%d) for this tool to work well.
@@ -407,6 +405,17 @@ def branches(use_limit=True, *args):
       git cl archive
       """, num, limit, key)
 
+
+def branches(use_limit=True, *args):
+    NO_BRANCH = ('* (no branch', '* (detached', '* (HEAD detached')
+
+    output = run('branch', *args)
+    assert isinstance(output, str)
+    raw_branches = output.splitlines()
+
+    if use_limit:
+        check_branch_limit(len(raw_branches))
+
     for line in raw_branches:
         if line.startswith(NO_BRANCH):
             continue
@@ -579,17 +588,29 @@ def freeze():
     return ' '.join(ret) or None
 
 
-def get_branch_tree(use_limit=False):
+def get_branch_tree(use_limit=False, snapshot=None):
     """Get the dictionary of {branch: parent}, compatible with topo_iter.
 
+    If snapshot is supplied, the branches and their upstreams are taken from
+    it instead of asking git about each branch.
+
     Returns a tuple of (skipped, <branch_tree dict>) where skipped is a set of
     branches without upstream branches defined.
     """
     skipped = set()
     branch_tree = {}
 
-    for branch in branches(use_limit=use_limit):
-        parent = upstream(branch)
+    if snapshot is None:
+        branch_list = branches(use_limit=use_limit)
+        get_upstream = upstream
+    else:
+        if use_limit:
+            check_branch_limit(len(snapshot.branches))
+        branch_list = sorted(snapshot.branches)
+        get_upstream = snapshot.upstream
+
+    for branch in branch_list:
+        parent = get_upstream(branch)
         if not parent:
             skipped.add(branch)
             continue
@@ -603,11 +624,24 @@ def get_or_create_merge_base(branch, parent=None) -> Optional[str]:
 
     If parent is supplied, it's used instead of calling upstream(branch).
     """
-    base: Optional[str] = branch_config(branch, 'base')
-    base_upstream = branch_config(branch, 'base-upstream')
     parent = parent or upstream(branch)
     if parent is None or branch is None:
         return None
+    base, changed = _find_merge_base(branch, parent)
+    if changed:
+        manual_merge_base(branch, base, parent)
+    return base
+
+
+def _find_merge_base(branch, parent) -> Tuple[str, bool]:
+    """Finds the merge base get_or_create_merge_base() returns, without
+    recording it.
+
+    Returns a tuple of the merge base and whether it needs to be recorded in
+    the branch's config.
+    """
+    base: Optional[str] = branch_config(branch, 'base')
+    base_upstream = branch_config(branch, 'base-upstream')
     actual_merge_base = run('merge-base', parent, branch)
     assert isinstance(actual_merge_base, str)
 
@@ -630,12 +664,12 @@ def get_or_create_merge_base(branch, parent=None) -> Optional[str]:
         else:
             logging.debug('Found pre-set merge-base for %s: %s', branch, base)
 
-    if not base:
+    changed = not base
+    if changed:
         base = actual_merge_base
-        manual_merge_base(branch, base, parent)
 
     assert isinstance(base, str)
-    return base
+    return base, changed
 
 
 def hash_multi(*reflike):
@@ -768,6 +802,127 @@ def rebase(parent, start, branch, abort=False, allow_gc=False):
                          cpe.stderr.decode('utf-8', 'replace'))
 
 
+def _merge_trees(base, ours, theirs, git_version):
+    """Merges the changes from commit |base| to commit |theirs| into commit
+    |ours|, without touching the working tree or the index.
+
+    Returns the hash of the merged tree, or None if the merge conflicts.
+    """
+    args = ['--merge-base=' + base]
+    if git_version < MIN_MERGE_TREE_BASE_GIT_VERSION:
+        # merge-tree merges from the merge base of its arguments, so merge
+        # into a commit with the tree of |ours| whose parent is |base|.
+        ours = run('commit-tree', '-p', base, '-m', 'rebase', ours + '^{tree}')
+        args = []
+    try:
+        return run('merge-tree', '--write-tree', '--no-messages', *args, ours,
+                   theirs).splitlines()[0]
+    except subprocess2.CalledProcessError:
+        return None
+
+
+def _copy_commit(commit, tree, parent, committer):
+    """Writes a copy of |commit| with |tree| and |parent| committed by
+    |committer|, and returns its hash."""
+    raw = run('cat-file', 'commit', commit, decode=False, autostrip=False)
+    header, _, message = raw.partition(b'\n\n')
+    lines = [b'tree ' + tree.encode(), b'parent ' + parent.encode()]
+    skip = False
+    for line in header.split(b'\n'):
+        # Lines starting with a space continue the previous header.
+        if not line.startswith(b' '):
+            key = line.split(b' ', 1)[0]
+            # The copy gets its own tree, parent and committer, and isn't
+            # signed.
+            skip = key in (b'tree', b'parent', b'committer', b'gpgsig',
+                           b'gpgsig-sha256')
+        if skip:
+            continue
+        lines.append(line)
+        if key == b'author':
+            if TEST_MODE:
+                # Like --committer-date-is-author-date.
+                committer = b' '.join([committer.rsplit(b' ', 2)[0]] +
+                                      line.rsplit(b' ', 2)[1:])
+            lines.append(b'committer ' + committer)
+    data = b'\n'.join(lines) + b'\n\n' + message
+    return run('hash-object', '-t', 'commit', '-w', '--stdin', indata=data)
+
+
+def _finish_rewrite(rewritten):
+    """Copies the notes of the rewritten commits and runs the post-rewrite
+    hook, like git-rebase does.
+
+    Args:
+        rewritten: (old hash, new hash) pairs of the copied commits.
+    """
+    if not rewritten:
+        return
+    data = ''.join('%s %s\n' % pair for pair in rewritten).encode('utf-8')
+    # Honours notes.rewrite.rebase and notes.rewriteRef.
+    run('notes', 'copy', '--for-rewrite=rebase', '--stdin', indata=data)
+    hook = os.path.abspath(run('rev-parse', '--git-path', 'hooks/post-rewrite'))
+    if os.access(hook, os.X_OK):
+        # Like git, ignore failures of the hook.
+        subprocess2.call([hook, 'rebase'], stdin=data, cwd=repo_root())
+
+
+def rebase_in_memory(parent, start, branch):
+    """Rebases |start|..|branch| onto |parent| like rebase(), without checking
+    out |branch|.
+
+    Each commit is merged with git merge-tree and written straight to the
+    object database, so the working tree and the index are left alone. Like
+    git-rebase, commits which become empty are dropped.
+
+    Nothing is changed if the commits can't be rebased this way, i.e. if they
+    conflict or aren't linear, if |branch| is checked out, if commits must be
+    signed (commit.gpgsign), or if git is older than
+    MIN_MERGE_TREE_GIT_VERSION. Use rebase() then.
+
+    Returns a RebaseRet like rebase(), whose stderr says why the rebase
+    failed.
+    """
+    git_version = get_git_version()
+    if git_version < MIN_MERGE_TREE_GIT_VERSION:
+        return RebaseRet(False, '', 'git merge-tree --write-tree is missing')
+    # The copies would lose their signatures.
+    if get_config('commit.gpgsign',
+                  'false').lower() in ('true', 'yes', 'on', '1'):
+        return RebaseRet(False, '', 'commit.gpgsign is set')
+    for line in run('worktree', 'list', '--porcelain').splitlines():
+        if line == 'branch refs/heads/' + branch:
+            return RebaseRet(False, '', '%s is checked out' % branch)
+
+    start_hash, start_tree, branch_hash, head, head_tree = hash_multi(
+        start, start + '^{tree}', branch, parent, parent + '^{tree}')
+    commits = run('rev-list', '--reverse', '--topo-order', '--no-commit-header',
+                  '--format=%H %T %P', '%s..%s' % (start_hash, branch_hash))
+    committer = run('var', 'GIT_COMMITTER_IDENT', decode=False)
+
+    trees = {start_hash: start_tree}
+    rewritten = []
+    for line in commits.splitlines():
+        commit, tree, *parents = line.split()
+        if len(parents) != 1 or parents[0] not in trees:
+            return RebaseRet(False, '', '%s is not linear' % commit)
+        trees[commit] = tree
+        new_tree = _merge_trees(parents[0], head, commit, git_version)
+        if new_tree is None:
+            return RebaseRet(False, '', '%s conflicts' % commit)
+        if new_tree == head_tree and tree != trees[parents[0]]:
+            logging.debug('Dropping %s, which is already in %s', commit, parent)
+            continue
+        head = _copy_commit(commit, new_tree, head, committer)
+        head_tree = new_tree
+        rewritten.append((commit, head))
+
+    run('update-ref', '-m', 'rebase-update: %s onto %s' % (branch, parent),
+        'refs/heads/' + branch, head, branch_hash)
+    _finish_rewrite(rewritten)
+    return RebaseRet(True, '', '')
+
+
 def remove_merge_base(branch):
     del_branch_config(branch, 'base')
     del_branch_config(branch, 'base-upstream')
@@ -1209,43 +1364,175 @@ def _extract_git_tuple(version_string):
     return tuple(int(x) for x in version.split('.'))
 
 
-def get_num_commits(branch):
-    base = get_or_create_merge_base(branch)
+def get_num_commits(branch, parent=None):
+    """Returns the number of commits on branch since its merge base, or None.
+
+    If parent is supplied, it's used instead of calling upstream(branch).
+    """
+    base = get_or_create_merge_base(branch, parent)
     if base:
         commits_list = run('rev-list', '--count', branch, '^%s' % base, '--')
         return int(commits_list) or None
     return None
 
 
-def get_branches_info(include_tracking_status):
-    format_string = (
-        '--format=%(refname:short):%(objectname:short):%(upstream:short):')
+def _count_commits(branch_parent):
+    """Returns the merge base of a (branch, parent) tuple, whether it must be
+    recorded, and the number of commits on branch since, see
+    get_num_commits()."""
+    branch, parent = branch_parent
+    base, changed = _find_merge_base(branch, parent)
+    commits_list = run('rev-list', '--count', branch, '^%s' % base, '--')
+    return base, changed, int(commits_list) or None
+
+
+# A local branch in a BranchesSnapshot.
+#   hash, short_hash - The commit the branch points to.
+#   upstream - The short name of the branch's upstream, or '' if it has none.
+#   upstream_ref - The full ref of the upstream, or ''.
+#   ahead, behind - The number of commits the branch is ahead and behind its
+#       upstream, or None.
+#   gone - Whether the upstream is configured but doesn't exist.
+#   commit_date - The committer date of the commit, in seconds since epoch.
+BranchSnapshot = collections.namedtuple(
+    'BranchSnapshot', 'hash short_hash upstream upstream_ref ahead behind gone '
+    'commit_date')
+
+
+class BranchesSnapshot(object):
+    """The local branches, tags and branch config of a repository at once.
+
+    Attributes:
+        branches: A {branch: BranchSnapshot} dict of the local branches.
+        tags: The set of tag names, or None if they weren't read.
+        current_branch: The checked out branch, 'HEAD' if HEAD is detached,
+            or None, like current_branch().
+        current_hash: The abbreviated hash of HEAD, or None.
+    """
 
-    # This is not covered by the depot_tools CQ which only has git version 1.8.
-    if (include_tracking_status and get_git_version() >=
-            MIN_UPSTREAM_TRACK_GIT_VERSION):  # pragma: no cover
-        format_string += '%(upstream:track)'
+    def __init__(self, branches, tags, current_branch, current_hash, config):
+        self.branches = branches
+        self.tags = tags
+        self.current_branch = current_branch
+        self.current_hash = current_hash
+        self._config = config
 
-    info_map = {}
-    data = run('for-each-ref', format_string, 'refs/heads')
+    def upstream(self, branch):
+        """Returns the upstream of branch if it exists, like upstream()."""
+        info = self.branches.get(branch)
+        if not info or not info.upstream or info.gone:
+            return None
+        return info.upstream
+
+    def branch_config(self, branch, option, default=None):
+        """Returns the branch.<branch>.<option> config, like branch_config()."""
+        return self._config.get(branch, {}).get(option.lower(), default)
+
+
+def get_branches_snapshot(include_tags=False):
+    """Returns a BranchesSnapshot of the repository in the current directory.
+
+    The branches are read with a single for-each-ref, and the config from the
+    config cache, so this costs the same for any number of branches.
+
+    Args:
+        include_tags: Whether to read the tags too, with a separate, cheaper
+            for-each-ref.
+    """
+    fields = [
+        'refname:strip=2', 'objectname', 'objectname:short', 'upstream',
+        'upstream:short', 'committerdate:unix', 'HEAD'
+    ]
+    # Older versions of git don't know %(upstream:track). The branches have
+    # no ahead, behind or gone state then.
+    if get_git_version() >= MIN_UPSTREAM_TRACK_GIT_VERSION:
+        fields.append('upstream:track')
+    data = run('for-each-ref',
+               '--format=' + '%00'.join('%%(%s)' % f for f in fields),
+               'refs/heads')
     assert isinstance(data, str)
-    BranchesInfo = collections.namedtuple('BranchesInfo',
-                                          'hash upstream commits behind')
+
+    branch_map = {}
+    current = None
+    current_hash = None
     for line in data.splitlines():
-        (branch, branch_hash, upstream_branch,
-         tracking_status) = line.split(':')
+        (branch, branch_hash, short_hash, upstream_ref, upstream_branch,
+         commit_date, head, *tracking_status) = line.split('\0')
+        tracking_status = tracking_status[0] if tracking_status else ''
+        ahead_match = re.search(r'ahead (\d+)', tracking_status)
+        behind_match = re.search(r'behind (\d+)', tracking_status)
+        branch_map[branch] = BranchSnapshot(
+            hash=branch_hash,
+            short_hash=short_hash,
+            upstream=upstream_branch,
+            upstream_ref=upstream_ref,
+            ahead=int(ahead_match.group(1)) if ahead_match else None,
+            behind=int(behind_match.group(1)) if behind_match else None,
+            gone=tracking_status == '[gone]',
+            commit_date=commit_date)
+        if head == '*':
+            current = branch
+            current_hash = short_hash
+
+    if current is None:
+        try:
+            current_hash = run('rev-parse', '--short', 'HEAD')
+            current = 'HEAD'
+        except subprocess2.CalledProcessError:
+            pass
 
-        commits = None
-        if include_tracking_status:
-            commits = get_num_commits(branch)
+    config = collections.defaultdict(dict)
+    for key, value in get_config_regexp(r'^branch\.'):
+        branch, _, option = key[len('branch.'):].rpartition('.')
+        config[branch][option] = value
 
-        behind_match = re.search(r'behind (\d+)', tracking_status)
-        behind = int(behind_match.group(1)) if behind_match else None
+    tag_set = None
+    if include_tags:
+        tag_set = set(
+            run('for-each-ref', '--format=%(refname:strip=2)',
+                'refs/tags').splitlines())
+
+    return BranchesSnapshot(branch_map, tag_set, current, current_hash,
+                            dict(config))
 
-        info_map[branch] = BranchesInfo(hash=branch_hash,
-                                        upstream=upstream_branch,
-                                        commits=commits,
-                                        behind=behind)
+
+def get_branches_info(include_tracking_status, snapshot=None):
+    """Returns {branch: BranchesInfo} for the local branches, and None for
+    their upstreams that are not local branches.
+
+    If include_tracking_status is set, the number of commits of each branch
+    since its merge base, and how far it's behind its upstream are included.
+    The merge bases are found concurrently.
+
+    Args:
+        include_tracking_status: Whether to include commits and behind.
+        snapshot: The BranchesSnapshot to use, instead of taking a new one.
+    """
+    snapshot = snapshot or get_branches_snapshot()
+    BranchesInfo = collections.namedtuple('BranchesInfo',
+                                          'hash upstream commits behind')
+
+    commits = {}
+    if include_tracking_status:
+        to_count = [(branch, snapshot.upstream(branch))
+                    for branch in sorted(snapshot.branches)
+                    if snapshot.upstream(branch)]
+        with ScopedPool(kind='threads') as pool:
+            counts = pool.map(_count_commits, to_count)
+        # The merge bases are recorded here, as git config can't be written
+        # concurrently.
+        for (branch, parent), (base, changed, count) in zip(to_count, counts):
+            if changed:
+                manual_merge_base(branch, base, parent)
+            commits[branch] = count
+
+    info_map = {}
+    for branch, info in snapshot.branches.items():
+        info_map[branch] = BranchesInfo(
+            hash=info.short_hash,
+            upstream=info.upstream,
+            commits=commits.get(branch),
+            behind=info.behind if include_tracking_status else None)
 
     # Set None for upstreams which are not branches (e.g empty upstream, remotes
     # and deleted upstream branches).
@@ -29,9 +29,9 @@ import metrics
 import subprocess2
 import sys
 
-from git_common import current_branch, upstream, tags, get_branches_info
+from git_common import get_branches_info, get_branches_snapshot
 from git_common import get_git_version, MIN_UPSTREAM_TRACK_GIT_VERSION, hash_one
-from git_common import get_config, run
+from git_common import run
 
 import gclient_utils
 import setup_color
@@ -111,6 +111,7 @@ class BranchMapper(object):
         __branches_info: a map of branches to their BranchesInfo objects which
             consist of the branch hash, upstream and ahead/behind status.
         __gone_branches: a set of upstreams which are not fetchable by git
+        __snapshot: the BranchesSnapshot the branches are read from.
     """
     def __init__(self):
         self.verbosity = 0
@@ -125,10 +126,13 @@ class BranchMapper(object):
         self.__current_hash = None
         self.__tag_set = None
         self.__status_info = {}
+        self.__snapshot = None
 
     def start(self):
+        self.__snapshot = get_branches_snapshot(include_tags=True)
         self.__branches_info = get_branches_info(
-            include_tracking_status=self.verbosity >= 1)
+            include_tracking_status=self.verbosity >= 1,
+            snapshot=self.__snapshot)
         if (self.verbosity >= 2):
             # Avoid heavy import unless necessary.
             from git_cl import get_cl_statuses, color_for_status, Changelist
@@ -162,15 +166,15 @@ class BranchMapper(object):
                 # branch like origin/main or it may be gone. Determine which it
                 # is, but don't re-query the same parent multiple times.
                 if parent not in roots:
-                    if not upstream(branch):
+                    if not self.__snapshot.upstream(branch):
                         self.__gone_branches.add(parent)
                     roots.add(parent)
 
             self.__parent_map[parent].append(branch)
 
-        self.__current_branch = current_branch()
-        self.__current_hash = hash_one('HEAD', short=True)
-        self.__tag_set = tags()
+        self.__current_branch = self.__snapshot.current_branch
+        self.__current_hash = self.__snapshot.current_hash or ''
+        self.__tag_set = self.__snapshot.tags
 
         if roots:
             for root in sorted(roots):
@@ -221,7 +225,7 @@ class BranchMapper(object):
         if '/' in branch:
             return False
 
-        return get_config(f'branch.{branch}.dormant') == 'true'
+        return self.__snapshot.branch_config(branch, 'dormant') == 'true'
 
     def __append_branch(self, branch, output, depth=0):
         """Recurses through the tree structure and appends an OutputLine to the
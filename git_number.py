@@ -18,11 +18,16 @@ any pair of the commits, one is an ancestor of the other.
 Since calculating the generation number of a commit requires walking that
 commit's entire history, this script caches all calculated data inside the git
 repo that it operates on in the ref 'refs/number/commits'.
+
+With --index, the numbers are instead kept in a sorted file in the git
+directory, which is looked up without loading it, and read from git's
+commit-graph when it has them.
 """
 
 import binascii
 import collections
 import logging
+import mmap
 import optparse
 import os
 import struct
@@ -48,6 +53,15 @@ PREFIX_LEN = 1
 # Set this to 'threads' to gather coverage data while testing.
 POOL_KIND = 'procs'
 
+# The file in the git directory NumberIndex keeps its numbers in. It starts
+# with an INDEX_HEADER_FMT header holding INDEX_MAGIC and the number of tips
+# and of numbers, followed by the 20 byte hashes of the tips, and the numbers
+# as CHUNK_FMT records sorted by commit hash.
+INDEX_FILE = 'number_index'
+INDEX_MAGIC = b'GNI1'
+INDEX_HEADER_FMT = '!4sLL'
+INDEX_HEADER_SIZE = struct.calcsize(INDEX_HEADER_FMT)
+
 
 def pathlify(hash_prefix):
     """Converts a binary object hash prefix into a posix path, one folder per
@@ -96,6 +110,11 @@ def clear_caches(on_disk=False):
     get_num.clear()
     if on_disk:
         git.run('update-ref', '-d', REF)
+        git_dir = git.run('rev-parse', '--absolute-git-dir')
+        try:
+            os.remove(os.path.join(git_dir, INDEX_FILE))
+        except OSError:
+            pass
 
 
 def intern_number_tree(tree):
@@ -262,6 +281,301 @@ def load_generation_numbers(targets):
             inc()
 
 
+def _bisect(data, start, size, lo, hi, commit_hash):
+    """Returns the position of the first of the records in data that is not
+    less than commit_hash.
+
+    Args:
+        data - A buffer with records of |size| bytes that start with a 20 byte
+            commit hash and are sorted by it, starting at |start|.
+        lo, hi - The range of records to search.
+        commit_hash - A binary-encoded full git commit hash.
+    """
+    while lo < hi:
+        mid = (lo + hi) // 2
+        offset = start + mid * size
+        if data[offset:offset + 20] < commit_hash:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _map_file(path):
+    """Returns the contents of the file at path mapped into memory, or None."""
+    try:
+        with open(path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+class CommitGraph(object):
+    """Reads generation numbers from git's commit-graph files.
+
+    For each commit, the commit-graph stores its topological level, which is
+    one more than its generation number, so numbering commits that are in it
+    needs no walk.
+    """
+    # Size of a record of the CDAT chunk and offset of the topological level.
+    CDAT_SIZE = 36
+    CDAT_LEVEL_OFFSET = 28
+    # Topological levels of commits too deep for the commit-graph, and of
+    # commits in commit-graphs written without them.
+    LEVEL_MAX = 0x3FFFFFFF
+    LEVEL_ZERO = 0
+
+    def __init__(self, git_dir):
+        self.layers = []
+        info_dir = os.path.join(git_dir, 'objects', 'info')
+        paths = [os.path.join(info_dir, 'commit-graph')]
+        if not os.path.exists(paths[0]):
+            graphs_dir = os.path.join(info_dir, 'commit-graphs')
+            try:
+                with open(os.path.join(graphs_dir, 'commit-graph-chain')) as f:
+                    paths = [
+                        os.path.join(graphs_dir, 'graph-%s.graph' % h)
+                        for h in f.read().split()
+                    ]
+            except IOError:
+                paths = []
+        for path in paths:
+            layer = self._read_layer(path)
+            if layer:
+                self.layers.append(layer)
+
+    @staticmethod
+    def _read_layer(path):
+        """Returns a (data, fanout, oids, commit data) tuple of the mapped
+        commit-graph file at path and the offsets of its chunks, or None."""
+        data = _map_file(path)
+        if data is None or len(data) < 8:
+            return None
+        signature, version, hash_version, num_chunks, _ = struct.unpack_from(
+            '!4sBBBB', data)
+        # Only SHA-1 repositories have 20 byte hashes.
+        if signature != b'CGPH' or version != 1 or hash_version != 1:
+            return None
+        chunks = {}
+        for i in range(num_chunks):
+            chunk_id, offset = struct.unpack_from('!4sQ', data, 8 + 12 * i)
+            chunks[chunk_id] = offset
+        if not all(c in chunks for c in (b'OIDF', b'OIDL', b'CDAT')):
+            return None
+        return data, chunks[b'OIDF'], chunks[b'OIDL'], chunks[b'CDAT']
+
+    def get_num(self, commit_hash):
+        """Returns the generation number for a commit, or None if it's not in
+        the commit-graph."""
+        for data, fanout, oids, commit_data in self.layers:
+            first = commit_hash[0]
+            lo = struct.unpack_from('!L', data, fanout + 4 *
+                                    (first - 1))[0] if first else 0
+            hi = struct.unpack_from('!L', data, fanout + 4 * first)[0]
+            i = _bisect(data, oids, 20, lo, hi, commit_hash)
+            if i == hi or data[oids + i * 20:oids + i * 20 + 20] != commit_hash:
+                continue
+            level = struct.unpack_from(
+                '!L', data,
+                commit_data + i * self.CDAT_SIZE + self.CDAT_LEVEL_OFFSET)[0]
+            level >>= 2
+            if level in (self.LEVEL_ZERO, self.LEVEL_MAX):
+                return None
+            return level - 1
+        return None
+
+
+class NumberIndex(object):
+    """Generation numbers kept in a sorted file in the git directory.
+
+    Unlike refs/number/commits, the file is never loaded: it's mapped into
+    memory and get_num() looks commits up with a binary search. It also
+    remembers the tips it numbered, so update() only walks the commits that
+    are newer than them. Numbers found in git's commit-graph are used as is.
+    """
+
+    def __init__(self, git_dir=None):
+        git_dir = git_dir or git.run('rev-parse', '--absolute-git-dir')
+        self.path = os.path.join(git_dir, INDEX_FILE)
+        self.commit_graph = None
+        # Like git, only read the commit-graph when core.commitGraph allows it.
+        if git.get_config('core.commitGraph',
+                          'true').lower() not in ('false', 'no', 'off', '0'):
+            self.commit_graph = CommitGraph(git_dir)
+        self.tips = []
+        # Numbers calculated since the file was written.
+        self.new = {}
+        self._data = None
+        self._count = 0
+        self._records = 0
+        self._load()
+
+    def _load(self):
+        self._data = _map_file(self.path)
+        if self._data is None or len(self._data) < INDEX_HEADER_SIZE:
+            return
+        magic, num_tips, count = struct.unpack_from(INDEX_HEADER_FMT,
+                                                    self._data)
+        self._records = INDEX_HEADER_SIZE + num_tips * 20
+        if (magic != INDEX_MAGIC
+                or len(self._data) != self._records + count * CHUNK_SIZE):
+            logging.warning('Ignoring corrupt git-number index %s', self.path)
+            self._data = None
+            return
+        self.tips = [
+            self._data[INDEX_HEADER_SIZE + i * 20:INDEX_HEADER_SIZE +
+                       (i + 1) * 20] for i in range(num_tips)
+        ]
+        self._count = count
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+        self._count = 0
+
+    def get_num(self, commit_hash):
+        """Returns the generation number for a commit.
+
+        Returns None if the generation number for this commit hasn't been
+        calculated yet (see update()).
+        """
+        num = self._get_indexed_num(commit_hash)
+        if num is None and self.commit_graph:
+            num = self.commit_graph.get_num(commit_hash)
+        return num
+
+    def _get_indexed_num(self, commit_hash):
+        """Returns the generation number of a commit if it's in the index file
+        or was calculated since it was written, and None otherwise."""
+        num = self.new.get(commit_hash)
+        if num is not None:
+            return num
+        i = _bisect(self._data, self._records, CHUNK_SIZE, 0, self._count,
+                    commit_hash)
+        if i < self._count:
+            key, num = struct.unpack_from(CHUNK_FMT, self._data,
+                                          self._records + i * CHUNK_SIZE)
+            if key == commit_hash:
+                return num
+        return None
+
+    def update(self, targets, save=True):
+        """Calculates the generation numbers of |targets| and their ancestors.
+
+        Commits are walked from |targets| until all the ancestors that are
+        left are numbered, either in the index, or in the commit-graph, or
+        because they are ancestors of the tips of the index. Ancestors of the
+        tips that turn out not to be numbered are then walked in full.
+
+        Args:
+            targets - An iterable of binary-encoded full git commit hashes.
+            save - Whether to write the new numbers to the index file.
+        """
+        targets = [t for t in targets if self.get_num(t) is None]
+        if not targets:
+            return
+
+        walked = self._walk(targets, self.tips)
+        # The tips' ancestors are not walked, but they may not all be in the
+        # index, e.g. when they were numbered from a commit-graph that has
+        # since gone away, so number the ones that are missing in full.
+        walked_hashes = set(commit_hash for commit_hash, _ in walked)
+        missing = set(targets)
+        missing.update(p for _, parents in walked for p in parents)
+        missing = [
+            c for c in missing
+            if c not in walked_hashes and self.get_num(c) is None
+        ]
+        if missing:
+            self._number(self._walk(missing, []))
+        self._number(walked)
+
+        tips = self.tips + targets
+        if len(tips) > 1:
+            # Only keep the tips that are not ancestors of others.
+            hex_tips = [binascii.hexlify(t).decode() for t in tips]
+            hex_tips = git.run('merge-base', '--independent', *hex_tips)
+            tips = [binascii.unhexlify(t) for t in hex_tips.split()]
+        self.tips = tips
+        if save:
+            self.save()
+
+    def _walk(self, targets, tips):
+        """Returns the (commit hash, parents) of the commits that need to be
+        walked to number |targets|, children first, excluding the ancestors of
+        |tips|."""
+        cmd = ['rev-list', '--topo-order', '--parents']
+        cmd += [binascii.hexlify(t).decode() for t in targets]
+        cmd += ['^' + binascii.hexlify(t).decode() for t in tips]
+        walked = []
+        # Commits the walk still needs to reach. Children come before their
+        # parents, so once there are none left, the rest of it can be skipped.
+        unknown = set(targets)
+        stream = git.run_stream(*cmd)
+        with git.ProgressPrinter('Walking: %(count)d') as inc:
+            for line in stream:
+                tokens = [binascii.unhexlify(token) for token in line.split()]
+                commit_hash, parents = tokens[0], tokens[1:]
+                walked.append((commit_hash, parents))
+                unknown.discard(commit_hash)
+                if self.get_num(commit_hash) is None:
+                    unknown.update(p for p in parents
+                                   if self.get_num(p) is None)
+                inc()
+                if not unknown:
+                    break
+        stream.close()
+        return walked
+
+    def _number(self, walked):
+        """Numbers the commits returned by _walk()."""
+        for commit_hash, parents in reversed(walked):
+            # The walk can include commits that are already in the index,
+            # which must not be written to it twice.
+            if self._get_indexed_num(commit_hash) is not None:
+                continue
+            num = self.get_num(commit_hash)
+            if num is None:
+                nums = [self.get_num(p) for p in parents]
+                if None in nums:
+                    raise ValueError('%s has unnumbered parents' %
+                                     binascii.hexlify(commit_hash).decode())
+                num = max(nums) + 1 if nums else 0
+            self.new[commit_hash] = num
+
+    def save(self):
+        """Writes the numbers calculated by update() to the index file."""
+        if not self.new:
+            return
+        new = sorted(self.new.items())
+        count = self._count + len(new)
+        data = self._data if self._data is not None else b''
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            header = struct.pack(INDEX_HEADER_FMT, INDEX_MAGIC, len(self.tips),
+                                 count)
+            f.write(header)
+            f.write(b''.join(self.tips))
+            # Copy the runs of old records between the new ones, rather than
+            # unpacking every record.
+            offset = self._records
+            for commit_hash, num in new:
+                end = _bisect(data, self._records, CHUNK_SIZE,
+                              (offset - self._records) // CHUNK_SIZE,
+                              self._count, commit_hash)
+                end = self._records + end * CHUNK_SIZE
+                f.write(data[offset:end])
+                f.write(struct.pack(CHUNK_FMT, commit_hash, num))
+                offset = end
+            f.write(data[offset:self._records + self._count * CHUNK_SIZE])
+        # The file can't be replaced while it's mapped on Windows.
+        self.close()
+        os.replace(tmp_path, self.path)
+        self.new = {}
+        self._load()
+
+
 def main():  # pragma: no cover
     parser = optparse.OptionParser(usage=sys.modules[__name__].__doc__)
     parser.add_option('--no-cache',
@@ -270,6 +584,11 @@ def main():  # pragma: no cover
     parser.add_option('--reset',
                       action='store_true',
                       help='Reset the generation number cache and quit.')
+    parser.add_option('--index',
+                      action='store_true',
+                      help='Keep the numbers in a file in the git directory '
+                      'rather than in %s, and use the numbers in git\'s '
+                      'commit-graph.' % REF)
     parser.add_option('-v',
                       '--verbose',
                       action='count',
@@ -297,6 +616,12 @@ def main():  # pragma: no cover
     except git.BadCommitRefException as e:
         parser.error(e)
 
+    if opts.index:
+        index = NumberIndex()
+        index.update(targets, save=not opts.no_cache)
+        print('\n'.join(str(index.get_num(t)) for t in targets))
+        return 0
+
     load_generation_numbers(targets)
     if not opts.no_cache:
         finalize(targets)
@@ -42,11 +42,20 @@ def find_return_branch_workdir():
     return return_branch, workdir
 
 
-def fetch_remotes(branch_tree):
-    """Fetches all remotes which are needed to update |branch_tree|."""
+def fetch_remotes(branch_tree, snapshot=None):
+    """Fetches all remotes which are needed to update |branch_tree|.
+
+    If |snapshot| is supplied, the tags and the full refs of the upstreams are
+    taken from it.
+    """
     fetch_tags = False
     remotes = set()
-    tag_set = git.tags()
+    tag_set = snapshot.tags if snapshot else git.tags()
+    full_refs = {}
+    if snapshot:
+        for info in snapshot.branches.values():
+            if info.upstream_ref:
+                full_refs[info.upstream] = info.upstream_ref
     fetchspec_map = {}
     all_fetchspec_configs = git.get_config_regexp(r'^remote\..*\.fetch')
     for key, fetchspec in all_fetchspec_configs:
@@ -57,7 +66,8 @@ def fetch_remotes(branch_tree):
         if parent in tag_set:
             fetch_tags = True
         else:
-            full_ref = git.run('rev-parse', '--symbolic-full-name', parent)
+            full_ref = full_refs.get(parent) or git.run(
+                'rev-parse', '--symbolic-full-name', parent)
             for dest_spec, remote_name in fetchspec_map.items():
                 if fnmatch(full_ref, dest_spec):
                     remotes.add(remote_name)
@@ -83,8 +93,8 @@ def fetch_remotes(branch_tree):
                             stderr=sys.stderr)
 
 
-def remove_empty_branches(branch_tree):
-    tag_set = git.tags()
+def remove_empty_branches(branch_tree, snapshot=None):
+    tag_set = snapshot.tags if snapshot else git.tags()
     ensure_root_checkout = git.once(lambda: git.run('checkout', git.root()))
 
     deletions = {}
@@ -140,7 +150,7 @@ def remove_empty_branches(branch_tree):
         print(git.run('branch', '-d', branch))
 
 
-def rebase_branch(branch, parent, start_hash):
+def rebase_branch(branch, parent, start_hash, in_memory=False):
     logging.debug('considering %s(%s) -> %s(%s) : %s', branch,
                   git.hash_one(branch), parent, git.hash_one(parent),
                   start_hash)
@@ -161,11 +171,18 @@ def rebase_branch(branch, parent, start_hash):
     if git.hash_one(parent) != start_hash:
         # Try a plain rebase first
         print('Rebasing:', branch)
-        consider_squashing = git.get_num_commits(branch) != 1
-        rebase_ret = git.rebase(parent,
-                                start_hash,
-                                branch,
-                                abort=consider_squashing)
+        rebase_ret = None
+        if in_memory:
+            rebase_ret = git.rebase_in_memory(parent, start_hash, branch)
+            if not rebase_ret.success:
+                logging.debug('Rebasing %s in memory failed: %s', branch,
+                              rebase_ret.stderr)
+        if not rebase_ret or not rebase_ret.success:
+            consider_squashing = git.get_num_commits(branch, parent) != 1
+            rebase_ret = git.rebase(parent,
+                                    start_hash,
+                                    branch,
+                                    abort=consider_squashing)
         if not rebase_ret.success:
             mid_rebase_message = textwrap.dedent("""\
                 Your working copy is in mid-rebase. Either:
@@ -242,6 +259,15 @@ def with_downstream_branches(base_branches, branch_tree):
     return downstream_branches.union(base_branches)
 
 
+def restore_return_branch(return_branch):
+    """Checks out return_branch again after --in-memory detached HEAD, unless
+    a rebase is left for the user to resolve."""
+    if git.in_rebase() or return_branch not in git.branches(use_limit=False):
+        return
+    git.run('checkout', return_branch)
+    git.thaw()
+
+
 def main(args=None):
     if gclient_utils.IsEnvCog():
         print(
@@ -275,6 +301,10 @@ def main(args=None):
                         '-e',
                         action='store_true',
                         help='Do not automatically delete empty branches.')
+    parser.add_argument('--in-memory',
+                        action='store_true',
+                        help='Rebase branches without checking them out, '
+                        'unless they conflict.')
     opts = parser.parse_args(args)
 
     if opts.verbose:  # pragma: no cover
@@ -310,7 +340,10 @@ def main(args=None):
     if opts.current:
         branches_to_rebase.add(git.current_branch())
 
-    skipped, branch_tree = git.get_branch_tree(use_limit=not opts.current)
+    # Read the branches, their upstreams and the tags once.
+    snapshot = git.get_branches_snapshot(include_tags=True)
+    skipped, branch_tree = git.get_branch_tree(use_limit=not opts.current,
+                                               snapshot=snapshot)
     if opts.tree:
         branches_to_rebase = with_downstream_branches(branches_to_rebase,
                                                       branch_tree)
@@ -321,7 +354,7 @@ def main(args=None):
         print('Skipping %s: No upstream specified' % branch)
 
     if not opts.no_fetch:
-        fetch_remotes(branch_tree)
+        fetch_remotes(branch_tree, snapshot)
 
     merge_base = {}
     for branch, parent in branch_tree.items():
@@ -330,33 +363,46 @@ def main(args=None):
     logging.debug('branch_tree: %s' % pformat(branch_tree))
     logging.debug('merge_base: %s' % pformat(merge_base))
 
+    if opts.in_memory:
+        # Branches can't be rebased in memory while they are checked out.
+        # return_branch is checked out again at the end.
+        git.run('checkout', '--detach')
+
     retcode = 0
     unrebased_branches = []
-    # Rebase each branch starting with the root-most branches and working
-    # towards the leaves.
-    for branch, parent in git.topo_iter(branch_tree):
-        # Only rebase specified branches, unless none specified.
-        if branches_to_rebase and branch not in branches_to_rebase:
-            continue
-        if git.is_dormant(branch):
-            print('Skipping dormant branch', branch)
-        else:
-            ret = rebase_branch(branch, parent, merge_base[branch])
-            if not ret:
-                retcode = 1
-
-                if opts.keep_going:
-                    print('--keep-going set, continuing with next branch.')
-                    unrebased_branches.append(branch)
-                    if git.in_rebase():
-                        git.run_with_retcode('rebase', '--abort')
-                    if git.in_rebase():  # pragma: no cover
-                        print(
-                            'Failed to abort rebase. Something is really wrong.'
-                        )
+    try:
+        # Rebase each branch starting with the root-most branches and working
+        # towards the leaves.
+        for branch, parent in git.topo_iter(branch_tree):
+            # Only rebase specified branches, unless none specified.
+            if branches_to_rebase and branch not in branches_to_rebase:
+                continue
+            if git.is_dormant(branch):
+                print('Skipping dormant branch', branch)
+            else:
+                ret = rebase_branch(branch, parent, merge_base[branch],
+                                    opts.in_memory)
+                if not ret:
+                    retcode = 1
+
+                    if opts.keep_going:
+                        print('--keep-going set, continuing with next branch.')
+                        unrebased_branches.append(branch)
+                        if git.in_rebase():
+                            git.run_with_retcode('rebase', '--abort')
+                        if git.in_rebase():  # pragma: no cover
+                            print('Failed to abort rebase. Something is '
+                                  'really wrong.')
+                            break
+                    else:
                         break
-                else:
-                    break
+    except BaseException:
+        if opts.in_memory:
+            restore_return_branch(return_branch)
+        raise
+    if retcode and opts.in_memory:
+        # return_branch is only checked out again below on success.
+        restore_return_branch(return_branch)
 
     if unrebased_branches:
         print()
@@ -366,7 +412,7 @@ def main(args=None):
 
     if not retcode:
         if not opts.keep_empty:
-            remove_empty_branches(branch_tree)
+            remove_empty_branches(branch_tree, snapshot)
 
         # return_branch may not be there any more.
         if return_branch in git.branches(use_limit=False):
@@ -13,15 +13,23 @@ import git_common as git
 import sys
 
 
+# Returns the hash of `branch`, reading it from `snapshot` if it's a local
+# branch.
+def get_hash(branch, snapshot):
+    if branch in snapshot.branches:
+        return snapshot.branches[branch].hash
+    return git.hash_one(branch)
+
+
 # Returns the list of branches that have diverged from their respective upstream
 # branch.
-def get_diverged_branches(tree):
+def get_diverged_branches(tree, snapshot):
     diverged_branches = []
     for branch, upstream_branch in tree.items():
         # If the merge base of a branch and its upstream is not equal to the
         # upstream, then it means that both branch diverged.
-        upstream_branch_hash = git.hash_one(upstream_branch)
-        merge_base_hash = git.hash_one(git.get_or_create_merge_base(branch))
+        upstream_branch_hash = get_hash(upstream_branch, snapshot)
+        merge_base_hash = git.get_or_create_merge_base(branch, upstream_branch)
         if upstream_branch_hash != merge_base_hash:
             diverged_branches.append(branch)
     return diverged_branches
@@ -29,11 +37,11 @@ def get_diverged_branches(tree):
 
 # Returns a dictionary that contains the hash of every branch before the
 # squashing started.
-def get_initial_hashes(tree):
+def get_initial_hashes(tree, snapshot):
     initial_hashes = {}
     for branch, upstream_branch in tree.items():
-        initial_hashes[branch] = git.hash_one(branch)
-        initial_hashes[upstream_branch] = git.hash_one(upstream_branch)
+        initial_hashes[branch] = get_hash(branch, snapshot)
+        initial_hashes[upstream_branch] = get_hash(upstream_branch, snapshot)
     return initial_hashes
 
 
@@ -92,7 +100,8 @@ def main(args=None):
     if git.is_dirty_git_tree('squash-branch-tree'):
         return 1
 
-    branches_without_upstream, tree = git.get_branch_tree()
+    snapshot = git.get_branches_snapshot()
+    branches_without_upstream, tree = git.get_branch_tree(snapshot=snapshot)
 
     if not opts.ignore_no_upstream and branches_without_upstream:
         print('Cannot use `git squash-branch-tree` since the following\n'
@@ -102,7 +111,7 @@ def main(args=None):
         print('Use --ignore-no-upstream to ignore this check and proceed.')
         return 1
 
-    diverged_branches = get_diverged_branches(tree)
+    diverged_branches = get_diverged_branches(tree, snapshot)
     if diverged_branches:
         print('Cannot use `git squash-branch-tree` since the following\n'
               'branches have diverged from their upstream and could cause\n'
@@ -113,9 +122,9 @@ def main(args=None):
 
     # Before doing the squashing, save the current branch checked out branch so
     # we can go back to it at the end.
-    return_branch = git.current_branch()
+    return_branch = snapshot.current_branch
 
-    initial_hashes = get_initial_hashes(tree)
+    initial_hashes = get_initial_hashes(tree, snapshot)
     downstream_branches = get_downstream_branches(tree)
     squash_subtree(opts.branch, initial_hashes, downstream_branches)
 
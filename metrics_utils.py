@@ -12,7 +12,7 @@ import urllib.parse
 # Current version of metrics recording.
 # When we add new metrics, the version number will be increased, we display the
 # user what has changed, and ask the user to agree again.
-CURRENT_VERSION = 3
+CURRENT_VERSION = 4
 
 APP_URL = 'https://cit-cli-metrics.appspot.com'
 
@@ -79,6 +79,14 @@ def get_change_notice(version):
             'you have opted in to or out of experimental features',
         ]
 
+    if version == 4:
+        return [
+            'We will start collecting metrics about HTTP hosts',
+            'asking depot_tools to slow down: the response code,',
+            'how many concurrent requests depot_tools limited',
+            'itself to and how long the host asked it to wait.',
+        ]
+
 
 KNOWN_PROJECT_URLS = {
     'https://chrome-internal.googlesource.com/chrome/ios_internal',
@@ -258,6 +266,25 @@ def extract_http_metrics(request_uri, method, status, response_time):
     return http_metrics
 
 
+def extract_http_throttling_metrics(host, status, concurrency_limit,
+                                    retry_after):
+    """Extract metrics about a host asking us to slow down.
+
+    Reports the status the host answered with, the concurrency limit that was
+    applied to it in response and the Retry-After delay it requested, if any.
+    The host is only reported if it is in KNOWN_HTTP_HOSTS.
+    """
+    throttling_metrics = {
+        'status': status,
+        'concurrency_limit': concurrency_limit,
+    }
+    if retry_after is not None:
+        throttling_metrics['retry_after'] = retry_after
+    if host in KNOWN_HTTP_HOSTS:
+        throttling_metrics['host'] = host
+    return throttling_metrics
+
+
 def get_repo_timestamp(path_to_repo):
     """Get an approximate timestamp for the upstream of |path_to_repo|.
 
@@ -221,17 +221,25 @@ class MyActivity(object):
         # Convert the "key:value" filter to a list of (key, value) pairs.
         req = list(f.split(':', 1) for f in filters)
         try:
-            # Instantiate the generator to force all the requests now and catch
-            # the errors here.
-            return list(
-                gerrit_util.GenerateAllChanges(instance['url'],
-                                               req,
-                                               o_params=[
-                                                   'MESSAGES', 'LABELS',
-                                                   'DETAILED_ACCOUNTS',
-                                                   'CURRENT_REVISION',
-                                                   'CURRENT_COMMIT'
-                                               ]))
+            # Consume the generator here to catch the errors. Changes are
+            # streamed and processed one at a time so that the raw query
+            # results are never held in memory all at once. The next page is
+            # fetched while the current one is processed, and pages are keyed
+            # on the update time so that changes updated meanwhile don't shift
+            # them.
+            return [
+                self.process_gerrit_issue(instance, issue)
+                for issue in gerrit_util.GenerateAllChanges(
+                    instance['url'],
+                    req,
+                    o_params=[
+                        'MESSAGES', 'LABELS', 'DETAILED_ACCOUNTS',
+                        'CURRENT_REVISION', 'CURRENT_COMMIT'
+                    ],
+                    stream=True,
+                    prefetch=True,
+                    keyset=True)
+            ]
         except gerrit_util.GerritError as e:
             error_message = 'Looking up %r: %s' % (instance['url'], e)
             if error_message not in self.access_errors:
@@ -255,9 +263,6 @@ class MyActivity(object):
 
         issues = self.gerrit_changes_over_rest(instance, filters)
         self.show_progress()
-        issues = [
-            self.process_gerrit_issue(instance, issue) for issue in issues
-        ]
 
         issues = filter(self.filter_issue, issues)
         issues = sorted(issues, key=lambda i: i['modified'], reverse=True)
@@ -569,6 +574,13 @@ class MyActivity(object):
             for error in self.access_errors:
                 logging.error(error.rstrip())
 
+    def print_throttling(self):
+        for host, state in sorted(gerrit_util.GetThrottleState().items()):
+            logging.info(
+                'Gerrit host %s was overloaded %d times, ending at %d '
+                'concurrent requests.', host, state['throttled'],
+                state['limit'])
+
     def get_reviews(self):
         num_instances = len(gerrit_instances)
         with contextlib.closing(ThreadPool(num_instances)) as pool:
@@ -1006,6 +1018,7 @@ def main():
     my_activity.show_progress('\n')
 
     my_activity.print_access_errors()
+    my_activity.print_throttling()
 
     output_file = None
     try:
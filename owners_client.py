@@ -2,11 +2,115 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import fnmatch
+import hashlib
+import heapq
+import json
+import logging
 import os
+import posixpath
 import random
+import re
+import time
 
+import gclient_utils
 import gerrit_util
 import git_common
+import scm
+import subprocess2
+
+
+# Seconds SuggestOwners spends looking for a smaller set of owners than the
+# greedy one, when asked for a minimal set, for each distinct set of owners of
+# the paths. The search never takes longer than MINIMAL_OWNERS_TIME_LIMIT.
+MINIMAL_OWNERS_TIME_PER_SET = 0.002
+MINIMAL_OWNERS_TIME_LIMIT = 0.2
+
+
+def time_time():
+    # Use this so that it can be mocked in tests without interfering with python
+    # system machinery.
+    return time.time()
+
+
+def _PosixPath(path):
+    """Returns path, relative to the root of the repository, with slashes."""
+    return path.replace(os.sep, '/').strip('/')
+
+
+def _BitCount(mask):
+    return bin(mask).count('1')
+
+
+def _GreedyCover(masks, rank):
+    """Returns owners covering all the bits in masks, picking the owner that
+    covers the most uncovered bits each time.
+
+    Gains only decrease as owners are picked, so the queue is updated lazily:
+    an owner is only re-scored when it reaches the top.
+    """
+    uncovered = 0
+    for mask in masks.values():
+        uncovered |= mask
+    queue = [(-_BitCount(mask), rank[owner], owner)
+             for owner, mask in masks.items()]
+    heapq.heapify(queue)
+    selected = []
+    while uncovered:
+        _, owner_rank, owner = heapq.heappop(queue)
+        gain = _BitCount(masks[owner] & uncovered)
+        if not gain:
+            continue
+        if queue and (-gain, owner_rank) > queue[0][:2]:
+            heapq.heappush(queue, (-gain, owner_rank, owner))
+            continue
+        selected.append(owner)
+        uncovered &= ~masks[owner]
+    return selected
+
+
+def _ExactCover(masks, rank, selected, deadline):
+    """Returns the smallest set of owners covering all the bits in masks that
+    can be found by deadline, or selected if none is smaller.
+
+    Branches on the uncovered bit with the fewest owners, and prunes branches
+    that can't beat the best set found so far.
+    """
+    uncovered = 0
+    for mask in masks.values():
+        uncovered |= mask
+    if not uncovered:
+        return selected
+    owners_by_bit = {}
+    for owner in sorted(masks, key=rank.get):
+        mask = masks[owner]
+        while mask:
+            bit = mask & -mask
+            owners_by_bit.setdefault(bit, []).append(owner)
+            mask ^= bit
+    max_gain = max(_BitCount(mask) for mask in masks.values())
+    best = [list(selected)]
+
+    def Search(uncovered, chosen):
+        if not uncovered:
+            best[0] = list(chosen)
+            return
+        # At least this many more owners are needed.
+        needed = -(-_BitCount(uncovered) // max_gain)
+        if len(chosen) + needed >= len(best[0]) or time_time() > deadline:
+            return
+        bit = min((b for b in owners_by_bit if b & uncovered),
+                  key=lambda b: len(owners_by_bit[b]))
+        candidates = sorted(owners_by_bit[bit],
+                            key=lambda o:
+                            (-_BitCount(masks[o] & uncovered), rank[o]))
+        for owner in candidates:
+            chosen.append(owner)
+            Search(uncovered & ~masks[owner], chosen)
+            chosen.pop()
+
+    Search(uncovered, [])
+    return best[0]
 
 
 class OwnersClient(object):
@@ -50,6 +154,8 @@ class OwnersClient(object):
         """
         if not paths:
             return dict()
+        # Avoid looking up the same path more than once concurrently.
+        paths = list(dict.fromkeys(paths))
         nproc = min(gerrit_util.MAX_CONCURRENT_CONNECTION, len(paths))
         with git_common.ScopedPool(nproc, kind='threads') as pool:
             return dict(
@@ -85,18 +191,34 @@ class OwnersClient(object):
         """Get sorted list of owners for the given paths."""
         if not paths:
             return []
+        return self._RankOwners(self.BatchListOwners(paths).values(), exclude)
+
+    @staticmethod
+    def _RankOwners(queues, exclude=None):
+        """Merges the lists of owners in queues, best owners first."""
+        if not queues:
+            return []
         exclude = exclude or []
         owners = []
-        queues = self.BatchListOwners(paths).values()
         for i in range(max(len(q) for q in queues)):
             for q in queues:
                 if i < len(q) and q[i] not in owners and q[i] not in exclude:
                     owners.append(q[i])
         return owners
 
-    def SuggestOwners(self, paths, exclude=None):
-        """Suggest a set of owners for the given paths."""
+    def SuggestOwners(self, paths, exclude=None, minimal=False):
+        """Suggest a set of owners for the given paths.
+
+        Args:
+            paths: the paths to suggest owners for.
+            exclude: owners not to suggest.
+            minimal: look for the smallest set of owners, for a few
+                milliseconds per distinct set of owners of the paths, instead
+                of picking owners in ScoreOwners order.
+        """
         exclude = exclude or []
+        if minimal:
+            return self._SuggestMinimalOwners(paths, exclude)
 
         paths_by_owner = {}
         owners_by_path = self.BatchListOwners(paths)
@@ -116,10 +238,146 @@ class OwnersClient(object):
 
         return selected
 
+    def _SuggestMinimalOwners(self, paths, exclude):
+        owners_by_path = self.BatchListOwners(paths)
+        ranked = self._RankOwners(list(owners_by_path.values()), exclude)
+        rank = {owner: i for i, owner in enumerate(ranked)}
+
+        # Paths with the same owners are covered by the same reviewers, so
+        # each distinct set of owners gets a bit, and masks has the bits of
+        # the sets each owner belongs to.
+        bits = {}
+        masks = dict.fromkeys(ranked, 0)
+        for owners in owners_by_path.values():
+            owners = frozenset(o for o in owners if o in rank)
+            if not owners or owners in bits:
+                continue
+            bits[owners] = 1 << len(bits)
+            for owner in owners:
+                masks[owner] |= bits[owners]
+
+        selected = _GreedyCover(masks, rank)
+        time_limit = min(MINIMAL_OWNERS_TIME_LIMIT,
+                         MINIMAL_OWNERS_TIME_PER_SET * len(bits))
+        selected = _ExactCover(masks, rank, selected, time_time() + time_limit)
+        return sorted(selected, key=rank.get)
+
+
+class _OwnersCache(object):
+    """Remembers the owners GerritClient looked up, until an OWNERS file
+    changes or MAX_AGE passes.
+
+    Owners are keyed on the host, project and branch, and on a hash of the
+    OWNERS files in the tree of a local ref of the branch. Owners also change
+    with things the checkout can't see, like group memberships and the
+    code-owners config on Gerrit, so they expire. The cache is stored in the
+    git directory of the checkout.
+    """
+    FILENAME = 'owners_cache.json'
+    # Number of revisions of the OWNERS files kept on disk, most recently used
+    # first.
+    MAX_REVISIONS = 10
+    # Seconds the owners of a revision are kept for, since the first of them
+    # was looked up.
+    MAX_AGE = 24 * 60 * 60
+
+    def __init__(self, path):
+        self._path = path
+        self._key = None
+        # Hashes of the OWNERS files of the trees seen last.
+        self._trees = {}
+        self._entries = {}
+        data = gclient_utils.FileReadJson(path)
+        try:
+            self._trees = dict(data['trees'])
+            self._entries = dict(data['entries'])
+        except (KeyError, TypeError, ValueError):
+            pass
+
+    @classmethod
+    def ForCheckout(cls, root, ref, host, project, branch):
+        """Returns the _OwnersCache of the checkout at root, or None."""
+        try:
+            git_dir = scm.GIT.GetGitDir(root)
+            tree = scm.GIT.Capture(['rev-parse', ref + '^{tree}'], cwd=root)
+        except (subprocess2.CalledProcessError, OSError):
+            return None
+        cache = cls(os.path.join(git_dir, cls.FILENAME))
+        revision = cache._trees.get(tree)
+        if not revision:
+            try:
+                listing = scm.GIT.Capture(['ls-tree', '-r', '-z', tree],
+                                          cwd=root,
+                                          strip_out=False)
+            except subprocess2.CalledProcessError:
+                return None
+            # OWNERS files can import any file named like *OWNERS*.
+            owners_files = [
+                entry for entry in listing.split('\0')
+                if 'OWNERS' in entry.rsplit('/', 1)[-1]
+            ]
+            revision = hashlib.sha256(
+                '\0'.join(owners_files).encode('utf-8')).hexdigest()
+            cache._trees = {tree: revision}
+        cache._key = json.dumps([host, project, branch, revision])
+        return cache
+
+    def _Entry(self):
+        """Returns the entry of the current revision, or None if it's missing
+        or expired."""
+        entry = self._entries.get(self._key)
+        if (not isinstance(entry, dict)
+                or time_time() - entry.get('created', 0) > self.MAX_AGE):
+            return None
+        return entry
+
+    @property
+    def owners(self):
+        """Returns the cached owners, as a dictionary {path: [owners]}."""
+        entry = self._Entry()
+        if not entry:
+            return {}
+        return {
+            _PosixPath(path): owners
+            for path, owners in entry.get('owners', {}).items()
+        }
+
+    def Save(self, owners):
+        """Stores the owners, a dictionary {path: [owners]}."""
+        now = time_time()
+        entry = self._Entry()
+        self._entries[self._key] = {
+            'time': now,
+            'created': entry['created'] if entry else now,
+            'owners': {
+                _PosixPath(path): o
+                for path, o in owners.items()
+            },
+        }
+        entries = sorted(self._entries.items(),
+                         key=lambda item: item[1].get('time', 0),
+                         reverse=True)[:self.MAX_REVISIONS]
+        gclient_utils.FileWriteJson(self._path, {
+            'trees': self._trees,
+            'entries': dict(entries)
+        })
+
 
 class GerritClient(OwnersClient):
-    """Implement OwnersClient using OWNERS REST API."""
-    def __init__(self, host, project, branch):
+    """Implement OwnersClient using OWNERS REST API.
+
+    Files in the same directory usually have the same owners, so
+    BatchListOwners looks up a single file per directory whose code owner
+    config doesn't give some of its files other owners.
+    """
+
+    def __init__(self, host, project, branch, root=None, ref=None):
+        """
+        Args:
+            root: optional checkout of the branch, to cache owners in.
+            ref: the ref of the branch in root, e.g. refs/remotes/origin/main.
+                Owners are cached until an OWNERS file in it changes.
+        """
         super(GerritClient, self).__init__()
 
         self._host = host
@@ -127,6 +385,16 @@ class GerritClient(OwnersClient):
         self._branch = branch
         self._owners_cache = {}
         self._best_owners_cache = {}
+        # Code owner configs by directory, or None if they can't be fetched.
+        self._configs = {}
+        self._configs_available = True
+
+        self._disk_cache = None
+        if root and ref:
+            self._disk_cache = _OwnersCache.ForCheckout(root, ref, host,
+                                                        project, branch)
+        if self._disk_cache:
+            self._owners_cache.update(self._disk_cache.owners)
 
         # Seed used by Gerrit to shuffle code owners that have the same score.
         # Can be used to make the sort order stable across several requests,
@@ -136,7 +404,7 @@ class GerritClient(OwnersClient):
 
     def _FetchOwners(self, path, cache, highest_score_only=False):
         # Always use slashes as separators.
-        path = path.replace(os.sep, '/')
+        path = _PosixPath(path)
         if path not in cache:
             # GetOwnersForFile returns a list of account details sorted by order
             # of best reviewer for path. If owners have the same score, the
@@ -162,6 +430,87 @@ class GerritClient(OwnersClient):
     def ListOwners(self, path):
         return self._FetchOwners(path, self._owners_cache)
 
+    def _GetCodeOwnerConfig(self, directory):
+        """Returns the code owner config of directory, {} if it has none, or
+        None if it can't be fetched."""
+        if directory not in self._configs:
+            config = None
+            if self._configs_available:
+                try:
+                    config = gerrit_util.GetCodeOwnerConfig(
+                        self._host, self._project, self._branch, directory)
+                except gerrit_util.GerritError as e:
+                    # Don't try again if the host doesn't support it.
+                    logging.info('Failed to get code owner config: %s', e)
+                    self._configs_available = False
+            self._configs[directory] = config
+        return self._configs[directory]
+
+    def _HasSameOwners(self, directory):
+        """Returns True if all the files right under directory have the same
+        owners.
+
+        That's the case unless the code owner config of the directory has
+        per-file rules, or one of the configs it inherits from has per-file
+        rules that reach into subdirectories. Imported per-file rules can't be
+        checked, so they count too.
+        """
+        own_config = True
+        while True:
+            config = self._GetCodeOwnerConfig(directory)
+            if config is None:
+                return False
+            for import_info in config.get('imports', []):
+                mode = import_info.get('import_mode')
+                if mode != 'GLOBAL_CODE_OWNER_SETS_ONLY':
+                    return False
+            for owner_set in config.get('code_owner_sets', []):
+                for expression in owner_set.get('path_expressions', []):
+                    if own_config or '/' in expression or '**' in expression:
+                        return False
+            if config.get('ignore_parent_code_owners') or not directory:
+                return True
+            directory = posixpath.dirname(directory)
+            own_config = False
+
+    def BatchListOwners(self, paths):
+        if not paths:
+            return dict()
+        paths = list(dict.fromkeys(paths))
+        paths_by_dir = {}
+        for path in paths:
+            path = _PosixPath(path)
+            if path not in self._owners_cache:
+                paths_by_dir.setdefault(posixpath.dirname(path),
+                                        []).append(path)
+
+        shared_dirs = [d for d, p in paths_by_dir.items() if len(p) > 1]
+        if shared_dirs:
+            nproc = min(gerrit_util.MAX_CONCURRENT_CONNECTION, len(shared_dirs))
+            with git_common.ScopedPool(nproc, kind='threads') as pool:
+                shared_dirs = {
+                    d
+                    for d, same in zip(
+                        shared_dirs, pool.map(self._HasSameOwners, shared_dirs))
+                    if same
+                }
+        lookups = []
+        for directory, dir_paths in paths_by_dir.items():
+            if directory in shared_dirs:
+                lookups.append(dir_paths[0])
+            else:
+                lookups.extend(dir_paths)
+
+        super(GerritClient, self).BatchListOwners(lookups)
+        for directory in shared_dirs:
+            dir_paths = paths_by_dir[directory]
+            for path in dir_paths[1:]:
+                self._owners_cache[path] = list(
+                    self._owners_cache[dir_paths[0]])
+        if self._disk_cache and lookups:
+            self._disk_cache.Save(self._owners_cache)
+        return {path: self.ListOwners(path) for path in paths}
+
     def ListBestOwners(self, path):
         return self._FetchOwners(path,
                                  self._best_owners_cache,
@@ -178,13 +527,219 @@ class GerritClient(OwnersClient):
                                     paths))
 
 
-def GetCodeOwnersClient(host, project, branch):
+class _OwnersFile(object):
+    """The rules of an OWNERS file, with the files it imports resolved."""
+
+    def __init__(self):
+        # Owners of every file in the directory and its subdirectories.
+        self.owners = []
+        self.noparent = False
+        # (patterns, owners, noparent) tuples, for files right under the
+        # directory whose name matches one of the compiled patterns.
+        self.per_file = []
+        # Lines that couldn't be understood.
+        self.bad_lines = []
+
+
+class LocalOwnersClient(OwnersClient):
+    """Implement OwnersClient by reading the OWNERS files of a checkout.
+
+    Understands the syntax of the find-owners backend of the code-owners
+    plugin: email addresses, '*', 'set noparent', 'per-file', 'file:' and
+    'include'. Like GerritClient, owners from the closest OWNERS file come
+    first, and EVERYONE comes last. Imports from other repositories are
+    ignored.
+
+    The owners of each directory are resolved once, so listing the owners of
+    a path only has to match the per-file rules of its directory.
+    """
+    OWNER_RE = re.compile(r'^[^@\s,=]+@[^@\s,=]+$')
+
+    def __init__(self, root, ref=None):
+        """
+        Args:
+            root: the checkout.
+            ref: optional ref to read the OWNERS files from, instead of the
+                working tree of root.
+        """
+        super(LocalOwnersClient, self).__init__()
+        self._root = root
+        self._ref = ref
+        # Contents of the files in ref, or None when reading the working tree.
+        self._tree = None
+        if ref:
+            self._tree = self._ReadTree(root, ref)
+        # Parsed OWNERS files by path, None for missing ones.
+        self._files = {}
+        # Owners inherited by everything under a directory, by directory.
+        self._dir_owners = {}
+
+    @staticmethod
+    def _ReadTree(root, ref):
+        """Returns {path: contents} for the files named like *OWNERS* in ref.
+
+        ls-tree can't match globs, so the listing is filtered here. Other
+        files an OWNERS file refers to are read on demand."""
+        listing = scm.GIT.Capture(['ls-tree', '-r', '-z', '--name-only', ref],
+                                  cwd=root,
+                                  strip_out=False)
+        return scm.GIT.GetOldContentsBatch(root, [
+            p for p in listing.split('\0')
+            if p and 'OWNERS' in posixpath.basename(p)
+        ], ref)
+
+    def _ReadFile(self, path):
+        """Returns the contents of path, relative to root, or None."""
+        if self._tree is None:
+            try:
+                with open(os.path.join(self._root, path),
+                          encoding='utf-8',
+                          errors='replace') as f:
+                    return f.read()
+            except (IOError, OSError):
+                return None
+        if path not in self._tree:
+            if 'OWNERS' in posixpath.basename(path):
+                return None
+            # A missing file reads as empty, which imports nothing.
+            self._tree[path] = scm.GIT.GetOldContents(self._root, path,
+                                                      self._ref)
+        return self._tree[path]
+
+    @staticmethod
+    def _ResolvePath(target, directory):
+        """Returns the path a file: or include line refers to, or None."""
+        target = target.strip()
+        # Files from other repositories, as repo:path or repo:branch:path.
+        if not target or ':' in target:
+            return None
+        if target.startswith('/'):
+            return posixpath.normpath(target.lstrip('/'))
+        path = posixpath.normpath(posixpath.join(directory, target))
+        if path.startswith('..'):
+            return None
+        return path
+
+    def _GetFile(self, path, loading=()):
+        """Returns the _OwnersFile at path, or None if it doesn't exist."""
+        if path in self._files:
+            return self._files[path]
+        # Ignore import cycles.
+        if path in loading:
+            return None
+        text = self._ReadFile(path)
+        owners_file = None
+        if text is not None:
+            owners_file = self._Parse(text, posixpath.dirname(path),
+                                      loading + (path, ))
+        self._files[path] = owners_file
+        return owners_file
+
+    def _Import(self, target, directory, loading):
+        target = self._ResolvePath(target, directory)
+        if target is None:
+            return None
+        return self._GetFile(target, loading)
+
+    def _Parse(self, text, directory, loading):
+        owners_file = _OwnersFile()
+        for raw_line in text.splitlines():
+            line = raw_line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            if line == 'set noparent':
+                owners_file.noparent = True
+            elif line.startswith('file:'):
+                imported = self._Import(line[len('file:'):], directory, loading)
+                if imported:
+                    owners_file.owners.extend(imported.owners)
+            elif line.startswith('include '):
+                imported = self._Import(line[len('include '):], directory,
+                                        loading)
+                if imported:
+                    owners_file.owners.extend(imported.owners)
+                    owners_file.noparent |= imported.noparent
+                    owners_file.per_file.extend(imported.per_file)
+            elif line.startswith('per-file ') and '=' in line:
+                globs, _, directive = line[len('per-file '):].partition('=')
+                patterns = [
+                    re.compile(fnmatch.translate(g.strip()))
+                    for g in globs.split(',') if g.strip()
+                ]
+                directive = directive.strip()
+                owners = []
+                noparent = False
+                if directive == 'set noparent':
+                    noparent = True
+                elif directive.startswith('file:'):
+                    imported = self._Import(directive[len('file:'):], directory,
+                                            loading)
+                    if imported:
+                        owners = list(imported.owners)
+                else:
+                    entries = [o.strip() for o in directive.split(',')]
+                    owners = [
+                        o for o in entries
+                        if o == self.EVERYONE or self.OWNER_RE.match(o)
+                    ]
+                    if len(owners) < len(entries):
+                        owners_file.bad_lines.append(raw_line)
+                owners_file.per_file.append((patterns, owners, noparent))
+            elif line == self.EVERYONE or self.OWNER_RE.match(line):
+                owners_file.owners.append(line)
+            else:
+                owners_file.bad_lines.append(raw_line)
+        return owners_file
+
+    def _DirectoryOwners(self, directory):
+        """Returns the owners of everything under directory, closest first."""
+        if directory not in self._dir_owners:
+            owners_file = self._GetFile(posixpath.join(directory, 'OWNERS'))
+            owners = []
+            if owners_file:
+                owners.extend(owners_file.owners)
+            if directory and not (owners_file and owners_file.noparent):
+                owners.extend(
+                    self._DirectoryOwners(posixpath.dirname(directory)))
+            self._dir_owners[directory] = owners
+        return self._dir_owners[directory]
+
+    def ListOwners(self, path):
+        directory, name = posixpath.split(_PosixPath(path))
+        owners = []
+        noparent = False
+        owners_file = self._GetFile(posixpath.join(directory, 'OWNERS'))
+        if owners_file:
+            for patterns, rule_owners, rule_noparent in owners_file.per_file:
+                if any(p.match(name) for p in patterns):
+                    owners.extend(rule_owners)
+                    noparent |= rule_noparent
+        if not noparent:
+            owners.extend(self._DirectoryOwners(directory))
+
+        owners = list(dict.fromkeys(owners))
+        if self.EVERYONE in owners:
+            owners.remove(self.EVERYONE)
+            owners.append(self.EVERYONE)
+        return owners
+
+    def BatchListOwners(self, paths):
+        return {path: self.ListOwners(path) for path in paths}
+
+    def GetBadLines(self, path):
+        """Returns the lines of the OWNERS file at path that aren't
+        understood."""
+        owners_file = self._GetFile(_PosixPath(path))
+        return owners_file.bad_lines if owners_file else []
+
+
+def GetCodeOwnersClient(host, project, branch, root=None, ref=None):
     """Get a new OwnersClient.
 
     Uses GerritClient and raises an exception if code-owners plugin is not
-    available."""
+    available. See GerritClient for root and ref."""
     if gerrit_util.IsCodeOwnersEnabledOnHost(host):
-        return GerritClient(host, project, branch)
+        return GerritClient(host, project, branch, root=root, ref=ref)
     raise Exception(
         'code-owners plugin is not enabled. Ask your host admin to enable it '
         'on %s. Read more about code-owners at '
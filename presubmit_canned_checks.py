@@ -237,8 +237,7 @@ def CheckAuthorizedAuthor(input_api, output_api, bot_allowlist=None):
     return []
 
 
-def CheckDoNotSubmitInFiles(input_api, output_api):
-    """Checks that the user didn't add 'DO NOT ''SUBMIT' to any files."""
+def _DoNotSubmitInFilesRule():
     # We want to check every text file, not just source files.
     file_filter = lambda x: x
 
@@ -252,22 +251,41 @@ def CheckDoNotSubmitInFiles(input_api, output_api):
         except UnicodeDecodeError:
             return True
 
-    errors = _FindNewViolationsOfRule(DoNotSubmitRule, input_api, file_filter)
-    text = '\n'.join('Found %s in %s' % (keyword, loc) for loc in errors)
-    if text:
-        return [output_api.PresubmitError(text)]
-    return []
+    def results_factory(output_api, errors):
+        text = '\n'.join('Found %s in %s' % (keyword, loc) for loc in errors)
+        if text:
+            return [output_api.PresubmitError(text)]
+        return []
+
+    return _LineRule(DoNotSubmitRule,
+                     results_factory,
+                     file_filter,
+                     file_rule=_KeywordFileRule(keyword))
+
+
+def CheckDoNotSubmitInFiles(input_api, output_api):
+    """Checks that the user didn't add 'DO NOT ''SUBMIT' to any files."""
+    return _RunLineRules(input_api, output_api, [_DoNotSubmitInFilesRule()])[0]
+
+
+def _CorpLinksInFilesRule(source_file_filter=None):
+
+    def results_factory(output_api, errors):
+        text = '\n'.join('Found corp link in %s' % loc for loc in errors)
+        if text:
+            return [output_api.PresubmitPromptWarning(text)]
+        return []
+
+    return _LineRule(lambda _, line: _CORP_LINK_KEYWORD not in line,
+                     results_factory,
+                     source_file_filter,
+                     file_rule=_KeywordFileRule(_CORP_LINK_KEYWORD))
 
 
 def CheckCorpLinksInFiles(input_api, output_api, source_file_filter=None):
     """Checks that files do not contain a corp link."""
-    errors = _FindNewViolationsOfRule(
-        lambda _, line: _CORP_LINK_KEYWORD not in line, input_api,
-        source_file_filter)
-    text = '\n'.join('Found corp link in %s' % loc for loc in errors)
-    if text:
-        return [output_api.PresubmitPromptWarning(text)]
-    return []
+    return _RunLineRules(input_api, output_api,
+                         [_CorpLinksInFilesRule(source_file_filter)])[0]
 
 
 def CheckLargeScaleChange(input_api, output_api):
@@ -292,12 +310,30 @@ def GetCppLintFilters(lint_filters=None):
     return filters
 
 
+def _CppLintCachePath(input_api):
+    """Returns the file to cache cpplint results in, or None."""
+    if input_api.change.scm != 'git':
+        return None
+    try:
+        git_dir = input_api.subprocess.check_output(
+            ['git', 'rev-parse', '--absolute-git-dir'],
+            cwd=input_api.change.RepositoryRoot()).decode('utf-8').strip()
+    except Exception:
+        return None
+    return input_api.os_path.join(git_dir, 'cpplint_cache.json')
+
+
 def CheckChangeLintsClean(input_api,
                           output_api,
                           source_file_filter=None,
                           lint_filters=None,
-                          verbose_level=None):
-    """Checks that all '.cc' and '.h' files pass cpplint.py."""
+                          verbose_level=None,
+                          changed_lines_only=False):
+    """Checks that all '.cc' and '.h' files pass cpplint.py.
+
+    If changed_lines_only is set, only the lines the change adds or modifies
+    are checked, which is much faster for small changes to large files.
+    """
     _RE_IS_TEST = input_api.re.compile(r'.*tests?.(cc|h)$')
     result = []
 
@@ -325,18 +361,26 @@ def CheckChangeLintsClean(input_api,
     # We currently are more strict with normal code than unit tests; 4 and 5 are
     # the verbosity level that would normally be passed to cpplint.py through
     # --verbose=#. Hopefully, in the future, we can be more verbose.
-    files = [
-        f.AbsoluteLocalPath()
-        for f in input_api.AffectedSourceFiles(source_file_filter)
-    ]
-    for file_name in files:
-        if _RE_IS_TEST.match(file_name):
+    affected_files = input_api.AffectedSourceFiles(source_file_filter)
+    files = [f.AbsoluteLocalPath() for f in affected_files]
+    changed_lines = None
+    if changed_lines_only:
+        changed_lines = {
+            f.AbsoluteLocalPath(): [n for n, _ in f.ChangedContents()]
+            for f in affected_files
+        }
+    if files:
+        if _RE_IS_TEST.match(files[0]):
             level = 5
         else:
             level = 4
 
         verbose_level = verbose_level or level
-        cpplint.ProcessFile(file_name, verbose_level)
+        cpplint.ProcessFiles(files,
+                             verbose_level,
+                             jobs=input_api.cpu_count,
+                             cache_path=_CppLintCachePath(input_api),
+                             changed_lines=changed_lines)
 
     if cpplint._cpplint_state.error_count > 0:
         # cpplint errors currently cannot be counted as errors during upload
@@ -526,10 +570,138 @@ def _FindNewViolationsOfRule(callable_rule,
         error_formatter)
 
 
-def CheckChangeHasNoTabs(input_api, output_api, source_file_filter=None):
-    """Checks that there are no tab characters in any of the text files to be
-    submitted.
+class _LineRule(object):
+    """A per-line rule that can be run together with other rules.
+
+    See _FindNewViolationsOfRules().
+
+    Attributes:
+        callable_rule: a callable taking a file extension and line of input and
+            returning True if the rule is satisfied and False if there was a
+            problem.
+        results_factory: a callable taking the output api and the list of newly
+            introduced violations, and returning a list of results.
+        source_file_filter: a filter to be passed to the input api.
+        error_formatter: a callable taking (filename, line_number, line) and
+            returning a formatted error string.
+        file_rule: an optional callable taking a file extension, the lines of a
+            file and the same lines joined with newlines, and returning True
+            only if |callable_rule| is satisfied by every line. It should be
+            much faster than running |callable_rule| on each line.
+        skip_extensions: file extensions this rule doesn't apply to.
+    """
+
+    def __init__(self,
+                 callable_rule,
+                 results_factory,
+                 source_file_filter=None,
+                 error_formatter=_ReportErrorFileAndLine,
+                 file_rule=None,
+                 skip_extensions=()):
+        self.callable_rule = callable_rule
+        self.results_factory = results_factory
+        self.source_file_filter = source_file_filter
+        self.error_formatter = error_formatter
+        self.file_rule = file_rule
+        self.skip_extensions = skip_extensions
+
+
+def _KeywordFileRule(keyword):
+    """Returns a _LineRule file_rule for rules that reject |keyword|."""
+    return lambda _, lines, text: keyword not in text
+
+
+def _FindNewViolationsOfRules(rules, input_api):
+    """Find all newly introduced violations of several per-line rules.
+
+    This is equivalent to calling _FindNewViolationsOfRule() for each rule, but
+    each affected file is read once for all of the rules that apply to it.
+    Rules with a file_rule are first checked against the whole file, so that
+    files without any violation are skipped without visiting each line, and
+    the remaining rules are all checked in a single pass over the lines.
+
+    Arguments:
+        rules: a list of _LineRule.
+        input_api: object to enumerate the affected files.
+
+    Returns:
+        A list with the newly-introduced violations reported by each rule, in
+        the same order as |rules|.
+    """
+    errors = [[] for _ in rules]
+    if input_api.no_diffs:
+        return errors
+
+    # Find the rules that apply to each file.
+    rules_by_file = {}
+    for index, rule in enumerate(rules):
+        for f, extension in _GenerateAffectedFileExtList(
+                input_api, rule.source_file_filter):
+            if extension in rule.skip_extensions:
+                continue
+            rules_by_file.setdefault(f, (extension, []))[1].append(index)
+
+    # Visit the files in the order of the change, like each rule on its own
+    # would, even if a file was skipped by the first rules.
+    file_order = {
+        f: i
+        for i, f in enumerate(
+            input_api.AffectedFiles(include_deletes=False,
+                                    file_filter=lambda _: True))
+    }
+    for f, (extension, indexes) in sorted(
+            rules_by_file.items(),
+            key=lambda item: file_order.get(item[0], len(file_order))):
+        new_contents = f.NewContents()
+        text = '\n'.join(new_contents)
+        # Rules that may be violated somewhere in the new file.
+        pending = [
+            i for i in indexes if rules[i].file_rule is None
+            or not rules[i].file_rule(extension, new_contents, text)
+        ]
+        if not pending:
+            continue
+
+        # For speed, we do two passes, checking first the full file. Shelling
+        # out to the SCM to determine the changed region can be quite
+        # expensive on Win32. Assuming that most files will be kept
+        # problem-free, we can skip the SCM operations most of the time.
+        violated = []
+        for line in new_contents:
+            failed = [
+                i for i in pending
+                if not rules[i].callable_rule(extension, line)
+            ]
+            if failed:
+                violated.extend(failed)
+                pending = [i for i in pending if i not in failed]
+                if not pending:
+                    break
+        if not violated:
+            continue  # No violation found in full text: can skip the diff.
+
+        for line_num, line in f.ChangedContents():
+            for i in violated:
+                if not rules[i].callable_rule(extension, line):
+                    errors[i].append(rules[i].error_formatter(
+                        f.LocalPath(), line_num, line))
+
+    return errors
+
+
+def _RunLineRules(input_api, output_api, rules):
+    """Runs several per-line rules in a single pass over the affected files.
+
+    Returns:
+        A list with the results of each rule, in the same order as |rules|.
     """
+    return [
+        rule.results_factory(output_api, errors) for rule, errors in zip(
+            rules, _FindNewViolationsOfRules(rules, input_api))
+    ]
+
+
+def _ChangeHasNoTabsRule(input_api, source_file_filter=None):
     # In addition to the filter, make sure that makefiles are skipped.
     if not source_file_filter:
         # It's the default filter.
@@ -541,54 +713,84 @@ def CheckChangeHasNoTabs(input_api, output_api, source_file_filter=None):
                      or basename.endswith('.mk'))
                 and source_file_filter(affected_file))
 
-    tabs = _FindNewViolationsOfRule(lambda _, line: '\t' not in line, input_api,
-                                    filter_more)
+    def results_factory(output_api, tabs):
+        if tabs:
+            return [
+                output_api.PresubmitPromptWarning('Found a tab character in:',
+                                                  long_text='\n'.join(tabs))
+            ]
+        return []
 
-    if tabs:
-        return [
-            output_api.PresubmitPromptWarning('Found a tab character in:',
-                                              long_text='\n'.join(tabs))
-        ]
-    return []
+    return _LineRule(lambda _, line: '\t' not in line,
+                     results_factory,
+                     filter_more,
+                     file_rule=_KeywordFileRule('\t'))
 
 
-def CheckChangeTodoHasOwner(input_api, output_api, source_file_filter=None):
-    """Checks that the user didn't add `TODO(name)` or `TODO: name -` without
-    an owner.
+def CheckChangeHasNoTabs(input_api, output_api, source_file_filter=None):
+    """Checks that there are no tab characters in any of the text files to be
+    submitted.
     """
+    return _RunLineRules(
+        input_api, output_api,
+        [_ChangeHasNoTabsRule(input_api, source_file_filter)])[0]
+
+
+def _ChangeTodoHasOwnerRule(input_api, source_file_filter=None):
     legacyTODO = '\\s*\\(.+\\)\\s*:'
     modernTODO = ':\\s*[^\\s]+\\s*\\-'
     unowned_todo = input_api.re.compile('TODO(?!(%s|%s))' %
                                         (legacyTODO, modernTODO))
-    errors = _FindNewViolationsOfRule(lambda _, x: not unowned_todo.search(x),
-                                      input_api, source_file_filter)
-    errors = ['Found TODO with no owner in ' + x for x in errors]
-    if errors:
-        return [output_api.PresubmitPromptWarning('\n'.join(errors))]
-    return []
+
+    def results_factory(output_api, errors):
+        errors = ['Found TODO with no owner in ' + x for x in errors]
+        if errors:
+            return [output_api.PresubmitPromptWarning('\n'.join(errors))]
+        return []
+
+    return _LineRule(lambda _, x: not unowned_todo.search(x),
+                     results_factory,
+                     source_file_filter,
+                     file_rule=_KeywordFileRule('TODO'))
+
+
+def CheckChangeTodoHasOwner(input_api, output_api, source_file_filter=None):
+    """Checks that the user didn't add `TODO(name)` or `TODO: name -` without
+    an owner.
+    """
+    return _RunLineRules(
+        input_api, output_api,
+        [_ChangeTodoHasOwnerRule(input_api, source_file_filter)])[0]
+
+
+def _ChangeHasNoStrayWhitespaceRule(source_file_filter=None):
+
+    def results_factory(output_api, errors):
+        if errors:
+            return [
+                output_api.PresubmitPromptWarning(
+                    'Found line ending with white spaces in:',
+                    long_text='\n'.join(errors))
+            ]
+        return []
+
+    return _LineRule(lambda _, line: line.rstrip() == line,
+                     results_factory,
+                     source_file_filter,
+                     file_rule=lambda _, lines, text: tuple(
+                         map(str.rstrip, lines)) == tuple(lines))
 
 
 def CheckChangeHasNoStrayWhitespace(input_api,
                                     output_api,
                                     source_file_filter=None):
     """Checks that there is no stray whitespace at source lines end."""
-    errors = _FindNewViolationsOfRule(lambda _, line: line.rstrip() == line,
-                                      input_api, source_file_filter)
-    if errors:
-        return [
-            output_api.PresubmitPromptWarning(
-                'Found line ending with white spaces in:',
-                long_text='\n'.join(errors))
-        ]
-    return []
+    return _RunLineRules(
+        input_api, output_api,
+        [_ChangeHasNoStrayWhitespaceRule(source_file_filter)])[0]
 
 
-def CheckLongLines(input_api, output_api, maxlen, source_file_filter=None):
-    """Checks that there aren't any lines longer than maxlen characters in any of
-    the text files to be submitted.
-    """
-    if input_api.no_diffs:
-        return []
+def _LongLinesRule(input_api, maxlen, source_file_filter=None):
     maxlens = {
         'java': 100,
         # This is specifically for Android's handwritten makefiles (Android.mk).
@@ -708,32 +910,44 @@ def CheckLongLines(input_api, output_api, maxlen, source_file_filter=None):
     def format_error(filename, line_num, line):
         return '%s, line %s, %s chars' % (filename, line_num, len(line))
 
-    file_ext_list = list(
-        _GenerateAffectedFileExtList(input_api, source_file_filter))
+    def results_factory(output_api, errors):
+        if input_api.no_diffs:
+            return []
 
-    errors = []
+        # Python files need more sophisticated checks that need parsing the
+        # whole source file, so they are skipped by the line-based rule.
+        py_file_list = [
+            f for f, extension in _GenerateAffectedFileExtList(
+                input_api, source_file_filter) if extension in PY_FILE_EXTS
+        ]
+        if py_file_list:
+            errors = errors + check_python_long_lines(
+                py_file_list, error_formatter=format_error)
+        if errors:
+            msg = 'Found %d lines longer than %s characters (first 5 shown).' % (
+                len(errors), maxlen)
+            return [output_api.PresubmitPromptWarning(msg, items=errors[:5])]
+
+        return []
 
     # For non-Python files, a simple line-based rule check is enough.
-    non_py_file_ext_list = [
-        x for x in file_ext_list if x[1] not in PY_FILE_EXTS
-    ]
-    if non_py_file_ext_list:
-        errors += _FindNewViolationsOfRuleForList(no_long_lines,
-                                                  non_py_file_ext_list,
-                                                  error_formatter=format_error)
-
-    # However, Python files need more sophisticated checks that need parsing
-    # the whole source file.
-    py_file_list = [x[0] for x in file_ext_list if x[1] in PY_FILE_EXTS]
-    if py_file_list:
-        errors += check_python_long_lines(py_file_list,
-                                          error_formatter=format_error)
-    if errors:
-        msg = 'Found %d lines longer than %s characters (first 5 shown).' % (
-            len(errors), maxlen)
-        return [output_api.PresubmitPromptWarning(msg, items=errors[:5])]
+    return _LineRule(
+        no_long_lines,
+        results_factory,
+        source_file_filter,
+        format_error,
+        file_rule=lambda extension, lines, text: max(map(
+            len, lines), default=0) <= maxlens.get(extension, maxlens['']),
+        skip_extensions=PY_FILE_EXTS)
 
-    return []
+
+def CheckLongLines(input_api, output_api, maxlen, source_file_filter=None):
+    """Checks that there aren't any lines longer than maxlen characters in any of
+    the text files to be submitted.
+    """
+    return _RunLineRules(
+        input_api, output_api,
+        [_LongLinesRule(input_api, maxlen, source_file_filter)])[0]
 
 
 def CheckLicense(input_api,
@@ -934,7 +1148,7 @@ def CheckInfraFreeze(input_api,
             will be excluded.
     """
     # Not in the freeze time range
-    now = datetime.datetime.now(_FREEZE_TZ)
+    now = datetime.datetime.fromtimestamp(input_api.time.time(), _FREEZE_TZ)
     if now < _FREEZE_START or now >= _FREEZE_END:
         input_api.logging.info('No freeze is in effect')
         return []
@@ -1545,6 +1759,8 @@ def CheckOwnersDirMetadataExclusive(input_api, output_api):
 
 
 def CheckOwnersFormat(input_api, output_api):
+    if 'PRESUBMIT_SKIP_NETWORK' in _os.environ:
+        return _CheckOwnersFormatLocally(input_api, output_api)
     if input_api.gerrit and input_api.gerrit.IsCodeOwnersEnabledOnRepo():
         return []
 
@@ -1563,7 +1779,64 @@ def CheckOwnersFormat(input_api, output_api):
     ]
 
 
+def _CheckOwnersFormatLocally(input_api, output_api):
+    """Checks the affected OWNERS files with input_api.owners_client, which
+    reads the OWNERS files of the checkout when the network isn't used."""
+    if not input_api.owners_client:
+        return []
+    file_filter = lambda f: input_api.basename(f.LocalPath()) == 'OWNERS'
+    errors = []
+    for f in input_api.change.AffectedFiles(include_deletes=False,
+                                            file_filter=file_filter):
+        for line in input_api.owners_client.GetBadLines(f.LocalPath()):
+            errors.append('%s: %s' % (f.LocalPath(), line))
+    if not errors:
+        return []
+    return [
+        output_api.PresubmitError('Unrecognized lines in OWNERS files:\n    ' +
+                                  '\n    '.join(errors))
+    ]
+
+
+def _CheckOwnersLocally(input_api, output_api, source_file_filter):
+    """Checks with input_api.owners_client that an owner of each affected file
+    is the author or a reviewer listed in the description.
+
+    Approvals can't be read without the network, so this can only tell which
+    files are missing owner reviewers, and doesn't check anything when
+    committing.
+    """
+    if not input_api.owners_client or input_api.is_committing:
+        return []
+    affected_files = sorted(
+        set(f.LocalPath() for f in input_api.change.AffectedFiles(
+            file_filter=source_file_filter)))
+    author = input_api.change.author_email
+    approval_status = input_api.owners_client.GetFilesApprovalStatus(
+        affected_files, [author] if author else [],
+        _ReviewersFromChange(input_api.change))
+    missing_files = [
+        f for f in affected_files
+        if approval_status[f] == input_api.owners_client.INSUFFICIENT_REVIEWERS
+    ]
+    if not missing_files:
+        return []
+    suggested_owners = input_api.owners_client.SuggestOwners(
+        missing_files, exclude=[author] if author else [])
+    return [
+        output_api.PresubmitNotifyResult(
+            'Missing OWNER reviewers for these files:\n    %s' %
+            '\n    '.join(missing_files)),
+        output_api.PresubmitNotifyResult(
+            'Suggested OWNERS: (Use "git-cl owners" to interactively select '
+            'owners.)\n    %s' % '\n    '.join(suggested_owners))
+    ]
+
+
 def CheckOwners(input_api, output_api, source_file_filter=None, allow_tbr=True):
+    if 'PRESUBMIT_SKIP_NETWORK' in _os.environ:
+        return _CheckOwnersLocally(input_api, output_api, source_file_filter)
+
     # Skip OWNERS check when Owners-Override label is approved. This is intended
     # for global owners, trusted bots, and on-call sheriffs. Review is still
     # required for these changes.
@@ -1710,20 +1983,20 @@ def PanProjectChecks(input_api,
     except Exception as e:
         print('Failed to check owners - %s' % str(e))
 
-    snapshot("checking long lines")
-    results.extend(
-        input_api.canned_checks.CheckLongLines(input_api,
-                                               output_api,
-                                               maxlen,
-                                               source_file_filter=sources))
-    snapshot("checking tabs")
-    results.extend(
-        input_api.canned_checks.CheckChangeHasNoTabs(
-            input_api, output_api, source_file_filter=sources))
-    snapshot("checking stray whitespace")
-    results.extend(
-        input_api.canned_checks.CheckChangeHasNoStrayWhitespace(
-            input_api, output_api, source_file_filter=sources))
+    # Run all the per-line rules in a single pass over the affected files, and
+    # report their results in the same order as the individual checks would.
+    snapshot("checking long lines, tabs, stray whitespace and corp links")
+    line_rules = [
+        _LongLinesRule(input_api, maxlen, source_file_filter=sources),
+        _ChangeHasNoTabsRule(input_api, source_file_filter=sources),
+        _ChangeHasNoStrayWhitespaceRule(source_file_filter=sources),
+        _CorpLinksInFilesRule(source_file_filter=sources),
+    ]
+    if input_api.is_committing:
+        line_rules.append(_DoNotSubmitInFilesRule())
+    line_results = _RunLineRules(input_api, output_api, line_rules)
+    for rule_results in line_results[:3]:
+        results.extend(rule_results)
     snapshot("checking license")
     results.extend(
         input_api.canned_checks.CheckLicense(input_api,
@@ -1731,10 +2004,7 @@ def PanProjectChecks(input_api,
                                              license_header,
                                              project_name,
                                              source_file_filter=sources))
-    snapshot("checking corp links in files")
-    results.extend(
-        input_api.canned_checks.CheckCorpLinksInFiles(
-            input_api, output_api, source_file_filter=sources))
+    results.extend(line_results[3])
     snapshot("checking large scale change")
     results.extend(
         input_api.canned_checks.CheckLargeScaleChange(input_api, output_api))
@@ -1760,10 +2030,7 @@ def PanProjectChecks(input_api,
             results.extend(
                 input_api.canned_checks.CheckCorpLinksInDescription(
                     input_api, output_api))
-        snapshot("checking do not submit in files")
-        results.extend(
-            input_api.canned_checks.CheckDoNotSubmitInFiles(
-                input_api, output_api))
+        results.extend(line_results[4])
 
     if global_checks:
         results.extend(
@@ -2536,8 +2803,8 @@ _NON_INCLUSIVE_TERMS = (
         True), )
 
 
-def _GetMessageForMatchingTerm(input_api, affected_file, line_number, line,
-                               term, message):
+def _GetMessageForMatchingTerm(input_api, local_path, line_number, line, term,
+                               message):
     """Helper method for CheckInclusiveLanguage.
 
     Returns an string composed of the name of the file, the line number where the
@@ -2572,7 +2839,7 @@ def _GetMessageForMatchingTerm(input_api, affected_file, line_number, line,
         matched = True
 
     if matched:
-        result.append('    %s:%d:' % (affected_file.LocalPath(), line_number))
+        result.append('    %s:%d:' % (local_path, line_number))
         for message_line in message:
             result.append('      %s' % message_line)
 
@@ -2594,9 +2861,6 @@ def CheckInclusiveLanguage(input_api,
     if input_api.no_diffs:
         return []
 
-    warnings = []
-    errors = []
-
     if excluded_directories_relative_path is None:
         excluded_directories_relative_path = [
             'infra', 'inclusive_language_presubmit_exempt_dirs.txt'
@@ -2614,15 +2878,12 @@ def CheckInclusiveLanguage(input_api,
 
         return local_dir in excluded_paths
 
-    def CheckForMatch(affected_file, line_num, line, term, message, error):
-        problems = _GetMessageForMatchingTerm(input_api, affected_file,
-                                              line_num, line, term, message)
-
-        if problems:
-            if error:
-                errors.extend(problems)
-            else:
-                warnings.extend(problems)
+    def FindProblems(local_path, line_num, line):
+        """Returns (error, problems) for each of the terms."""
+        return [(error,
+                 _GetMessageForMatchingTerm(input_api, local_path, line_num,
+                                            line, term, message))
+                for term, message, error in non_inclusive_terms]
 
     excluded_paths = []
     excluded_directories_relative_path = input_api.os_path.join(
@@ -2637,12 +2898,38 @@ def CheckInclusiveLanguage(input_api,
             excluded_paths.append(path)
 
     excluded_paths = set(excluded_paths)
-    for f in input_api.AffectedFiles():
-        for line_num, line in f.ChangedContents():
-            for term, message, error in non_inclusive_terms:
-                if IsExcludedFile(f, excluded_paths):
-                    continue
-                CheckForMatch(f, line_num, line, term, message, error)
+
+    def MayMatch(text):
+        """Returns False if no line of text can match any of the terms."""
+        for term, _, _ in non_inclusive_terms:
+            if term[0:1] == '/':
+                # Comments are stripped from the lines before they are
+                # matched, which moves where they end.
+                if '$' in term:
+                    return True
+                if input_api.re.search(term[1:], text, input_api.re.MULTILINE):
+                    return True
+            elif term in text:
+                return True
+        return False
+
+    rule = _LineRule(
+        lambda _, line: not any(problems
+                                for _, problems in FindProblems('', 0, line)),
+        lambda _, found: found,
+        source_file_filter=lambda f: not IsExcludedFile(f, excluded_paths),
+        error_formatter=FindProblems,
+        file_rule=lambda _, lines, text: not MayMatch(text))
+    found, = _FindNewViolationsOfRules([rule], input_api)
+
+    warnings = []
+    errors = []
+    for line_problems in found:
+        for error, problems in line_problems:
+            if error:
+                errors.extend(problems)
+            else:
+                warnings.extend(problems)
 
     result = []
     if (warnings):
@@ -0,0 +1,336 @@
+#!/usr/bin/env vpython3
+# Copyright (c) 2026 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Keeps presubmit_support.py loaded between presubmit runs of a checkout.
+
+Every git cl presubmit or git cl upload starts presubmit_support.py from
+scratch, which imports presubmit_canned_checks, gerrit_util, owners_client and
+friends, and compiles the PRESUBMIT.py scripts of the change. The server keeps
+all of that loaded in a process listening on a Unix socket, and forks a copy of
+itself for each run. git cl hands its stdin, stdout and stderr to the server,
+so prompts and output behave as if presubmit_support.py ran in the terminal,
+and runs presubmit_support.py itself when no server is listening.
+
+The server is started from within the checkout with
+
+    presubmit-server start
+
+and exits when asked to stop, after being idle for IDLE_TIMEOUT seconds, or
+when depot_tools is updated. It needs fork() and passing file descriptors over
+Unix sockets, so it isn't available on Windows.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import tempfile
+import traceback
+
+import gclient_utils
+import scm
+import subprocess2
+
+DEPOT_TOOLS = os.path.dirname(os.path.abspath(__file__))
+
+# Seconds the server waits for a run before exiting.
+IDLE_TIMEOUT = 60 * 60
+
+
+def SocketPath(root):
+    """Returns the path of the socket of the server for the checkout at root.
+
+    Socket paths are limited to about a hundred bytes, so the socket lives in
+    the temporary directory and is named after the checkout instead.
+    """
+    digest = hashlib.sha256(os.path.realpath(root).encode('utf-8'))
+    return os.path.join(
+        tempfile.gettempdir(),
+        'presubmit-server-%d-%s.sock' % (os.getuid(), digest.hexdigest()[:16]))
+
+
+def _Send(conn, message):
+    conn.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+
+def _Connect(root):
+    """Returns a socket connected to the server for root, or None."""
+    if not hasattr(socket, 'send_fds'):
+        return None
+    path = SocketPath(root)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        # Don't hand the terminal to a server run by another user.
+        if os.stat(path).st_uid != os.getuid():
+            sock.close()
+            return None
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def RunPresubmit(root, args):
+    """Runs presubmit_support.py with args in the server for root.
+
+    Returns:
+        The exit code of presubmit_support.py, or None if there is no server
+        for root, or it went away before the run finished, in which case the
+        caller should run presubmit_support.py itself.
+    """
+    sock = _Connect(root)
+    if not sock:
+        return None
+    with sock:
+        request = {
+            'command': 'presubmit',
+            'args': list(args),
+            'cwd': os.getcwd(),
+            'env': dict(os.environ),
+        }
+        pid = None
+        try:
+            socket.send_fds(sock, [b'\0'], [0, 1, 2])
+            _Send(sock, request)
+            for line in sock.makefile('rb'):
+                response = json.loads(line)
+                if 'pid' in response:
+                    pid = response['pid']
+                    continue
+                return response['exit_code']
+        except KeyboardInterrupt:
+            # The run isn't in the terminal's process group, so pass the
+            # interrupt along.
+            if pid:
+                os.kill(pid, signal.SIGINT)
+            raise
+        except (OSError, ValueError) as e:
+            logging.warning('Presubmit server failed: %s', e)
+    return None
+
+
+def StopServer(root):
+    """Asks the server for root to exit. Returns False if none was running."""
+    sock = _Connect(root)
+    if not sock:
+        return False
+    with sock:
+        socket.send_fds(sock, [b'\0'], [])
+        _Send(sock, {'command': 'stop'})
+        sock.makefile('rb').readline()
+    return True
+
+
+def _ModuleTimes():
+    """Returns the modification times of the loaded depot_tools modules."""
+    times = {}
+    for module in list(sys.modules.values()):
+        path = getattr(module, '__file__', None)
+        if not path or not path.startswith(DEPOT_TOOLS + os.sep):
+            continue
+        try:
+            times[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            times[path] = None
+    return times
+
+
+def _RunChild(request, fds, report_fd):
+    """Runs presubmit_support.py in a process forked from the server.
+
+    Reports the exit code, and the PRESUBMIT.py scripts that were compiled so
+    the server can keep them warm, as JSON to report_fd.
+    """
+    import presubmit_support
+    exit_code = 1
+    try:
+        for fd, target in zip(fds, (0, 1, 2)):
+            os.dup2(fd, target)
+        sys.stdout.reconfigure(line_buffering=sys.stdout.isatty())
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        exit_code = presubmit_support.main(request['args'])
+    except SystemExit as e:
+        exit_code = e.code
+    except KeyboardInterrupt:
+        sys.stderr.write('interrupted\n')
+        exit_code = 2
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        if exit_code is None:
+            exit_code = 0
+        elif not isinstance(exit_code, int):
+            print(exit_code, file=sys.stderr)
+            exit_code = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        report = {
+            'exit_code': exit_code,
+            'scripts': sorted(presubmit_support._COMPILED_SCRIPTS),
+        }
+        with os.fdopen(report_fd, 'w') as f:
+            f.write(json.dumps(report))
+
+
+class PresubmitServer(object):
+    """Runs presubmit_support.py for a checkout in forks of a warm process."""
+
+    def __init__(self, root, idle_timeout=IDLE_TIMEOUT):
+        # Load everything the runs need before forking them.
+        import presubmit_support  # pylint: disable=unused-import
+        self.root = root
+        self.path = SocketPath(root)
+        self.idle_timeout = idle_timeout
+        self._module_times = _ModuleTimes()
+
+    def Serve(self):
+        """Handles runs until asked to stop, idle, or stale."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        # Only the user running the server can connect to it.
+        umask = os.umask(0o077)
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        sock.listen()
+        sock.settimeout(self.idle_timeout)
+        try:
+            while True:
+                try:
+                    conn, _ = sock.accept()
+                except socket.timeout:
+                    return
+                with conn:
+                    conn.settimeout(None)
+                    if not self._Handle(conn):
+                        return
+        finally:
+            sock.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def _IsStale(self):
+        """Returns True if depot_tools changed since the server started."""
+        current = _ModuleTimes()
+        return any(
+            current.get(path) != mtime
+            for path, mtime in self._module_times.items())
+
+    def _Handle(self, conn):
+        """Handles a request. Returns False if the server should exit."""
+        _, fds, _, _ = socket.recv_fds(conn, 1, 3)
+        try:
+            request = json.loads(conn.makefile('rb').readline())
+            if request.get('command') != 'presubmit':
+                _Send(conn, {})
+                return False
+            if self._IsStale():
+                _Send(conn, {'exit_code': None})
+                return False
+            _Send(conn, {'exit_code': self._Run(conn, request, fds)})
+        except (OSError, ValueError) as e:
+            logging.warning('Failed to handle presubmit request: %s', e)
+        finally:
+            for fd in fds:
+                os.close(fd)
+        return True
+
+    def _Run(self, conn, request, fds):
+        """Runs presubmit_support.py in a fork and returns its exit code."""
+        sys.stdout.flush()
+        sys.stderr.flush()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(read_fd)
+                _RunChild(request, fds, write_fd)
+            finally:
+                os._exit(0)
+        os.close(write_fd)
+        _Send(conn, {'pid': pid})
+        with os.fdopen(read_fd) as f:
+            report = f.read()
+        _, status = os.waitpid(pid, 0)
+        if not report:
+            return os.waitstatus_to_exitcode(status)
+        report = json.loads(report)
+        self._WarmScripts(report['scripts'])
+        return report['exit_code']
+
+    @staticmethod
+    def _WarmScripts(paths):
+        """Compiles the PRESUBMIT.py scripts in paths for the next runs."""
+        import presubmit_support
+        for path in paths:
+            try:
+                # Accept CRLF presubmit script.
+                script_text = gclient_utils.FileRead(path).replace('\r\n', '\n')
+                presubmit_support._CompileScript(script_text, path)
+            except (IOError, OSError, SyntaxError, ValueError):
+                pass
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Keeps presubmit_support.py loaded between presubmit runs '
+        'of a checkout.')
+    parser.add_argument('command', choices=['start', 'stop', 'serve'])
+    parser.add_argument('--root',
+                        help='The checkout to serve. Defaults to the checkout '
+                        'of the current directory.')
+    parser.add_argument('--idle_timeout',
+                        type=int,
+                        default=IDLE_TIMEOUT,
+                        help='Exit after this many seconds without a run.')
+    options = parser.parse_args(argv)
+    if not hasattr(socket, 'send_fds') or not hasattr(os, 'fork'):
+        print('The presubmit server is not supported on this platform.')
+        return 1
+    root = options.root or scm.GIT.GetCheckoutRoot(os.getcwd())
+
+    if options.command == 'stop':
+        if not StopServer(root):
+            print('No presubmit server is running for %s.' % root)
+        return 0
+
+    if options.command == 'start':
+        sock = _Connect(root)
+        if sock:
+            sock.close()
+            print('A presubmit server is already running for %s.' % root)
+            return 0
+        subprocess2.Popen([
+            sys.executable,
+            os.path.abspath(__file__), 'serve', '--root', root,
+            '--idle_timeout',
+            str(options.idle_timeout)
+        ],
+                          cwd=root,
+                          stdin=subprocess2.DEVNULL,
+                          stdout=subprocess2.DEVNULL,
+                          stderr=subprocess2.DEVNULL,
+                          start_new_session=True)
+        print('Started a presubmit server for %s.' % root)
+        return 0
+
+    PresubmitServer(root, options.idle_timeout).Serve()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -14,10 +14,14 @@ __version__ = '2.0.0'
 import argparse
 import ast  # Exposed through the API.
 import contextlib
+import copy
 import cpplint
 import fnmatch  # Exposed through the API.
 import glob
+import hashlib
 import inspect
+import io
+import itertools
 import json  # Exposed through the API.
 import logging
 import mimetypes
@@ -62,6 +66,13 @@ _ASKED_FOR_FEEDBACK = False
 # are coming from.
 _SHOW_CALLSTACKS = False
 
+# _Profiler collecting per-check timings, set if --profile is requested.
+_PROFILER = None
+
+# Compiled PRESUBMIT.py scripts, as {presubmit_path: (script_text, code)}. A
+# presubmit_server process keeps them across runs.
+_COMPILED_SCRIPTS = {}
+
 
 def time_time():
     # Use this so that it can be mocked in tests without interfering with python
@@ -69,6 +80,24 @@ def time_time():
     return time.time()
 
 
+def _CompileScript(script_text, presubmit_path):
+    """Returns the code object of a PRESUBMIT.py script, compiling it only if
+    its text changed since it was last compiled."""
+    cached = _COMPILED_SCRIPTS.get(presubmit_path)
+    if cached and cached[0] == script_text:
+        return cached[1]
+    code = compile(script_text, presubmit_path, 'exec', dont_inherit=True)
+    _COMPILED_SCRIPTS[presubmit_path] = (script_text, code)
+    return code
+
+
+def _count_bytes_read(contents):
+    """Adds the size of file contents read by a check to the profile."""
+    if _PROFILER:
+        _PROFILER.bytes_read += len(contents)
+    return contents
+
+
 class PresubmitFailure(Exception):
     pass
 
@@ -87,6 +116,11 @@ class CommandData(object):
         self.kwargs['stdin'] = subprocess.PIPE
         self.message = message
         self.info = None
+        # The share of the ThreadPool the test needs while it runs: a number of
+        # CPUs, and bytes of memory. Raise them for tests which start several
+        # processes or use a lot of memory, so the pool doesn't overcommit.
+        self.cpus = 1
+        self.memory = 0
 
 
 # Adapted from
@@ -168,19 +202,58 @@ class Timer(object):
         self.completed = True
 
 
+def _PhysicalMemory():
+    """Returns the physical memory of the machine in bytes, or None."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
 class ThreadPool(object):
-    def __init__(self, pool_size=None, timeout=None):
+    """Runs the tests queued by input_api.RunTests.
+
+    Tests are started longest first, according to the durations recorded by
+    earlier runs, so that a long test doesn't start last and hold up the end of
+    the run. A parallel test only starts once the pool has the CPUs and memory
+    it asks for. Nonparallel tests run one after another before the parallel
+    ones, each with the whole pool to itself.
+    """
+
+    def __init__(self, pool_size=None, timeout=None, durations=None):
+        """
+        Args:
+            pool_size: the number of CPUs tests can use at once. Defaults to
+                the number of CPUs of the machine.
+            timeout: seconds after which a test is terminated.
+            durations: a _TestDurations to order the tests with, and to record
+                how long they took in.
+        """
         self.timeout = timeout
         self._pool_size = pool_size or multiprocessing.cpu_count()
         if sys.platform == 'win32':
             # TODO(crbug.com/1190269) - we can't use more than 56 child
             # processes on Windows or Python3 may hang.
             self._pool_size = min(self._pool_size, 56)
+        self.durations = durations
         self._messages = []
         self._messages_lock = threading.Lock()
         self._tests = []
         self._tests_lock = threading.Lock()
         self._nonparallel_tests = []
+        # CPUs and memory not used by running tests.
+        self._memory = _PhysicalMemory()
+        self._free_cpus = self._pool_size
+        self._free_memory = self._memory or 0
+        self._budget = threading.Condition()
+        # Total time spent running tests in CallCommand.
+        self.subprocess_time = 0.0
+        self._subprocess_time_lock = threading.Lock()
+        # Statistics for UtilisationSummary.
+        self._tests_run = 0
+        self._cpu_time = 0.0
+        self._wall_time = 0.0
+        self._longest_test = None
 
     def _GetCommand(self, test):
         vpython = 'vpython3'
@@ -230,10 +303,14 @@ class ThreadPool(object):
             duration = time_time() - start
         except Exception:
             duration = time_time() - start
+            self._AddSubprocessTime(duration, test)
             return test.message(
                 '%s\n%s exec failure (%4.2fs)\n%s' %
                 (test.name, ' '.join(cmd), duration, traceback.format_exc()),
                 show_callstack=show_callstack)
+        self._AddSubprocessTime(duration, test)
+        if self.durations:
+            self.durations.Add(test, duration)
 
         if returncode != 0:
             return test.message('%s\n%s (%4.2fs) failed\n%s' %
@@ -245,6 +322,54 @@ class ThreadPool(object):
                              (test.name, ' '.join(cmd), duration),
                              show_callstack=show_callstack)
 
+    def _AddSubprocessTime(self, duration, test):
+        with self._subprocess_time_lock:
+            self.subprocess_time += duration
+            self._tests_run += 1
+            self._cpu_time += duration * self._Cost(test)[0]
+            if not self._longest_test or duration > self._longest_test[0]:
+                self._longest_test = (duration, test.name)
+
+    def _Cost(self, test):
+        """Returns the CPUs and memory test takes from the pool."""
+        cpus = min(max(test.cpus, 1), self._pool_size)
+        memory = min(test.memory, self._memory) if self._memory else 0
+        return cpus, memory
+
+    def _Acquire(self, cost):
+        cpus, memory = cost
+        with self._budget:
+            self._budget.wait_for(
+                lambda: self._free_cpus >= cpus and self._free_memory >= memory)
+            self._free_cpus -= cpus
+            self._free_memory -= memory
+
+    def _Release(self, cost):
+        cpus, memory = cost
+        with self._budget:
+            self._free_cpus += cpus
+            self._free_memory += memory
+            self._budget.notify_all()
+
+    def _SortLongestFirst(self, tests):
+        """Sorts tests so that popping them yields the longest first.
+
+        Tests that never ran before are assumed to be long, and keep the order
+        they were popped in before.
+        """
+        if not self.durations:
+            return tests
+
+        def _Key(test):
+            duration = self.durations.Get(test)
+            return duration is None, duration or 0
+
+        return sorted(tests, key=_Key)
+
+    def QueuedTests(self):
+        """Returns the number of tests waiting for RunAsync."""
+        return len(self._tests) + len(self._nonparallel_tests)
+
     def AddTests(self, tests, parallel=True):
         if parallel:
             self._tests.extend(tests)
@@ -253,6 +378,13 @@ class ThreadPool(object):
 
     def RunAsync(self):
         self._messages = []
+        if not self.QueuedTests():
+            return self._messages
+        start = time_time()
+        with self._tests_lock:
+            self._tests = self._SortLongestFirst(self._tests)
+            self._nonparallel_tests = self._SortLongestFirst(
+                self._nonparallel_tests)
 
         def _WorkerFn():
             while True:
@@ -261,7 +393,12 @@ class ThreadPool(object):
                     if not self._tests:
                         break
                     test = self._tests.pop()
-                result = self.CallCommand(test, show_callstack=False)
+                cost = self._Cost(test)
+                self._Acquire(cost)
+                try:
+                    result = self.CallCommand(test, show_callstack=False)
+                finally:
+                    self._Release(cost)
                 if result:
                     with self._messages_lock:
                         self._messages.append(result)
@@ -272,19 +409,36 @@ class ThreadPool(object):
             t.start()
             return t
 
+        # Nonparallel tests run alone, before the parallel ones.
         while self._nonparallel_tests:
-            test = self._nonparallel_tests.pop()
-            result = self.CallCommand(test)
+            result = self.CallCommand(self._nonparallel_tests.pop())
             if result:
                 self._messages.append(result)
 
-        if self._tests:
-            threads = [_StartDaemon() for _ in range(self._pool_size)]
-            for worker in threads:
-                worker.join()
+        threads = [
+            _StartDaemon()
+            for _ in range(min(self._pool_size, len(self._tests)))
+        ]
+        for worker in threads:
+            worker.join()
 
+        self._wall_time += time_time() - start
         return self._messages
 
+    def UtilisationSummary(self):
+        """Returns a line describing how busy the pool was, or None if it ran
+        no tests."""
+        if not self._tests_run:
+            return None
+        utilisation = 0
+        if self._wall_time:
+            utilisation = self._cpu_time / (self._wall_time * self._pool_size)
+        return ('Ran %d tests in %.1fs on %d CPUs, %d%% utilisation. The '
+                'longest test was %s (%.1fs).' %
+                (self._tests_run, self._wall_time, self._pool_size,
+                 round(min(utilisation, 1) * 100), self._longest_test[1],
+                 self._longest_test[0]))
+
 
 def normpath(path):
     """Version of os.path.normpath that also changes backward slashes to
@@ -531,6 +685,28 @@ class OutputApi(object):
         return self.PresubmitPromptWarning(*args, **kwargs)
 
 
+class _LiveStateAttribute(object):
+    """An InputApi attribute whose answers can change while the change does
+    not, e.g. because they come from Gerrit, the network or the clock.
+
+    Reading it marks the change, so that the result cache does not remember the
+    check that read it.
+    """
+
+    def __set_name__(self, owner, name):
+        self._attribute = '_' + name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        if obj.change is not None:
+            obj.change._live_state_read = True
+        return getattr(obj, self._attribute)
+
+    def __set__(self, obj, value):
+        setattr(obj, self._attribute, value)
+
+
 class InputApi(object):
     """An instance of this object is passed to presubmit scripts so they can
     know stuff about the change they're looking at.
@@ -599,6 +775,11 @@ class InputApi(object):
         r'.+\.patch$',
     )
 
+    gerrit = _LiveStateAttribute()
+    owners_client = _LiveStateAttribute()
+    time = _LiveStateAttribute()
+    urllib_request = _LiveStateAttribute()
+
     def __init__(self,
                  change,
                  presubmit_path,
@@ -694,6 +875,11 @@ class InputApi(object):
                     branch=self.gerrit.branch)
             except Exception as e:
                 print('Failed to set owners_client - %s' % str(e))
+        elif 'PRESUBMIT_SKIP_NETWORK' in self.environ:
+            # Offline runs answer owners questions from the OWNERS files of
+            # the checkout instead.
+            self.owners_client = owners_client.LocalOwnersClient(
+                change.RepositoryRoot())
         self.owners_finder = owners_finder.OwnersFinder
         self.verbose = verbose
         self.Command = CommandData
@@ -844,7 +1030,7 @@ class InputApi(object):
             file_item = file_item.AbsoluteLocalPath()
         if not file_item.startswith(self.change.RepositoryRoot()):
             raise IOError('Access outside the repository root is denied.')
-        return gclient_utils.FileRead(file_item, mode)
+        return _count_bytes_read(gclient_utils.FileRead(file_item, mode))
 
     def CreateTemporaryFile(self, **kwargs):
         """Returns a named temporary file that must be removed with a call to
@@ -915,6 +1101,11 @@ class InputApi(object):
 class _DiffCache(object):
     """Caches diffs retrieved from a particular SCM."""
 
+    def __init__(self):
+        # Paths of the files in the change, set by Change so that their old
+        # contents can be read together.
+        self.affected_paths = []
+
     def GetDiff(self, path, local_root):
         """Get the diff for a particular path."""
         raise NotImplementedError()
@@ -924,8 +1115,79 @@ class _DiffCache(object):
         raise NotImplementedError()
 
 
+class _SpooledDiff(object):
+    """A unified diff split per file and kept in a temporary file.
+
+    The diff is written to a spooled temporary file while it is parsed, and the
+    diff of a file is only read back when it is asked for, so that huge diffs
+    aren't held in memory.
+
+    It can be pickled, e.g. to be sent to a spawned process, and used from
+    forked processes, which share the file offset of the temporary file.
+    """
+    # Diffs larger than this are written to disk.
+    MAX_MEMORY_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, lines):
+        """
+        Args:
+            lines: the lines of the unified diff, with their line breaks.
+        """
+        self._file = tempfile.SpooledTemporaryFile(
+            max_size=self.MAX_MEMORY_SIZE)
+        self._lock = threading.Lock()
+        # Maps each path to the (start, end) offsets of its diff in _file.
+        self._offsets = {}
+        current = None
+        offset = 0
+        for path, line in _iter_unified_diff(lines):
+            if path is not None:
+                current = path
+                self._offsets[path] = (offset, offset)
+            elif current is None:
+                continue
+            data = line.encode('utf-8')
+            self._file.write(data)
+            offset += len(data)
+            self._offsets[current] = (self._offsets[current][0], offset)
+        self._file.flush()
+
+    def __getstate__(self):
+        with self._lock:
+            self._file.seek(0)
+            data = self._file.read()
+        return {'offsets': self._offsets, 'data': data}
+
+    def __setstate__(self, state):
+        self._file = tempfile.SpooledTemporaryFile(
+            max_size=self.MAX_MEMORY_SIZE)
+        self._file.write(state['data'])
+        self._file.flush()
+        self._lock = threading.Lock()
+        self._offsets = state['offsets']
+
+    def __contains__(self, path):
+        return path in self._offsets
+
+    def get(self, path, default=None):
+        """Returns the diff of |path|, or |default| if it isn't in the diff."""
+        if path not in self._offsets:
+            return default
+        start, end = self._offsets[path]
+        if self._file._rolled and hasattr(os, 'pread'):
+            # Read without seeking, since forked processes share the offset.
+            data = os.pread(self._file.fileno(), end - start, start)
+        else:
+            with self._lock:
+                self._file.seek(start)
+                data = self._file.read(end - start)
+        return data.decode('utf-8')
+
+
 class _GitDiffCache(_DiffCache):
     """DiffCache implementation for git; gets all file diffs at once."""
+    # Number of files whose old contents are read by a single git call.
+    OLD_CONTENTS_BATCH_SIZE = 100
 
     def __init__(self, upstream, end_commit):
         """Stores the upstream revision against which all diffs are computed."""
@@ -933,6 +1195,11 @@ class _GitDiffCache(_DiffCache):
         self._upstream = upstream
         self._end_commit = end_commit
         self._diffs_by_file = None
+        # Old contents read in a batch, until they are asked for.
+        self._old_contents = {}
+        # Paths in the change whose old contents haven't been read yet, in
+        # the order of the change.
+        self._unread_paths = None
 
     def GetDiff(self, path, local_root):
         # Compare against None to distinguish between None and an initialized
@@ -940,14 +1207,16 @@ class _GitDiffCache(_DiffCache):
         if self._diffs_by_file == None:
             # Don't specify any filenames below, because there are command line
             # length limits on some platforms and GenerateDiff would fail.
-            unified_diff = scm.GIT.GenerateDiff(local_root,
-                                                files=[],
-                                                full_move=True,
-                                                branch=self._upstream,
-                                                branch_head=self._end_commit)
-            # Compute a single diff for all files and parse the output; with git
-            # this is much faster than computing one diff for each file.
-            self._diffs_by_file = _parse_unified_diff(unified_diff)
+            unified_diff = scm.GIT.GenerateDiffLines(
+                local_root,
+                files=[],
+                full_move=True,
+                branch=self._upstream,
+                branch_head=self._end_commit)
+            # Compute a single diff for all files and parse the output as git
+            # writes it; with git this is much faster than computing one diff
+            # for each file.
+            self._diffs_by_file = _SpooledDiff(unified_diff)
 
         if path not in self._diffs_by_file:
             # SCM didn't have any diff on this file. It could be that the file
@@ -956,10 +1225,28 @@ class _GitDiffCache(_DiffCache):
             # https://crbug.com/808346.
             return ''
 
-        return self._diffs_by_file[path]
+        return self._diffs_by_file.get(path)
 
     def GetOldContents(self, path, local_root):
-        return scm.GIT.GetOldContents(local_root, path, branch=self._upstream)
+        if path not in self._old_contents:
+            # Read the old contents of the next files in the change along with
+            # this one, rather than running git once per file. Only a bounded
+            # number are read at once, so that checks that look at a few files
+            # don't pay for reading all of them.
+            if self._unread_paths is None:
+                self._unread_paths = dict.fromkeys(self.affected_paths)
+            self._unread_paths.pop(path, None)
+            paths = [path] + list(
+                itertools.islice(self._unread_paths,
+                                 self.OLD_CONTENTS_BATCH_SIZE - 1))
+            for unread_path in paths[1:]:
+                del self._unread_paths[unread_path]
+            self._old_contents.update(
+                scm.GIT.GetOldContentsBatch(local_root,
+                                            paths,
+                                            branch=self._upstream))
+        # AffectedFile keeps its own copy, so don't hold onto this one.
+        return self._old_contents.pop(path)
 
 
 class _ProvidedDiffCache(_DiffCache):
@@ -1015,7 +1302,13 @@ class _ProvidedDiffCache(_DiffCache):
 
 
 class AffectedFile(object):
-    """Representation of a file in a change."""
+    """Representation of a file in a change.
+
+    OldContents, NewContents and ChangedContents return tuples rather than the
+    lists they used to return, since the same lines are shared by all the
+    checks. Scripts that modify the lines they get have to copy them first,
+    e.g. with list().
+    """
 
     DIFF_CACHE = _DiffCache
 
@@ -1028,6 +1321,7 @@ class AffectedFile(object):
         self._is_directory = None
         self._cached_changed_contents = None
         self._cached_new_contents = None
+        self._cached_old_contents = None
         self._diff_cache = diff_cache
         self._is_testable_file = None
         logging.debug('%s(%s)', self.__class__.__name__, self._path)
@@ -1067,33 +1361,41 @@ class AffectedFile(object):
         return self.IsTestableFile()
 
     def OldContents(self):
-        """Returns an iterator over the lines in the old version of file.
+        """Returns a tuple of the lines in the old version of file.
 
         The old version is the file before any modifications in the user's
         workspace, i.e. the 'left hand side'.
 
+        The lines are read once and the same tuple is returned on every call.
         Contents will be empty if the file is a directory or does not exist.
         Note: The carriage returns (LF or CR) are stripped off.
         """
-        return self._diff_cache.GetOldContents(self.LocalPath(),
-                                               self._local_root).splitlines()
+        if self._cached_old_contents is None:
+            self._cached_old_contents = tuple(
+                _count_bytes_read(
+                    self._diff_cache.GetOldContents(
+                        self.LocalPath(), self._local_root)).splitlines())
+        return self._cached_old_contents
 
     def NewContents(self, flush_cache=False):
-        """Returns an iterator over the lines in the new version of file.
+        """Returns a tuple of the lines in the new version of file.
 
         The new version is the file in the user's workspace, i.e. the 'right hand
         side'.
 
+        The lines are read once and the same tuple is returned on every call.
         If flush_cache is True, read from disk and replace any cached contents.
 
         Contents will be empty if the file is a directory or does not exist.
         Note: The carriage returns (LF or CR) are stripped off.
         """
         if self._cached_new_contents is None or flush_cache:
-            self._cached_new_contents = []
+            self._cached_new_contents = ()
             try:
-                self._cached_new_contents = gclient_utils.FileRead(
-                    self.AbsoluteLocalPath(), 'rU').splitlines()
+                self._cached_new_contents = tuple(
+                    _count_bytes_read(
+                        gclient_utils.FileRead(self.AbsoluteLocalPath(),
+                                               'rU')).splitlines())
             except IOError:
                 pass  # File not found?  That's fine; maybe it was deleted.
             except UnicodeDecodeError as e:
@@ -1102,19 +1404,22 @@ class AffectedFile(object):
                 print('Error reading %s: %s' % (self.AbsoluteLocalPath(), e))
                 raise
 
-        return self._cached_new_contents[:]
+        return self._cached_new_contents
 
     def ChangedContents(self, keeplinebreaks=False):
-        """Returns a list of tuples (line number, line text) of all new lines.
+        """Returns a tuple of (line number, line text) tuples of all new lines.
 
         This relies on the scm diff output describing each changed code section
         with a line of the form
 
         ^@@ <old line num>,<old size> <new line num>,<new size> @@$
+
+        Unless keeplinebreaks is set, the lines are computed once and the same
+        tuple is returned on every call.
         """
         # Don't return cached results when line breaks are requested.
         if not keeplinebreaks and self._cached_changed_contents is not None:
-            return self._cached_changed_contents[:]
+            return self._cached_changed_contents
         result = []
         line_num = 0
 
@@ -1129,11 +1434,11 @@ class AffectedFile(object):
                 result.append((line_num, line[1:]))
             if not line.startswith('-'):
                 line_num += 1
+        result = tuple(result)
         # Don't cache results with line breaks.
-        if keeplinebreaks:
-            return result
-        self._cached_changed_contents = result
-        return self._cached_changed_contents[:]
+        if not keeplinebreaks:
+            self._cached_changed_contents = result
+        return result
 
     def __str__(self):
         return self.LocalPath()
@@ -1201,6 +1506,12 @@ class Change(object):
         self.tags = {}
         self._description_without_tags = ''
         self.SetDescriptionText(description)
+        # Set whenever the description text is read, so that the result cache
+        # knows which checks depend on it.
+        self._description_read = False
+        # Set whenever Gerrit, the network or the clock are read through the
+        # InputApi, so that the result cache skips the checks that did.
+        self._live_state_read = False
 
         # List of submodule paths in the repo.
         self._submodules = None
@@ -1213,6 +1524,9 @@ class Change(object):
             self._AFFECTED_FILES(path, action.strip(), self._local_root,
                                  diff_cache) for action, path in files
         ]
+        diff_cache.affected_paths = [
+            f.LocalPath() for f in self._affected_files
+        ]
 
     def _diff_cache(self):
         return self._AFFECTED_FILES.DIFF_CACHE()
@@ -1228,10 +1542,12 @@ class Change(object):
         (whitespace permitted before and around) is considered a tag line.  Such
         lines are stripped out of the description this function returns.
         """
+        self._description_read = True
         return self._description_without_tags
 
     def FullDescriptionText(self):
         """Returns the complete changelist description including tags."""
+        self._description_read = True
         return self._full_description
 
     def SetDescriptionText(self, description):
@@ -1288,7 +1604,7 @@ class Change(object):
             footers: A dict of {footer: [values]} containing a multimap of the footers
                 in the change description.
         """
-        return git_footers.parse_footers(self.FullDescriptionText())
+        return git_footers.parse_footers(self._full_description)
 
     def BugsFromDescription(self):
         """Returns all bugs referenced in the commit description."""
@@ -1495,7 +1811,112 @@ class ProvidedDiffChange(Change):
         return scm.DIFF.GetAllFiles(root)
 
 
-def ListRelevantPresubmitFiles(files, root):
+def _IsPresubmitFile(name):
+    """Returns True if |name| is the basename of a PRESUBMIT.py script."""
+    return bool(
+        re.match(r'PRESUBMIT.*\.py$', name)
+        and not name.startswith('PRESUBMIT_test'))
+
+
+class _PresubmitIndex(object):
+    """Locates the PRESUBMIT.py scripts of a git checkout without listing
+    directories.
+
+    The index is built from the tree of HEAD and stored in the git directory,
+    keyed on the tree hash, so it is only rebuilt when the tree changes. The
+    scripts added or deleted by the change are taken into account on top of
+    it. Directories that aren't in the tree, like untracked directories and
+    submodules, aren't covered by the index and have to be listed.
+    """
+    FILENAME = 'presubmit_index.json'
+
+    def __init__(self, root, paths, dirs):
+        """
+        Args:
+            root: the directory the index covers.
+            paths: the paths of the PRESUBMIT.py scripts, relative to root.
+            dirs: the paths of the directories in the tree, relative to root,
+                with '' for root itself.
+        """
+        self.root = normpath(root)
+        self._files_by_dir = {}
+        for path in paths:
+            path = normpath(os.path.join(self.root, path))
+            self._files_by_dir.setdefault(os.path.dirname(path),
+                                          set()).add(path)
+        self._dirs = {
+            normpath(os.path.join(self.root, d)) if d else self.root
+            for d in dirs
+        }
+
+    @classmethod
+    def ForChange(cls, change):
+        """Returns a _PresubmitIndex for the change, or None if it can't be
+        indexed."""
+        if not isinstance(change, GitChange):
+            return None
+        root = change.RepositoryRoot()
+        try:
+            git_dir = scm.GIT.GetGitDir(root)
+            tree = scm.GIT.Capture(['rev-parse', 'HEAD^{tree}'], cwd=root)
+        except subprocess.CalledProcessError:
+            return None
+
+        index_path = os.path.join(git_dir, cls.FILENAME)
+        paths = dirs = None
+        index = gclient_utils.FileReadJson(index_path)
+        if isinstance(index, dict) and index.get('tree') == tree:
+            paths = index.get('paths')
+            dirs = index.get('dirs')
+        if not isinstance(paths, list) or not isinstance(dirs, list):
+            try:
+                listing = scm.GIT.Capture(['ls-tree', '-r', '-z', tree],
+                                          cwd=root,
+                                          strip_out=False)
+            except subprocess.CalledProcessError:
+                return None
+            paths = []
+            dirs = set()
+            for entry in listing.split('\0'):
+                if not entry:
+                    continue
+                info, path = entry.split('\t', 1)
+                if info.split()[1] == 'blob' and _IsPresubmitFile(
+                        path.rsplit('/', 1)[-1]):
+                    paths.append(path)
+                # Submodules are listed as commits, so only the directories
+                # above them are covered.
+                while '/' in path:
+                    path = path.rsplit('/', 1)[0]
+                    if path in dirs:
+                        break
+                    dirs.add(path)
+            dirs.add('')
+            dirs = sorted(dirs)
+            gclient_utils.FileWriteJson(index_path, {
+                'tree': tree,
+                'paths': paths,
+                'dirs': dirs
+            })
+
+        # Scripts added by the change may not be in HEAD yet.
+        paths.extend(p for p in change.LocalPaths()
+                     if _IsPresubmitFile(os.path.basename(p)))
+        return cls(root, paths, dirs)
+
+    def Covers(self, directory):
+        """Returns True if |directory| is a directory of the indexed tree."""
+        return directory in self._dirs
+
+    def ListPresubmitFiles(self, directory):
+        """Returns the absolute paths of the scripts right under |directory|."""
+        return [
+            p for p in sorted(self._files_by_dir.get(directory, ()))
+            if os.path.isfile(p)
+        ]
+
+
+def ListRelevantPresubmitFiles(files, root, presubmit_index=None):
     """Finds all presubmit files that apply to a given set of source files.
 
     If inherit-review-settings-ok is present right under root, looks for
@@ -1504,6 +1925,8 @@ def ListRelevantPresubmitFiles(files, root):
     Args:
         files: An iterable container containing file paths.
         root: Path where to stop searching.
+        presubmit_index: an optional _PresubmitIndex used instead of listing
+            the directories it covers.
 
     Return:
         List of absolute paths of the existing PRESUBMIT.py scripts.
@@ -1535,12 +1958,13 @@ def ListRelevantPresubmitFiles(files, root):
     # Look for PRESUBMIT.py in all candidate directories.
     results = []
     for directory in sorted(list(candidates)):
+        if presubmit_index and presubmit_index.Covers(directory):
+            results.extend(presubmit_index.ListPresubmitFiles(directory))
+            continue
         try:
             for f in os.listdir(directory):
                 p = os.path.join(directory, f)
-                if os.path.isfile(p) and re.match(
-                        r'PRESUBMIT.*\.py$',
-                        f) and not f.startswith('PRESUBMIT_test'):
+                if os.path.isfile(p) and _IsPresubmitFile(f):
                     results.append(p)
         except OSError:
             pass
@@ -1586,9 +2010,7 @@ class GetPostUploadExecuter(object):
                                               presubmit_path):
         context = {}
         try:
-            exec(
-                compile(script_text, presubmit_path, 'exec', dont_inherit=True),
-                context)
+            exec(_CompileScript(script_text, presubmit_path), context)
         except Exception as e:
             raise PresubmitFailure('"%s" had an exception.\n%s' %
                                    (presubmit_path, e))
@@ -1614,7 +2036,8 @@ def DoPostUploadExecuter(change, gerrit_obj, verbose):
     python_version = 'Python %s' % sys.version_info.major
     sys.stdout.write('Running %s post upload checks ...\n' % python_version)
     presubmit_files = ListRelevantPresubmitFiles(
-        change.LocalPaths() + change.LocalSubmodules(), change.RepositoryRoot())
+        change.LocalPaths() + change.LocalSubmodules(), change.RepositoryRoot(),
+        _PresubmitIndex.ForChange(change))
     if not presubmit_files and verbose:
         sys.stdout.write('Warning, no PRESUBMIT.py found.\n')
     results = []
@@ -1650,6 +2073,417 @@ def DoPostUploadExecuter(change, gerrit_obj, verbose):
     return exit_code
 
 
+class _Profiler(object):
+    """Collects the time and I/O spent by each presubmit check.
+
+    Each record has the wall and CPU time of a check, the time spent in tests
+    it ran through ThreadPool.CallCommand, and the size of the file contents
+    it read through AffectedFile and InputApi.ReadFile.
+    """
+
+    def __init__(self):
+        self.records = []
+        # Incremented by _count_bytes_read.
+        self.bytes_read = 0
+
+    def Start(self, thread_pool):
+        """Returns the counters to pass to Record once a check is done."""
+        return (time_time(), time.process_time(),
+                thread_pool.subprocess_time if thread_pool else 0.0,
+                self.bytes_read)
+
+    def Record(self, presubmit_path, function_name, thread_pool, start):
+        """Records a check that ran since Start returned |start|."""
+        start_time, start_cpu, start_subprocess, start_bytes = start
+        self.records.append({
+            'file':
+            presubmit_path,
+            'check':
+            function_name,
+            'start':
+            start_time,
+            'wall':
+            time_time() - start_time,
+            'cpu':
+            time.process_time() - start_cpu,
+            'subprocess':
+            ((thread_pool.subprocess_time if thread_pool else 0.0) -
+             start_subprocess),
+            'bytes_read':
+            self.bytes_read - start_bytes,
+        })
+
+    def PrintReport(self, root):
+        """Prints the slowest checks and the total per PRESUBMIT.py file."""
+
+        def _line(record, name):
+            sys.stdout.write('%8.2fs %8.2fs %8.2fs %10d  %s\n' %
+                             (record['wall'], record['cpu'],
+                              record['subprocess'], record['bytes_read'], name))
+
+        header = '%9s %9s %9s %10s  %s\n'
+        sys.stdout.write('** Presubmit profile **\n')
+        sys.stdout.write(header %
+                         ('Wall', 'CPU', 'Subproc', 'Bytes read', 'Check'))
+        by_file = {}
+        for record in sorted(self.records,
+                             key=lambda r: r['wall'],
+                             reverse=True):
+            path = os.path.relpath(record['file'], root)
+            _line(record, '%s:%s' % (path, record['check']))
+            total = by_file.setdefault(path, {
+                'wall': 0,
+                'cpu': 0,
+                'subprocess': 0,
+                'bytes_read': 0
+            })
+            for key in total:
+                total[key] += record[key]
+        sys.stdout.write('\n')
+        sys.stdout.write(header %
+                         ('Wall', 'CPU', 'Subproc', 'Bytes read', 'File'))
+        for path, total in sorted(by_file.items(),
+                                  key=lambda item: item[1]['wall'],
+                                  reverse=True):
+            _line(total, path)
+        sys.stdout.write('\n')
+
+    def WriteTraceEvents(self, path):
+        """Writes the records in the Trace Event Format used by chrome://tracing
+        and Perfetto."""
+        events = []
+        for record in self.records:
+            events.append({
+                'name': record['check'],
+                'cat': record['file'],
+                'ph': 'X',
+                'ts': int(record['start'] * 1e6),
+                'dur': int(record['wall'] * 1e6),
+                'pid': record.get('pid', os.getpid()),
+                'tid': 0,
+                'args': {
+                    'cpu': record['cpu'],
+                    'subprocess': record['subprocess'],
+                    'bytes_read': record['bytes_read'],
+                },
+            })
+        gclient_utils.FileWrite(path, json.dumps({'traceEvents': events}))
+
+
+def _AffectedFileDigests(change):
+    """Returns a (path, action, sha256) tuple for each affected file.
+
+    The digest is None for files that don't exist anymore.
+    """
+    files = []
+    for f in change._affected_files:
+        digest = None
+        path = f.AbsoluteLocalPath()
+        if os.path.isfile(path):
+            with open(path, 'rb') as fh:
+                digest = hashlib.sha256(fh.read()).hexdigest()
+        files.append((f.LocalPath(), f.Action(), digest))
+    return files
+
+
+class _IncrementalState(object):
+    """Remembers the affected files of the last presubmit run that passed.
+
+    Checks listed in PRESUBMIT_INCREMENTAL_CHECKS only look at the files that
+    changed since then, see PresubmitExecuter. The state is keyed on the
+    upstream commit, the committing flag and the PRESUBMIT.py scripts that
+    run, and is stored in the git directory of the change. It also remembers
+    which checks each script listed, since a check that was not listed then
+    has not seen the files that did not change since.
+    """
+    FILENAME = 'presubmit_incremental.json'
+
+    def __init__(self, path, key, files):
+        """
+        Args:
+            path: the file the state is stored in.
+            key: identifies the upstream and the scripts the files are
+                compared against.
+            files: the (path, action, sha256) tuple of each affected file.
+        """
+        self._path = path
+        self._key = key
+        self._files = files
+        self._previous = None
+
+    @classmethod
+    def ForChange(cls, change, committing, scripts):
+        """Returns the _IncrementalState of the change, or None if the change
+        isn't computed from git with an explicit upstream.
+
+        Args:
+            scripts: the (script_text, presubmit_path) tuple of each
+                PRESUBMIT.py script that runs.
+        """
+        if not isinstance(change, GitChange) or not change.UpstreamBranch():
+            return None
+        root = change.RepositoryRoot()
+        try:
+            git_dir = scm.GIT.GetGitDir(root)
+            upstream = scm.GIT.ResolveCommit(root, change.UpstreamBranch())
+        except subprocess.CalledProcessError:
+            return None
+        script_digests = [(path,
+                           hashlib.sha256(text.encode('utf-8')).hexdigest())
+                          for text, path in scripts]
+        key = json.dumps(
+            [__version__, committing, root, upstream, script_digests])
+        return cls(os.path.join(git_dir, cls.FILENAME), key,
+                   _AffectedFileDigests(change))
+
+    def _Load(self):
+        """Returns the state of the last run that passed, if it has the same
+        key, or an empty dict."""
+        if self._previous is None:
+            self._previous = {}
+            state = gclient_utils.FileReadJson(self._path)
+            if isinstance(state, dict) and state.get('key') == self._key:
+                self._previous = state
+        return self._previous
+
+    def ChangedFiles(self):
+        """Returns the paths of the affected files that changed since the last
+        run that passed, or None if there was no such run."""
+        try:
+            previous = set(tuple(f) for f in self._Load()['files'])
+        except (KeyError, TypeError):
+            return None
+        return set(f[0] for f in self._files if tuple(f) not in previous)
+
+    def IncrementalChecks(self):
+        """Returns a map from the path of each script to the checks it listed
+        in PRESUBMIT_INCREMENTAL_CHECKS in the last run that passed."""
+        checks = self._Load().get('checks')
+        return checks if isinstance(checks, dict) else {}
+
+    def Save(self, checks):
+        """Records the affected files as the ones of the last run that
+        passed.
+
+        Args:
+            checks: a map from the path of each script to the checks it listed
+                in PRESUBMIT_INCREMENTAL_CHECKS.
+        """
+        gclient_utils.FileWriteJson(self._path, {
+            'key': self._key,
+            'files': self._files,
+            'checks': checks,
+        })
+
+
+def _IsBot():
+    """Returns True when running on a bot rather than for a developer."""
+    return (os.environ.get('CHROME_HEADLESS') == '1'
+            or os.environ.get('SWARMING_HEADLESS') == '1')
+
+
+_canned_checks_digest = None
+
+
+def _CannedChecksDigest():
+    """Returns a hash of presubmit_canned_checks.py, so that the results of
+    checks expire when the canned checks they run change."""
+    global _canned_checks_digest
+    if _canned_checks_digest is None:
+        with open(
+                os.path.splitext(presubmit_canned_checks.__file__)[0] + '.py',
+                'rb') as f:
+            _canned_checks_digest = hashlib.sha256(f.read()).hexdigest()
+    return _canned_checks_digest
+
+
+class _ResultCache(object):
+    """Remembers the presubmit checks that passed, so they can be skipped.
+
+    A check is keyed on its name, the PRESUBMIT.py script it comes from and a
+    fingerprint of the change: the upstream and end commits, the contents of
+    the affected files and the tags and footers of the description, and on the
+    source of the canned checks. Checks which read the description text are
+    also keyed on the whole description. Only checks which returned no
+    results, added no CCs, queued no tests and did not ask Gerrit, the network
+    or the clock are remembered.
+
+    The cache is stored in the git directory of the change.
+    """
+    FILENAME = 'presubmit_cache.json'
+    # Number of entries kept on disk, most recently added first.
+    MAX_ENTRIES = 5000
+
+    def __init__(self, path, fingerprint):
+        self._path = path
+        self._fingerprint = fingerprint
+        self._entries = {}
+        # Entries added since the cache was loaded.
+        self.new_entries = {}
+        entries = gclient_utils.FileReadJson(path)
+        if isinstance(entries, dict):
+            self._entries = entries
+
+    @classmethod
+    def ForChange(cls, change, committing, dry_run, gerrit_obj):
+        """Returns a _ResultCache for the change, or None if it can't be cached.
+
+        Only changes computed from git with an explicit upstream are cached,
+        since the upstream and end commits together with the affected files
+        describe the whole checkout. Checks are never skipped when committing,
+        nor on bots.
+        """
+        if committing or _IsBot():
+            return None
+        if not isinstance(change, GitChange) or not change.UpstreamBranch():
+            return None
+        root = change.RepositoryRoot()
+        try:
+            git_dir = scm.GIT.GetGitDir(root)
+            upstream = scm.GIT.ResolveCommit(root, change.UpstreamBranch())
+            end_commit = scm.GIT.ResolveCommit(root, change._end_commit
+                                               or 'HEAD')
+        except subprocess.CalledProcessError:
+            return None
+
+        fingerprint = {
+            'version':
+            __version__,
+            'canned_checks':
+            _CannedChecksDigest(),
+            'dry_run':
+            bool(dry_run),
+            'gerrit': [
+                getattr(gerrit_obj, 'host', None),
+                getattr(gerrit_obj, 'project', None),
+                getattr(gerrit_obj, 'branch', None),
+            ],
+            'issue':
+            change.issue,
+            'upstream':
+            upstream,
+            'end_commit':
+            end_commit,
+            'tags':
+            change.tags,
+            'footers':
+            change.GitFootersFromDescription(),
+            'files':
+            _AffectedFileDigests(change),
+        }
+        return cls(os.path.join(git_dir, cls.FILENAME),
+                   cls._Hash(json.dumps(fingerprint, sort_keys=True)))
+
+    @staticmethod
+    def _Hash(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def CheckKey(self, script_text, presubmit_path, function_name):
+        """Returns the key of a check function from a PRESUBMIT.py script."""
+        return self._Hash('\n'.join([
+            self._fingerprint,
+            self._Hash(script_text), presubmit_path, function_name
+        ]))
+
+    def HasPassed(self, key, description):
+        """Returns True if the check passed before with the same inputs."""
+        entry = self._entries.get(key)
+        if not isinstance(entry, dict):
+            return False
+        return entry.get('description') in (None, self._Hash(description))
+
+    def AddPassed(self, key, description=None):
+        """Records a check that passed.
+
+        Args:
+            key: the key of the check, from CheckKey.
+            description: the change description, if the check read it.
+        """
+        self.Update({
+            key: {
+                'description': description and self._Hash(description),
+                'time': time_time(),
+            }
+        })
+
+    def Update(self, entries):
+        """Merges entries added by another _ResultCache for the same change."""
+        self._entries.update(entries)
+        self.new_entries.update(entries)
+
+    def Save(self):
+        """Writes the cache to disk if any check was added."""
+        if not self.new_entries:
+            return
+        entries = sorted(self._entries.items(),
+                         key=lambda item: item[1].get('time', 0),
+                         reverse=True)[:self.MAX_ENTRIES]
+        gclient_utils.FileWriteJson(self._path, dict(entries))
+        self.new_entries = {}
+
+
+class _TestDurations(object):
+    """Remembers how long the tests queued by input_api.RunTests took, so that
+    ThreadPool can start the longest ones first.
+
+    Tests are keyed on their name and command line. The durations are stored
+    in the git directory of the change.
+    """
+    FILENAME = 'presubmit_test_durations.json'
+    # Number of entries kept on disk, most recently run first.
+    MAX_ENTRIES = 5000
+
+    def __init__(self, path):
+        self._path = path
+        self._entries = {}
+        # Entries added since the durations were loaded.
+        self.new_entries = {}
+        entries = gclient_utils.FileReadJson(path)
+        if isinstance(entries, dict):
+            self._entries = entries
+
+    @classmethod
+    def ForChange(cls, change):
+        """Returns the _TestDurations of the change's checkout, or None."""
+        if not isinstance(change, GitChange):
+            return None
+        try:
+            git_dir = scm.GIT.GetGitDir(change.RepositoryRoot())
+        except subprocess.CalledProcessError:
+            return None
+        return cls(os.path.join(git_dir, cls.FILENAME))
+
+    @staticmethod
+    def _Key(test):
+        return json.dumps([test.name, [str(arg) for arg in test.cmd]])
+
+    def Get(self, test):
+        """Returns the last duration of test in seconds, or None."""
+        entry = self._entries.get(self._Key(test))
+        if not isinstance(entry, dict):
+            return None
+        return entry.get('duration')
+
+    def Add(self, test, duration):
+        entry = {'duration': duration, 'time': time_time()}
+        self.Update({self._Key(test): entry})
+
+    def Update(self, entries):
+        """Merges entries added by another _TestDurations."""
+        self._entries.update(entries)
+        self.new_entries.update(entries)
+
+    def Save(self):
+        """Writes the durations to disk if any test ran."""
+        if not self.new_entries:
+            return
+        entries = sorted(self._entries.items(),
+                         key=lambda item: item[1].get('time', 0),
+                         reverse=True)[:self.MAX_ENTRIES]
+        gclient_utils.FileWriteJson(self._path, dict(entries))
+        self.new_entries = {}
+
+
 class PresubmitExecuter(object):
     def __init__(self,
                  change,
@@ -1659,7 +2493,10 @@ class PresubmitExecuter(object):
                  dry_run=None,
                  thread_pool=None,
                  parallel=False,
-                 no_diffs=False):
+                 no_diffs=False,
+                 result_cache=None,
+                 incremental_files=None,
+                 incremental_checks=None):
         """
         Args:
             change: The Change object.
@@ -1671,6 +2508,14 @@ class PresubmitExecuter(object):
                 PRESUBMIT files will be run in parallel.
             no_diffs: if true, implies that --files or --all was specified so some
                 checks can be skipped, and some errors will be messages.
+            result_cache: if set, a _ResultCache used to skip checks that passed
+                before with the same inputs.
+            incremental_files: if set, the paths of the affected files that
+                changed since the last run that passed. The checks listed in
+                PRESUBMIT_INCREMENTAL_CHECKS only see those files.
+            incremental_checks: if set, a map from the path of each script to
+                the checks it listed in PRESUBMIT_INCREMENTAL_CHECKS in the last
+                run that passed. Only those checks only see incremental_files.
         """
         self.change = change
         self.committing = committing
@@ -1681,6 +2526,11 @@ class PresubmitExecuter(object):
         self.thread_pool = thread_pool
         self.parallel = parallel
         self.no_diffs = no_diffs
+        self.result_cache = result_cache
+        self.incremental_files = incremental_files
+        self.incremental_checks = incremental_checks
+        # The checks listed in PRESUBMIT_INCREMENTAL_CHECKS by each script run.
+        self.listed_incremental_checks = {}
 
     def ExecPresubmitScript(self, script_text, presubmit_path):
         """Executes a single presubmit script.
@@ -1706,25 +2556,36 @@ class PresubmitExecuter(object):
             # Return the process to the original working directory.
             os.chdir(main_path)
 
+    def _incremental_change(self):
+        """Returns a copy of the change that only has the affected files that
+        changed since the last run that passed."""
+        change = copy.copy(self.change)
+        change._affected_files = [
+            f for f in self.change._affected_files
+            if f.LocalPath() in self.incremental_files
+        ]
+        return change
+
     def _execute_with_local_working_directory(self, script_text, presubmit_dir,
                                               presubmit_path):
         # Load the presubmit script into context.
-        input_api = InputApi(self.change,
-                             presubmit_path,
-                             self.committing,
-                             self.verbose,
-                             gerrit_obj=self.gerrit,
-                             dry_run=self.dry_run,
-                             thread_pool=self.thread_pool,
-                             parallel=self.parallel,
-                             no_diffs=self.no_diffs)
+        def make_input_api(change):
+            return InputApi(change,
+                            presubmit_path,
+                            self.committing,
+                            self.verbose,
+                            gerrit_obj=self.gerrit,
+                            dry_run=self.dry_run,
+                            thread_pool=self.thread_pool,
+                            parallel=self.parallel,
+                            no_diffs=self.no_diffs)
+
+        input_api = make_input_api(self.change)
         output_api = OutputApi(self.committing)
         context = {}
 
         try:
-            exec(
-                compile(script_text, presubmit_path, 'exec', dont_inherit=True),
-                context)
+            exec(_CompileScript(script_text, presubmit_path), context)
         except Exception as e:
             raise PresubmitFailure('"%s" had an exception.\n%s' %
                                    (presubmit_path, e))
@@ -1747,6 +2608,42 @@ class PresubmitExecuter(object):
         # Prefix for test names
         prefix = 'presubmit:%s/%s:%s/' % (host, project, rel_path)
 
+        # Checks listed in PRESUBMIT_NON_CACHEABLE_CHECKS always run, e.g.
+        # checks that depend on state that the InputApi does not expose.
+        non_cacheable = context.get('PRESUBMIT_NON_CACHEABLE_CHECKS', ())
+
+        # Checks listed in PRESUBMIT_INCREMENTAL_CHECKS only look at each
+        # affected file on its own, so they are only given the files that
+        # changed since the last run that passed.
+        listed_checks = context.get('PRESUBMIT_INCREMENTAL_CHECKS', ())
+        if listed_checks:
+            self.listed_incremental_checks[presubmit_path] = sorted(
+                listed_checks)
+        incremental_checks = ()
+        incremental_input_api = None
+        if self.incremental_files is not None:
+            incremental_checks = listed_checks
+            if self.incremental_checks is not None:
+                # Checks that were not listed in the last run that passed
+                # haven't seen the files that did not change since.
+                previous = self.incremental_checks.get(presubmit_path, ())
+                incremental_checks = [c for c in listed_checks if c in previous]
+            if incremental_checks:
+                incremental_input_api = make_input_api(
+                    self._incremental_change())
+
+        def cache_key(function_name):
+            if (not self.result_cache or function_name in non_cacheable
+                    or function_name in incremental_checks):
+                return None
+            return self.result_cache.CheckKey(script_text, presubmit_path,
+                                              function_name)
+
+        def check_args(function_name):
+            if function_name in incremental_checks:
+                return (incremental_input_api, output_api)
+            return (input_api, output_api)
+
         # Perform all the desired presubmit checks.
         results = []
 
@@ -1772,9 +2669,11 @@ class PresubmitExecuter(object):
                             continue
                         logging.debug('Running %s in %s', function_name,
                                       presubmit_path)
+                        context['__args'] = check_args(function_name)
                         results.extend(
                             self._run_check_function(function_name, context,
-                                                     sink, presubmit_path))
+                                                     sink, presubmit_path,
+                                                     cache_key(function_name)))
                         logging.debug('Running %s done.', function_name)
                         self.more_cc.extend(output_api.more_cc)
                         # Clear the CC list between running each presubmit check
@@ -1789,9 +2688,11 @@ class PresubmitExecuter(object):
                     if function_name in list(context.keys()):
                         logging.debug('Running %s in %s', function_name,
                                       presubmit_path)
+                        context['__args'] = check_args(function_name)
                         results.extend(
                             self._run_check_function(function_name, context,
-                                                     sink, presubmit_path))
+                                                     sink, presubmit_path,
+                                                     cache_key(function_name)))
                         logging.debug('Running %s done.', function_name)
                         self.more_cc.extend(output_api.more_cc)
                         # Clear the CC list between running each presubmit check
@@ -1801,12 +2702,25 @@ class PresubmitExecuter(object):
         finally:
             for f in input_api._named_temporary_files:
                 os.remove(f)
+            if incremental_input_api:
+                for f in incremental_input_api._named_temporary_files:
+                    os.remove(f)
 
-        self.more_cc = sorted(set(self.more_cc))
+        self.AddMoreCc([])
 
         return results
 
-    def _run_check_function(self, function_name, context, sink, presubmit_path):
+    def AddMoreCc(self, more_cc):
+        """Adds CCs to more_cc, which is kept sorted and without duplicates no
+        matter which script, or worker process, they come from."""
+        self.more_cc = sorted(set(self.more_cc).union(more_cc))
+
+    def _run_check_function(self,
+                            function_name,
+                            context,
+                            sink,
+                            presubmit_path,
+                            cache_key=None):
         """Evaluates and returns the result of a given presubmit function.
 
         If sink is given, the result of the presubmit function will be reported
@@ -1816,9 +2730,27 @@ class PresubmitExecuter(object):
             function_name: the name of the presubmit function to evaluate
             context: a context dictionary in which the function will be evaluated
             sink: an instance of ResultSink. None, by default.
+            cache_key: if set, the key of the function in self.result_cache.
+                The function is skipped if it passed before, and recorded if it
+                passes now.
         Returns:
             the result of the presubmit function call.
         """
+        if cache_key and self.result_cache.HasPassed(
+                cache_key, self.change.FullDescriptionText()):
+            logging.debug('Skipping %s in %s, it passed before.', function_name,
+                          presubmit_path)
+            if sink:
+                sink.report(function_name, rdb_wrapper.STATUS_PASS, 0)
+            return []
+
+        output_api = context['__args'][1]
+        more_cc_count = len(output_api.more_cc)
+        queued_tests = self.thread_pool and self.thread_pool.QueuedTests()
+        self.change._description_read = False
+        self.change._live_state_read = False
+        if _PROFILER:
+            profile_start = _PROFILER.Start(self.thread_pool)
         start_time = time_time()
 
         def _progress_loop(event):
@@ -1846,6 +2778,22 @@ class PresubmitExecuter(object):
         finally:
             event.set()
             event_thread.join()
+        description_read = self.change._description_read
+        live_state_read = self.change._live_state_read
+        if _PROFILER:
+            _PROFILER.Record(presubmit_path, function_name, self.thread_pool,
+                             profile_start)
+
+        # Tests queued by input_api.RunTests with --parallel only report their
+        # results later, so the check can't be known to have passed. Checks
+        # that asked Gerrit, the network or the clock may not pass next time.
+        if (cache_key and not result and not live_state_read
+                and len(output_api.more_cc) == more_cc_count
+                and (not self.thread_pool
+                     or self.thread_pool.QueuedTests() == queued_tests)):
+            self.result_cache.AddPassed(
+                cache_key,
+                self.change.FullDescriptionText() if description_read else None)
 
         elapsed_time = time_time() - start_time
         if elapsed_time > 10.0:
@@ -1887,6 +2835,85 @@ def RDBStatusFrom(result):
     return status, failure_reason
 
 
+# PresubmitExecuter of a worker process started by DoPresubmitChecks to run
+# PRESUBMIT.py scripts concurrently. Set up by _InitPresubmitWorker.
+_worker_executer = None
+
+
+def _InitPresubmitWorker(change, committing, verbose, gerrit_obj, dry_run,
+                         parallel, no_diffs, result_cache, profile,
+                         incremental_files, incremental_checks, durations):
+    """Sets up the PresubmitExecuter used by a presubmit worker process.
+
+    The change is only handed to each worker once, and is treated as
+    read-only by the scripts the worker runs.
+    """
+    global _worker_executer
+    global _PROFILER
+    _PROFILER = _Profiler() if profile else None
+    _worker_executer = PresubmitExecuter(change, committing, verbose,
+                                         gerrit_obj, dry_run,
+                                         ThreadPool(durations=durations),
+                                         parallel, no_diffs, result_cache,
+                                         incremental_files, incremental_checks)
+
+
+def _ExecPresubmitScriptInWorker(args):
+    """Runs a single PRESUBMIT.py script in a presubmit worker process.
+
+    Each worker process has its own working directory, so the os.chdir done by
+    ExecPresubmitScript doesn't affect scripts running in other workers. Tests
+    queued by the script through input_api.RunTests are run before returning,
+    since they can't be handed back to the main process' thread pool.
+
+    Args:
+        args: a (script_text, presubmit_path) tuple.
+
+    Returns:
+        A (output, results, more_cc, cache_entries, profile_records, durations,
+        listed_incremental_checks) tuple for the script, where output is what
+        the script printed, cache_entries are the checks added to the worker's
+        result cache, profile_records the checks recorded by its _Profiler and
+        durations the tests recorded by its _TestDurations.
+    """
+    script_text, presubmit_path = args
+    executer = _worker_executer
+    executer.more_cc = []
+    executer.listed_incremental_checks = {}
+    # Buffer what the script prints, so that the main process can print it in
+    # one piece rather than interleaved with the other workers' output.
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        results = executer.ExecPresubmitScript(script_text, presubmit_path)
+        results += _RunQueuedTests(executer.thread_pool, presubmit_path)
+    cache_entries = {}
+    if executer.result_cache:
+        cache_entries = executer.result_cache.new_entries
+        executer.result_cache.new_entries = {}
+    profile_records = []
+    if _PROFILER:
+        profile_records = _PROFILER.records
+        for record in profile_records:
+            record['pid'] = os.getpid()
+        _PROFILER.records = []
+    durations = {}
+    if executer.thread_pool.durations:
+        durations = executer.thread_pool.durations.new_entries
+        executer.thread_pool.durations.new_entries = {}
+    return (output.getvalue(), results, executer.more_cc, cache_entries,
+            profile_records, durations, executer.listed_incremental_checks)
+
+
+def _RunQueuedTests(thread_pool, presubmit_path):
+    """Runs the tests queued with --parallel, profiling them as one check."""
+    if not _PROFILER or not thread_pool.QueuedTests():
+        return thread_pool.RunAsync()
+    start = _PROFILER.Start(thread_pool)
+    results = thread_pool.RunAsync()
+    _PROFILER.Record(presubmit_path, 'RunTests (parallel)', thread_pool, start)
+    return results
+
+
 def DoPresubmitChecks(change,
                       committing,
                       verbose,
@@ -1896,7 +2923,12 @@ def DoPresubmitChecks(change,
                       dry_run=None,
                       parallel=False,
                       json_output=None,
-                      no_diffs=False):
+                      no_diffs=False,
+                      jobs=None,
+                      use_cache=False,
+                      profile=False,
+                      profile_output=None,
+                      incremental=False):
     """Runs all presubmit checks that apply to the files in the change.
 
     This finds all PRESUBMIT.py files in directories enclosing the files in the
@@ -1919,9 +2951,22 @@ def DoPresubmitChecks(change,
             PRESUBMIT files will be run in parallel.
         no_diffs: if true, implies that --files or --all was specified so some
             checks can be skipped, and some errors will be messages.
+        jobs: if greater than 1, the number of worker processes used to run
+            PRESUBMIT.py files concurrently. Results are still reported in the
+            same order as when running them one after another.
+        use_cache: if true, skip checks that passed before with the same inputs
+            and remember the ones that pass now. See _ResultCache.
+        profile: if true, print the time spent by each check.
+        profile_output: if set, a file to write the time spent by each check
+            to, in the Trace Event Format.
+        incremental: if true, the checks listed in PRESUBMIT_INCREMENTAL_CHECKS
+            only look at the files that changed since the last run that passed.
+            See _IncrementalState.
     Return:
         1 if presubmit checks failed or 0 otherwise.
     """
+    global _PROFILER
+    _PROFILER = _Profiler() if profile or profile_output else None
     with setup_environ({'PYTHONDONTWRITEBYTECODE': '1'}):
         python_version = 'Python %s' % sys.version_info.major
         if committing:
@@ -1933,29 +2978,103 @@ def DoPresubmitChecks(change,
         start_time = time_time()
         presubmit_files = ListRelevantPresubmitFiles(
             change.AbsoluteLocalPaths() + change.AbsoluteLocalSubmodules(),
-            change.RepositoryRoot())
+            change.RepositoryRoot(), _PresubmitIndex.ForChange(change))
         if not presubmit_files and verbose:
             sys.stdout.write('Warning, no PRESUBMIT.py found.\n')
         results = []
-        thread_pool = ThreadPool()
+        thread_pool = ThreadPool(durations=_TestDurations.ForChange(change))
+        result_cache = None
+        if use_cache and not no_diffs:
+            result_cache = _ResultCache.ForChange(change, committing, dry_run,
+                                                  gerrit_obj)
+        scripts = []
+        for filename in presubmit_files:
+            filename = os.path.abspath(filename)
+            # Accept CRLF presubmit script.
+            presubmit_script = gclient_utils.FileRead(filename).replace(
+                '\r\n', '\n')
+            scripts.append((presubmit_script, filename))
+
+        incremental_state = None
+        incremental_files = None
+        incremental_checks = None
+        if incremental and not no_diffs:
+            key_scripts = list(scripts)
+            if default_presubmit:
+                key_scripts.append((default_presubmit, 'default'))
+            incremental_state = _IncrementalState.ForChange(
+                change, committing, key_scripts)
+        if incremental_state:
+            incremental_files = incremental_state.ChangedFiles()
+            incremental_checks = incremental_state.IncrementalChecks()
+            if incremental_files is None:
+                sys.stdout.write('No previous presubmit run passed, checking '
+                                 'all files.\n')
+            else:
+                sys.stdout.write(
+                    'Checking %d of %d files changed since the last presubmit '
+                    'run that passed.\n' %
+                    (len(incremental_files), len(change.AffectedFiles())))
         executer = PresubmitExecuter(change, committing, verbose, gerrit_obj,
-                                     dry_run, thread_pool, parallel, no_diffs)
+                                     dry_run, thread_pool, parallel, no_diffs,
+                                     result_cache, incremental_files,
+                                     incremental_checks)
         if default_presubmit:
             if verbose:
                 sys.stdout.write('Running default presubmit script.\n')
             fake_path = os.path.join(change.RepositoryRoot(), 'PRESUBMIT.py')
             results += executer.ExecPresubmitScript(default_presubmit,
                                                     fake_path)
-        for filename in presubmit_files:
-            filename = os.path.abspath(filename)
-            # Accept CRLF presubmit script.
-            presubmit_script = gclient_utils.FileRead(filename).replace(
-                '\r\n', '\n')
-            if verbose:
-                sys.stdout.write('Running %s\n' % filename)
-            results += executer.ExecPresubmitScript(presubmit_script, filename)
-
-        results += thread_pool.RunAsync()
+        if jobs and jobs > 1 and len(scripts) > 1:
+            # The initargs are pickled when the workers are spawned rather
+            # than forked, e.g. on Windows and macOS, so the change and its
+            # diff cache must stay picklable.
+            pool = multiprocessing.Pool(
+                min(jobs, len(scripts)),
+                initializer=_InitPresubmitWorker,
+                initargs=(change, committing, verbose, gerrit_obj,
+                          dry_run, parallel, no_diffs, result_cache,
+                          bool(_PROFILER), incremental_files,
+                          incremental_checks, thread_pool.durations))
+            try:
+                # map() returns the results in the order of the scripts, no
+                # matter which worker finishes first.
+                worker_results = pool.map(_ExecPresubmitScriptInWorker,
+                                          scripts,
+                                          chunksize=1)
+                for (_, filename), worker_result in zip(scripts,
+                                                        worker_results):
+                    (output, script_results, more_cc, cache_entries,
+                     profile_records, durations,
+                     listed_incremental_checks) = worker_result
+                    if verbose:
+                        sys.stdout.write('Running %s\n' % filename)
+                    sys.stdout.write(output)
+                    results += script_results
+                    executer.AddMoreCc(more_cc)
+                    executer.listed_incremental_checks.update(
+                        listed_incremental_checks)
+                    if result_cache:
+                        result_cache.Update(cache_entries)
+                    if _PROFILER:
+                        _PROFILER.records.extend(profile_records)
+                    if thread_pool.durations:
+                        thread_pool.durations.Update(durations)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for presubmit_script, filename in scripts:
+                if verbose:
+                    sys.stdout.write('Running %s\n' % filename)
+                results += executer.ExecPresubmitScript(presubmit_script,
+                                                        filename)
+
+        results += _RunQueuedTests(thread_pool, change.RepositoryRoot())
+        if result_cache:
+            result_cache.Save()
+        if thread_pool.durations:
+            thread_pool.durations.Save()
 
         messages = {}
         should_prompt = False
@@ -1981,6 +3100,16 @@ def DoPresubmitChecks(change,
                     item.handle()
                     sys.stdout.write('\n')
 
+        if _PROFILER:
+            if profile:
+                _PROFILER.PrintReport(change.RepositoryRoot())
+            if profile_output:
+                _PROFILER.WriteTraceEvents(profile_output)
+
+        utilisation_summary = thread_pool.UtilisationSummary()
+        if utilisation_summary:
+            sys.stdout.write(utilisation_summary + '\n')
+
         total_time = time_time() - start_time
         if total_time > 1.0:
             sys.stdout.write('Presubmit checks took %.1fs to calculate.\n' %
@@ -2000,6 +3129,10 @@ def DoPresubmitChecks(change,
             sys.stdout.write('There were %s presubmit errors.\n' %
                              python_version)
 
+        # Only remember the run once the warnings were accepted.
+        if incremental_state and not presubmits_failed:
+            incremental_state.Save(executer.listed_incremental_checks)
+
         if json_output:
             # Write the presubmit results to json output
             presubmit_results = {
@@ -2177,27 +3310,38 @@ def _parse_gerrit_options(parser, options):
     return gerrit_obj
 
 
-def _parse_unified_diff(diff):
-    """Parses a unified git diff and returns a list of (path, diff) tuples."""
-    diffs = {}
+def _iter_unified_diff(lines):
+    """Parses the lines of a unified git diff.
 
+    Yields (path, line) tuples, where path is the normalized path of the file
+    whose diff starts at that line, or None for the other lines.
+    """
     # This regex matches the path twice, separated by a space. Note that
     # filename itself may contain spaces.
     file_marker = re.compile(
         '^diff --git (?:a/)?(?P<filename>.*) (?:b/)?(?P=filename)$')
-    current_diff = []
-    keep_line_endings = True
-    for x in diff.splitlines(keep_line_endings):
+    for x in lines:
+        if not x.startswith('diff --git'):
+            yield None, x
+            continue
         match = file_marker.match(x)
-        if match:
-            # Marks the start of a new per-file section.
-            diffs[match.group('filename')] = current_diff = [x]
-        elif x.startswith('diff --git'):
+        if not match:
             raise PresubmitFailure('Unexpected diff line: %s' % x)
-        else:
-            current_diff.append(x)
+        # Marks the start of a new per-file section.
+        yield normpath(match.group('filename')), x
 
-    return dict((normpath(path), ''.join(diff)) for path, diff in diffs.items())
+
+def _parse_unified_diff(diff):
+    """Parses a unified git diff and returns a list of (path, diff) tuples."""
+    diffs = {}
+    current_diff = []
+    keep_line_endings = True
+    for path, x in _iter_unified_diff(diff.splitlines(keep_line_endings)):
+        if path is not None:
+            diffs[path] = current_diff = []
+        current_diff.append(x)
+
+    return dict((path, ''.join(diff)) for path, diff in diffs.items())
 
 
 def _process_diff_file(diff_file):
@@ -2359,6 +3503,25 @@ def main(argv=None):
                         action='store_true',
                         help='Run all tests specified by input_api.RunTests in '
                         'all PRESUBMIT files in parallel.')
+    parser.add_argument('--jobs',
+                        type=int,
+                        help='Run up to this many PRESUBMIT.py files '
+                        'concurrently in separate processes.')
+    parser.add_argument('--no_cache',
+                        action='store_true',
+                        help='Run all checks, even the ones that passed before '
+                        'with the same files and description.')
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        help='Only give the checks listed in '
+                        'PRESUBMIT_INCREMENTAL_CHECKS the files changed since '
+                        'the last run that passed.')
+    parser.add_argument('--profile',
+                        action='store_true',
+                        help='Print the time spent by each check.')
+    parser.add_argument('--profile_output',
+                        help='Write the time spent by each check to this file, '
+                        'in the Trace Event Format.')
     parser.add_argument('--json_output',
                         help='Write presubmit errors to json output.')
     parser.add_argument('--all_files',
@@ -2402,11 +3565,12 @@ def main(argv=None):
         if options.post_upload:
             return DoPostUploadExecuter(change, gerrit_obj, options.verbose)
         with canned_check_filter(options.skip_canned):
-            return DoPresubmitChecks(change, options.commit, options.verbose,
-                                     options.default_presubmit,
-                                     options.may_prompt, gerrit_obj,
-                                     options.dry_run, options.parallel,
-                                     options.json_output, options.no_diffs)
+            return DoPresubmitChecks(
+                change, options.commit, options.verbose,
+                options.default_presubmit, options.may_prompt, gerrit_obj,
+                options.dry_run, options.parallel, options.json_output,
+                options.no_diffs, options.jobs, not options.no_cache,
+                options.profile, options.profile_output, options.incremental)
     except PresubmitFailure as e:
         import utils
         print(e, file=sys.stderr)
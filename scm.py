@@ -1012,15 +1012,54 @@ class GIT(object):
             return ''
 
     @staticmethod
-    def GenerateDiff(cwd: str,
-                     branch: Optional[str] = None,
-                     branch_head: str = 'HEAD',
-                     full_move: bool = False,
-                     files: Optional[Iterable[str]] = None) -> str:
-        """Diffs against the upstream branch or optionally another branch.
+    def GetOldContentsBatch(cwd: str,
+                            filenames: Sequence[str],
+                            branch: Optional[str] = None) -> Dict[str, str]:
+        """Returns the contents of many files at branch, keyed by filename.
 
-        full_move means that move or copy operations should completely recreate the
-        files, usually in the prospect to apply the patch for a try job."""
+        All files are read by a single `git cat-file --batch` process. Files
+        that don't exist at branch, or aren't regular files, map to ''.
+        """
+        if not filenames:
+            return {}
+        if not branch:
+            branch = GIT.GetUpstreamBranch(cwd)
+        objects = []
+        for filename in filenames:
+            if platform.system() == 'Windows':
+                # git cat-file <sha>:<path> wants a posix path.
+                filename = filename.replace('\\', '/')
+            objects.append('%s:%s\n' % (branch, filename))
+        out = GIT.Capture(['cat-file', '--batch'],
+                          cwd=cwd,
+                          strip_out=False,
+                          decode=False,
+                          indata=''.join(objects).encode('utf-8'))
+
+        # Each object is printed as "<sha> <type> <size>\n<contents>\n", or
+        # as "<object> missing\n" if it doesn't exist.
+        contents = {}
+        pos = 0
+        for filename in filenames:
+            end = out.index(b'\n', pos)
+            header = out[pos:end].split(b' ')
+            pos = end + 1
+            if len(header) != 3 or not header[2].isdigit():
+                contents[filename] = ''
+                continue
+            size = int(header[2])
+            if header[1] == b'blob':
+                contents[filename] = out[pos:pos + size].decode(
+                    'utf-8', 'replace')
+            else:
+                contents[filename] = ''
+            pos += size + 1
+        return contents
+
+    @staticmethod
+    def _DiffCommand(cwd: str, branch: Optional[str], branch_head: str,
+                     full_move: bool,
+                     files: Optional[Iterable[str]]) -> list[str]:
         if not branch:
             branch = GIT.GetUpstreamBranch(cwd)
             assert isinstance(branch, str)
@@ -1042,6 +1081,19 @@ class GIT(object):
         if files:
             command.append('--')
             command.extend(files)
+        return command
+
+    @staticmethod
+    def GenerateDiff(cwd: str,
+                     branch: Optional[str] = None,
+                     branch_head: str = 'HEAD',
+                     full_move: bool = False,
+                     files: Optional[Iterable[str]] = None) -> str:
+        """Diffs against the upstream branch or optionally another branch.
+
+        full_move means that move or copy operations should completely recreate the
+        files, usually in the prospect to apply the patch for a try job."""
+        command = GIT._DiffCommand(cwd, branch, branch_head, full_move, files)
         output = GIT.Capture(command, cwd=cwd, strip_out=False)
         assert isinstance(output, str)
         diff = output.splitlines(True)
@@ -1052,6 +1104,38 @@ class GIT(object):
                 diff[i] = '--- %s' % diff[i + 1][4:]
         return ''.join(diff)
 
+    @staticmethod
+    def GenerateDiffLines(
+            cwd: str,
+            branch: Optional[str] = None,
+            branch_head: str = 'HEAD',
+            full_move: bool = False,
+            files: Optional[Iterable[str]] = None) -> Iterator[str]:
+        """Same as GenerateDiff, but yields the lines of the diff as git
+        outputs them instead of holding the whole diff in memory.
+
+        The lines keep their line breaks, and are split like str.splitlines
+        would split the whole diff."""
+        command = GIT._DiffCommand(cwd, branch, branch_head, full_move, files)
+        env = GIT.ApplyEnvVars({})
+        added = None
+        with git_common.run_stream_with_retcode(*command, cwd=cwd,
+                                                env=env) as stdout:
+            for raw_line in stdout:
+                raw_line = raw_line.decode('utf-8', 'replace')
+                for line in raw_line.splitlines(True):
+                    if added is not None:
+                        # In the case of added files, replace /dev/null with
+                        # the path to the file being added.
+                        yield '--- %s' % line[4:]
+                        added = None
+                    if line.startswith('--- /dev/null'):
+                        added = line
+                    else:
+                        yield line
+        if added is not None:
+            yield added
+
     @staticmethod
     def GetAllFiles(cwd):
         """Returns the list of all files under revision control."""
@@ -1075,6 +1159,11 @@ class GIT(object):
             commit_hashes[record[3]] = record[1]
         return commit_hashes
 
+    @staticmethod
+    def GetGitDir(cwd) -> str:
+        """Returns the git directory of a checkout as an absolute path."""
+        return GIT.Capture(['rev-parse', '--absolute-git-dir'], cwd=cwd)
+
     @staticmethod
     def GetCheckoutRoot(cwd) -> str:
         """Returns the top level directory of a git checkout as an absolute path.
@@ -27,6 +27,10 @@ CL_SPLIT_FORCE_LIMIT = 10
 # will be listed.
 CL_SPLIT_TOP_REVIEWERS = 5
 
+# Rough number of seconds it takes to upload a CL, including presubmit checks,
+# used to estimate how long a split takes.
+CL_SPLIT_UPLOAD_SECONDS = 45
+
 FilesAndOwnersDirectory = collections.namedtuple("FilesAndOwnersDirectory",
                                                  "files owners_directories")
 
@@ -36,17 +40,86 @@ def EnsureInGitRepository():
     git.run('rev-parse')
 
 
-def CreateBranchForDirectories(prefix, directories, upstream):
+def GetOwnersDirectories(repository_root):
+    """Returns the directories of the checkout that have an OWNERS file.
+
+    Paths are relative to |repository_root|, and '.' is the root itself.
+    """
+    output = git.run('ls-files',
+                     '-z',
+                     '--',
+                     'OWNERS',
+                     '*/OWNERS',
+                     cwd=repository_root,
+                     autostrip=False)
+    return {
+        os.path.normpath(os.path.dirname(path))
+        for path in output.split('\0') if path
+    }
+
+
+def GetSplitBranchName(prefix, directories):
+    return prefix + '_' + directories[0] + '_split'
+
+
+def CreateBranchForDirectories(prefix, directories, upstream, files,
+                               description, repository_root):
     """Creates a branch named |prefix| + "_" + |directories[0]| + "_split".
 
-    Return false if the branch already exists. |upstream| is used as upstream
-    for the created branch.
+    The branch has a single commit on top of |upstream| with the changes to
+    |files| in the |prefix| branch, and |upstream| as its upstream. It is
+    created with plumbing commands in a temporary index, so the working tree
+    is left alone.
+
+    Return false if the branch already exists.
     """
     existing_branches = set(git.branches(use_limit=False))
-    branch_name = prefix + '_' + directories[0] + '_split'
+    branch_name = GetSplitBranchName(prefix, directories)
     if branch_name in existing_branches:
         return False
-    git.run('checkout', '-t', upstream, '-b', branch_name)
+
+    base = git.run('rev-parse', upstream, cwd=repository_root)
+    paths = [f.replace(os.sep, '/') for action, f in files if action != 'D']
+    # ls-tree prints entries in the format update-index --index-info reads.
+    index_info = []
+    if paths:
+        index_info = git.run('ls-tree',
+                             '-r',
+                             '-z',
+                             prefix,
+                             '--',
+                             *paths,
+                             cwd=repository_root,
+                             autostrip=False).split('\0')
+    # Mode 0 removes the path from the index.
+    index_info.extend('0 %s\t%s' % ('0' * 40, f.replace(os.sep, '/'))
+                      for action, f in files if action == 'D')
+
+    with gclient_utils.temporary_directory() as tmp_dir:
+        env = os.environ.copy()
+        env['GIT_INDEX_FILE'] = os.path.join(tmp_dir, 'index')
+        git.run('read-tree', base, cwd=repository_root, env=env)
+        git.run('update-index',
+                '-z',
+                '--index-info',
+                indata=('\0'.join(i for i in index_info if i) +
+                        '\0').encode('utf-8'),
+                cwd=repository_root,
+                env=env)
+        tree = git.run('write-tree', cwd=repository_root, env=env)
+
+    commit = git.run('commit-tree',
+                     tree,
+                     '-p',
+                     base,
+                     indata=FormatDescriptionOrComment(
+                         description, directories).encode('utf-8'),
+                     cwd=repository_root)
+    git.run('branch', '--track', branch_name, upstream, cwd=repository_root)
+    git.run('update-ref',
+            'refs/heads/' + branch_name,
+            commit,
+            cwd=repository_root)
     return True
 
 
@@ -84,18 +157,14 @@ def AddUploadedByGitClSplitToDescription(description):
     return '\n'.join(lines)
 
 
-def UploadCl(refactor_branch, refactor_branch_upstream, directories, files,
-             description, comment, reviewers, changelist, cmd_upload,
-             cq_dry_run, enable_auto_submit, topic, repository_root):
-    """Uploads a CL with all changes to |files| in |refactor_branch|.
+def UploadCl(refactor_branch, directories, comment, reviewers, changelist,
+             cmd_upload, cq_dry_run, enable_auto_submit, topic):
+    """Uploads the CL in the split branch of |directories|.
 
     Args:
         refactor_branch: Name of the branch that contains the changes to upload.
-        refactor_branch_upstream: Name of the upstream of |refactor_branch|.
         directories: Paths to the directories that contain the OWNERS files for
             which to upload a CL.
-        files: List of AffectedFile instances to include in the uploaded CL.
-        description: Description of the uploaded CL.
         comment: Comment to post on the uploaded CL.
         reviewers: A set of reviewers for the CL.
         changelist: The Changelist class.
@@ -104,35 +173,7 @@ def UploadCl(refactor_branch, refactor_branch_upstream, directories, files,
         enable_auto_submit: If CL uploads should also enable auto submit.
         topic: Topic to associate with uploaded CLs.
     """
-    # Create a branch.
-    if not CreateBranchForDirectories(refactor_branch, directories,
-                                      refactor_branch_upstream):
-        print('Skipping ' + FormatDirectoriesForPrinting(directories) +
-              ' for which a branch already exists.')
-        return
-
-    # Checkout all changes to files in |files|.
-    deleted_files = []
-    modified_files = []
-    for action, f in files:
-        abspath = os.path.abspath(os.path.join(repository_root, f))
-        if action == 'D':
-            deleted_files.append(abspath)
-        else:
-            modified_files.append(abspath)
-
-    if deleted_files:
-        git.run(*['rm'] + deleted_files)
-    if modified_files:
-        git.run(*['checkout', refactor_branch, '--'] + modified_files)
-
-    # Commit changes. The temporary file is created with delete=False so that it
-    # can be deleted manually after git has read it rather than automatically
-    # when it is closed.
-    with gclient_utils.temporary_file() as tmp_file:
-        gclient_utils.FileWrite(
-            tmp_file, FormatDescriptionOrComment(description, directories))
-        git.run('commit', '-F', tmp_file)
+    git.run('checkout', GetSplitBranchName(refactor_branch, directories))
 
     # Upload a CL.
     upload_args = ['-f']
@@ -162,13 +203,26 @@ def UploadCl(refactor_branch, refactor_branch_upstream, directories, files,
                                 publish=True)
 
 
-def GetFilesSplitByOwners(files, max_depth):
+def GetFilesSplitByOwners(files, max_depth, owners_directories=None):
     """Returns a map of files split by OWNERS file.
 
+    Args:
+        files: List of (action, path) tuples.
+        max_depth: The maximum directory depth to search for OWNERS files.
+        owners_directories: Optional set of the directories with an OWNERS
+            file, as returned by GetOwnersDirectories(), to look OWNERS files
+            up in instead of the file system.
+
     Returns:
         A map where keys are paths to directories containing an OWNERS file and
         values are lists of files sharing an OWNERS file.
     """
+
+    def HasOwnersFile(directory):
+        if owners_directories is None:
+            return os.path.isfile(os.path.join(directory, 'OWNERS'))
+        return os.path.normpath(directory) in owners_directories
+
     files_split_by_owners = {}
     for action, path in files:
         # normpath() is important to normalize separators here, in prepration
@@ -180,8 +234,11 @@ def GetFilesSplitByOwners(files, max_depth):
                 *dir_with_owners.split(os.path.sep)[:max_depth])
         # Find the closest parent directory with an OWNERS file.
         while (dir_with_owners not in files_split_by_owners
-               and not os.path.isfile(os.path.join(dir_with_owners, 'OWNERS'))):
-            dir_with_owners = os.path.dirname(dir_with_owners)
+               and not HasOwnersFile(dir_with_owners)):
+            parent = os.path.dirname(dir_with_owners)
+            if parent == dir_with_owners:
+                break
+            dir_with_owners = parent
         files_split_by_owners.setdefault(dir_with_owners, []).append(
             (action, path))
     return files_split_by_owners
@@ -266,7 +323,7 @@ def SplitCl(description_file, comment_file, changelist, cmd_upload, dry_run,
             return 0
 
         files_split_by_reviewers = SelectReviewersForFiles(
-            cl, author, files, max_depth)
+            cl, author, files, max_depth, GetOwnersDirectories(repository_root))
 
         num_cls = len(files_split_by_reviewers)
         print('Will split current branch (' + refactor_branch + ') into ' +
@@ -287,6 +344,22 @@ def SplitCl(description_file, comment_file, changelist, cmd_upload, dry_run,
             if answer.lower() != 'y':
                 return 0
 
+        # Create all the branches before uploading any of them, so that the
+        # working tree only changes to upload each CL.
+        reviewers_to_upload = set()
+        if not dry_run:
+            for reviewers, cl_info in files_split_by_reviewers.items():
+                directories = cl_info.owners_directories
+                if CreateBranchForDirectories(refactor_branch, directories,
+                                              refactor_branch_upstream,
+                                              cl_info.files, description,
+                                              repository_root):
+                    reviewers_to_upload.add(reviewers)
+                else:
+                    print('Skipping ' +
+                          FormatDirectoriesForPrinting(directories) +
+                          ' for which a branch already exists.')
+
         cls_per_reviewer = collections.defaultdict(int)
         for cl_index, (reviewers, cl_info) in \
             enumerate(files_split_by_reviewers.items(), 1):
@@ -297,15 +370,18 @@ def SplitCl(description_file, comment_file, changelist, cmd_upload, dry_run,
                 PrintClInfo(cl_index, num_cls, cl_info.owners_directories,
                             file_paths, description, reviewer_set, cq_dry_run,
                             enable_auto_submit, topic)
-            else:
-                UploadCl(refactor_branch, refactor_branch_upstream,
-                         cl_info.owners_directories, cl_info.files, description,
-                         comment, reviewer_set, changelist, cmd_upload,
-                         cq_dry_run, enable_auto_submit, topic, repository_root)
+            elif reviewers in reviewers_to_upload:
+                UploadCl(refactor_branch, cl_info.owners_directories, comment,
+                         reviewer_set, changelist, cmd_upload, cq_dry_run,
+                         enable_auto_submit, topic)
 
             for reviewer in reviewers:
                 cls_per_reviewer[reviewer] += 1
 
+        if dry_run:
+            print('Uploading {} CLs will take about {} minutes.\n'.format(
+                num_cls, -(-num_cls * CL_SPLIT_UPLOAD_SECONDS // 60)))
+
         # List the top reviewers that will be sent the most CLs as a result of
         # the split.
         reviewer_rankings = sorted(cls_per_reviewer.items(),
@@ -342,7 +418,11 @@ def CheckDescriptionBugLink(description):
     return answer.lower() == 'y'
 
 
-def SelectReviewersForFiles(cl, author, files, max_depth):
+def SelectReviewersForFiles(cl,
+                            author,
+                            files,
+                            max_depth,
+                            owners_directories=None):
     """Selects reviewers for passed-in files
 
     Args:
@@ -351,8 +431,15 @@ def SelectReviewersForFiles(cl, author, files, max_depth):
         files: List of files
         max_depth: The maximum directory depth to search for OWNERS files.
             A value less than 1 means no limit.
+        owners_directories: Optional set of the directories with an OWNERS
+            file, see GetFilesSplitByOwners().
     """
-    info_split_by_owners = GetFilesSplitByOwners(files, max_depth)
+    info_split_by_owners = GetFilesSplitByOwners(files, max_depth,
+                                                 owners_directories)
+
+    # Look the owners of all the files up at once, so that suggesting
+    # reviewers for each CL below is answered from the owners client's cache.
+    cl.owners_client.BatchListOwners([f for _, f in files])
 
     info_split_by_reviewers = {}
 
@@ -365,7 +452,9 @@ def SelectReviewersForFiles(cl, author, files, max_depth):
         # dictionary.
         reviewers = tuple(
             cl.owners_client.SuggestOwners(
-                file_paths, exclude=[author, cl.owners_client.EVERYONE]))
+                file_paths,
+                exclude=[author, cl.owners_client.EVERYONE],
+                minimal=True))
 
         if not reviewers in info_split_by_reviewers:
             info_split_by_reviewers[reviewers] = FilesAndOwnersDirectory([], [])
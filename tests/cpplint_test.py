@@ -0,0 +1,478 @@
+#!/usr/bin/env vpython3
+# Copyright (c) 2026 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Unit tests for the cpplint.py driver."""
+
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cpplint
+import gclient_utils
+
+# pylint: disable=protected-access
+
+BAD_INDENT = '\n'.join([
+    '// Copyright 1999 <a@example.com>',
+    'namespace foo {',
+    '  class a;',
+    '}',
+    'int x = 1 ;',
+    '',
+])
+
+
+# A sample of files that trip many of the per-line checks.
+GOLDEN_CORPUS = {
+    'foo/bar.h':
+    '\n'.join([
+        '// Copyright 2026 The Chromium Authors',
+        '#ifndef FOO_BAZ_H_',
+        '#define FOO_BAZ_H_',
+        '',
+        '#include <stdio.h>',
+        '#include <string>',
+        '',
+        'using namespace std;',
+        '',
+        'namespace foo {',
+        '',
+        'class Bar {',
+        '  public:',
+        '  Bar(int x);',
+        '  int Get() const { return x_ >? 0; }',
+        '  void Print( int value ) {printf("%d\\n", value);}',
+        'private:',
+        '  long long x_;',
+        '  short port_;',
+        '};',
+        '',
+        '}  // namespace foo',
+        '',
+        '#endif  // FOO_BAR_H_',
+        '',
+    ]),
+    'foo/bar.cc':
+    '\n'.join([
+        '// Copyright 2026 The Chromium Authors',
+        '#include <vector>',
+        '#include "foo/bar.h"',
+        '#include <stdlib.h>',
+        '',
+        'namespace foo {',
+        '',
+        'Bar::Bar(int x) : x_(x) {}',
+        '',
+        'void Shift(int a, int b) {',
+        '  int c = a<<b;',
+        '  int d = a>>b;',
+        '  if(c < d){',
+        '    c = (int)d;',
+        '  }',
+        '  else {',
+        '    d = c ;',
+        '  }',
+        '\tc = d;',
+        '  char buffer[10];',
+        '  sprintf(buffer, "%d", c);',
+        '  snprintf(buffer, 10, "%d", d);',
+        '  printf("\\%d", c);',
+        '  char* token = strtok(buffer, " ");',
+        '  // TODO: remove this',
+        '  std::vector<int> v = std::vector<int>() ;   ',
+        '  std::cout<<token<<std::endl;',
+        '  if (a < b && b > a) return;',
+        '  int very_long_variable_name_number_one = a + b + c + d + a + b + c '
+        '+ d + a + b + c + d;',
+        '  long suppressed = 0;  // NOLINT(runtime/int)',
+        '}',
+        '',
+        '}  // namespace foo',
+        '',
+    ]),
+    'foo/clean.cc':
+    '\n'.join([
+        '// Copyright 2026 The Chromium Authors',
+        '#include "foo/clean.h"',
+        '',
+        'namespace foo {',
+        '',
+        'int Add(int a, int b) {',
+        '  return a + b;',
+        '}',
+        '',
+        '}  // namespace foo',
+        '',
+    ]),
+}
+
+# The errors cpplint reported on GOLDEN_CORPUS before the checks were sped up,
+# as (file, line, message, category, confidence).
+GOLDEN_ERRORS = [
+    ('foo/bar.cc', 4, 'Found C system header after other header. Should be: '
+     'bar.h, c system, c++ system, other.', 'build/include_order', 4),
+    ('foo/bar.cc', 11, 'Missing spaces around <<', 'whitespace/operators', 3),
+    ('foo/bar.cc', 12, 'Missing spaces around >>', 'whitespace/operators', 3),
+    ('foo/bar.cc', 13, 'Missing space before ( in if(', 'whitespace/parens', 5),
+    ('foo/bar.cc', 13, 'Missing space before {', 'whitespace/braces', 5),
+    ('foo/bar.cc', 14, 'Using C-style cast.  Use static_cast<int>(...) instead',
+     'readability/casting', 4),
+    ('foo/bar.cc', 16,
+     'An else should appear on the same line as the preceding }',
+     'whitespace/newline', 4),
+    ('foo/bar.cc', 16,
+     'If an else has a brace on one side, it should have it on both',
+     'readability/braces', 5),
+    ('foo/bar.cc', 17, 'Extra space before last semicolon. If this should be '
+     'an empty statement, use {} instead.', 'whitespace/semicolon', 5),
+    ('foo/bar.cc', 19, 'Tab found; better to use spaces', 'whitespace/tab', 1),
+    ('foo/bar.cc', 21, 'Never use sprintf. Use snprintf instead.',
+     'runtime/printf', 5),
+    ('foo/bar.cc', 22, 'If you can, use sizeof(buffer) instead of 10 as the '
+     '2nd arg to snprintf.', 'runtime/printf', 3),
+    ('foo/bar.cc', 23,
+     '%, [, (, and { are undefined character escapes.  Unescape them.',
+     'build/printf_format', 3),
+    ('foo/bar.cc', 24, 'Consider using strtok_r(...) instead of strtok(...) '
+     'for improved thread safety.', 'runtime/threadsafe_fn', 2),
+    ('foo/bar.cc', 25, 'Missing username in TODO; it should look like '
+     '"// TODO(my_username): Stuff."', 'readability/todo', 2),
+    ('foo/bar.cc', 26,
+     'Line ends in whitespace.  Consider deleting these extra spaces.',
+     'whitespace/end_of_line', 4),
+    ('foo/bar.cc', 26, 'Extra space before last semicolon. If this should be '
+     'an empty statement, use {} instead.', 'whitespace/semicolon', 5),
+    ('foo/bar.cc', 27, 'Missing spaces around <<', 'whitespace/operators', 3),
+    ('foo/bar.cc', 29, 'Lines should be <= 80 characters long',
+     'whitespace/line_length', 2),
+    ('foo/bar.h', 2,
+     '#ifndef header guard has wrong style, please use: FOO_BAR_H_',
+     'build/header_guard', 5),
+    ('foo/bar.h', 8, 'Do not use namespace using-directives.  Use '
+     'using-declarations instead.', 'build/namespaces', 5),
+    ('foo/bar.h', 13, 'public: should be indented +1 space inside class Bar',
+     'whitespace/indent', 3),
+    ('foo/bar.h', 14, 'Single-parameter constructors should be marked '
+     'explicit.', 'runtime/explicit', 5),
+    ('foo/bar.h', 15, '>? and <? (max and min) operators are non-standard and '
+     'deprecated.', 'build/deprecated', 3),
+    ('foo/bar.h', 16, 'Extra space after ( in function call',
+     'whitespace/parens', 4),
+    ('foo/bar.h', 17, 'private: should be indented +1 space inside class Bar',
+     'whitespace/indent', 3),
+    ('foo/bar.h', 18, 'Use int16/int64/etc, rather than the C type long',
+     'runtime/int', 4),
+    ('foo/bar.h', 19, 'Use int16/int64/etc, rather than the C type short',
+     'runtime/int', 4),
+]
+
+
+class ProcessFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(gclient_utils.rmtree, self.root)
+        self.cache_path = os.path.join(self.root, 'cache.json')
+        self.files = []
+        for name in ('a.cc', 'b.cc', 'c.cc'):
+            self.files.append(os.path.join(self.root, name))
+            gclient_utils.FileWrite(self.files[-1], BAD_INDENT)
+
+        self.addCleanup(cpplint._SetState, cpplint._GetState())
+        cpplint._SetCountingStyle('detailed')
+        cpplint._SetFilters('-build/header_guard')
+        cpplint._cpplint_state.ResetErrorCounts()
+        mock.patch('sys.stderr', io.StringIO()).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def Lint(self, jobs=1, changed_lines=None):
+        """Returns the output and error counts of linting the files."""
+        sys.stderr.seek(0)
+        sys.stderr.truncate()
+        cpplint._cpplint_state.ResetErrorCounts()
+        cpplint.ProcessFiles(self.files,
+                             1,
+                             jobs=jobs,
+                             cache_path=self.cache_path,
+                             changed_lines=changed_lines)
+        return (sys.stderr.getvalue(), cpplint._cpplint_state.error_count,
+                cpplint._cpplint_state.errors_by_category)
+
+    def testSameAsProcessFile(self):
+        for filename in self.files:
+            cpplint.ProcessFile(filename, 1)
+        expected = (sys.stderr.getvalue(), 6, {
+            'runtime/indentation_namespace': 3,
+            'whitespace/semicolon': 3,
+        })
+
+        self.assertEqual(expected, self.Lint())
+        os.remove(self.cache_path)
+        self.assertEqual(expected, self.Lint(jobs=2))
+
+    def testCache(self):
+        expected = self.Lint()
+
+        with mock.patch('cpplint._LintFile') as mockLintFile:
+            self.assertEqual(expected, self.Lint())
+        mockLintFile.assert_not_called()
+
+        # Only changed files are linted again.
+        gclient_utils.FileWrite(self.files[1], BAD_INDENT.replace(' ;', ';'))
+        output, error_count, _ = self.Lint()
+        self.assertEqual(5, error_count)
+        self.assertNotIn('b.cc:5', output)
+
+        with mock.patch('cpplint._LintFile') as mockLintFile:
+            self.Lint()
+        mockLintFile.assert_not_called()
+
+    def testCacheConfig(self):
+        self.Lint()
+        gclient_utils.FileWrite(os.path.join(self.root, 'CPPLINT.cfg'),
+                                'filter=-whitespace\n')
+
+        output, error_count, _ = self.Lint()
+        self.assertEqual(3, error_count)
+        self.assertNotIn('whitespace/semicolon', output)
+
+        # The configuration only applies to the files it covers.
+        self.assertEqual(80, cpplint._line_length)
+        self.assertNotIn('-whitespace', cpplint._Filters())
+
+    def testChangedLines(self):
+        self.Lint()
+        # Files that are not in changed_lines are linted in full.
+        output, error_count, _ = self.Lint(changed_lines={
+            self.files[0]: [5],
+            self.files[1]: [1, 2],
+        })
+        self.assertEqual(3, error_count)
+        self.assertIn(self.files[0] + ':5:', output)
+        self.assertNotIn(self.files[0] + ':3:', output)
+        self.assertNotIn(self.files[1], output)
+        self.assertIn(self.files[2] + ':3:', output)
+
+    def testDaemonLintsSerially(self):
+        expected = self.Lint()
+        os.remove(self.cache_path)
+
+        with mock.patch('multiprocessing.current_process') as process, \
+                mock.patch('multiprocessing.get_context') as get_context:
+            process.return_value.daemon = True
+            self.assertEqual(expected, self.Lint(jobs=2))
+        get_context.assert_not_called()
+
+    def testOutputPerFile(self):
+        # Errors are collected per thread rather than by swapping sys.stderr,
+        # which other threads may be writing to.
+        output, error_count, _ = cpplint._LintFile(
+            (cpplint._GetState(), self.files[0], 1, [], None))
+        self.assertEqual(2, error_count)
+        self.assertIn(self.files[0] + ':3:', output)
+        self.assertEqual('', sys.stderr.getvalue())
+        self.assertIsNone(cpplint._thread_output.stream)
+
+
+class GoldenOutputTest(unittest.TestCase):
+    """Checks that the output on GOLDEN_CORPUS stays byte-identical, however
+    the files are linted."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(gclient_utils.rmtree, self.root)
+        # Header guards are relative to the checkout.
+        os.mkdir(os.path.join(self.root, '.git'))
+        self.cache_path = os.path.join(self.root, 'cache.json')
+        self.files = []
+        for name, content in sorted(GOLDEN_CORPUS.items()):
+            self.files.append(os.path.join(self.root, name))
+            os.makedirs(os.path.dirname(self.files[-1]), exist_ok=True)
+            gclient_utils.FileWrite(self.files[-1], content)
+
+        self.addCleanup(cpplint._SetState, cpplint._GetState())
+        cpplint._SetCountingStyle('detailed')
+        cpplint._SetFilters('')
+        mock.patch('sys.stderr', io.StringIO()).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def Expected(self, changed_lines=None):
+        """Returns the golden output, only on changed_lines if given."""
+        changed_lines = changed_lines or {}
+        output = ''
+        for name, linenum, message, category, confidence in GOLDEN_ERRORS:
+            path = os.path.join(self.root, name)
+            if path in changed_lines and linenum not in changed_lines[path]:
+                continue
+            output += '%s:%d:  (cpplint) %s  [%s] [%d]\n' % (
+                path, linenum, message, category, confidence)
+        return output
+
+    def Lint(self, **kwargs):
+        sys.stderr.seek(0)
+        sys.stderr.truncate()
+        cpplint._cpplint_state.ResetErrorCounts()
+        cpplint.ProcessFiles(self.files, 1, **kwargs)
+        self.assertEqual(len(sys.stderr.getvalue().splitlines()),
+                         cpplint._cpplint_state.error_count)
+        return sys.stderr.getvalue()
+
+    def testProcessFile(self):
+        for filename in self.files:
+            cpplint.ProcessFile(filename, 1)
+        self.assertEqual(self.Expected(), sys.stderr.getvalue())
+
+    def testSerial(self):
+        self.assertEqual(self.Expected(), self.Lint())
+
+    def testJobs(self):
+        self.assertEqual(self.Expected(), self.Lint(jobs=2))
+
+    def testCache(self):
+        self.assertEqual(self.Expected(), self.Lint(cache_path=self.cache_path))
+        with mock.patch('cpplint._LintFile') as mockLintFile:
+            self.assertEqual(self.Expected(),
+                             self.Lint(cache_path=self.cache_path))
+        mockLintFile.assert_not_called()
+
+    def testChangedLines(self):
+        changed_lines = {
+            self.files[0]: [11, 13, 16, 20, 24, 29],
+            self.files[1]: [2, 15, 16],
+        }
+        expected = self.Expected(changed_lines)
+        self.assertEqual(expected, self.Lint(changed_lines=changed_lines))
+        self.assertEqual(expected, self.Lint(changed_lines=changed_lines,
+                                             jobs=2))
+
+
+class ChangedLinesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(cpplint._SetState, cpplint._GetState())
+        cpplint._SetFilters('-legal/copyright')
+        self.errors = []
+
+    def Error(self, filename, linenum, category, confidence, message):
+        self.errors.append((linenum, category))
+
+    def Lint(self, lines, changed_lines):
+        cpplint.ProcessFileData('foo/foo.cc',
+                                'cc',
+                                lines,
+                                self.Error,
+                                changed_lines=changed_lines)
+        return sorted(self.errors)
+
+    def testOnlyChangedLines(self):
+        lines = [
+            'namespace foo {',
+            'int x = 1 ;',
+            'int y = 2 ;',
+            '}  // namespace foo',
+            '',
+        ]
+        self.assertEqual([(2, 'whitespace/semicolon')], self.Lint(lines, [2]))
+
+    def testContext(self):
+        # The includes and blocks before the changed lines are still known.
+        lines = [
+            '#include "foo/foo.h"',
+            '',
+            '#include <string>',
+            '#include <stdio.h>',
+            'class Foo {',
+            ' public:',
+            '  Foo(int x);',
+            '};',
+            '',
+        ]
+        self.assertEqual([(4, 'build/include_order'), (7, 'runtime/explicit')],
+                         self.Lint(lines, [4, 7]))
+
+    def testParseUnifiedDiff(self):
+        diff = '\n'.join([
+            'diff --git a/foo.cc b/foo.cc',
+            '--- a/foo.cc',
+            '+++ b/foo.cc',
+            '@@ -1,3 +1,4 @@',
+            ' a',
+            '-b',
+            '+c',
+            '+--- d',
+            ' e',
+            '@@ -10 +11,0 @@',
+            '-f',
+            '@@ -20,0 +21 @@',
+            '+g',
+            'diff --git a/bar.cc b/bar.cc',
+            'deleted file mode 100644',
+            '--- a/bar.cc',
+            '+++ /dev/null',
+            '@@ -1 +0,0 @@',
+            '-h',
+            '',
+        ])
+        self.assertEqual({'foo.cc': {2, 3, 21}}, cpplint.ParseUnifiedDiff(diff))
+
+
+class DiffArgumentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(gclient_utils.rmtree, self.root)
+        os.mkdir(os.path.join(self.root, '.git'))
+        os.mkdir(os.path.join(self.root, 'foo'))
+        self.diff_path = os.path.join(self.root, 'changes.diff')
+        gclient_utils.FileWrite(
+            self.diff_path, '\n'.join([
+                'diff --git a/foo/bar.cc b/foo/bar.cc',
+                '--- a/foo/bar.cc',
+                '+++ b/foo/bar.cc',
+                '@@ -1 +1 @@',
+                '-a',
+                '+b',
+                '',
+            ]))
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(os.path.join(self.root, 'foo'))
+        self.addCleanup(cpplint._SetState, cpplint._GetState())
+        mock.patch('cpplint._changed_lines', None).start()
+        mock.patch('cpplint._diff_root', None).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def testRelativeToGitRoot(self):
+        cpplint.ParseArguments(['--diff=' + self.diff_path, 'bar.cc'])
+        self.assertEqual({os.path.join(self.root, 'foo', 'bar.cc'): {1}},
+                         cpplint._changed_lines)
+
+    def testDiffRoot(self):
+        cpplint.ParseArguments(
+            ['--diff=' + self.diff_path, '--diff_root=.', 'bar.cc'])
+        self.assertEqual({os.path.join(self.root, 'foo', 'foo', 'bar.cc'): {1}},
+                         cpplint._changed_lines)
+
+    @mock.patch('cpplint.ProcessFiles')
+    def testMainWarnsAboutFilesNotInDiff(self, mockProcessFiles):
+        argv = ['cpplint.py', '--diff=' + self.diff_path, 'bar.cc', 'baz.cc']
+        stderr = io.BytesIO()
+        with mock.patch('sys.argv', argv), mock.patch('sys.stderr', stderr):
+            with self.assertRaises(SystemExit):
+                cpplint.main()
+        self.assertIn(b'Warning: baz.cc is not in the diff, linting all of it.',
+                      stderr.getvalue())
+        self.assertNotIn(b'bar.cc is not', stderr.getvalue())
+        mockProcessFiles.assert_called_once_with(['bar.cc', 'baz.cc'],
+                                                 mock.ANY,
+                                                 jobs=1,
+                                                 changed_lines={'bar.cc': {1}})
+
+
+if __name__ == '__main__':
+    unittest.main()
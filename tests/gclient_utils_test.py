@@ -395,6 +395,18 @@ class GClientUtilsTest(trial_dir.TestCase):
             gclient_utils.FileWrite(tmp, 'foo ✔ bar')
             self.assertEqual('foo ✔ bar', gclient_utils.FileRead(tmp))
 
+    def testFileReadWriteJson(self):
+        with gclient_utils.temporary_directory() as tmp:
+            path = os.path.join(tmp, 'state.json')
+            self.assertIsNone(gclient_utils.FileReadJson(path))
+            gclient_utils.FileWriteJson(path, {'a': [1, 2]})
+            self.assertEqual({'a': [1, 2]}, gclient_utils.FileReadJson(path))
+            self.assertEqual(['state.json'], os.listdir(tmp))
+            gclient_utils.FileWrite(path, 'not json')
+            self.assertIsNone(gclient_utils.FileReadJson(path))
+            # Failing to write is not fatal.
+            gclient_utils.FileWriteJson(os.path.join(tmp, 'missing', 'x'), 1)
+
     def testTemporaryFile(self):
         with gclient_utils.temporary_file() as tmp:
             gclient_utils.FileWrite(tmp, 'test')
@@ -4,12 +4,14 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import itertools
 import json
 import os
 import socket
 import subprocess
 import sys
 import textwrap
+import threading
 import unittest
 
 from io import StringIO
@@ -483,6 +485,69 @@ class GerritUtilTest(unittest.TestCase):
         content = gerrit_util.ReadHttpResponse(conn, (404, ))
         self.assertEqual('', content.getvalue())
 
+    def testReadHttpResponse_RetryAfter(self):
+        response = mock.Mock(status=429)
+        response.get.return_value = '30'
+        conn = mock.Mock(req_host='throttled.example.com',
+                         req_params={
+                             'uri': 'uri',
+                             'method': 'method'
+                         })
+        conn.request.side_effect = [
+            (response, b''),
+            (mock.Mock(status=200), b'content'),
+        ]
+
+        # Pretend the Retry-After delay has elapsed once the request is retried.
+        with mock.patch('gerrit_util.time_monotonic',
+                        side_effect=itertools.count(0, 100)):
+            self.assertEqual('content',
+                             gerrit_util.ReadHttpResponse(conn).getvalue())
+        gerrit_util.time_sleep.assert_called_once_with(30.0)
+        response.get.assert_called_once_with('retry-after')
+        state = gerrit_util.GetThrottleState()['throttled.example.com']
+        self.assertEqual(1, state['throttled'])
+        self.assertEqual(0, state['in_flight'])
+
+    def testHostThrottle_AIMD(self):
+        throttle = gerrit_util._HostThrottle('host', max_limit=8)
+        self.assertEqual(8, throttle.limit)
+
+        for status in (429, 503, 429):
+            throttle.acquire()
+            throttle.release(status)
+        self.assertEqual(1, throttle.limit)
+        throttle.acquire()
+        throttle.release(500)
+        self.assertEqual(1, throttle.limit)
+
+        # The limit grows by about one for each window of successful requests.
+        throttle.acquire()
+        throttle.release(200)
+        self.assertEqual(2, throttle.limit)
+        for _ in range(100):
+            throttle.acquire()
+            throttle.release(200)
+        self.assertEqual(8, throttle.limit)
+        self.assertEqual(3, throttle.state()['throttled'])
+
+    def testHostThrottle_BlocksAtLimit(self):
+        throttle = gerrit_util._HostThrottle('host', max_limit=1)
+        throttle.acquire()
+        acquired = threading.Event()
+
+        def worker():
+            throttle.acquire()
+            acquired.set()
+            throttle.release(200)
+
+        t = threading.Thread(target=worker)
+        t.start()
+        self.assertFalse(acquired.wait(0.05))
+        throttle.release(200)
+        self.assertTrue(acquired.wait(5))
+        t.join()
+
     @mock.patch('gerrit_util.ReadHttpResponse')
     def testReadHttpJsonResponse_NotJSON(self, mockReadHttpResponse):
         mockReadHttpResponse.return_value = StringIO('not json')
@@ -504,6 +569,37 @@ class GerritUtilTest(unittest.TestCase):
                                                      json.dumps(expected_value))
         self.assertEqual(expected_value, gerrit_util.ReadHttpJsonResponse(None))
 
+    @mock.patch('gerrit_util.ReadHttpResponse')
+    def testReadHttpJsonStreamResponse_JSON(self, mockReadHttpResponse):
+        expected_value = [{'_number': i, 'subject': 'x' * i} for i in range(50)]
+        expected_value.append(12345)
+        mockReadHttpResponse.return_value = StringIO(')]}\'\n' +
+                                                     json.dumps(expected_value))
+        with mock.patch('gerrit_util.JSON_STREAM_CHUNK_SIZE', 7):
+            self.assertEqual(expected_value,
+                             list(gerrit_util.ReadHttpJsonStreamResponse(None)))
+
+    @mock.patch('gerrit_util.ReadHttpResponse')
+    def testReadHttpJsonStreamResponse_Empty(self, mockReadHttpResponse):
+        mockReadHttpResponse.return_value = StringIO(')]}\'\n[ ]')
+        self.assertEqual([], list(gerrit_util.ReadHttpJsonStreamResponse(None)))
+        mockReadHttpResponse.return_value = StringIO(')]}\'')
+        self.assertEqual([], list(gerrit_util.ReadHttpJsonStreamResponse(None)))
+
+    @mock.patch('gerrit_util.ReadHttpResponse')
+    def testReadHttpJsonStreamResponse_Truncated(self, mockReadHttpResponse):
+        mockReadHttpResponse.return_value = StringIO(')]}\'\n[{"a": 1}, {"b"')
+        stream = gerrit_util.ReadHttpJsonStreamResponse(None)
+        self.assertEqual({'a': 1}, next(stream))
+        with self.assertRaises(gerrit_util.GerritError):
+            next(stream)
+
+    @mock.patch('gerrit_util.ReadHttpResponse')
+    def testReadHttpJsonStreamResponse_NotArray(self, mockReadHttpResponse):
+        mockReadHttpResponse.return_value = StringIO(')]}\'\n{"a": 1}')
+        with self.assertRaises(gerrit_util.GerritError):
+            list(gerrit_util.ReadHttpJsonStreamResponse(None))
+
     @mock.patch('gerrit_util.CreateHttpConn')
     @mock.patch('gerrit_util.ReadHttpJsonResponse')
     def testQueryChanges(self, mockJsonResponse, mockCreateHttpConn):
@@ -590,6 +686,115 @@ class GerritUtilTest(unittest.TestCase):
             mock.call('host', 'params', None, 500, None, 0),
         ], mockQueryChanges.mock_calls)
 
+    @mock.patch('gerrit_util.QueryChanges')
+    def testGenerateAllChanges_Prefetch(self, mockQueryChanges):
+        mockQueryChanges.side_effect = [
+            [{
+                '_number': '3'
+            }, {
+                '_number': '2',
+                '_more_changes': True
+            }],
+            [{
+                '_number': '1'
+            }],
+            [{
+                '_number': '3'
+            }],
+        ]
+
+        changes = gerrit_util.GenerateAllChanges('host',
+                                                 'params',
+                                                 prefetch=True)
+        # The second page is requested before the first one is consumed.
+        self.assertEqual('3', next(changes)['_number'])
+        self.assertEqual(['2', '1'], [cl['_number'] for cl in changes])
+        self.assertEqual([
+            mock.call('host', 'params', None, 500, None, 0),
+            mock.call('host', 'params', None, 500, None, 2),
+            mock.call('host', 'params', None, 500, None, 0),
+        ], mockQueryChanges.mock_calls)
+
+    @mock.patch('gerrit_util.QueryChanges')
+    def testGenerateAllChanges_Keyset(self, mockQueryChanges):
+        mockQueryChanges.side_effect = [
+            [{
+                '_number': '4',
+                'updated': '2024-01-02 10:00:00.000000000'
+            }, {
+                '_number': '3',
+                'updated': '2024-01-01 10:00:00.500000000',
+                '_more_changes': True
+            }],
+            # All changes in this page were updated within the same second, so
+            # the next page falls back to an offset.
+            [{
+                '_number': '3',
+                'updated': '2024-01-01 10:00:00.500000000'
+            }, {
+                '_number': '2',
+                'updated': '2024-01-01 10:00:00.100000000',
+                '_more_changes': True
+            }],
+            [{
+                '_number': '1',
+                'updated': '2023-12-31 10:00:00.000000000'
+            }],
+            [],
+        ]
+
+        changes = list(
+            gerrit_util.GenerateAllChanges('host', [('is', 'open')],
+                                           keyset=True))
+        self.assertEqual(['4', '3', '2', '1'],
+                         [cl['_number'] for cl in changes])
+        cursor = ('before', '%222024-01-01%2010%3A00%3A01%20%2B0000%22')
+        self.assertEqual([
+            mock.call('host', [('is', 'open')], None, 500, None, 0),
+            mock.call('host', [('is', 'open'), cursor], None, 500, None, 0),
+            mock.call('host', [('is', 'open'), cursor], None, 500, None, 2),
+            mock.call('host', [('is', 'open')], None, 500, None, 0),
+        ], mockQueryChanges.mock_calls)
+
+    @mock.patch('gerrit_util.CreateHttpConn')
+    @mock.patch('gerrit_util.ReadHttpJsonStreamResponse')
+    def testStreamQueryChanges(self, mockStreamResponse, mockCreateHttpConn):
+        mockStreamResponse.return_value = iter([{'_number': 1}])
+        changes = gerrit_util.StreamQueryChanges('host', [('key', 'val')],
+                                                 limit=10)
+        self.assertEqual([{'_number': 1}], list(changes))
+        mockCreateHttpConn.assert_called_once_with('host',
+                                                   'changes/?q=key:val&n=10',
+                                                   timeout=30.0)
+
+    @mock.patch('gerrit_util.StreamQueryChanges')
+    def testGenerateAllChanges_Stream(self, mockStreamQueryChanges):
+        mockStreamQueryChanges.side_effect = [
+            iter([{
+                '_number': '3'
+            }, {
+                '_number': '2',
+                '_more_changes': True
+            }]),
+            iter([{
+                '_number': '2'
+            }, {
+                '_number': '1'
+            }]),
+            iter([{
+                '_number': '3'
+            }]),
+        ]
+
+        changes = list(
+            gerrit_util.GenerateAllChanges('host', 'params', stream=True))
+        self.assertEqual(['3', '2', '1'], [cl['_number'] for cl in changes])
+        self.assertEqual([
+            mock.call('host', 'params', None, 500, None, 0),
+            mock.call('host', 'params', None, 500, None, 2),
+            mock.call('host', 'params', None, 500, None, 0),
+        ], mockStreamQueryChanges.mock_calls)
+
     @mock.patch('gerrit_util.CreateHttpConn')
     @mock.patch('gerrit_util.ReadHttpJsonResponse')
     def testIsCodeOwnersEnabledOnRepo_Disabled(self, mockJsonResponse,
@@ -38,6 +38,7 @@ import git_common
 import git_footers
 import git_new_branch
 import owners_client
+import presubmit_server
 import scm
 import subprocess2
 
@@ -410,6 +411,7 @@ class TestGitClBasic(unittest.TestCase):
         self.assertEqual(f('v8', 'chromium:123,456,v8:123'),
                          ['v8:456', 'chromium:123', 'v8:123'])
 
+    @mock.patch.dict('gerrit_util._account_details_cache', clear=True)
     @mock.patch('gerrit_util.GetAccountDetails')
     def test_valid_accounts(self, mockGetAccountDetails):
         mock_per_account = {
@@ -447,6 +449,73 @@ class TestGitClBasic(unittest.TestCase):
             })
 
 
+    @mock.patch.dict('gerrit_util._account_details_cache', clear=True)
+    @mock.patch('gerrit_util.GetAccountDetails')
+    def test_valid_accounts_prefetched(self, mockGetAccountDetails):
+        mockGetAccountDetails.side_effect = (lambda _, account: {
+            'email': account
+        } if account != 'u2' else None)
+        git_cl.gerrit_util.PrefetchAccounts('host', ['u1', 'u2', 'u1'])
+        actual = git_cl.gerrit_util.ValidAccounts('host', ['u1', 'u2', 'u3'])
+        self.assertEqual(actual, {
+            'u1': {
+                'email': 'u1'
+            },
+            'u3': {
+                'email': 'u3'
+            },
+        })
+        # Every account is looked up exactly once.
+        self.assertEqual(['u1', 'u2', 'u3'],
+                         sorted(c.args[1]
+                                for c in mockGetAccountDetails.mock_calls))
+
+        # Later calls are served from the cache.
+        git_cl.gerrit_util.ValidAccounts('host', ['u1', 'u2'])
+        self.assertEqual(3, mockGetAccountDetails.call_count)
+
+    @mock.patch.dict('gerrit_util._account_details_cache', clear=True)
+    @mock.patch('gerrit_util.GetAccountDetails')
+    def test_valid_accounts_unexpected_error(self, mockGetAccountDetails):
+        mockGetAccountDetails.side_effect = [
+            ValueError('oops'), {
+                'email': 'u1'
+            }
+        ]
+        with self.assertRaises(ValueError):
+            git_cl.gerrit_util.ValidAccounts('host', ['u1'])
+        # The failure isn't cached.
+        self.assertEqual({'u1': {
+            'email': 'u1'
+        }}, git_cl.gerrit_util.ValidAccounts('host', ['u1']))
+
+    @mock.patch('git_cl.gerrit_util.PrefetchAccounts')
+    @mock.patch('git_cl.Changelist.GetGerritHost',
+                return_value='other-review.googlesource.com')
+    def test_prefetch_accounts(self, _mockGetGerritHost, mockPrefetchAccounts):
+        cl = git_cl.Changelist(issue=1, codereview_host='host')
+        cl.ExtendCC(['watcher@example.com'])
+        options = optparse.Values({'cc': ['cc@example.com', ' ']})
+        change_desc = git_cl.ChangeDescription(
+            'desc\n\nR=r@example.com\nCC=c2@example.com')
+        cl._PrefetchAccounts(options, change_desc)
+        mockPrefetchAccounts.assert_called_once_with(
+            'other-review.googlesource.com', [
+                'r@example.com', 'c2@example.com', 'cc@example.com',
+                'watcher@example.com'
+            ])
+
+    @mock.patch('git_cl.gerrit_util.PrefetchAccounts')
+    @mock.patch('git_cl.Changelist.GetGerritHost',
+                return_value='chromium-review.googlesource.com')
+    def test_prefetch_accounts_chromium(self, _mockGetGerritHost,
+                                        mockPrefetchAccounts):
+        cl = git_cl.Changelist(issue=1, codereview_host='host')
+        options = optparse.Values({'cc': ['cc@example.com']})
+        cl._PrefetchAccounts(options, git_cl.ChangeDescription('desc'))
+        mockPrefetchAccounts.assert_not_called()
+
+
 class TestParseIssueURL(unittest.TestCase):
     def _test(self, arg, issue=None, patchset=None, hostname=None, fail=False):
         parsed = git_cl.ParseIssueNumberArgument(arg)
@@ -1457,8 +1526,10 @@ class TestGitCl(unittest.TestCase):
         mockRunGitPush.assert_called_once_with(expected_refspec,
                                                expected_refspec_opts, mock.ANY,
                                                options.push_options)
-        mockPostUploadUpdates.assert_called_once_with(options, new_upload,
-                                                      '1234')
+        mockPostUploadUpdates.assert_called_once_with(options,
+                                                      new_upload,
+                                                      '1234',
+                                                      pool=mock.ANY)
 
     @mock.patch('git_cl.Changelist.GetGerritHost',
                 return_value='chromium-review.googlesource.com')
@@ -1554,9 +1625,9 @@ class TestGitCl(unittest.TestCase):
                                                expected_refspec_opts, mock.ANY,
                                                options.push_options)
 
-        self.assertEqual(mockPostUploadUpdates.mock_calls, [
-            mock.call(options, new_upload_upstream, '1233'),
-            mock.call(options, new_upload_current, '1234')
+        self.assertEqual(mockPostUploadUpdates.call_args_list, [
+            mock.call(options, new_upload_upstream, '1233', pool=mock.ANY),
+            mock.call(options, new_upload_current, '1234', pool=mock.ANY)
         ])
 
     @mock.patch('git_cl.Changelist.GetGerritHost',
@@ -1638,8 +1709,9 @@ class TestGitCl(unittest.TestCase):
                                                expected_refspec_opts, mock.ANY,
                                                options.push_options)
 
-        self.assertEqual(mockPostUploadUpdates.mock_calls,
-                         [mock.call(options, new_upload_current, '1233')])
+        self.assertEqual(
+            mockPostUploadUpdates.call_args_list,
+            [mock.call(options, new_upload_current, '1233', pool=mock.ANY)])
 
         # Test case: user does not want external changes or there are none.
         mockSquashedCommit.reset_mock()
@@ -2045,6 +2117,15 @@ class TestGitCl(unittest.TestCase):
                     'test7',  # test7
                 ]
                 return '\n'.join(branch_deps)
+            if args[0][0] == 'rev-parse':
+                return 'hash-%s\n' % args[0][1]
+            if args[0][0] == 'config':
+                # test3 was left out of the last upload of test5.
+                if args[0][2] == 'branch.test3.last-upload-hash':
+                    return 'old-hash\n'
+                branch = args[0][2][len('branch.'):-len('.last-upload-hash')]
+                return 'hash-%s\n' % branch
+            return ''
 
         git_cl.RunGit.side_effect = mock_run_git
         git_cl.CMDupload.return_value = 0
@@ -2071,6 +2152,22 @@ class TestGitCl(unittest.TestCase):
         self.assertEqual(5, len(git_cl.CMDupload.mock_calls))
         self.assertEqual(0, ret)
 
+        # Stacked uploads only upload the leaves, test5 and test3.1, which
+        # also upload the branches in between.
+        git_cl.CMDupload.reset_mock()
+        git_cl.RunGit.reset_mock()
+        ret = git_cl.upload_branch_deps(MockChangelist(), [], stacked=True)
+        self.assertEqual(2, len(git_cl.CMDupload.mock_calls))
+        self.assertIn(mock.call(['checkout', '-q', 'test5']),
+                      git_cl.RunGit.mock_calls)
+        self.assertIn(mock.call(['checkout', '-q', 'test3.1']),
+                      git_cl.RunGit.mock_calls)
+        self.assertNotIn(mock.call(['checkout', '-q', 'test3']),
+                         git_cl.RunGit.mock_calls)
+        self.assertEqual(0, ret)
+        self.assertIn('  test3 : skipped\n  test4 : succeeded\n',
+                      sys.stdout.getvalue())
+
     def test_gerrit_change_id(self):
         self.calls = [
             ((['git', 'write-tree'], ), 'hashtree'),
@@ -2093,7 +2190,7 @@ class TestGitCl(unittest.TestCase):
     @mock.patch('git_cl.Changelist.GetGerritHost')
     @mock.patch('git_cl.Changelist.GetGerritProject')
     @mock.patch('git_cl.Changelist.GetRemoteBranch')
-    @mock.patch('owners_client.OwnersClient.BatchListOwners')
+    @mock.patch('owners_client.GerritClient.BatchListOwners')
     def getDescriptionForUploadTest(self,
                                     mockBatchListOwners=None,
                                     mockGetRemoteBranch=None,
@@ -3679,6 +3776,7 @@ class ChangelistTest(unittest.TestCase):
         mock.patch('git_cl.time_time').start()
         mock.patch('metrics.collector').start()
         mock.patch('subprocess2.Popen').start()
+        mock.patch('presubmit_server.RunPresubmit', return_value=None).start()
         mock.patch('git_cl.Changelist.GetGerritProject',
                    return_value='project').start()
         mock.patch('sys.exit', side_effect=SystemExitMock).start()
@@ -3710,7 +3808,12 @@ class ChangelistTest(unittest.TestCase):
                              upstream='upstream',
                              description='description',
                              all_files=True,
-                             resultdb=False)
+                             resultdb=False,
+                             jobs=4,
+                             no_cache=True,
+                             profile=True,
+                             profile_output='profile.json',
+                             incremental=True)
 
         self.assertEqual(expected_results, results)
         subprocess2.Popen.assert_any_call([
@@ -3737,6 +3840,13 @@ class ChangelistTest(unittest.TestCase):
             '--commit',
             '--may_prompt',
             '--parallel',
+            '--jobs',
+            '4',
+            '--no_cache',
+            '--incremental',
+            '--profile',
+            '--profile_output',
+            'profile.json',
             '--all_files',
             '--no_diffs',
             '--json_output',
@@ -3933,6 +4043,24 @@ class ChangelistTest(unittest.TestCase):
 
         sys.exit.assert_called_once_with(2)
 
+    def testRunHook_PresubmitServer(self):
+        gclient_utils.FileRead.return_value = json.dumps({'errors': []})
+        git_cl.time_time.side_effect = [100, 200]
+        presubmit_server.RunPresubmit.return_value = 0
+
+        cl = git_cl.Changelist()
+        results = cl.RunHook(committing=False,
+                             may_prompt=False,
+                             verbose=0,
+                             parallel=False,
+                             upstream='upstream',
+                             description='description',
+                             all_files=False)
+
+        self.assertEqual({'errors': []}, results)
+        presubmit_server.RunPresubmit.assert_called_once_with('root', mock.ANY)
+        subprocess2.Popen.assert_not_called()
+
     def testRunPostUploadHook(self):
         cl = git_cl.Changelist()
         cl.RunPostUploadHook(2, 'upstream', 'description')
@@ -4151,6 +4279,7 @@ class ChangelistTest(unittest.TestCase):
         options.bypass_hooks = False
         options.verbose = False
         options.parallel = False
+        options.no_cache = False
         options.preserve_tryjobs = False
         options.private = False
         options.no_autocc = False
@@ -4184,7 +4313,8 @@ class ChangelistTest(unittest.TestCase):
                                             upstream='420parent',
                                             description=desc,
                                             all_files=False,
-                                            end_commit='420latest_tree')
+                                            end_commit='420latest_tree',
+                                            no_cache=False)
 
     @mock.patch('git_cl.Changelist.GetAffectedFiles', return_value=[])
     @mock.patch('git_cl.Changelist.GetIssue', return_value='123')
@@ -4203,6 +4333,7 @@ class ChangelistTest(unittest.TestCase):
         options.bypass_hooks = False
         options.verbose = False
         options.parallel = False
+        options.no_cache = False
         options.edit_description = False
         options.preserve_tryjobs = False
         options.private = False
@@ -4237,7 +4368,8 @@ class ChangelistTest(unittest.TestCase):
                                             upstream=parent,
                                             description=desc,
                                             all_files=False,
-                                            end_commit=latest_tree)
+                                            end_commit=latest_tree,
+                                            no_cache=False)
         mockEnsureCanUploadPatchset.assert_called_once()
 
         # Test preserve_tryjob
@@ -4295,6 +4427,20 @@ class ChangelistTest(unittest.TestCase):
         mockRunPostHook.assert_called_once_with(True, 'parent-commit',
                                                 change_desc.description)
 
+        # With a pool, reviewers are added in the background.
+        mockAddReviewers.reset_mock()
+        pool = mock.Mock()
+        result = cl.PostUploadUpdates(options, new_upload, '12345', pool=pool)
+        mockAddReviewers.assert_not_called()
+        self.assertEqual(pool.apply_async.return_value, result)
+        pool.apply_async.assert_called_once_with(mockAddReviewers,
+                                                 ('chromium', 'project~123456'),
+                                                 {
+                                                     'reviewers': reviewers,
+                                                     'ccs': ccs,
+                                                     'notify': False
+                                                 })
+
 
 class CMDTestCaseBase(unittest.TestCase):
     _STATUSES = [
@@ -4404,7 +4550,12 @@ class CMDPresubmitTestCase(CMDTestCaseBase):
             all_files=None,
             files=None,
             resultdb=None,
-            realm=None)
+            realm=None,
+            jobs=None,
+            no_cache=None,
+            profile=None,
+            profile_output=None,
+            incremental=None)
 
     def testNoIssue(self):
         git_cl.Changelist.GetIssue.return_value = None
@@ -4419,7 +4570,12 @@ class CMDPresubmitTestCase(CMDTestCaseBase):
             all_files=None,
             files=None,
             resultdb=None,
-            realm=None)
+            realm=None,
+            jobs=None,
+            no_cache=None,
+            profile=None,
+            profile_output=None,
+            incremental=None)
 
     def testCustomBranch(self):
         self.assertEqual(0, git_cl.main(['presubmit', 'custom_branch']))
@@ -4433,14 +4589,20 @@ class CMDPresubmitTestCase(CMDTestCaseBase):
             all_files=None,
             files=None,
             resultdb=None,
-            realm=None)
+            realm=None,
+            jobs=None,
+            no_cache=None,
+            profile=None,
+            profile_output=None,
+            incremental=None)
 
     def testOptions(self):
         self.assertEqual(
             0,
             git_cl.main([
-                'presubmit', '-v', '-v', '--all', '--parallel', '-u',
-                '--resultdb', '--realm', 'chromium:public'
+                'presubmit', '-v', '-v', '--all', '--parallel', '--jobs', '4',
+                '--no-cache', '--incremental', '--profile', '--profile-output',
+                'profile.json', '-u', '--resultdb', '--realm', 'chromium:public'
             ]))
         git_cl.Changelist.RunHook.assert_called_once_with(
             committing=False,
@@ -4452,7 +4614,12 @@ class CMDPresubmitTestCase(CMDTestCaseBase):
             all_files=True,
             files=None,
             resultdb=True,
-            realm='chromium:public')
+            realm='chromium:public',
+            jobs=4,
+            no_cache=True,
+            profile=True,
+            profile_output='profile.json',
+            incremental=True)
 
     @mock.patch('git_cl.write_json')
     def testJson(self, mock_write_json):
@@ -5233,20 +5400,20 @@ class CMDFormatTestCase(unittest.TestCase):
 class CMDStatusTestCase(CMDTestCaseBase):
     # Return branch names a,..,f with comitterdates in increasing order, i.e.
     # 'f' is the most-recently changed branch.
-    def _mock_run_git(commands):
-        if commands == [
-                'for-each-ref', '--format=%(refname) %(committerdate:unix)',
-                'refs/heads'
-        ]:
-            branches_and_committerdates = [
-                'refs/heads/a 1',
-                'refs/heads/b 2',
-                'refs/heads/c 3',
-                'refs/heads/d 4',
-                'refs/heads/e 5',
-                'refs/heads/f 6',
-            ]
-            return '\n'.join(branches_and_committerdates)
+    def _mock_get_branches_snapshot():
+        branches = {
+            b:
+            git_common.BranchSnapshot(hash='0' * 40,
+                                      short_hash='0' * 7,
+                                      upstream='',
+                                      upstream_ref='',
+                                      ahead=None,
+                                      behind=None,
+                                      gone=False,
+                                      commit_date=str(i + 1))
+            for i, b in enumerate('abcdef')
+        }
+        return git_common.BranchesSnapshot(branches, set(), 'a', '0' * 7, {})
 
     # Mock the status in such a way that the issue number gives us an
     # indication of the commit date (simplifies manual debugging).
@@ -5258,7 +5425,7 @@ class CMDStatusTestCase(CMDTestCaseBase):
     @mock.patch('git_cl.Changelist.EnsureAuthenticated')
     @mock.patch('git_cl.Changelist.FetchDescription', lambda cl, pretty: 'x')
     @mock.patch('git_cl.Changelist.GetIssue', lambda cl: cl.issue)
-    @mock.patch('git_cl.RunGit', _mock_run_git)
+    @mock.patch('git_common.get_branches_snapshot', _mock_get_branches_snapshot)
     @mock.patch('git_cl.get_cl_statuses', _mock_get_cl_statuses)
     @mock.patch('git_cl.Settings.GetRoot', return_value='')
     @mock.patch('git_cl.Settings.IsStatusCommitOrderByDate', return_value=False)
@@ -5282,7 +5449,7 @@ class CMDStatusTestCase(CMDTestCaseBase):
     @mock.patch('git_cl.Changelist.EnsureAuthenticated')
     @mock.patch('git_cl.Changelist.FetchDescription', lambda cl, pretty: 'x')
     @mock.patch('git_cl.Changelist.GetIssue', lambda cl: cl.issue)
-    @mock.patch('git_cl.RunGit', _mock_run_git)
+    @mock.patch('git_common.get_branches_snapshot', _mock_get_branches_snapshot)
     @mock.patch('git_cl.get_cl_statuses', _mock_get_cl_statuses)
     @mock.patch('git_cl.Settings.GetRoot', return_value='')
     @mock.patch('git_cl.Settings.IsStatusCommitOrderByDate', return_value=False)
@@ -5307,7 +5474,7 @@ class CMDStatusTestCase(CMDTestCaseBase):
     @mock.patch('git_cl.Changelist.EnsureAuthenticated')
     @mock.patch('git_cl.Changelist.FetchDescription', lambda cl, pretty: 'x')
     @mock.patch('git_cl.Changelist.GetIssue', lambda cl: cl.issue)
-    @mock.patch('git_cl.RunGit', _mock_run_git)
+    @mock.patch('git_common.get_branches_snapshot', _mock_get_branches_snapshot)
     @mock.patch('git_cl.get_cl_statuses', _mock_get_cl_statuses)
     @mock.patch('git_cl.Settings.GetRoot', return_value='')
     @mock.patch('git_cl.Settings.IsStatusCommitOrderByDate', return_value=True)
@@ -5350,7 +5517,7 @@ class CMDOwnersTestCase(CMDTestCaseBase):
                    return_value='project').start()
         mock.patch('git_cl.Changelist.GetRemoteBranch',
                    return_value=('origin', 'refs/remotes/origin/main')).start()
-        mock.patch('owners_client.OwnersClient.BatchListOwners',
+        mock.patch('owners_client.GerritClient.BatchListOwners',
                    return_value=self.owners_by_path).start()
         mock.patch('gerrit_util.IsCodeOwnersEnabledOnHost',
                    return_value=True).start()
@@ -5364,7 +5531,7 @@ class CMDOwnersTestCase(CMDTestCaseBase):
     def testShowAll(self):
         self.assertEqual(
             0, git_cl.main(['owners', '--show-all', 'foo', 'bar', 'baz']))
-        owners_client.OwnersClient.BatchListOwners.assert_called_once_with(
+        owners_client.GerritClient.BatchListOwners.assert_called_once_with(
             ['foo', 'bar', 'baz'])
         self.assertEqual(
             '\n'.join([
@@ -5383,6 +5550,17 @@ class CMDOwnersTestCase(CMDTestCaseBase):
         self.assertIn('a@example.com', sys.stdout.getvalue())
         self.assertIn('b@example.com', sys.stdout.getvalue())
 
+    @mock.patch('owners_client.LocalOwnersClient._ReadTree', return_value={})
+    @mock.patch('owners_client.LocalOwnersClient.BatchListOwners')
+    def testLocal(self, mockBatchListOwners, mockReadTree):
+        mockBatchListOwners.return_value = {'foo': ['a@example.com']}
+        self.assertEqual(
+            0, git_cl.main(['owners', '--local', '--show-all', 'foo']))
+        mockReadTree.assert_called_once_with('root', 'refs/remotes/origin/main')
+        mockBatchListOwners.assert_called_once_with(['foo'])
+        owners_client.GerritClient.BatchListOwners.assert_not_called()
+        self.assertIn(' - a@example.com', sys.stdout.getvalue())
+
 
 class CMDLintTestCase(CMDTestCaseBase):
     bad_indent = '\n'.join([
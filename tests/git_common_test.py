@@ -600,6 +600,63 @@ class GitMutableFunctionsTest(git_test_utils.GitRepoReadWriteTestBase,
         }
         self.assertEqual(expected, actual)
 
+    def testGetBranchesSnapshot(self):
+        self.repo.git('commit', '--allow-empty', '-am', 'foooooo')
+        self.repo.git('tag', 'tagged')
+        self.repo.git('checkout', '-t', '-b', 'happybranch', 'main')
+        self.repo.git('commit', '--allow-empty', '-am', 'foooooo')
+        self.repo.git('config', 'branch.happybranch.dormant', 'true')
+        self.repo.git('checkout', '-t', '-b', 'to_delete', 'main')
+        self.repo.git('checkout', '-t', '-b', 'parent_gone', 'to_delete')
+        self.repo.git('branch', '-D', 'to_delete')
+        self.repo.git('checkout', 'happybranch')
+
+        snapshot = self.repo.run(self.gc.get_branches_snapshot,
+                                 include_tags=True)
+
+        self.assertEqual({'main', 'happybranch', 'parent_gone'},
+                         set(snapshot.branches))
+        self.assertEqual({'tagged'}, snapshot.tags)
+        self.assertEqual('happybranch', snapshot.current_branch)
+        self.assertEqual(
+            self.repo.run(self.gc.hash_one, 'happybranch', short=True),
+            snapshot.current_hash)
+
+        happy = snapshot.branches['happybranch']
+        self.assertEqual(self.repo.run(self.gc.hash_one, 'happybranch'),
+                         happy.hash)
+        self.assertEqual(('main', 'refs/heads/main'),
+                         (happy.upstream, happy.upstream_ref))
+        self.assertEqual((1, None, False),
+                         (happy.ahead, happy.behind, happy.gone))
+        self.assertEqual('main', snapshot.upstream('happybranch'))
+        self.assertEqual('true', snapshot.branch_config('happybranch',
+                                                        'dormant'))
+        self.assertEqual('x', snapshot.branch_config('main', 'dormant', 'x'))
+
+        self.assertTrue(snapshot.branches['parent_gone'].gone)
+        self.assertIsNone(snapshot.upstream('parent_gone'))
+        self.assertIsNone(snapshot.upstream('main'))
+
+        self.repo.git('checkout', '--detach', 'main')
+        snapshot = self.repo.run(self.gc.get_branches_snapshot)
+        self.assertIsNone(snapshot.tags)
+        self.assertEqual('HEAD', snapshot.current_branch)
+        self.assertEqual(self.repo.run(self.gc.hash_one, 'main', short=True),
+                         snapshot.current_hash)
+
+    def testGetBranchesSnapshotOldGit(self):
+        self.repo.git('commit', '--allow-empty', '-am', 'foooooo')
+        self.repo.git('checkout', '-t', '-b', 'oldgit', 'main')
+        self.repo.git('commit', '--allow-empty', '-am', 'foooooo')
+
+        with mock.patch.object(self.gc, 'get_git_version', return_value=(2, 2)):
+            snapshot = self.repo.run(self.gc.get_branches_snapshot)
+
+        old = snapshot.branches['oldgit']
+        self.assertEqual('main', old.upstream)
+        self.assertEqual((None, None, False), (old.ahead, old.behind, old.gone))
+
 
 class GitMutableStructuredTest(git_test_utils.GitRepoReadWriteTestBase,
                                GitCommonTestBase):
@@ -856,6 +913,90 @@ class GitMutableStructuredTest(git_test_utils.GitRepoReadWriteTestBase,
     CAT DOG
     """)
 
+    def testRebaseInMemory(self):
+        self.repo.git('checkout', 'branch_L')
+        head = self.repo.git('rev-parse', 'HEAD').stdout
+
+        rslt = self.repo.run(self.gc.rebase_in_memory, 'branch_G', 'branch_K~4',
+                             'branch_K')
+        self.assertTrue(rslt.success)
+
+        self.assertSchema("""
+    A B C D E F G H I J K
+      B H I J L
+
+    X Y Z
+
+    CAT DOG
+    """)
+        self.assertEqual(head, self.repo.git('rev-parse', 'HEAD').stdout)
+        self.assertEqual(self.repo.git('status', '--porcelain').stdout, '')
+
+        # Checked out branches are not rebased.
+        rslt = self.repo.run(self.gc.rebase_in_memory, 'branch_G', 'branch_L~4',
+                             'branch_L')
+        self.assertFalse(rslt.success)
+
+        # Conflicts leave the branch alone.
+        self.repo.git('checkout', 'branch_G')
+        rslt = self.repo.run(self.gc.rebase_in_memory, 'branch_K', 'branch_L~1',
+                             'branch_L')
+        self.assertFalse(rslt.success)
+        self.assertFalse(self.repo.run(self.gc.in_rebase))
+        self.assertEqual(head, self.repo.git('rev-parse', 'branch_L').stdout)
+
+        # Commits which are already in the parent are dropped.
+        self.repo.git('checkout', '-b', 'picked', 'branch_K~1')
+        self.repo.git('cherry-pick', 'branch_K')
+        with self.repo.open('picked', 'w') as f:
+            f.write('picked')
+        self.repo.git('add', 'picked')
+        self.repo.git_commit('picked')
+        self.repo.git('checkout', 'branch_G')
+        rslt = self.repo.run(self.gc.rebase_in_memory, 'branch_K', 'branch_K~1',
+                             'picked')
+        self.assertTrue(rslt.success)
+        self.assertEqual(
+            self.repo.git('rev-parse', 'branch_K').stdout,
+            self.repo.git('rev-parse', 'picked~1').stdout)
+        self.assertEqual(
+            self.repo.git('show', 'picked:picked').stdout, 'picked')
+
+    def testRebaseInMemoryRewrite(self):
+        self.repo.git('checkout', 'branch_G')
+        self.repo.git('config', 'notes.rewriteRef', 'refs/notes/commits')
+        self.repo.git('notes', 'add', '-m', 'note', 'branch_K')
+        old = self.repo.git('rev-parse', 'branch_K').stdout.strip()
+        hook = os.path.join(self.repo.repo_path, '.git', 'hooks',
+                            'post-rewrite')
+        os.makedirs(os.path.dirname(hook), exist_ok=True)
+        with open(hook, 'w') as f:
+            f.write('#!/bin/sh\necho "$1" > rewritten\ncat >> rewritten\n')
+        os.chmod(hook, 0o755)
+
+        rslt = self.repo.run(self.gc.rebase_in_memory, 'branch_G', 'branch_K~4',
+                             'branch_K')
+        self.assertTrue(rslt.success)
+        new = self.repo.git('rev-parse', 'branch_K').stdout.strip()
+        self.assertEqual('note\n',
+                         self.repo.git('notes', 'show', 'branch_K').stdout)
+        with self.repo.open('rewritten', 'r') as f:
+            rewritten = f.read().splitlines()
+        self.assertEqual('rebase', rewritten[0])
+        self.assertEqual('%s %s' % (old, new), rewritten[-1])
+        self.assertEqual(5, len(rewritten))
+
+    def testRebaseInMemorySigned(self):
+        self.repo.git('checkout', 'branch_G')
+        self.repo.git('config', 'commit.gpgsign', 'true')
+        head = self.repo.git('rev-parse', 'branch_K').stdout
+
+        rslt = self.repo.run(self.gc.rebase_in_memory, 'branch_G', 'branch_K~4',
+                             'branch_K')
+        self.assertFalse(rslt.success)
+        self.assertEqual('commit.gpgsign is set', rslt.stderr)
+        self.assertEqual(head, self.repo.git('rev-parse', 'branch_K').stdout)
+
     def testStatus(self):
         def inner():
             dictified_status = lambda: {
@@ -7,6 +7,7 @@
 import binascii
 import os
 import sys
+from unittest import mock
 
 DEPOT_TOOLS_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, DEPOT_TOOLS_ROOT)
@@ -78,6 +79,119 @@ class Basic(git_test_utils.GitRepoReadWriteTestBase):
             self.repo.run(self.gn.get_num, binascii.unhexlify(self.repo['A'])))
 
 
+class Index(git_test_utils.GitRepoReadWriteTestBase):
+    REPO_SCHEMA = Basic.REPO_SCHEMA
+
+    @classmethod
+    def setUpClass(cls):
+        super(Index, cls).setUpClass()
+        import git_common
+        import git_number
+        cls.git = git_common
+        cls.gn = git_number
+
+    def _index(self):
+        index = self.repo.run(self.gn.NumberIndex)
+        self.addCleanup(index.close)
+        return index
+
+    def _git_number(self, index, refs):
+        refs = [binascii.unhexlify(ref) for ref in refs]
+        with mock.patch('git_common.run_stream',
+                        side_effect=self.git.run_stream) as run_stream:
+            self.repo.run(index.update, refs)
+        self.walks = [call[0] for call in run_stream.call_args_list]
+        return [index.get_num(ref) for ref in refs]
+
+    def testBasic(self):
+        index = self._index()
+        self.assertEqual([0], self._git_number(index, [self.repo['A']]))
+        self.assertEqual([2], self._git_number(index, [self.repo['F']]))
+        self.assertEqual([0], self._git_number(index, [self.repo['X']]))
+        self.assertEqual([4, 3],
+                         self._git_number(index,
+                                          [self.repo['E'], self.repo['D']]))
+
+    def testOnDisk(self):
+        self.assertEqual([3], self._git_number(self._index(), [self.repo['D']]))
+
+        index = self._index()
+        self.assertEqual({}, index.new)
+        self.assertEqual([binascii.unhexlify(self.repo['D'])], index.tips)
+        for commit, num in (('A', 0), ('C', 2), ('D', 3), ('E', None)):
+            self.assertEqual(
+                num, index.get_num(binascii.unhexlify(self.repo[commit])))
+
+        # Only the commits that are not ancestors of the tips are walked.
+        self.assertEqual([4], self._git_number(index, [self.repo['E']]))
+        self.assertIn('^' + self.repo['D'], self.walks[0])
+        index = self._index()
+        for commit, num in (('A', 0), ('B', 1), ('C', 2), ('D', 3), ('E', 4),
+                            ('F', None)):
+            self.assertEqual(
+                num, index.get_num(binascii.unhexlify(self.repo[commit])))
+
+        self.repo.run(self.gn.clear_caches, True)
+        self.assertIsNone(self._index().get_num(
+            binascii.unhexlify(self.repo['A'])))
+
+    def testNoDuplicates(self):
+        self.assertEqual([3], self._git_number(self._index(), [self.repo['D']]))
+
+        # Without the tips, the walk goes through commits that are already in
+        # the index.
+        index = self._index()
+        index.tips = []
+        self.assertEqual([4, 2],
+                         self._git_number(index,
+                                          [self.repo['E'], self.repo['F']]))
+        # A to F are each in the index once.
+        index = self._index()
+        self.assertEqual(6, index._count)
+
+    def testCommitGraph(self):
+        self.repo.git('commit-graph', 'write', '--reachable')
+        index = self._index()
+        self.assertEqual([4], self._git_number(index, [self.repo['E']]))
+        self.assertEqual([], self.walks)
+
+        # The walk stops at the commits in the commit-graph.
+        tree = self.repo.git('rev-parse', self.repo['E'] + '^{tree}').stdout
+        commit = self.repo.git('commit-tree', '-p', self.repo['E'], '-m', 'G',
+                               tree.strip()).stdout.strip()
+        self.repo.run(index.update, [binascii.unhexlify(commit)], save=False)
+        self.assertEqual({binascii.unhexlify(commit): 5}, index.new)
+
+    def testCommitGraphRemoved(self):
+        self.repo.git('commit-graph', 'write', '--reachable')
+        tree = self.repo.git('rev-parse', self.repo['E'] + '^{tree}').stdout
+        commit = self.repo.git('commit-tree', '-p', self.repo['E'], '-m', 'G',
+                               tree.strip()).stdout.strip()
+        self.assertEqual([5], self._git_number(self._index(), [commit]))
+
+        # E was numbered from the commit-graph and is not in the index, but it
+        # is an ancestor of its tip.
+        self.repo.git('commit-graph', 'write', '--reachable')
+        os.remove(
+            os.path.join(self.repo.repo_path, '.git', 'objects', 'info',
+                         'commit-graph'))
+        index = self._index()
+        self.assertIsNone(index.get_num(binascii.unhexlify(self.repo['E'])))
+        self.assertEqual([4, 2],
+                         self._git_number(index,
+                                          [self.repo['E'], self.repo['F']]))
+
+    def testCommitGraphDisabled(self):
+        self.repo.git('commit-graph', 'write', '--reachable')
+        self.repo.git('config', 'core.commitGraph', 'false')
+        self.addCleanup(self.git.scm.GIT.drop_config_cache)
+        self.git.scm.GIT.drop_config_cache()
+        index = self._index()
+        self.assertIsNone(index.get_num(binascii.unhexlify(self.repo['E'])))
+        self.assertEqual([4], self._git_number(index, [self.repo['E']]))
+        self.assertEqual(1, len(self.walks))
+
+
 if __name__ == '__main__':
     sys.exit(
         coverage_utils.covered_main(
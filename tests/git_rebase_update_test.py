@@ -6,6 +6,7 @@
 
 import os
 import sys
+from unittest import mock
 
 DEPOT_TOOLS_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, DEPOT_TOOLS_ROOT)
@@ -242,6 +243,25 @@ class GitRebaseUpdateTest(git_test_utils.GitRepoReadWriteTestBase):
         _, branch_tree = self.repo.run(self.gc.get_branch_tree)
         self.assertEqual(branch_tree['sub_K'], 'foobar')
 
+    def testRebaseUpdateInMemory(self):
+        self.repo.git('checkout', 'branch_K')
+        with self.repo.open('bob', 'wb') as f:
+            f.write(b'testing auto-freeze/thaw')
+
+        with mock.patch.object(self.gc, 'rebase') as rebase:
+            self.repo.capture_stdio(self.reup.main, ['--in-memory'])
+        rebase.assert_not_called()
+
+        self.assertSchema("""
+    A B C D E F G M N O H I J K
+                              K L
+    """)
+        self.assertEqual(
+            self.repo.git('rev-parse', '--abbrev-ref', 'HEAD').stdout,
+            'branch_K\n')
+        self.assertEqual(
+            self.repo.git('status', '--porcelain').stdout, '?? bob\n')
+
     def testRebaseConflicts(self):
         # Pretend that branch_L landed
         self.origin.git('checkout', 'main')
@@ -324,6 +344,30 @@ class GitRebaseUpdateTest(git_test_utils.GitRepoReadWriteTestBase):
         self.assertIn('could not be cleanly rebased:', output)
         self.assertIn('  branch_K', output)
 
+    def testRebaseConflictsKeepGoingInMemory(self):
+        # Add a commit to branch_K so that things fail
+        self.repo.git('checkout', 'branch_K')
+        with self.repo.open('M', 'w') as f:
+            f.write('NOPE')
+        self.repo.git('add', 'M')
+        self.repo.git_commit('K NOPE')
+
+        self.repo.git('checkout', 'branch_L')
+        with self.repo.open('bob', 'wb') as f:
+            f.write(b'testing auto-freeze/thaw')
+
+        output, _ = self.repo.capture_stdio(self.reup.main,
+                                            ['-k', '--in-memory'])
+        self.assertIn('could not be cleanly rebased:', output)
+        self.assertIn('  branch_K', output)
+
+        # branch_L is checked out and thawed again.
+        self.assertEqual(
+            self.repo.git('rev-parse', '--abbrev-ref', 'HEAD').stdout,
+            'branch_L\n')
+        self.assertEqual(
+            self.repo.git('status', '--porcelain').stdout, '?? bob\n')
+
     def testTrackTag(self):
         self.origin.git('tag', 'lkgr', self.origin['M'])
         self.repo.git('tag', 'lkgr', self.repo['D'])
@@ -760,6 +760,30 @@ class MetricsUtilsTest(unittest.TestCase):
             'https://review.example.com/?foo=bar&baz=1', '', 0, 0)
         self.assertNotIn('arguments', http_metrics)
 
+    def test_extracts_throttling(self):
+        """Test that we extract throttling metrics for known hosts only."""
+        throttling_metrics = metrics_utils.extract_http_throttling_metrics(
+            'chromium-review.googlesource.com', 429, 5, 2.0)
+        self.assertEqual(
+            {
+                'host': 'chromium-review.googlesource.com',
+                'status': 429,
+                'concurrency_limit': 5,
+                'retry_after': 2.0,
+            }, throttling_metrics)
+
+        throttling_metrics = metrics_utils.extract_http_throttling_metrics(
+            'foo-review.googlesource.com', 503, 1, None)
+        self.assertEqual({
+            'status': 503,
+            'concurrency_limit': 1
+        }, throttling_metrics)
+
+    def test_change_notices(self):
+        """Test that every metrics version tells users what it adds."""
+        for version in range(1, metrics_utils.CURRENT_VERSION + 1):
+            self.assertTrue(metrics_utils.get_change_notice(version))
+
     def test_validates_method(self):
         """Test that we validate the HTTP method used."""
         # Regular case
@@ -8,6 +8,7 @@ import sys
 import unittest
 
 from datetime import datetime
+from unittest import mock
 
 DEPOT_TOOLS_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, DEPOT_TOOLS_ROOT)
@@ -61,6 +62,39 @@ class MyActivityTest(unittest.TestCase):
         self.assertEqual((datetime(2020, 9, 14), datetime(2020, 9, 21)),
                          my_activity.get_week_of(datetime(2020, 9, 14)))
 
+    @mock.patch('gerrit_util.GenerateAllChanges')
+    def test_gerrit_changes_over_rest(self, mockGenerateAllChanges):
+        mockGenerateAllChanges.return_value = iter([{'_number': 1}])
+        activity = my_activity.MyActivity(mock.Mock(skip_servers=''))
+        activity.process_gerrit_issue = lambda _instance, issue: issue
+        issues = activity.gerrit_changes_over_rest(
+            {'url': 'host'}, ['owner:me', 'status:merged'])
+        self.assertEqual([{'_number': 1}], issues)
+        mockGenerateAllChanges.assert_called_once_with(
+            'host', [['owner', 'me'], ['status', 'merged']],
+            o_params=mock.ANY,
+            stream=True,
+            prefetch=True,
+            keyset=True)
+
+    @mock.patch('gerrit_util.GetThrottleState')
+    def test_print_throttling(self, mockGetThrottleState):
+        mockGetThrottleState.return_value = {
+            'host': {
+                'limit': 2,
+                'in_flight': 0,
+                'throttled': 3,
+                'retry_after': 0.0,
+            },
+        }
+        activity = my_activity.MyActivity(mock.Mock(skip_servers=''))
+        with self.assertLogs(level='INFO') as logs:
+            activity.print_throttling()
+        self.assertEqual([
+            'INFO:root:Gerrit host host was overloaded 3 times, ending at 2 '
+            'concurrent requests.'
+        ], logs.output)
+
     def _get_issue_with_description(self, description):
         return {
             'current_revision': 'rev',
@@ -5,13 +5,16 @@
 
 import os
 import sys
+import tempfile
 import unittest
 from unittest import mock
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import gclient_utils
 import gerrit_util
 import owners_client
+import subprocess2
 
 alice = 'alice@example.com'
 bob = 'bob@example.com'
@@ -95,6 +98,277 @@ class GerritClientTest(unittest.TestCase):
         self.assertEqual(['bar@example.com'], self.client.ListOwners('bar.txt'))
 
 
+class GerritClientBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        mock.patch('gerrit_util.GetOwnersForFile',
+                   side_effect=self.GetOwnersForFile).start()
+        mock.patch('gerrit_util.GetCodeOwnerConfig').start()
+        self.addCleanup(mock.patch.stopall)
+
+    @staticmethod
+    def GetOwnersForFile(host, project, branch, path, **kwargs):
+        return {'code_owners': [{'account': {'email': path + '@example.com'}}]}
+
+    def LookedUp(self):
+        return sorted(call.args[3]
+                      for call in gerrit_util.GetOwnersForFile.call_args_list)
+
+    def testOnePathPerDirectory(self):
+        configs = {
+            '': {},
+            'a': {
+                'code_owner_sets': [{
+                    'code_owners': [alice]
+                }]
+            },
+            'b': {
+                'code_owner_sets': [{
+                    'path_expressions': ['*.mojom'],
+                    'code_owners': [bob]
+                }]
+            },
+        }
+        gerrit_util.GetCodeOwnerConfig.side_effect = (
+            lambda host, project, branch, path: configs[path])
+        client = owners_client.GerritClient('host', 'project', 'branch')
+
+        self.assertEqual(
+            {
+                'a/1': ['a/1@example.com'],
+                'a/2': ['a/1@example.com'],
+                'b/1': ['b/1@example.com'],
+                'b/2': ['b/2@example.com'],
+                'c/1': ['c/1@example.com'],
+            }, client.BatchListOwners(['a/1', 'a/2', 'b/1', 'b/2', 'c/1']))
+        self.assertEqual(['a/1', 'b/1', 'b/2', 'c/1'], self.LookedUp())
+
+    def testConfigUnavailable(self):
+        gerrit_util.GetCodeOwnerConfig.side_effect = gerrit_util.GerritError(
+            404, 'Not found')
+        client = owners_client.GerritClient('host', 'project', 'branch')
+
+        client.BatchListOwners(['a/1', 'a/2', 'b/1'])
+        self.assertEqual(['a/1', 'a/2', 'b/1'], self.LookedUp())
+
+        # It isn't tried again.
+        client.BatchListOwners(['c/1', 'c/2'])
+        gerrit_util.GetCodeOwnerConfig.assert_called_once()
+
+    def testHasSameOwners(self):
+        client = owners_client.GerritClient('host', 'project', 'branch')
+        configs = {'': {}, 'a': {}}
+        gerrit_util.GetCodeOwnerConfig.side_effect = (
+            lambda host, project, branch, path: configs[path])
+
+        configs['a/b'] = {'imports': [{'import_mode': 'ALL'}]}
+        self.assertFalse(client._HasSameOwners('a/b'))
+
+        client._configs.clear()
+        configs['a/b'] = {
+            'imports': [{
+                'import_mode': 'GLOBAL_CODE_OWNER_SETS_ONLY'
+            }]
+        }
+        configs['a'] = {'code_owner_sets': [{'path_expressions': ['*.h']}]}
+        self.assertTrue(client._HasSameOwners('a/b'))
+
+        client._configs.clear()
+        configs['a'] = {'code_owner_sets': [{'path_expressions': ['**.h']}]}
+        self.assertFalse(client._HasSameOwners('a/b'))
+
+        client._configs.clear()
+        configs['a/b'] = {'ignore_parent_code_owners': True}
+        self.assertTrue(client._HasSameOwners('a/b'))
+
+
+class OwnersCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(gclient_utils.rmtree, self.root)
+        self.Git('init', '-q')
+        self.Commit('OWNERS', alice)
+        mock.patch('gerrit_util.GetOwnersForFile',
+                   return_value={
+                       'code_owners': [{
+                           'account': {
+                               'email': alice
+                           }
+                       }]
+                   }).start()
+        mock.patch('gerrit_util.GetCodeOwnerConfig',
+                   side_effect=gerrit_util.GerritError(404, '')).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def Git(self, *args):
+        subprocess2.check_output([
+            'git', '-c', 'user.name=test', '-c', 'user.email=test@example.com'
+        ] + list(args),
+                                 cwd=self.root)
+
+    def Commit(self, path, content):
+        gclient_utils.FileWrite(os.path.join(self.root, path), content)
+        self.Git('add', path)
+        self.Git('commit', '-q', '-m', path)
+
+    def ListOwners(self, path):
+        client = owners_client.GerritClient('host',
+                                            'project',
+                                            'branch',
+                                            root=self.root,
+                                            ref='HEAD')
+        return client.BatchListOwners([path])[path]
+
+    def testCache(self):
+        self.assertEqual([alice], self.ListOwners('foo'))
+        self.assertEqual(1, gerrit_util.GetOwnersForFile.call_count)
+
+        # Cached on disk.
+        self.assertEqual([alice], self.ListOwners('foo'))
+        self.assertEqual(1, gerrit_util.GetOwnersForFile.call_count)
+
+        # Still cached after changes to other files.
+        self.Commit('foo', 'foo')
+        self.assertEqual([alice], self.ListOwners('foo'))
+        self.assertEqual(1, gerrit_util.GetOwnersForFile.call_count)
+
+        # Invalidated by changes to OWNERS files.
+        self.Commit('OWNERS', bob)
+        self.assertEqual([alice], self.ListOwners('foo'))
+        self.assertEqual(2, gerrit_util.GetOwnersForFile.call_count)
+
+    @mock.patch('owners_client.time_time')
+    def testCacheExpires(self, mockTime):
+        mockTime.return_value = 1000
+        self.assertEqual([alice], self.ListOwners('foo'))
+        self.assertEqual(1, gerrit_util.GetOwnersForFile.call_count)
+
+        # Looking up more owners doesn't keep the old ones longer.
+        mockTime.return_value += owners_client._OwnersCache.MAX_AGE
+        self.assertEqual([alice], self.ListOwners('bar'))
+        self.assertEqual(2, gerrit_util.GetOwnersForFile.call_count)
+
+        # Owners can change on Gerrit without a change to the OWNERS files.
+        mockTime.return_value += 1
+        self.assertEqual([alice], self.ListOwners('foo'))
+        self.assertEqual(3, gerrit_util.GetOwnersForFile.call_count)
+
+
+class LocalOwnersClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(gclient_utils.rmtree, self.root)
+        self.files = {
+            'OWNERS':
+            '\n'.join([alice, 'per-file *.md=*']),
+            'bar/OWNERS':
+            '\n'.join([
+                '# Comment',
+                bob,
+                'per-file *.cc,*.h=' + chris,
+                'per-file BUILD.gn=set noparent',
+                'per-file BUILD.gn=' + dave,
+                'per-file DEPS=file://build/OWNERS',
+            ]),
+            'bar/baz/OWNERS':
+            'include ../../build/OWNERS',
+            'build/OWNERS':
+            '\n'.join([
+                'set noparent', emily, 'per-file *.py=' + chris,
+                'include //build/OWNERS'
+            ]),
+            'qux/OWNERS':
+            'file:/build/OWNERS\nfile:other/repo:/OWNERS\n',
+        }
+        for path, content in self.files.items():
+            path = os.path.join(self.root, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            gclient_utils.FileWrite(path, content)
+
+    def assertOwners(self, client):
+        self.assertEqual(
+            {
+                'foo.txt': [alice],
+                'README.md': [alice, '*'],
+                'bar/foo.txt': [bob, alice],
+                'bar/foo.cc': [chris, bob, alice],
+                'bar/BUILD.gn': [dave],
+                'bar/DEPS': [emily, bob, alice],
+                'bar/sub/foo.cc': [bob, alice],
+                'bar/baz/foo.txt': [emily],
+                'bar/baz/foo.py': [chris, emily],
+                'qux/foo.txt': [emily, alice],
+            },
+            client.BatchListOwners([
+                'foo.txt', 'README.md', 'bar/foo.txt', 'bar/foo.cc',
+                'bar/BUILD.gn', 'bar/DEPS', 'bar/sub/foo.cc', 'bar/baz/foo.txt',
+                'bar/baz/foo.py', 'qux/foo.txt'
+            ]))
+
+    def testListOwners(self):
+        self.assertOwners(owners_client.LocalOwnersClient(self.root))
+
+    def testListOwnersFromRef(self):
+        git = ['git', '-c', 'user.name=test', '-c', 'user.email=t@example.com']
+        subprocess2.check_output(git + ['init', '-q'], cwd=self.root)
+        subprocess2.check_output(git + ['add', '-A'], cwd=self.root)
+        subprocess2.check_output(git + ['commit', '-q', '-m', 'init'],
+                                 cwd=self.root)
+        # Changes to the working tree don't matter.
+        gclient_utils.FileWrite(os.path.join(self.root, 'bar', 'OWNERS'), dave)
+
+        self.assertOwners(owners_client.LocalOwnersClient(self.root,
+                                                          ref='HEAD'))
+
+    def testListOwnersFromRefImportsOtherFiles(self):
+        gclient_utils.FileWrite(os.path.join(self.root, 'qux', 'OWNERS'),
+                                'file://build/people\n')
+        gclient_utils.FileWrite(os.path.join(self.root, 'build', 'people'),
+                                dave)
+        git = ['git', '-c', 'user.name=test', '-c', 'user.email=t@example.com']
+        subprocess2.check_output(git + ['init', '-q'], cwd=self.root)
+        subprocess2.check_output(git + ['add', '-A'], cwd=self.root)
+        subprocess2.check_output(git + ['commit', '-q', '-m', 'init'],
+                                 cwd=self.root)
+
+        client = owners_client.LocalOwnersClient(self.root, ref='HEAD')
+        self.assertNotIn('build/people', client._tree)
+        self.assertEqual([dave, alice], client.ListOwners('qux/foo.txt'))
+
+    def testBadLines(self):
+        gclient_utils.FileWrite(
+            os.path.join(self.root, 'qux', 'OWNERS'),
+            '\n'.join([alice, 'not an owner', 'per-file *.cc=' + bob + ',bob']))
+        client = owners_client.LocalOwnersClient(self.root)
+        self.assertEqual(['not an owner', 'per-file *.cc=' + bob + ',bob'],
+                         client.GetBadLines(os.path.join('qux', 'OWNERS')))
+        self.assertEqual([bob, alice], client.ListOwners('qux/foo.cc'))
+        self.assertEqual([], client.GetBadLines('bar/OWNERS'))
+
+    def testNativePaths(self):
+        client = owners_client.LocalOwnersClient(self.root)
+        self.assertEqual([chris, bob, alice],
+                         client.ListOwners(os.path.join('bar', 'foo.cc')))
+
+    def testApprovalStatus(self):
+        client = owners_client.LocalOwnersClient(self.root)
+        self.assertEqual(
+            {
+                'bar/foo.txt': owners_client.OwnersClient.APPROVED,
+                'bar/baz/foo.txt': owners_client.OwnersClient.PENDING,
+                'bar/BUILD.gn':
+                owners_client.OwnersClient.INSUFFICIENT_REVIEWERS,
+            },
+            client.GetFilesApprovalStatus(
+                ['bar/foo.txt', 'bar/baz/foo.txt', 'bar/BUILD.gn'], [alice],
+                [emily]))
+        self.assertEqual([alice],
+                         client.SuggestOwners(['bar/foo.txt', 'foo.txt'],
+                                              exclude=[bob]))
+
+
 class TestClient(owners_client.OwnersClient):
     def __init__(self, owners_by_path):
         super(TestClient, self).__init__()
@@ -174,9 +448,17 @@ class OwnersClientTest(unittest.TestCase):
             [alice, chris, bob, dave])
 
     def assertSuggestsOwners(self, owners_by_path, exclude=None):
+        self.assertSuggestsCoveringOwners(owners_by_path, exclude)
+        self.assertSuggestsCoveringOwners(owners_by_path, exclude, minimal=True)
+
+    def assertSuggestsCoveringOwners(self,
+                                     owners_by_path,
+                                     exclude=None,
+                                     minimal=False):
         self.client.owners_by_path = owners_by_path
         suggested = self.client.SuggestOwners(owners_by_path.keys(),
-                                              exclude=exclude)
+                                              exclude=exclude,
+                                              minimal=minimal)
 
         # Owners should appear only once
         self.assertEqual(len(suggested), len(set(suggested)))
@@ -228,6 +510,58 @@ class OwnersClientTest(unittest.TestCase):
         # owners.
         self.assertSuggestsOwners({str(x): [str(x)] for x in range(100)})
 
+    def testSuggestMinimalOwners(self):
+        # Picking the owner of the most paths first takes three owners.
+        self.client.owners_by_path = {
+            'a': [alice, bob],
+            'b': [alice, bob, dave],
+            'c': [alice, chris],
+            'd': [alice, chris, dave],
+            'e': [bob],
+            'f': [chris],
+        }
+        paths = list(self.client.owners_by_path)
+        self.assertEqual([bob, chris],
+                         self.client.SuggestOwners(paths, minimal=True))
+        self.assertEqual([alice, chris],
+                         self.client.SuggestOwners(paths,
+                                                   exclude=[bob],
+                                                   minimal=True))
+
+    @mock.patch('owners_client.time_time')
+    def testSuggestMinimalOwnersTimeLimit(self, mockTime):
+        mockTime.side_effect = [0, owners_client.MINIMAL_OWNERS_TIME_LIMIT + 1]
+        self.client.owners_by_path = {
+            'a': [alice, bob],
+            'b': [alice, bob, dave],
+            'c': [alice, chris],
+            'd': [alice, chris, dave],
+            'e': [bob],
+            'f': [chris],
+        }
+        paths = list(self.client.owners_by_path)
+        # Only the greedy set is tried.
+        self.assertEqual([alice, bob, chris],
+                         self.client.SuggestOwners(paths, minimal=True))
+
+    @mock.patch('owners_client.time_time')
+    def testSuggestMinimalOwnersTimePerSet(self, mockTime):
+        # The paths have 6 distinct sets of owners.
+        time_limit = 6 * owners_client.MINIMAL_OWNERS_TIME_PER_SET
+        self.assertLess(time_limit, owners_client.MINIMAL_OWNERS_TIME_LIMIT)
+        mockTime.side_effect = [0, time_limit + 0.001]
+        self.client.owners_by_path = {
+            'a': [alice, bob],
+            'b': [alice, bob, dave],
+            'c': [alice, chris],
+            'd': [alice, chris, dave],
+            'e': [bob],
+            'f': [chris],
+        }
+        paths = list(self.client.owners_by_path)
+        self.assertEqual([alice, bob, chris],
+                         self.client.SuggestOwners(paths, minimal=True))
+
     def testBatchListOwners(self):
         self.client.owners_by_path = {
             'bar/everyone/foo.txt': [alice, bob],
@@ -298,6 +298,32 @@ class InclusiveLanguageCheckTest(unittest.TestCase):
             input_api, MockOutputApi())
         self.assertEqual([], errors)
 
+    def testAnchoredTerms(self):
+        input_api = MockInputApi()
+        input_api.change.RepositoryRoot = lambda: ''
+        input_api.presubmit_local_path = ''
+
+        input_api.files = [
+            MockFile(
+                os.path.normpath(
+                    'infra/inclusive_language_presubmit_exempt_dirs.txt'), []),
+            MockFile(os.path.normpath('some/file.cc'),
+                     ['int a;', 'foo bar;', 'int b;']),
+            MockFile(os.path.normpath('some/other/file.cc'),
+                     ['int a;', 'bar foo// comment', 'int b;']),
+        ]
+        terms = (
+            (r'/^foo', ('Starts with foo.', ), True),
+            (r'/foo$', ('Ends with foo.', ), True),
+        )
+        errors = presubmit_canned_checks.CheckInclusiveLanguage(
+            input_api, MockOutputApi(), non_inclusive_terms=terms)
+        self.assertEqual(1, len(errors))
+        self.assertIn(
+            os.path.normpath('some/file.cc') + ':2', errors[0].message)
+        self.assertIn(
+            os.path.normpath('some/other/file.cc') + ':2', errors[0].message)
+
 
 class DescriptionChecksTest(unittest.TestCase):
     def testCheckDescriptionUsesColonInsteadOfEquals(self):
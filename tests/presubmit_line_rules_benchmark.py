@@ -0,0 +1,133 @@
+#!/usr/bin/env vpython3
+# Copyright (c) 2026 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Benchmarks the per-line canned checks on a synthetic change.
+
+Runs each per-line check on its own, then all of their rules in the single
+pass of _RunLineRules(), checks that both report the same results, and prints
+how long each took. For example:
+
+    tests/presubmit_line_rules_benchmark.py --files 100 --lines 500
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from testing_support.presubmit_canned_checks_test_mocks import (MockFile,
+                                                                MockInputApi,
+                                                                MockOutputApi)
+
+import presubmit_canned_checks
+
+EXTENSIONS = ('cc', 'h', 'py', 'java', 'gn', 'md')
+
+
+def MakeInputApi(num_files, num_lines, dirty_ratio):
+    """Returns a MockInputApi for a change of num_files new files.
+
+    One in every 1 / dirty_ratio files has a violation of each rule.
+    """
+    input_api = MockInputApi()
+    input_api.change.RepositoryRoot = lambda: ''
+    input_api.presubmit_local_path = ''
+    input_api.files.append(
+        MockFile('infra/inclusive_language_presubmit_exempt_dirs.txt',
+                 ['third_party 1 1']))
+    dirty_every = max(1, int(round(1 / dirty_ratio))) if dirty_ratio else 0
+    for i in range(num_files):
+        lines = [
+            '  int value_%d = compute(%d, "some text");' % (j, j)
+            for j in range(num_lines)
+        ]
+        if dirty_every and i % dirty_every == 0:
+            lines[1] = '\tint tab;'
+            lines[2] = 'int stray;  '
+            lines[3] = '// ' + 'x' * 120
+            lines[4] = '// TODO: no owner'
+            lines[5] = '// go/link.corp.google.com'
+            lines[6] = 'int blacklist;'  # nocheck
+        path = 'dir%d/file%d.%s' % (i % 10, i, EXTENSIONS[i % len(EXTENSIONS)])
+        input_api.files.append(MockFile(path, lines))
+    return input_api
+
+
+def Checks(input_api, output_api, maxlen):
+    """Returns the individual checks, and the rules they run."""
+    return [
+        (lambda: presubmit_canned_checks.CheckLongLines(input_api, output_api,
+                                                        maxlen),
+         presubmit_canned_checks._LongLinesRule(input_api, maxlen)),
+        (lambda: presubmit_canned_checks.CheckChangeHasNoTabs(
+            input_api, output_api),
+         presubmit_canned_checks._ChangeHasNoTabsRule(input_api)),
+        (lambda: presubmit_canned_checks.CheckChangeHasNoStrayWhitespace(
+            input_api, output_api),
+         presubmit_canned_checks._ChangeHasNoStrayWhitespaceRule()),
+        (lambda: presubmit_canned_checks.CheckChangeTodoHasOwner(
+            input_api, output_api),
+         presubmit_canned_checks._ChangeTodoHasOwnerRule(input_api)),
+        (lambda: presubmit_canned_checks.CheckCorpLinksInFiles(
+            input_api, output_api),
+         presubmit_canned_checks._CorpLinksInFilesRule()),
+    ]
+
+
+def Time(fn, repeat):
+    """Returns the result of fn and the best time of repeat runs of it."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def Format(results):
+    return [[(r.type, r.message, r.long_text) for r in check_results]
+            for check_results in results]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--lines', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--maxlen', type=int, default=80)
+    options = parser.parse_args(argv)
+
+    output_api = MockOutputApi()
+    for dirty_ratio in (0, 0.1, 1):
+        input_api = MakeInputApi(options.files, options.lines, dirty_ratio)
+        checks = Checks(input_api, output_api, options.maxlen)
+
+        separate, separate_time = Time(lambda: [check() for check, _ in checks],
+                                       options.repeat)
+        combined, combined_time = Time(
+            lambda: presubmit_canned_checks._RunLineRules(
+                input_api, output_api, [rule for _, rule in checks]),
+            options.repeat)
+        if Format(separate) != Format(combined):
+            print('The results differ!')
+            return 1
+
+        inclusive, inclusive_time = Time(
+            lambda: presubmit_canned_checks.CheckInclusiveLanguage(
+                input_api, output_api), options.repeat)
+        print('%d files x %d lines, %d%% with violations:' %
+              (options.files, options.lines, dirty_ratio * 100))
+        print('  separate checks: %.3fs' % separate_time)
+        print('  single pass:     %.3fs' % combined_time)
+        print('  CheckInclusiveLanguage: %.3fs, %d results' %
+              (inclusive_time, len(inclusive)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,104 @@
+#!/usr/bin/env vpython3
+# Copyright (c) 2026 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Unit tests for presubmit_server.py."""
+
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gclient_utils
+import presubmit_server
+import presubmit_support
+
+
+@unittest.skipIf(sys.platform == 'win32', 'Unix sockets only')
+class PresubmitServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(gclient_utils.rmtree, self.root)
+        self.path = os.path.join(self.root, 'server.sock')
+        self.output = os.path.join(self.root, 'output.json')
+        mock.patch('presubmit_server.SocketPath',
+                   return_value=self.path).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def StartServer(self):
+        """Serves from a forked process, which shares the mocks of the test."""
+        server = presubmit_server.PresubmitServer(self.root)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server.Serve()
+            finally:
+                os._exit(0)
+        self.addCleanup(os.waitpid, pid, 0)
+        for _ in range(100):
+            if os.path.exists(self.path):
+                break
+            time.sleep(0.05)
+
+    def FakeMain(self, args):
+        with open(self.output, 'w') as f:
+            f.write(json.dumps({'args': args, 'cwd': os.getcwd()}))
+        return 3
+
+    def testNoServer(self):
+        self.assertIsNone(presubmit_server.RunPresubmit(self.root,
+                                                        ['--upload']))
+        self.assertFalse(presubmit_server.StopServer(self.root))
+
+    def testRunPresubmit(self):
+        mock.patch('presubmit_support.main', self.FakeMain).start()
+        self.StartServer()
+
+        self.assertEqual(3,
+                         presubmit_server.RunPresubmit(self.root, ['--upload']))
+        with open(self.output) as f:
+            self.assertEqual({
+                'args': ['--upload'],
+                'cwd': os.getcwd()
+            }, json.loads(f.read()))
+
+        self.assertTrue(presubmit_server.StopServer(self.root))
+
+    def testStaleServer(self):
+        mock.patch('presubmit_support.main', self.FakeMain).start()
+        module_times = [{'scm.py': 1}, {'scm.py': 2}]
+        mock.patch('presubmit_server._ModuleTimes',
+                   side_effect=module_times).start()
+        self.StartServer()
+
+        self.assertIsNone(presubmit_server.RunPresubmit(self.root, []))
+        self.assertFalse(os.path.exists(self.output))
+
+    def testWarmScripts(self):
+        path = os.path.join(self.root, 'PRESUBMIT.py')
+        gclient_utils.FileWrite(path, 'X = 1\r\n')
+        mock.patch.dict(presubmit_support._COMPILED_SCRIPTS, clear=True).start()
+
+        presubmit_server.PresubmitServer._WarmScripts(
+            [path, os.path.join(self.root, 'missing')])
+
+        self.assertEqual([path], list(presubmit_support._COMPILED_SCRIPTS))
+        code = presubmit_support._COMPILED_SCRIPTS[path][1]
+        self.assertIs(code, presubmit_support._CompileScript('X = 1\n', path))
+
+    @mock.patch('sys.stdout')
+    @mock.patch('presubmit_server.socket', mock.Mock(spec=[]))
+    def testUnsupportedPlatform(self, _):
+        # Without socket.send_fds, as on Windows.
+        self.assertEqual(1,
+                         presubmit_server.main(['start', '--root', self.root]))
+
+
+if __name__ == '__main__':
+    unittest.main()
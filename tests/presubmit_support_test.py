@@ -82,8 +82,8 @@ class ProvidedDiffChangeTest(fake_repos.FakeReposTestBase):
 
     def _test(self, name, old, new):
         affected_file = self._get_affected_file_from_name(self.change, name)
-        self.assertEqual(affected_file.OldContents(), old)
-        self.assertEqual(affected_file.NewContents(), new)
+        self.assertEqual(affected_file.OldContents(), tuple(old))
+        self.assertEqual(affected_file.NewContents(), tuple(new))
 
     def test_old_contents_of_added_file_returns_empty(self):
         self._test('added', [], ['a new file'])
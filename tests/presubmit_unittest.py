@@ -11,7 +11,9 @@ import io
 import itertools
 import logging
 import multiprocessing
+import multiprocessing.pool
 import os
+import pickle
 import random
 import re
 import sys
@@ -194,6 +196,7 @@ index fe3de7b..54ae6e1 100755
         mock.patch('presubmit_support.warn').start()
         mock.patch('random.randint').start()
         mock.patch('scm.GIT.GenerateDiff').start()
+        mock.patch('scm.GIT.GenerateDiffLines').start()
         mock.patch('scm.determine_scm').start()
         mock.patch('subprocess2.Popen').start()
         mock.patch('sys.stderr', StringIO()).start()
@@ -250,6 +253,30 @@ class PresubmitUnittest(PresubmitTestsBase):
             files, self.fake_root_dir)
         self.assertEqual(presubmit_files, known_files)
 
+    def testListRelevantPresubmitFilesWithIndex(self):
+        files = [
+            'blat.cc',
+            os.path.join('foo', 'haspresubmit', 'yodle', 'smart.h'),
+            os.path.join('foo', 'luck.h'),
+        ]
+        index = presubmit._PresubmitIndex(self.fake_root_dir, [
+            'PRESUBMIT.py',
+            'foo/haspresubmit/PRESUBMIT.py',
+            'foo/haspresubmit/PRESUBMIT_deleted.py',
+            'moo/PRESUBMIT.py',
+        ], ['', 'foo', 'foo/haspresubmit', 'foo/haspresubmit/yodle', 'moo'])
+        os.path.isfile.side_effect = (
+            lambda f: f.endswith('.py') and not f.endswith('_deleted.py'))
+
+        presubmit_files = presubmit.ListRelevantPresubmitFiles(
+            files, self.fake_root_dir, index)
+        self.assertEqual(presubmit_files, [
+            os.path.join(self.fake_root_dir, 'PRESUBMIT.py'),
+            os.path.join(self.fake_root_dir, 'foo', 'haspresubmit',
+                         'PRESUBMIT.py'),
+        ])
+        os.listdir.assert_not_called()
+
     def testListUserPresubmitFiles(self):
         files = [
             'blat.cc',
@@ -376,7 +403,8 @@ class PresubmitUnittest(PresubmitTestsBase):
         ]
         os.path.isfile.side_effect = lambda f: f in known_files
 
-        scm.GIT.GenerateDiff.return_value = '\n'.join(unified_diff)
+        scm.GIT.GenerateDiffLines.return_value = iter(
+            '\n'.join(unified_diff).splitlines(True))
 
         change = presubmit.GitChange('mychange',
                                      '\n'.join(description_lines),
@@ -414,11 +442,12 @@ class PresubmitUnittest(PresubmitTestsBase):
         actual_rhs_lines = []
         for f, linenum, line in change.RightHandSideLines():
             actual_rhs_lines.append((f.LocalPath(), linenum, line))
-        scm.GIT.GenerateDiff.assert_called_once_with(self.fake_root_dir,
-                                                     files=[],
-                                                     full_move=True,
-                                                     branch='upstream',
-                                                     branch_head='end_commit')
+        scm.GIT.GenerateDiffLines.assert_called_once_with(
+            self.fake_root_dir,
+            files=[],
+            full_move=True,
+            branch='upstream',
+            branch_head='end_commit')
 
 
         f_blat = os.path.normpath('boo/blat.cc')
@@ -811,6 +840,30 @@ def CheckChangeOnCommit(input_api, output_api):
             self.assertEqual(sys.stdout.getvalue().count('??'), 2)
         self.assertEqual(sys.stdout.getvalue().count(RUNNING_PY_CHECKS_TEXT), 1)
 
+    @mock.patch('presubmit_support._IncrementalState.ForChange')
+    def testDoPresubmitChecksIncrementalStateAfterPrompt(self, ForChange):
+        presubmit_path = os.path.join(self.fake_root_dir, 'PRESUBMIT.py')
+        os.path.isfile.side_effect = lambda f: f == presubmit_path
+        os.listdir.return_value = ['PRESUBMIT.py']
+        gclient_utils.FileRead.return_value = self.presubmit_text
+        ForChange.return_value.ChangedFiles.return_value = None
+        ForChange.return_value.IncrementalChecks.return_value = {}
+        change = self.ExampleChange(extra_lines=['PROMPT_WARNING=yes'])
+
+        for answer, saved in (('n', False), ('y', True)):
+            with mock.patch('sys.stdin', StringIO(answer + '\n')):
+                presubmit.DoPresubmitChecks(change=change,
+                                            committing=False,
+                                            verbose=False,
+                                            default_presubmit=None,
+                                            may_prompt=True,
+                                            gerrit_obj=None,
+                                            json_output=None,
+                                            incremental=True)
+            self.assertEqual(saved, ForChange.return_value.Save.called)
+        ForChange.assert_called_with(change, False,
+                                     [(self.presubmit_text, presubmit_path)])
+
     def testDoPresubmitChecksWithWarningsAndNoPrompt(self):
         presubmit_path = os.path.join(self.fake_root_dir, 'PRESUBMIT.py')
         haspresubmit_path = os.path.join(self.fake_root_dir, 'haspresubmit',
@@ -865,6 +918,101 @@ def CheckChangeOnCommit(input_api, output_api):
         self.assertEqual(sys.stdout.getvalue().count('(y/N)'), 0)
         self.assertEqual(sys.stdout.getvalue().count(RUNNING_PY_CHECKS_TEXT), 1)
 
+    # Threads share sys.stdout, so only run one script at a time.
+    @mock.patch(
+        'multiprocessing.Pool',
+        lambda _, **kwargs: multiprocessing.pool.ThreadPool(1, **kwargs))
+    def testDoPresubmitChecksConcurrentScripts(self):
+        presubmit_path = os.path.join(self.fake_root_dir, 'PRESUBMIT.py')
+        haspresubmit_path = os.path.join(self.fake_root_dir, 'haspresubmit',
+                                         'PRESUBMIT.py')
+        scripts = {
+            presubmit_path: ('def CheckChangeOnUpload(input_api, output_api):\n'
+                             '  print("running root")\n'
+                             '  output_api.more_cc = ["z@example.com"]\n'
+                             '  return [output_api.PresubmitError("root")]\n'),
+            haspresubmit_path:
+            ('def CheckChangeOnUpload(input_api, output_api):\n'
+             '  print("running sub")\n'
+             '  output_api.more_cc = ["a@example.com", "z@example.com"]\n'
+             '  return [output_api.PresubmitError("sub")]\n'),
+        }
+
+        os.path.isfile.side_effect = lambda f: f in scripts
+        os.listdir.return_value = ['PRESUBMIT.py']
+        gclient_utils.FileRead.side_effect = lambda f: scripts[f]
+        random.randint.return_value = 1
+
+        change = self.ExampleChange()
+        self.assertEqual(
+            1,
+            presubmit.DoPresubmitChecks(change=change,
+                                        committing=False,
+                                        verbose=False,
+                                        default_presubmit=None,
+                                        may_prompt=False,
+                                        gerrit_obj=None,
+                                        json_output='temp.json',
+                                        jobs=2))
+        concurrent_stdout = sys.stdout.getvalue()
+        concurrent_json = gclient_utils.FileWrite.call_args[0][1]
+
+        sys.stdout.seek(0)
+        sys.stdout.truncate()
+        presubmit.DoPresubmitChecks(change=change,
+                                    committing=False,
+                                    verbose=False,
+                                    default_presubmit=None,
+                                    may_prompt=False,
+                                    gerrit_obj=None,
+                                    json_output='temp.json')
+
+        # The output, results and CCs are the same as when running serially.
+        self.assertIn('running root\nrunning sub\n', concurrent_stdout)
+        self.assertIn('** Presubmit ERRORS: 2 **\nroot\n\nsub\n\n',
+                      concurrent_stdout)
+        self.assertEqual(re.sub(r'\d+\.\ds', '', sys.stdout.getvalue()),
+                         re.sub(r'\d+\.\ds', '', concurrent_stdout))
+        output = json.loads(concurrent_json)
+        self.assertEqual(['root', 'sub'],
+                         [e['message'] for e in output['errors']])
+        self.assertEqual(['a@example.com', 'z@example.com'], output['more_cc'])
+        self.assertEqual(gclient_utils.FileWrite.call_args[0][1],
+                         concurrent_json)
+
+    def testDoPresubmitChecksProfile(self):
+        presubmit_path = os.path.join(self.fake_root_dir, 'PRESUBMIT.py')
+        script = ('def CheckChangeOnUpload(input_api, output_api):\n'
+                  '  input_api.ReadFile(%r)\n'
+                  '  return []\n' % presubmit_path)
+        os.path.isfile.side_effect = lambda f: f == presubmit_path
+        os.listdir.return_value = ['PRESUBMIT.py']
+        gclient_utils.FileRead.return_value = script
+
+        change = self.ExampleChange()
+        self.assertEqual(
+            0,
+            presubmit.DoPresubmitChecks(change=change,
+                                        committing=False,
+                                        verbose=False,
+                                        default_presubmit=None,
+                                        may_prompt=False,
+                                        gerrit_obj=None,
+                                        json_output=None,
+                                        profile=True,
+                                        profile_output='profile.json'))
+        self.assertIn('** Presubmit profile **', sys.stdout.getvalue())
+        self.assertIn('%d  PRESUBMIT.py:CheckChangeOnUpload\n' % len(script),
+                      sys.stdout.getvalue())
+        gclient_utils.FileWrite.assert_called_once_with('profile.json',
+                                                        mock.ANY)
+        events = json.loads(
+            gclient_utils.FileWrite.call_args[0][1])['traceEvents']
+        self.assertEqual(1, len(events))
+        self.assertEqual('CheckChangeOnUpload', events[0]['name'])
+        self.assertEqual(presubmit_path, events[0]['cat'])
+        self.assertEqual(len(script), events[0]['args']['bytes_read'])
+
     def testDoDefaultPresubmitChecksAndFeedback(self):
         always_fail_presubmit_script = ("""\n
 def CheckChangeOnUpload(input_api, output_api):
@@ -1271,7 +1419,8 @@ class InputApiUnittest(PresubmitTestsBase):
             diffs.append(self.presubmit_diffs % {'filename': f})
 
         os.path.isfile.side_effect = lambda f: f in known_files
-        presubmit.scm.GIT.GenerateDiff.return_value = '\n'.join(diffs)
+        presubmit.scm.GIT.GenerateDiffLines.return_value = iter(
+            '\n'.join(diffs).splitlines(True))
 
         change = presubmit.GitChange('mychange',
                                      '\n'.join(description_lines),
@@ -1767,13 +1916,129 @@ class AffectedFileUnittest(PresubmitTestsBase):
                                        None)
         self.assertEqual(presubmit.normpath('foo/blat.cc'), af.LocalPath())
         self.assertEqual('M', af.Action())
-        self.assertEqual(['whatever', 'cookie'], af.NewContents())
+        self.assertEqual(('whatever', 'cookie'), af.NewContents())
+        # The same lines are returned without reading or copying them again.
+        self.assertIs(af.NewContents(), af.NewContents())
+        gclient_utils.FileRead.assert_called_once()
 
     def testAffectedFileNotExists(self):
         notfound = 'notfound.cc'
         gclient_utils.FileRead.side_effect = IOError
         af = presubmit.AffectedFile(notfound, 'A', self.fake_root_dir, None)
-        self.assertEqual([], af.NewContents())
+        self.assertEqual((), af.NewContents())
+
+    def testOldContents(self):
+        diff_cache = mock.Mock()
+        diff_cache.GetOldContents.return_value = 'old\ncookie\n'
+        af = presubmit.GitAffectedFile('foo/blat.cc', 'M', self.fake_root_dir,
+                                       diff_cache)
+        self.assertEqual(('old', 'cookie'), af.OldContents())
+        self.assertIs(af.OldContents(), af.OldContents())
+        diff_cache.GetOldContents.assert_called_once_with(
+            presubmit.normpath('foo/blat.cc'), self.fake_root_dir)
+
+    @mock.patch('scm.GIT.GetOldContentsBatch')
+    def testGitDiffCacheBatchesOldContents(self, mockGetOldContentsBatch):
+        mockGetOldContentsBatch.side_effect = lambda _root, paths, branch: {
+            p: 'old %s' % p if p != 'b' else ''
+            for p in paths
+        }
+        change = presubmit.GitChange('mychange',
+                                     '',
+                                     self.fake_root_dir,
+                                     [['M', 'a'], ['A', 'b'], ['D', 'c']],
+                                     0,
+                                     0,
+                                     None,
+                                     upstream='upstream',
+                                     end_commit=None)
+        a, b, c = change._affected_files
+        self.assertEqual(('old a', ), a.OldContents())
+        self.assertEqual((), b.OldContents())
+        self.assertEqual(('old c', ), c.OldContents())
+        mockGetOldContentsBatch.assert_called_once_with(self.fake_root_dir,
+                                                        ['a', 'b', 'c'],
+                                                        branch='upstream')
+
+    @mock.patch('presubmit_support._GitDiffCache.OLD_CONTENTS_BATCH_SIZE', 2)
+    @mock.patch('scm.GIT.GetOldContentsBatch')
+    def testGitDiffCacheBoundsOldContentsBatch(self, mockGetOldContentsBatch):
+        mockGetOldContentsBatch.side_effect = lambda _root, paths, branch: {
+            p: 'old %s' % p
+            for p in paths
+        }
+        change = presubmit.GitChange(
+            'mychange',
+            '',
+            self.fake_root_dir,
+            [['M', 'a'], ['M', 'b'], ['M', 'c'], ['M', 'd']],
+            0,
+            0,
+            None,
+            upstream='upstream',
+            end_commit=None)
+        a, b, c, d = change._affected_files
+        self.assertEqual(('old c', ), c.OldContents())
+        self.assertEqual(('old a', ), a.OldContents())
+        self.assertEqual(('old b', ), b.OldContents())
+        self.assertEqual(('old d', ), d.OldContents())
+        self.assertEqual([
+            mock.call(self.fake_root_dir, ['c', 'a'], branch='upstream'),
+            mock.call(self.fake_root_dir, ['b', 'd'], branch='upstream'),
+        ], mockGetOldContentsBatch.mock_calls)
+
+    def testSpooledDiff(self):
+        diff = (self.presubmit_diffs % {
+            'filename': 'foo/a.cc'
+        } + self.presubmit_diffs % {
+            'filename': 'foo bar/b.cc'
+        })
+        expected = presubmit._parse_unified_diff(diff)
+        for max_size in (presubmit._SpooledDiff.MAX_MEMORY_SIZE, 1):
+            with mock.patch('presubmit_support._SpooledDiff.MAX_MEMORY_SIZE',
+                            max_size):
+                spooled = presubmit._SpooledDiff(
+                    iter(('garbage\n' + diff).splitlines(True)))
+            # The diff is only written to disk when it is too large.
+            self.assertEqual(max_size == 1, spooled._file._rolled)
+            for path, file_diff in expected.items():
+                self.assertIn(path, spooled)
+                self.assertEqual(file_diff, spooled.get(path))
+            self.assertNotIn('foo/c.cc', spooled)
+            self.assertEqual('', spooled.get('foo/c.cc', ''))
+
+    def testSpooledDiffPickle(self):
+        diff = (self.presubmit_diffs % {
+            'filename': 'foo/a.cc'
+        } + self.presubmit_diffs % {
+            'filename': 'foo/b.cc'
+        })
+        expected = presubmit._parse_unified_diff(diff)
+        for max_size in (presubmit._SpooledDiff.MAX_MEMORY_SIZE, 1):
+            with mock.patch('presubmit_support._SpooledDiff.MAX_MEMORY_SIZE',
+                            max_size):
+                spooled = presubmit._SpooledDiff(diff.splitlines(True))
+                copy = pickle.loads(pickle.dumps(spooled))
+            self.assertEqual(max_size == 1, copy._file._rolled)
+            for path, file_diff in expected.items():
+                self.assertEqual(file_diff, copy.get(path))
+
+    @unittest.skipIf(not hasattr(os, 'pread'), 'needs os.pread')
+    def testSpooledDiffKeepsOffset(self):
+        # Forked processes share the offset of the file, so reading a diff
+        # must not move it.
+        diff = self.presubmit_diffs % {'filename': 'foo/a.cc'}
+        with mock.patch('presubmit_support._SpooledDiff.MAX_MEMORY_SIZE', 1):
+            spooled = presubmit._SpooledDiff(diff.splitlines(True))
+        offset = spooled._file.tell()
+        self.assertEqual(
+            presubmit._parse_unified_diff(diff)['foo/a.cc'],
+            spooled.get('foo/a.cc'))
+        self.assertEqual(offset, spooled._file.tell())
+
+    def testSpooledDiffUnexpectedLine(self):
+        with self.assertRaises(presubmit.PresubmitFailure):
+            presubmit._SpooledDiff(['diff --git a/foo b/bar\n'])
 
     def testIsTestableFile(self):
         files = [
@@ -3117,6 +3382,54 @@ the current line as well!
                                is_committing=False,
                                expected_output='')
 
+    @mock.patch.dict(os.environ, {'PRESUBMIT_SKIP_NETWORK': '1'})
+    def testCannedCheckOwnersLocally(self):
+        owners_files = {
+            'OWNERS': 'alice@example.com\n',
+            'foo/OWNERS': 'bob@example.com\nnot an owner\n',
+        }
+        change = mock.MagicMock(presubmit.Change)
+        change.ReviewersFromDescription.return_value = ['bob@example.com']
+        change.TBRsFromDescription.return_value = []
+        change.author_email = 'john@example.com'
+        affected_files = []
+        for f in ('OWNERS', 'foo/OWNERS', 'foo/bar.cc'):
+            affected_file = mock.MagicMock(presubmit.GitAffectedFile)
+            affected_file.LocalPath.return_value = f
+            affected_files.append(affected_file)
+        change.AffectedFiles.return_value = affected_files
+        input_api = self.MockInputApi(change, False)
+        input_api.basename = os.path.basename
+        input_api.owners_client = owners_client.LocalOwnersClient('root')
+        input_api.owners_client._ReadFile = owners_files.get
+
+        results = presubmit_canned_checks.CheckOwners(input_api,
+                                                      presubmit.OutputApi)
+        self.assertEqual(2, len(results))
+        self.assertIsInstance(results[0],
+                              presubmit.OutputApi.PresubmitNotifyResult)
+        self.assertEqual('Missing OWNER reviewers for these files:\n    OWNERS',
+                         results[0]._message)
+        self.assertIn('alice@example.com', results[1]._message)
+
+        input_api.is_committing = True
+        self.assertEqual([],
+                         presubmit_canned_checks.CheckOwners(
+                             input_api, presubmit.OutputApi))
+        input_api.is_committing = False
+
+        change.ReviewersFromDescription.return_value.append('alice@example.com')
+        self.assertEqual([],
+                         presubmit_canned_checks.CheckOwners(
+                             input_api, presubmit.OutputApi))
+
+        results = presubmit_canned_checks.CheckOwnersFormat(
+            input_api, presubmit.OutputApi)
+        self.assertEqual(1, len(results))
+        self.assertEqual(
+            'Unrecognized lines in OWNERS files:\n    foo/OWNERS: not an owner',
+            results[0]._message)
+
     @mock.patch('io.open', mock.mock_open())
     def testCannedRunUnitTests(self):
         io.open().readline.return_value = ''
@@ -3388,6 +3701,123 @@ the current line as well!
                          results[0]._message)
         self.checkstdout('')
 
+    def _MockLineRulesFiles(self, input_api, contents_by_path):
+        files = []
+        for path, lines in contents_by_path.items():
+            affected_file = mock.MagicMock(presubmit.GitAffectedFile)
+            affected_file.LocalPath.return_value = path
+            affected_file.NewContents.return_value = lines
+            affected_file.ChangedContents.return_value = [
+                (i + 1, line) for i, line in enumerate(lines)
+            ]
+            files.append(affected_file)
+        input_api.AffectedFiles.return_value = files
+        return files
+
+    def testFindNewViolationsOfRules(self):
+        change = presubmit.Change('foo1', 'description1', self.fake_root_dir,
+                                  None, 0, 0, None)
+        input_api = self.MockInputApi(change, False)
+        self._MockLineRulesFiles(
+            input_api, {
+                'clean.cc': ['int a;', '', 'int b;'],
+                'tabs.cc': ['int\ta;', 'int b; ', ' x' * 50],
+                'todo.cc':
+                ['// TODO: fix', '// TODO(foo): fix', 'go/x.corp.google'],
+                'BUILD.gn': ['\tfoo ', 'DO NOT ' + 'SUBMIT'],
+                'foo.py': ['y' * 100, 'import\tfoo'],
+            })
+        rules = [
+            presubmit_canned_checks._LongLinesRule(input_api, 80),
+            presubmit_canned_checks._ChangeHasNoTabsRule(input_api),
+            presubmit_canned_checks._ChangeTodoHasOwnerRule(input_api),
+            presubmit_canned_checks._ChangeHasNoStrayWhitespaceRule(),
+            presubmit_canned_checks._CorpLinksInFilesRule(),
+            presubmit_canned_checks._DoNotSubmitInFilesRule(),
+        ]
+
+        errors = presubmit_canned_checks._FindNewViolationsOfRules(
+            rules, input_api)
+
+        self.assertEqual(errors, [
+            ['tabs.cc, line 3, 100 chars'],
+            ['tabs.cc:1', 'BUILD.gn:1', 'foo.py:2'],
+            ['todo.cc:1'],
+            ['tabs.cc:2', 'BUILD.gn:1'],
+            ['todo.cc:3'],
+            ['BUILD.gn:2'],
+        ])
+        # Each rule must report the same results as its individual check.
+        checks = [
+            lambda: presubmit_canned_checks.CheckLongLines(
+                input_api, presubmit.OutputApi, 80),
+            lambda: presubmit_canned_checks.CheckChangeHasNoTabs(
+                input_api, presubmit.OutputApi),
+            lambda: presubmit_canned_checks.CheckChangeTodoHasOwner(
+                input_api, presubmit.OutputApi),
+            lambda: presubmit_canned_checks.CheckChangeHasNoStrayWhitespace(
+                input_api, presubmit.OutputApi),
+            lambda: presubmit_canned_checks.CheckCorpLinksInFiles(
+                input_api, presubmit.OutputApi),
+            lambda: presubmit_canned_checks.CheckDoNotSubmitInFiles(
+                input_api, presubmit.OutputApi),
+        ]
+        results = presubmit_canned_checks._RunLineRules(input_api,
+                                                        presubmit.OutputApi,
+                                                        rules)
+        self.assertEqual(len(results), len(checks))
+        for rule_results, check in zip(results, checks):
+            self.assertEqual([r.json_format() for r in rule_results],
+                             [r.json_format() for r in check()])
+
+    def testFindNewViolationsOfRulesSkipsCleanFiles(self):
+        change = presubmit.Change('foo1', 'description1', self.fake_root_dir,
+                                  None, 0, 0, None)
+        input_api = self.MockInputApi(change, False)
+        affected_file, = self._MockLineRulesFiles(
+            input_api, {'clean.cc': ['int a;', '', 'int b;']})
+        callable_rule = mock.Mock(return_value=True)
+        file_rule = mock.Mock(return_value=True)
+        rules = [
+            presubmit_canned_checks._LineRule(callable_rule,
+                                              mock.Mock(),
+                                              file_rule=file_rule),
+            presubmit_canned_checks._LineRule(
+                callable_rule,
+                mock.Mock(),
+                file_rule=presubmit_canned_checks._KeywordFileRule('\t')),
+        ]
+
+        self.assertEqual(
+            presubmit_canned_checks._FindNewViolationsOfRules(rules, input_api),
+            [[], []])
+        file_rule.assert_called_once_with('cc', ['int a;', '', 'int b;'],
+                                          'int a;\n\nint b;')
+        callable_rule.assert_not_called()
+        affected_file.ChangedContents.assert_not_called()
+
+    def testFindNewViolationsOfRulesKeepsFileOrder(self):
+        change = presubmit.Change('foo1', 'description1', self.fake_root_dir,
+                                  None, 0, 0, None)
+        input_api = self.MockInputApi(change, False)
+        files = self._MockLineRulesFiles(input_api, {
+            'a.py': ['\tx' * 60],
+            'b.cc': ['\tx' * 60],
+        })
+        input_api.FilterSourceFile = lambda x: True
+        input_api.AffectedFiles = lambda include_deletes, file_filter: [
+            f for f in files if not file_filter or file_filter(f)
+        ]
+        rules = [
+            presubmit_canned_checks._LongLinesRule(input_api, 80),
+            presubmit_canned_checks._ChangeHasNoTabsRule(input_api),
+        ]
+
+        # a.py is skipped by the first rule, but still comes first.
+        self.assertEqual(
+            presubmit_canned_checks._FindNewViolationsOfRules(rules, input_api),
+            [['b.cc, line 1, 120 chars'], ['a.py:1', 'b.cc:1']])
+
     def testCheckCIPDManifest_file(self):
         input_api = self.MockInputApi(None, False)
 
@@ -3501,6 +3931,310 @@ the current line as well!
             self.assertIsNone(commands[0].info)
 
 
+class ResultCacheTest(unittest.TestCase):
+    script = ('def CheckChangeOnUpload(input_api, output_api):\n'
+              '  print("ran")\n'
+              '  return []\n')
+
+    def setUp(self):
+        super(ResultCacheTest, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(gclient_utils.rmtree, self.root)
+        self.path = os.path.join(self.root, 'presubmit_cache.json')
+        self.presubmit_path = os.path.join(self.root, 'PRESUBMIT.py')
+        mock.patch('sys.stdout', StringIO()).start()
+        mock.patch('presubmit_support.rdb_wrapper.client',
+                   return_value=mock.MagicMock()).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def Run(self, script, description='description', cache=None):
+        cache = cache or presubmit._ResultCache(self.path, 'fingerprint')
+        change = presubmit.Change('mychange', description, self.root, [], 0, 0,
+                                  None)
+        executer = presubmit.PresubmitExecuter(
+            change,
+            False,
+            None,
+            None,
+            thread_pool=presubmit.ThreadPool(),
+            result_cache=cache)
+        results = executer.ExecPresubmitScript(script, self.presubmit_path)
+        cache.Save()
+        return results
+
+    def RunCount(self):
+        return sys.stdout.getvalue().count('ran')
+
+    def testSkipsPassedChecks(self):
+        self.Run(self.script)
+        self.Run(self.script)
+        self.assertEqual(1, self.RunCount())
+
+    def testDifferentFingerprint(self):
+        self.Run(self.script)
+        self.Run(self.script, cache=presubmit._ResultCache(self.path, 'other'))
+        self.assertEqual(2, self.RunCount())
+
+    def testFailuresAreNotCached(self):
+        script = ('def CheckChangeOnUpload(input_api, output_api):\n'
+                  '  print("ran")\n'
+                  '  return [output_api.PresubmitError("!!")]\n')
+        self.assertEqual(1, len(self.Run(script)))
+        self.assertEqual(1, len(self.Run(script)))
+        self.assertEqual(2, self.RunCount())
+
+    def testNonCacheableChecks(self):
+        script = (self.script +
+                  'PRESUBMIT_NON_CACHEABLE_CHECKS = ["CheckChangeOnUpload"]\n')
+        self.Run(script)
+        self.Run(script)
+        self.assertEqual(2, self.RunCount())
+
+    def testChecksReadingLiveState(self):
+        for attribute in ('gerrit', 'owners_client', 'time', 'urllib_request'):
+            script = ('def CheckChangeOnUpload(input_api, output_api):\n'
+                      '  print("ran", input_api.%s)\n'
+                      '  return []\n' % attribute)
+            self.Run(script)
+            self.Run(script)
+        self.assertEqual(8, self.RunCount())
+
+    def testForChange(self):
+        change = mock.Mock(spec=presubmit.GitChange)
+        with mock.patch.dict(os.environ, {'CHROME_HEADLESS': '1'}):
+            self.assertIsNone(
+                presubmit._ResultCache.ForChange(change, False, False, None))
+        with mock.patch.dict(os.environ, {'CHROME_HEADLESS': '0'}):
+            self.assertIsNone(
+                presubmit._ResultCache.ForChange(change, True, False, None))
+        change.RepositoryRoot.assert_not_called()
+
+    def testChecksReadingDescription(self):
+        script = ('def CheckChangeOnUpload(input_api, output_api):\n'
+                  '  print("ran", input_api.change.DescriptionText())\n'
+                  '  return []\n')
+        self.Run(script)
+        self.Run(script)
+        self.assertEqual(1, self.RunCount())
+        self.Run(script, description='new description')
+        self.assertEqual(2, self.RunCount())
+
+    def testChecksNotReadingDescription(self):
+        self.Run(self.script)
+        self.Run(self.script, description='new description')
+        self.assertEqual(1, self.RunCount())
+
+    def testCorruptCache(self):
+        gclient_utils.FileWrite(self.path, 'not json')
+        self.Run(self.script)
+        self.Run(self.script)
+        self.assertEqual(1, self.RunCount())
+
+    @mock.patch('presubmit_support._ResultCache.MAX_ENTRIES', 1)
+    def testSaveKeepsNewestEntries(self):
+        cache = presubmit._ResultCache(self.path, 'fingerprint')
+        with mock.patch('presubmit_support.time_time', side_effect=[1, 2]):
+            cache.AddPassed('old')
+            cache.AddPassed('new')
+        cache.Save()
+        cache = presubmit._ResultCache(self.path, 'fingerprint')
+        self.assertFalse(cache.HasPassed('old', ''))
+        self.assertTrue(cache.HasPassed('new', ''))
+
+
+class PresubmitIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        super(PresubmitIndexTest, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(gclient_utils.rmtree, self.root)
+        self.git_dir = os.path.join(self.root, '.git')
+        os.mkdir(self.git_dir)
+        for path in ('PRESUBMIT.py', 'foo/PRESUBMIT.py',
+                     'foo/new/PRESUBMIT.py'):
+            os.makedirs(os.path.join(self.root, os.path.dirname(path)),
+                        exist_ok=True)
+            gclient_utils.FileWrite(os.path.join(self.root, path), '')
+        self.change = mock.Mock(spec=presubmit.GitChange)
+        self.change.RepositoryRoot.return_value = self.root
+        self.change.LocalPaths.return_value = [
+            'foo/new/PRESUBMIT.py', 'foo/bar.cc'
+        ]
+        self.tree = 'a' * 40
+        mock.patch('scm.GIT.Capture', self.Capture).start()
+        self.addCleanup(mock.patch.stopall)
+        self.ls_tree_calls = 0
+
+    def Capture(self, args, cwd=None, strip_out=True):
+        self.assertEqual(self.root, cwd)
+        if args == ['rev-parse', '--absolute-git-dir']:
+            return self.git_dir
+        if args == ['rev-parse', 'HEAD^{tree}']:
+            return self.tree
+        self.assertEqual(['ls-tree', '-r', '-z', self.tree], args)
+        self.ls_tree_calls += 1
+        entries = [
+            '100644 blob %s\t%s' % ('b' * 40, p)
+            for p in ('PRESUBMIT.py', 'foo/bar.cc', 'foo/PRESUBMIT.py',
+                      'foo/PRESUBMIT_test.py', 'foo/baz/PRESUBMIT.py')
+        ]
+        entries.append('160000 commit %s\tsub' % ('c' * 40))
+        return '\0'.join(entries) + '\0'
+
+    def testForChange(self):
+        index = presubmit._PresubmitIndex.ForChange(self.change)
+        self.assertTrue(index.Covers(self.root))
+        self.assertTrue(index.Covers(os.path.join(self.root, 'foo')))
+        self.assertFalse(index.Covers(os.path.dirname(self.root)))
+        self.assertEqual([os.path.join(self.root, 'PRESUBMIT.py')],
+                         index.ListPresubmitFiles(self.root))
+        self.assertEqual([os.path.join(self.root, 'foo', 'PRESUBMIT.py')],
+                         index.ListPresubmitFiles(os.path.join(
+                             self.root, 'foo')))
+        # Scripts added by the change are listed, and the ones that don't
+        # exist anymore aren't.
+        self.assertEqual(
+            [os.path.join(self.root, 'foo', 'new', 'PRESUBMIT.py')],
+            index.ListPresubmitFiles(os.path.join(self.root, 'foo', 'new')))
+        self.assertEqual([],
+                         index.ListPresubmitFiles(
+                             os.path.join(self.root, 'foo', 'baz')))
+
+    def testListRelevantPresubmitFilesUntrackedDir(self):
+        # Directories that aren't in HEAD aren't covered by the index, so they
+        # are listed, which finds untracked scripts.
+        self.change.LocalPaths.return_value = ['foo/new/bar.cc']
+        index = presubmit._PresubmitIndex.ForChange(self.change)
+        self.assertFalse(index.Covers(os.path.join(self.root, 'foo', 'new')))
+        presubmit_files = presubmit.ListRelevantPresubmitFiles(
+            ['foo/new/bar.cc'], self.root, index)
+        self.assertEqual([
+            os.path.join(self.root, 'PRESUBMIT.py'),
+            os.path.join(self.root, 'foo', 'PRESUBMIT.py'),
+            os.path.join(self.root, 'foo', 'new', 'PRESUBMIT.py'),
+        ], presubmit_files)
+
+    def testListRelevantPresubmitFilesSubmodule(self):
+        # Submodules are listed as commits by ls-tree, so their scripts
+        # aren't in the index.
+        os.makedirs(os.path.join(self.root, 'sub', 'dir'))
+        gclient_utils.FileWrite(os.path.join(self.root, 'sub', 'PRESUBMIT.py'),
+                                '')
+        index = presubmit._PresubmitIndex.ForChange(self.change)
+        self.assertFalse(index.Covers(os.path.join(self.root, 'sub')))
+        self.assertFalse(index.Covers(os.path.join(self.root, 'sub', 'dir')))
+        presubmit_files = presubmit.ListRelevantPresubmitFiles(
+            ['sub/dir/bar.cc'], self.root, index)
+        self.assertEqual([
+            os.path.join(self.root, 'PRESUBMIT.py'),
+            os.path.join(self.root, 'sub', 'PRESUBMIT.py'),
+        ], presubmit_files)
+
+    def testForChangeReusesIndex(self):
+        presubmit._PresubmitIndex.ForChange(self.change)
+        index = presubmit._PresubmitIndex.ForChange(self.change)
+        self.assertEqual(1, self.ls_tree_calls)
+        self.assertEqual([os.path.join(self.root, 'foo', 'PRESUBMIT.py')],
+                         index.ListPresubmitFiles(os.path.join(
+                             self.root, 'foo')))
+
+        self.tree = 'b' * 40
+        presubmit._PresubmitIndex.ForChange(self.change)
+        self.assertEqual(2, self.ls_tree_calls)
+
+    def testForChangeNotGit(self):
+        self.assertIsNone(
+            presubmit._PresubmitIndex.ForChange(
+                presubmit.Change('mychange', 'description', self.root, [], 0, 0,
+                                 None)))
+
+
+class IncrementalTest(unittest.TestCase):
+    script = ('PRESUBMIT_VERSION = "2.0.0"\n'
+              'PRESUBMIT_INCREMENTAL_CHECKS = ["CheckFiles"]\n'
+              'def CheckFiles(input_api, output_api):\n'
+              '  print("files: %s" % [f.LocalPath()\n'
+              '                       for f in input_api.AffectedFiles()])\n'
+              '  return []\n'
+              'def CheckChange(input_api, output_api):\n'
+              '  print("change: %s" % [f.LocalPath()\n'
+              '                        for f in input_api.AffectedFiles()])\n'
+              '  return []\n')
+
+    def setUp(self):
+        super(IncrementalTest, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(gclient_utils.rmtree, self.root)
+        self.path = os.path.join(self.root, 'presubmit_incremental.json')
+        mock.patch('sys.stdout', StringIO()).start()
+        mock.patch('presubmit_support.rdb_wrapper.client',
+                   return_value=mock.MagicMock()).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def Run(self, incremental_files, incremental_checks=None):
+        change = presubmit.Change('mychange', 'description', self.root,
+                                  [('M', 'a'), ('M', 'b')], 0, 0, None)
+        executer = presubmit.PresubmitExecuter(
+            change,
+            False,
+            None,
+            None,
+            thread_pool=presubmit.ThreadPool(),
+            incremental_files=incremental_files,
+            incremental_checks=incremental_checks)
+        executer.ExecPresubmitScript(self.script,
+                                     os.path.join(self.root, 'PRESUBMIT.py'))
+        return sys.stdout.getvalue()
+
+    def testIncrementalChecksOnlySeeChangedFiles(self):
+        output = self.Run({'b'})
+        self.assertIn("files: ['b']", output)
+        self.assertIn("change: ['a', 'b']", output)
+
+    def testNotIncremental(self):
+        output = self.Run(None)
+        self.assertIn("files: ['a', 'b']", output)
+        self.assertIn("change: ['a', 'b']", output)
+
+    def testChangedFiles(self):
+        files = [('a', 'M', '1'), ('b', 'M', '2')]
+        self.assertIsNone(
+            presubmit._IncrementalState(self.path, 'key', files).ChangedFiles())
+        presubmit._IncrementalState(self.path, 'key', files).Save({})
+
+        files = [('a', 'M', '1'), ('b', 'M', '3'), ('c', 'A', '4')]
+        self.assertEqual({'b', 'c'},
+                         presubmit._IncrementalState(self.path, 'key',
+                                                     files).ChangedFiles())
+        self.assertIsNone(
+            presubmit._IncrementalState(self.path, 'other',
+                                        files).ChangedFiles())
+
+    def testNewlyListedChecksSeeAllFiles(self):
+        # CheckFiles was not listed in the last run that passed.
+        output = self.Run({'b'}, incremental_checks={})
+        self.assertIn("files: ['a', 'b']", output)
+
+        sys.stdout.truncate(0)
+        output = self.Run({'b'},
+                          incremental_checks={
+                              os.path.join(self.root, 'PRESUBMIT.py'):
+                              ['CheckFiles']
+                          })
+        self.assertIn("files: ['b']", output)
+
+    def testIncrementalChecks(self):
+        state = presubmit._IncrementalState(self.path, 'key', [])
+        self.assertEqual({}, state.IncrementalChecks())
+        state.Save({'PRESUBMIT.py': ['CheckFiles']})
+        self.assertEqual({'PRESUBMIT.py': ['CheckFiles']},
+                         presubmit._IncrementalState(self.path, 'key',
+                                                     []).IncrementalChecks())
+        self.assertEqual({},
+                         presubmit._IncrementalState(self.path, 'other',
+                                                     []).IncrementalChecks())
+
+
 class ThreadPoolTest(unittest.TestCase):
     def setUp(self):
         super(ThreadPoolTest, self).setUp()
@@ -3544,6 +4278,152 @@ class ThreadPoolTest(unittest.TestCase):
             messages[1])
         self.assertEqual('5\n5 (0.00s) failed\nstdout', messages[2])
 
+    def testSubprocessTime(self):
+        subprocess.Popen.return_value = mock.Mock(returncode=0)
+        presubmit.time_time.side_effect = itertools.count(0, 2)
+        t = presubmit.ThreadPool(1)
+        t.AddTests([
+            presubmit.CommandData(
+                name=str(i),
+                cmd=[str(i)],
+                kwargs={},
+                message=lambda x, **kwargs: x,
+            ) for i in range(3)
+        ])
+        self.assertEqual(3, t.QueuedTests())
+        t.RunAsync()
+        self.assertEqual(0, t.QueuedTests())
+        self.assertEqual(6, t.subprocess_time)
+
+    def MakeTests(self, count):
+        return [
+            presubmit.CommandData(
+                name=str(i),
+                cmd=[str(i)],
+                kwargs={},
+                message=lambda x, **kwargs: x,
+            ) for i in range(count)
+        ]
+
+    def testLongestFirst(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(gclient_utils.rmtree, root)
+        path = os.path.join(root, 'durations.json')
+        durations = presubmit._TestDurations(path)
+        tests = self.MakeTests(4)
+        for test, duration in zip(tests[1:], [1, 3, 2]):
+            durations.Add(test, duration)
+        order = []
+
+        def FakePopen(cmd, **kwargs):
+            order.append(cmd[0])
+            return mock.Mock(returncode=0)
+
+        subprocess.Popen.side_effect = FakePopen
+        t = presubmit.ThreadPool(1, durations=durations)
+        t.AddTests(tests)
+        t.RunAsync()
+        durations.Save()
+
+        # Tests that never ran come first.
+        self.assertEqual(['0', '2', '3', '1'], order)
+        durations = presubmit._TestDurations(path)
+        self.assertEqual([0, 0, 0, 0], [durations.Get(test) for test in tests])
+
+    def testBudget(self):
+        lock = threading.Lock()
+        running = {}
+        used = []
+
+        def FakePopen(cmd, **kwargs):
+            with lock:
+                running[cmd[0]] = 2 if cmd[0] == '0' else 1
+                used.append(sum(running.values()))
+            return mock.Mock(returncode=0, cmd=cmd)
+
+        def FakeWait(p, stdin):
+            time.sleep(0.01)
+            with lock:
+                del running[p.cmd[0]]
+            return b'', ''
+
+        subprocess.Popen.side_effect = FakePopen
+        presubmit.sigint_handler.wait.side_effect = FakeWait
+        tests = self.MakeTests(6)
+        tests[0].cpus = 2
+        t = presubmit.ThreadPool(2)
+        t.AddTests(tests[:3])
+        t.AddTests(tests[3:], parallel=False)
+        self.assertEqual([], t.RunAsync())
+
+        self.assertEqual(6, len(used))
+        self.assertLessEqual(max(used), 2)
+        # Nonparallel tests run alone, before the parallel ones.
+        self.assertEqual([1, 1, 1], used[:3])
+
+    def testUtilisationSummary(self):
+        subprocess.Popen.return_value = mock.Mock(returncode=0)
+        presubmit.time_time.side_effect = itertools.count()
+        t = presubmit.ThreadPool(1)
+        self.assertIsNone(t.UtilisationSummary())
+        t.AddTests(self.MakeTests(2))
+        t.RunAsync()
+        self.assertEqual(
+            'Ran 2 tests in 5.0s on 1 CPUs, 40% utilisation. The longest test '
+            'was 1 (1.0s).', t.UtilisationSummary())
+
+
+class PresubmitWorkerTest(unittest.TestCase):
+    script = ('def CheckChangeOnUpload(input_api, output_api):\n'
+              '  f = input_api.AffectedFiles()[0]\n'
+              '  return [output_api.PresubmitNotifyResult(\n'
+              '      "\\n".join(f.GenerateScmDiff().splitlines()[-2:]))]\n')
+
+    def setUp(self):
+        super(PresubmitWorkerTest, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(gclient_utils.rmtree, self.root)
+        self.Git('init', '-q')
+        gclient_utils.FileWrite(os.path.join(self.root, 'foo.cc'), 'a\n')
+        self.Commit('initial')
+        gclient_utils.FileWrite(os.path.join(self.root, 'foo.cc'), 'b\n')
+        self.Commit('change')
+
+    def Commit(self, message):
+        self.Git('add', 'foo.cc')
+        self.Git('-c', 'user.name=a', '-c', 'user.email=a@example.com',
+                 'commit', '-q', '-m', message)
+
+    def Git(self, *args):
+        subprocess.check_call(('git', ) + args, cwd=self.root)
+
+    def testSpawnedWorker(self):
+        change = presubmit.GitChange('mychange',
+                                     'description',
+                                     self.root, [('M', 'foo.cc')],
+                                     0,
+                                     0,
+                                     None,
+                                     upstream='HEAD~',
+                                     end_commit='HEAD')
+        # Load the diff, so that the spooled diff is sent to the worker.
+        diff = change.AffectedFiles()[0].GenerateScmDiff()
+        self.assertTrue(diff.endswith('-a\n+b\n'))
+        pool = multiprocessing.get_context('spawn').Pool(
+            1,
+            initializer=presubmit._InitPresubmitWorker,
+            initargs=(change, False, False, None, False, False, False, None,
+                      False, None, None, None))
+        try:
+            ((_, results, _, _, _, _, _), ) = pool.map(
+                presubmit._ExecPresubmitScriptInWorker,
+                [(self.script, os.path.join(self.root, 'PRESUBMIT.py'))])
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(1, len(results))
+        self.assertEqual('-a\n+b', results[0]._message)
+
 
 if __name__ == '__main__':
     import unittest
@@ -194,6 +194,29 @@ class RealGitTest(fake_repos.FakeReposTestBase):
         self.assertEqual(['DEPS', 'foo bar', 'origin'],
                          scm.GIT.GetAllFiles(self.cwd))
 
+    def testGetOldContentsBatch(self):
+        first_rev = self.githash('repo_1', 1)
+        filenames = ['DEPS', 'foo bar', 'origin', 'missing']
+        expected = {
+            f: scm.GIT.GetOldContents(self.cwd, f, branch=first_rev)
+            for f in filenames
+        }
+        self.assertEqual('', expected['missing'])
+        self.assertEqual(
+            expected,
+            scm.GIT.GetOldContentsBatch(self.cwd, filenames, branch=first_rev))
+
+    def testGenerateDiffLines(self):
+        first_rev = self.githash('repo_1', 1)
+        diff = scm.GIT.GenerateDiff(self.cwd, branch=first_rev, full_move=True)
+        self.assertIn('diff --git', diff)
+        self.assertEqual(
+            diff.splitlines(True),
+            list(
+                scm.GIT.GenerateDiffLines(self.cwd,
+                                          branch=first_rev,
+                                          full_move=True)))
+
     def testScopedConfig(self):
         scm.GIT.SetConfig(self.cwd,
                           "diff.test-key",
@@ -50,7 +50,7 @@ class SplitClTest(unittest.TestCase):
     def GetDirectoryBaseName(self, file_path):
         return os.path.basename(os.path.dirname(file_path))
 
-    def MockSuggestOwners(self, paths, exclude=None):
+    def MockSuggestOwners(self, paths, exclude=None, minimal=False):
         if not paths:
             return ["superowner"]
         return self.GetDirectoryBaseName(paths[0]).split(",")
@@ -105,74 +105,126 @@ class SplitClTest(unittest.TestCase):
                 "git_common.current_branch", test)
             self.mock_git_current_branch.return_value = "branch_to_upload"
             self.mock_git_run = self.StartPatcher("git_common.run", test)
-            self.mock_temporary_file = self.StartPatcher(
-                "gclient_utils.temporary_file", test)
-            self.mock_temporary_file(
-            ).__enter__.return_value = "temporary_file0"
-            self.mock_file_writer = self.StartPatcher("gclient_utils.FileWrite",
-                                                      test)
+            self.mock_git_run.side_effect = self.GitRun
+            self.mock_temporary_directory = self.StartPatcher(
+                "gclient_utils.temporary_directory", test)
+            self.mock_temporary_directory(
+            ).__enter__.return_value = "temporary_directory0"
 
         def StartPatcher(self, target, test):
             patcher = mock.patch(target)
             test.addCleanup(patcher.stop)
             return patcher.start()
 
-        def DoUploadCl(self, directories, files, reviewers, cmd_upload):
-            split_cl.UploadCl("branch_to_upload", "upstream_branch",
-                              directories, files, "description", None,
-                              reviewers, mock.Mock(), cmd_upload, True, True,
-                              "topic", os.path.sep)
+        def GitRun(self, *args, **_kwargs):
+            return {
+                "rev-parse": "base",
+                "ls-tree": "100644 blob sha\tbar/a.cc\0",
+                "write-tree": "tree",
+                "commit-tree": "commit",
+            }.get(args[0], "")
 
-    def testUploadCl(self):
-        """Tests commands run by UploadCl."""
+        def DoCreateBranch(self, directories, files):
+            return split_cl.CreateBranchForDirectories(
+                "branch_to_upload", directories, "upstream_branch", files,
+                "description $directory", "root")
+
+        def DoUploadCl(self, directories, reviewers, cmd_upload):
+            split_cl.UploadCl("branch_to_upload", directories, None, reviewers,
+                              mock.Mock(), cmd_upload, True, True, "topic")
+
+    def testCreateBranchForDirectories(self):
+        """Tests commands run by CreateBranchForDirectories."""
 
         upload_cl_tester = self.UploadClTester(self)
 
-        directories = ["dir0"]
         files = [("M", os.path.join("bar", "a.cc")),
                  ("D", os.path.join("foo", "b.cc"))]
-        reviewers = {"reviewer1@gmail.com", "reviewer2@gmail.com"}
-        mock_cmd_upload = mock.Mock()
-        upload_cl_tester.DoUploadCl(directories, files, reviewers,
-                                    mock_cmd_upload)
-
-        abs_repository_path = os.path.abspath(os.path.sep)
-        mock_git_run = upload_cl_tester.mock_git_run
-        self.assertEqual(mock_git_run.call_count, 4)
-        mock_git_run.assert_has_calls([
-            mock.call("checkout", "-t", "upstream_branch", "-b",
-                      "branch_to_upload_dir0_split"),
-            mock.call("rm", os.path.join(abs_repository_path, "foo", "b.cc")),
-            mock.call("checkout", "branch_to_upload", "--",
-                      os.path.join(abs_repository_path, "bar", "a.cc")),
-            mock.call("commit", "-F", "temporary_file0")
+        self.assertTrue(upload_cl_tester.DoCreateBranch(["dir0"], files))
+
+        env = mock.ANY
+        index_info = ("100644 blob sha\tbar/a.cc\0"
+                      "0 %s\tfoo/b.cc\0" % ("0" * 40)).encode("utf-8")
+        upload_cl_tester.mock_git_run.assert_has_calls([
+            mock.call("rev-parse", "upstream_branch", cwd="root"),
+            mock.call("ls-tree",
+                      "-r",
+                      "-z",
+                      "branch_to_upload",
+                      "--",
+                      "bar/a.cc",
+                      cwd="root",
+                      autostrip=False),
+            mock.call("read-tree", "base", cwd="root", env=env),
+            mock.call("update-index",
+                      "-z",
+                      "--index-info",
+                      indata=index_info,
+                      cwd="root",
+                      env=env),
+            mock.call("write-tree", cwd="root", env=env),
+            mock.call("commit-tree",
+                      "tree",
+                      "-p",
+                      "base",
+                      indata=b"description dir0",
+                      cwd="root"),
+            mock.call("branch",
+                      "--track",
+                      "branch_to_upload_dir0_split",
+                      "upstream_branch",
+                      cwd="root"),
+            mock.call("update-ref",
+                      "refs/heads/branch_to_upload_dir0_split",
+                      "commit",
+                      cwd="root"),
         ])
+        # The changes are staged in a temporary index.
+        env = upload_cl_tester.mock_git_run.call_args_list[2][1]["env"]
+        self.assertEqual(os.path.join("temporary_directory0", "index"),
+                         env["GIT_INDEX_FILE"])
 
-        expected_upload_args = [
-            "-f", "-r", "reviewer1@gmail.com,reviewer2@gmail.com",
-            "--cq-dry-run", "--send-mail", "--enable-auto-submit",
-            "--topic=topic"
-        ]
-        mock_cmd_upload.assert_called_once_with(expected_upload_args)
-
-    def testDontUploadClIfBranchAlreadyExists(self):
-        """Tests that a CL is not uploaded if split branch already exists"""
+    def testDontCreateBranchIfBranchAlreadyExists(self):
+        """Tests that a branch is not created if split branch already exists"""
 
         upload_cl_tester = self.UploadClTester(self)
         upload_cl_tester.mock_git_branches.return_value = [
             "branch0", "branch_to_upload_dir0_split"
         ]
 
-        directories = ["dir0"]
         files = [("M", os.path.join("bar", "a.cc")),
                  ("D", os.path.join("foo", "b.cc"))]
-        reviewers = {"reviewer1@gmail.com"}
-        mock_cmd_upload = mock.Mock()
-        upload_cl_tester.DoUploadCl(directories, files, reviewers,
-                                    mock_cmd_upload)
+        self.assertFalse(upload_cl_tester.DoCreateBranch(["dir0"], files))
 
         upload_cl_tester.mock_git_run.assert_not_called()
-        mock_cmd_upload.assert_not_called()
+
+    def testUploadCl(self):
+        """Tests commands run by UploadCl."""
+
+        upload_cl_tester = self.UploadClTester(self)
+
+        reviewers = {"reviewer1@gmail.com", "reviewer2@gmail.com"}
+        mock_cmd_upload = mock.Mock()
+        upload_cl_tester.DoUploadCl(["dir0"], reviewers, mock_cmd_upload)
+
+        upload_cl_tester.mock_git_run.assert_called_once_with(
+            "checkout", "branch_to_upload_dir0_split")
+
+        expected_upload_args = [
+            "-f", "-r", "reviewer1@gmail.com,reviewer2@gmail.com",
+            "--cq-dry-run", "--send-mail", "--enable-auto-submit",
+            "--topic=topic"
+        ]
+        mock_cmd_upload.assert_called_once_with(expected_upload_args)
+
+    def testGetFilesSplitByOwnersFromIndex(self):
+        files = [("M", os.path.join("foo", "bar", "a.cc")),
+                 ("M", os.path.join("foo", "b.cc")),
+                 ("M", os.path.join("baz", "c.cc"))]
+        self.assertEqual({
+            "foo": files[:2],
+            "": files[2:],
+        }, split_cl.GetFilesSplitByOwners(files, 0, {"foo", "."}))
 
     @mock.patch("gclient_utils.AskForData")
     def testCheckDescriptionBugLink(self, mock_ask_for_data):